@@ -0,0 +1,210 @@
+"""
+Planificador de animaciones de mensajes.
+
+Un único hilo mueve todas las animaciones activas (por ejemplo, los mensajes
+kawaii mientras se genera el enlace de pago) en lugar de un hilo por usuario.
+Limita la tasa total de ediciones, expira animaciones olvidadas y permite
+detenerlas sin esperar.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import ANIMATION_FRAME_INTERVAL, ANIMATION_MAX_EDITS_PER_SECOND, ANIMATION_MAX_AGE_SECONDS, ANIMATION_EDIT_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Mensajes de la animación de procesamiento de pago
+PAYMENT_ANIMATION_FRAMES = [
+    "🌸 Preparando tu entrada VIP... 🌸",
+    "📝 Anotando tu nombre en mi lista secreta~",
+    "✨ Qué nombre tan lindo... jeje~ ✨",
+    "🎀 Abriendo las puertas del club VIP~",
+    "🌟 Un momento más... ¡Todo listo! 🌟",
+    "💰 Oh casi lo olvido, falta el pago... 💰"
+]
+
+
+class AnimationScheduler:
+    """Mueve todas las animaciones activas desde un único bucle con temporizador"""
+
+    def __init__(self, frame_interval=ANIMATION_FRAME_INTERVAL,
+                 max_edits_per_second=ANIMATION_MAX_EDITS_PER_SECOND,
+                 max_age=ANIMATION_MAX_AGE_SECONDS):
+        self.frame_interval = frame_interval
+        self.max_edits_per_second = max_edits_per_second
+        self.max_age = max_age
+
+        self._cond = threading.Condition()
+        self._animations = {}  # (chat_id, message_id) -> estado de la animación
+        self._heap = []        # (próxima edición, secuencia, clave, estado)
+        self._seq = itertools.count()
+        self._thread = None
+        self._executor = ThreadPoolExecutor(max_workers=ANIMATION_EDIT_WORKERS, thread_name_prefix="animation-edit")
+
+        # Cubeta de tokens para limitar la tasa global de ediciones
+        self._tokens = float(max_edits_per_second)
+        self._last_refill = time.monotonic()
+
+        self._stats = {'started': 0, 'stopped': 0, 'expired': 0, 'edits': 0, 'errors': 0, 'throttled': 0}
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="animation-scheduler", daemon=True)
+            self._thread.start()
+
+    def is_healthy(self):
+        """El hilo debe estar vivo mientras haya animaciones pendientes"""
+        with self._cond:
+            return not self._animations or (self._thread is not None and self._thread.is_alive())
+
+    def ensure_running(self):
+        with self._cond:
+            self._ensure_thread()
+
+    def start(self, bot, chat_id, message_id, frames=None):
+        """Registra una animación sobre un mensaje existente"""
+        key = (chat_id, message_id)
+        now = time.monotonic()
+        with self._cond:
+            idle = threading.Event()
+            idle.set()
+            entry = {
+                'bot': bot,
+                'frames': frames or PAYMENT_ANIMATION_FRAMES,
+                'frame': 0,
+                'created_at': now,
+                'idle': idle,
+            }
+            # Si ya había una animación sobre el mensaje, se reemplaza
+            self._animations[key] = entry
+            # La primera edición va de inmediato
+            heapq.heappush(self._heap, (now, next(self._seq), key, entry))
+            self._stats['started'] += 1
+            self._ensure_thread()
+            self._cond.notify()
+
+    def stop(self, chat_id, message_id=None):
+        """
+        Detiene la animación sin bloquear.
+
+        Returns:
+            threading.Event: se activa cuando no hay ninguna edición en curso
+            para ese mensaje. Quien vaya a editar el mismo mensaje puede
+            esperarlo para que un fotograma tardío no pise su texto.
+        """
+        done = threading.Event()
+        with self._cond:
+            keys = [k for k in self._animations if k[0] == chat_id and (message_id is None or k[1] == message_id)]
+            if not keys:
+                done.set()
+                return done
+            pending = []
+            for key in keys:
+                entry = self._animations.pop(key)
+                pending.append(entry['idle'])
+                self._stats['stopped'] += 1
+            # Las entradas del heap huérfanas se descartan solas en el bucle
+            self._cond.notify()
+
+        if all(event.is_set() for event in pending):
+            done.set()
+        else:
+            def _wait_idle():
+                for event in pending:
+                    event.wait(self.frame_interval * 2)
+                done.set()
+            threading.Thread(target=_wait_idle, daemon=True).start()
+        return done
+
+    def is_active(self, chat_id, message_id=None):
+        with self._cond:
+            return any(k[0] == chat_id and (message_id is None or k[1] == message_id) for k in self._animations)
+
+    def _take_token(self, now):
+        """Consume un token de edición. Devuelve 0 si hay token o los segundos a esperar"""
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._tokens = min(float(self.max_edits_per_second), self._tokens + elapsed * self.max_edits_per_second)
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.max_edits_per_second
+
+    def _run(self):
+        logger.info("Planificador de animaciones iniciado")
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    due, _, key, entry = self._heap[0]
+                    if self._animations.get(key) is not entry:
+                        # Animación detenida o reemplazada: descartar
+                        heapq.heappop(self._heap)
+                        continue
+                    if now - entry['created_at'] > self.max_age:
+                        heapq.heappop(self._heap)
+                        del self._animations[key]
+                        self._stats['expired'] += 1
+                        logger.info(f"Animación expirada para chat {key[0]}")
+                        continue
+                    if due > now:
+                        self._cond.wait(due - now)
+                        continue
+                    wait = self._take_token(now)
+                    if wait:
+                        # Límite global alcanzado: posponer esta edición
+                        heapq.heapreplace(self._heap, (now + wait, next(self._seq), key, entry))
+                        self._stats['throttled'] += 1
+                        continue
+                    heapq.heappop(self._heap)
+                    break
+
+                frame_index = entry['frame']
+                text = entry['frames'][frame_index % len(entry['frames'])]
+                entry['frame'] = frame_index + 1
+                entry['idle'].clear()
+
+            # Las ediciones se hacen fuera del bucle para no frenar el temporizador
+            self._executor.submit(self._edit, key, entry, text)
+
+    def _edit(self, key, entry, text):
+        ok = True
+        try:
+            entry['bot'].edit_message_text(chat_id=key[0], message_id=key[1], text=text)
+        except Exception as e:
+            ok = False
+            logger.error(f"Error en animación para chat {key[0]}: {str(e)}")
+
+        with self._cond:
+            entry['idle'].set()
+            if ok:
+                self._stats['edits'] += 1
+            else:
+                self._stats['errors'] += 1
+            if self._animations.get(key) is entry:
+                if ok:
+                    heapq.heappush(self._heap, (time.monotonic() + self.frame_interval, next(self._seq), key, entry))
+                    self._cond.notify()
+                else:
+                    del self._animations[key]
+
+    def get_stats(self):
+        with self._cond:
+            return {
+                'active': len(self._animations),
+                'scheduled': len(self._heap),
+                'thread_alive': self._thread is not None and self._thread.is_alive(),
+                'max_edits_per_second': self.max_edits_per_second,
+                **self._stats,
+            }
+
+
+# Instancia compartida por toda la aplicación
+animation_scheduler = AnimationScheduler()
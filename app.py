@@ -1,16 +1,40 @@
 import logging
 import telebot
-from flask import Flask, request, jsonify, render_template, send_file
+from flask import Flask, request, jsonify, render_template, send_file, g, Response
 import threading
 import time
 import os
 import json
+import hashlib
 import datetime
 import requests
 from telebot import types
 import database as db
 import payments as pay
 from config import BOT_TOKEN, PORT, WEBHOOK_URL, ADMIN_IDS, PLANS, DB_PATH, RECURRING_PAYMENTS_ENABLED, SUBSCRIPTION_GRACE_PERIOD_HOURS
+from config import WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, WEBHOOK_DEDUP_SIZE
+from update_queue import UpdateDispatcher
+from animations import animation_scheduler
+from runtime import runtime, get_bot_info
+from config import METRICS_TOKEN, PROFILER_DEFAULT_INTERVAL_MS
+from config import ADMIN_SUMMARY_CACHE_SECONDS, ADMIN_PANEL_REFRESH_SECONDS
+from config import ADMIN_PAGE_SIZE, ADMIN_PAGE_SIZE_MAX
+from config import SQL_CONSOLE_MAX_ROWS, SQL_CONSOLE_EXPORT_TIMEOUT_SECONDS, SQL_CONSOLE_EXPORT_MAX_ROWS
+from config import BACKUP_RETENTION_COUNT, BACKUP_CRON
+import metrics
+import telegram_api
+import db_profiler
+import logging_setup
+import profiler
+import tracing
+import rollups
+import events
+import sql_console
+import backups
+import retention
+import replica
+import event_log
+from health import health
 
 admin_states = {}
 
@@ -20,8 +44,7 @@ import bot_handlers
 # Y asigna admin_states en bot_handlers
 bot_handlers.admin_states = admin_states
 
-# Configurar logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Logger del módulo (el pipeline de logging se configura en config.py)
 logger = logging.getLogger(__name__)
 
 processed_payment_ids = set()
@@ -78,6 +101,25 @@ def log_webhook_data(update):
 bot = telebot.TeleBot(BOT_TOKEN)
 app = Flask(__name__)
 
+# Métricas: todas las llamadas a Telegram y a SQLite quedan instrumentadas
+telegram_api.install()
+metrics.install_sqlite_observer()
+db_profiler.install_if_enabled()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """Registra duración y código de estado por endpoint (el nombre de la vista, nunca la URL con el token)"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = request.endpoint or 'unknown'
+        metrics.HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, endpoint=endpoint, method=request.method)
+        metrics.HTTP_REQUESTS.inc(endpoint=endpoint, status=str(response.status_code))
+    return response
+
 admin_states = {}
 
 # Importar el sistema centralizado de handlers
@@ -85,469 +127,449 @@ import bot_handlers
 
 bot_handlers.admin_states = admin_states
 
-@app.route(f'/webhook/{BOT_TOKEN}', methods=['POST'])
-def webhook():
-    """Recibe las actualizaciones de Telegram a través de webhook"""
+def process_update(update):
+    """Procesa una actualización de Telegram (se ejecuta en el pool de workers)"""
     try:
-        if request.headers.get('content-type') == 'application/json':
-            json_string = request.get_data().decode('utf-8')
+        # Registrar el tipo de actualización
+        if update.message:
+            if update.message.text:
+                logger.info(f"Mensaje recibido de {update.message.from_user.id}: {update.message.text}")
+                
+                # Verificar si es una respuesta a un estado de whitelist
+                if update.message.from_user.id in admin_states and admin_states[update.message.from_user.id]['action'] == 'whitelist':
+                    bot_handlers.handle_whitelist_duration(update.message, bot)
+                    logger.info(f"Procesando duración de whitelist para admin {update.message.from_user.id}")
+                    return
+                    
+                # Manejar comandos de administrador
+                if update.message.from_user.id in ADMIN_IDS:
+                    try:
+                        # Procesar comandos de administrador
+                        if update.message.text == '/stats' or update.message.text == '/estadisticas':
+                            bot_handlers.handle_stats_command(update.message, bot)
+                            logger.info(f"Comando de administrador {update.message.text} procesado para {update.message.from_user.id}")
+                            return
+                        elif update.message.text == '/check_permissions':
+                            bot_handlers.verify_bot_permissions(bot, use_cache=False) and bot.reply_to(update.message, "✅ Verificación de permisos del bot completada. Revisa los mensajes privados para detalles.")
+                            logger.info(f"Verificación de permisos procesada para {update.message.from_user.id}")
+                            return
+                        elif update.message.text == '/test_invite':
+                            bot_handlers.handle_test_invite(update.message, bot)
+                            logger.info(f"Comando de test_invite procesado para {update.message.from_user.id}")
+                            return
+                        elif update.message.text.startswith('/whitelist'):
+                            if ' list' in update.message.text:
+                                bot_handlers.handle_whitelist_list(update.message, bot)
+                            else:
+                                # Manejar directamente en app.py
+                                handle_whitelist_command(update.message, bot)
+                            logger.info(f"Comando whitelist procesado para {update.message.from_user.id}")
+                            return
+                        elif update.message.text.startswith('/subinfo'):
+                            bot_handlers.handle_subinfo(update.message, bot)
+                            logger.info(f"Comando subinfo procesado para {update.message.from_user.id}")
+                            return
+                        # NUEVO: Manejar comando para forzar verificación de seguridad
+                        elif update.message.text == '/force_security_check':
+                            bot_handlers.admin_force_security_check(update.message, bot)
+                            logger.info(f"Comando force_security_check procesado para {update.message.from_user.id}")
+                            return
+                    except Exception as e:
+                        logger.error(f"Error al procesar comando de administrador: {str(e)}")
+                        # Intentar responder al usuario con el error
+                        try:
+                            bot.reply_to(update.message, f"❌ Error al procesar comando: {str(e)}")
+                        except:
+                            pass
             
-            # Registrar el contenido de la actualización
-            logger.info(f"Actualización recibida: {json_string}")
+            # Verificar si el mensaje no tiene texto pero es un evento
+            else:
+                logger.info(f"Evento recibido de {update.message.from_user.id}")
+                
+            # Manejar directamente new_chat_members aquí
+            if update.message.new_chat_members:
+                logger.info(f"Nuevos miembros detectados: {[m.id for m in update.message.new_chat_members]}")
+                try:
+                    bot_handlers.handle_new_chat_members(update.message, bot)
+                    return
+                except Exception as e:
+                    logger.error(f"Error procesando nuevos miembros: {str(e)}")
             
-            # Procesar la actualización
-            update = telebot.types.Update.de_json(json_string)
+            # Manejar left_chat_member - Añadida esta verificación
+            if hasattr(update.message, 'left_chat_member') and update.message.left_chat_member is not None:
+                logger.info(f"Usuario abandonó el chat: {update.message.left_chat_member.id}")
+                return
             
-            # Registrar el tipo de actualización
-            if update.message:
-                if update.message.text:
-                    logger.info(f"Mensaje recibido de {update.message.from_user.id}: {update.message.text}")
-                    
-                    # Verificar si es una respuesta a un estado de whitelist
-                    if update.message.from_user.id in admin_states and admin_states[update.message.from_user.id]['action'] == 'whitelist':
-                        bot_handlers.handle_whitelist_duration(update.message, bot)
-                        logger.info(f"Procesando duración de whitelist para admin {update.message.from_user.id}")
-                        return 'OK', 200
-                        
-                    # Manejar comandos de administrador
-                    if update.message.from_user.id in ADMIN_IDS:
-                        try:
-                            # Procesar comandos de administrador
-                            if update.message.text == '/stats' or update.message.text == '/estadisticas':
-                                bot_handlers.handle_stats_command(update.message, bot)
-                                logger.info(f"Comando de administrador {update.message.text} procesado para {update.message.from_user.id}")
-                                return 'OK', 200
-                            elif update.message.text == '/check_permissions':
-                                bot_handlers.verify_bot_permissions(bot) and bot.reply_to(update.message, "✅ Verificación de permisos del bot completada. Revisa los mensajes privados para detalles.")
-                                logger.info(f"Verificación de permisos procesada para {update.message.from_user.id}")
-                                return 'OK', 200
-                            elif update.message.text == '/test_invite':
-                                bot_handlers.handle_test_invite(update.message, bot)
-                                logger.info(f"Comando de test_invite procesado para {update.message.from_user.id}")
-                                return 'OK', 200
-                            elif update.message.text.startswith('/whitelist'):
-                                if ' list' in update.message.text:
-                                    bot_handlers.handle_whitelist_list(update.message, bot)
-                                else:
-                                    # Manejar directamente en app.py
-                                    handle_whitelist_command(update.message, bot)
-                                logger.info(f"Comando whitelist procesado para {update.message.from_user.id}")
-                                return 'OK', 200
-                            elif update.message.text.startswith('/subinfo'):
-                                bot_handlers.handle_subinfo(update.message, bot)
-                                logger.info(f"Comando subinfo procesado para {update.message.from_user.id}")
-                                return 'OK', 200
-                            # NUEVO: Manejar comando para forzar verificación de seguridad
-                            elif update.message.text == '/force_security_check':
-                                bot_handlers.admin_force_security_check(update.message, bot)
-                                logger.info(f"Comando force_security_check procesado para {update.message.from_user.id}")
-                                return 'OK', 200
-                        except Exception as e:
-                            logger.error(f"Error al procesar comando de administrador: {str(e)}")
-                            # Intentar responder al usuario con el error
-                            try:
-                                bot.reply_to(update.message, f"❌ Error al procesar comando: {str(e)}")
-                            except:
-                                pass
+            # Continuar con el manejo del mensaje /start
+            if update.message.text == '/start':
+                logger.info("¡Comando /start detectado! Enviando respuesta directa...")
                 
-                # Verificar si el mensaje no tiene texto pero es un evento
-                else:
-                    logger.info(f"Evento recibido de {update.message.from_user.id}")
-                    
-                # Manejar directamente new_chat_members aquí
-                if update.message.new_chat_members:
-                    logger.info(f"Nuevos miembros detectados: {[m.id for m in update.message.new_chat_members]}")
+                try:
+                    # Usar la función handle_start mejorada
+                    bot_handlers.handle_start(update.message, bot)
+                    logger.info(f"Respuesta enviada al usuario {update.message.from_user.id}")
+                    return
+                except Exception as e:
+                    logger.error(f"Error al enviar respuesta directa: {str(e)}")
+            
+            # Manejar comando recover
+            if update.message.text == '/recover' or update.message.text.startswith('/recover'):
+                try:
+                    bot_handlers.handle_recover_access(update.message, bot)
+                    logger.info(f"Comando /recover procesado para {update.message.from_user.id}")
+                    return
+                except Exception as e:
+                    logger.error(f"Error al procesar comando /recover: {str(e)}")
+        
+        elif update.callback_query:
+            logger.info(f"Callback recibido de {update.callback_query.from_user.id}: {update.callback_query.data}")
+            
+            # Manejar directamente los callbacks aquí
+            try:
+                call = update.callback_query
+                chat_id = call.message.chat.id
+                message_id = call.message.message_id
+                
+                # Manejar directamente callbacks de whitelist (cancelar y páginas de /whitelist list)
+                if call.data == "whitelist_cancel" or call.data.startswith(("whitelist_next_", "whitelist_prev_")):
                     try:
-                        bot_handlers.handle_new_chat_members(update.message, bot)
-                        return 'OK', 200
+                        bot_handlers.handle_whitelist_callback(call, bot)
+                        logger.info(f"Callback de whitelist procesado para {call.from_user.id}")
+                        bot.answer_callback_query(call.id)
+                        return
                     except Exception as e:
-                        logger.error(f"Error procesando nuevos miembros: {str(e)}")
+                        logger.error(f"Error al procesar callback whitelist: {str(e)}")
                 
-                # Manejar left_chat_member - Añadida esta verificación
-                if hasattr(update.message, 'left_chat_member') and update.message.left_chat_member is not None:
-                    logger.info(f"Usuario abandonó el chat: {update.message.left_chat_member.id}")
-                    return 'OK', 200
+                if call.data == "view_plans":
+                    # Usar la nueva función para mostrar planes dinámicamente
+                    bot_handlers.show_plans(bot, chat_id, message_id)
+                    logger.info(f"Planes mostrados a usuario {chat_id}")
                 
-                # Continuar con el manejo del mensaje /start
-                if update.message.text == '/start':
-                    logger.info("¡Comando /start detectado! Enviando respuesta directa...")
+                elif call.data == "tutorial":
+                    # Mostrar tutorial de pagos
+                    bot_handlers.show_payment_tutorial(bot, chat_id, message_id)
+                    logger.info(f"Tutorial mostrado a usuario {chat_id}")
+                    
+                elif call.data == "bot_credits":
+                    # Mostrar créditos - SIN formato Markdown para evitar errores
+                    credits_text = (
+                        "🧠 Créditos del Bot\n\n"
+                        "Este bot fue desarrollado por el equipo de desarrollo VIP.\n\n"
+                        "Si deseas realizar tu propio bot de suscripciones contactate con @NuryOwO.\n\n"
+                        "© 2025 Todos los derechos reservados.\n\n"
+                    )
+                    
+                    markup = types.InlineKeyboardMarkup()
+                    markup.add(types.InlineKeyboardButton("🔙 Volver", callback_data="back_to_main"))
                     
+                    bot.edit_message_text(
+                        chat_id=chat_id,
+                        message_id=message_id,
+                        text=credits_text,
+                        reply_markup=markup
+                    )
+                    logger.info(f"Créditos mostrados a usuario {chat_id}")
+                    
+                elif call.data == "terms":
+                    # Mostrar términos - SIN formato Markdown para evitar errores
                     try:
-                        # Usar la función handle_start mejorada
-                        bot_handlers.handle_start(update.message, bot)
-                        logger.info(f"Respuesta enviada al usuario {update.message.from_user.id}")
-                        return 'OK', 200
-                    except Exception as e:
-                        logger.error(f"Error al enviar respuesta directa: {str(e)}")
+                        with open(os.path.join('static', 'terms.txt'), 'r', encoding='utf-8') as f:
+                            # Eliminar los asteriscos que causan problemas de formato Markdown
+                            terms_text = f.read().replace('*', '')
+                    except:
+                        terms_text = (
+                            "📜 Términos de Uso\n\n"
+                            "1. El contenido del grupo VIP es exclusivo para suscriptores.\n"
+                            "2. No se permiten reembolsos una vez activada la suscripción.\n"
+                            "3. Está prohibido compartir el enlace de invitación.\n"
+                            "4. No se permite redistribuir el contenido fuera del grupo.\n"
+                            "5. El incumplimiento de estas normas resultará en expulsión sin reembolso.\n\n"
+                            "Al suscribirte, aceptas estos términos."
+                        )
+                    
+                    markup = types.InlineKeyboardMarkup()
+                    markup.add(types.InlineKeyboardButton("🔙 Volver", callback_data="back_to_main"))
+                    
+                    bot.edit_message_text(
+                        chat_id=chat_id,
+                        message_id=message_id,
+                        text=terms_text,
+                        reply_markup=markup
+                    )
+                    logger.info(f"Términos mostrados a usuario {chat_id}")
+                    
+                elif call.data == "back_to_main":
+                    # Volver al menú principal
+                    markup = bot_handlers.create_main_menu_markup()
+                    
+                    bot.edit_message_text(
+                        chat_id=chat_id,
+                        message_id=message_id,
+                        text = (
+                            "👋 ¡𝗢𝗵𝗮𝘆𝗼𝘂~! ヾ(๑╹◡╹)ﾉ 𝗦𝗼𝘆 𝗹𝗮 𝗽𝗼𝗿𝘁𝗲𝗿𝗮 𝗱𝗲𝗹 𝗴𝗿𝘂𝗽𝗼 𝗩𝗜𝗣\n\n"
+                            "Este grupo es un espacio exclusivo con contenido premium y acceso limitado.\n\n"
+                            "Estoy aquí para ayudarte a ingresar correctamente al grupo 💫\n\n"
+                            "Por favor, elige una opción para continuar 👇"
+                        ),
+                        reply_markup=markup
+                    )
+                    logger.info(f"Vuelto al menú principal para usuario {chat_id}")
                 
-                # Manejar comando recover
-                if update.message.text == '/recover' or update.message.text.startswith('/recover'):
-                    try:
-                        bot_handlers.handle_recover_access(update.message, bot)
-                        logger.info(f"Comando /recover procesado para {update.message.from_user.id}")
-                        return 'OK', 200
-                    except Exception as e:
-                        logger.error(f"Error al procesar comando /recover: {str(e)}")
-            
-            elif update.callback_query:
-                logger.info(f"Callback recibido de {update.callback_query.from_user.id}: {update.callback_query.data}")
+                elif "_plan" in call.data:
+                    # Manejar selección de plan usando la función dinámica
+                    plan_id = bot_handlers.get_plan_from_callback(call.data)
+                    if plan_id and plan_id in PLANS:
+                        bot_handlers.show_plan_details(bot, chat_id, message_id, plan_id)
+                        logger.info(f"Detalles del plan {plan_id} mostrados a usuario {chat_id}")
+                    else:
+                        bot.answer_callback_query(call.id, "Plan no disponible")
+                        logger.error(f"Plan {plan_id} no encontrado")
                 
-                # Manejar directamente los callbacks aquí
-                try:
-                    call = update.callback_query
-                    chat_id = call.message.chat.id
-                    message_id = call.message.message_id
+                elif call.data.startswith("payment_paypal_"):
+                    # Manejar pago con PayPal
+                    checkout_started = time.time()
+                    plan_id = call.data.split("_")[-1]  # Extraer el ID del plan
                     
-                    # Manejar directamente callback de whitelist
-                    if call.data == "whitelist_cancel":
-                        try:
-                            bot_handlers.handle_whitelist_callback(call, bot)
-                            logger.info(f"Callback de whitelist procesado para {call.from_user.id}")
-                            bot.answer_callback_query(call.id)
-                            return 'OK', 200
-                        except Exception as e:
-                            logger.error(f"Error al procesar callback whitelist: {str(e)}")
+                    # Verificar que el plan existe
+                    if plan_id not in PLANS:
+                        bot.answer_callback_query(call.id, "❌ Plan no válido")
+                        logger.error(f"Intento de pago con plan inválido: {plan_id}")
+                        return
                     
-                    if call.data == "view_plans":
-                        # Usar la nueva función para mostrar planes dinámicamente
-                        bot_handlers.show_plans(bot, chat_id, message_id)
-                        logger.info(f"Planes mostrados a usuario {chat_id}")
+                    # Mostrar mensaje inicial kawaii
+                    processing_message = bot.edit_message_text(
+                        chat_id=chat_id,
+                        message_id=message_id,
+                        text="✨ Preparando algo especial para ti... ✨"
+                    )
                     
-                    elif call.data == "tutorial":
-                        # Mostrar tutorial de pagos
-                        bot_handlers.show_payment_tutorial(bot, chat_id, message_id)
-                        logger.info(f"Tutorial mostrado a usuario {chat_id}")
-                        
-                    elif call.data == "bot_credits":
-                        # Mostrar créditos - SIN formato Markdown para evitar errores
-                        credits_text = (
-                            "🧠 Créditos del Bot\n\n"
-                            "Este bot fue desarrollado por el equipo de desarrollo VIP.\n\n"
-                            "Si deseas realizar tu propio bot de suscripciones contactate con @NuryOwO.\n\n"
-                            "© 2025 Todos los derechos reservados.\n\n"
-                        )
-                        
-                        markup = types.InlineKeyboardMarkup()
-                        markup.add(types.InlineKeyboardButton("🔙 Volver", callback_data="back_to_main"))
+                    # Animación kawaii mientras se crea el enlace (planificador compartido)
+                    animation_scheduler.start(bot, chat_id, message_id)
+                    
+                    # ID de correlación del checkout: vuelve en la URL de retorno de PayPal (ver tracing.py)
+                    correlation_id = tracing.new_correlation_id()
+                    subscription_url = None
+                    try:
+                        # Crear enlace de suscripción de PayPal
+                        with tracing.span(correlation_id, 'create_payment_link', chat_id) as link_span:
+                            subscription_url = pay.create_subscription_link(plan_id, chat_id, correlation_id=correlation_id)
+                            if not subscription_url:
+                                link_span['status'] = 'error'
                         
-                        bot.edit_message_text(
-                            chat_id=chat_id,
-                            message_id=message_id,
-                            text=credits_text,
-                            reply_markup=markup
-                        )
-                        logger.info(f"Créditos mostrados a usuario {chat_id}")
+                        # Detener animación; solo espera si hay un fotograma en vuelo
+                        animation_scheduler.stop(chat_id, message_id).wait(5)
                         
-                    elif call.data == "terms":
-                        # Mostrar términos - SIN formato Markdown para evitar errores
-                        try:
-                            with open(os.path.join('static', 'terms.txt'), 'r', encoding='utf-8') as f:
-                                # Eliminar los asteriscos que causan problemas de formato Markdown
-                                terms_text = f.read().replace('*', '')
-                        except:
-                            terms_text = (
-                                "📜 Términos de Uso\n\n"
-                                "1. El contenido del grupo VIP es exclusivo para suscriptores.\n"
-                                "2. No se permiten reembolsos una vez activada la suscripción.\n"
-                                "3. Está prohibido compartir el enlace de invitación.\n"
-                                "4. No se permite redistribuir el contenido fuera del grupo.\n"
-                                "5. El incumplimiento de estas normas resultará en expulsión sin reembolso.\n\n"
-                                "Al suscribirte, aceptas estos términos."
+                        if subscription_url:
+                            # Crear markup con botón para pagar
+                            markup = types.InlineKeyboardMarkup()
+                            markup.add(
+                                types.InlineKeyboardButton("💳 Ir a pagar", url=subscription_url),
+                                types.InlineKeyboardButton("🔙 Cancelar", callback_data="view_plans")
+                            )
+                            
+                            # Determinar tipo de plan
+                            is_recurring = RECURRING_PAYMENTS_ENABLED
+                            if 'recurring' in PLANS[plan_id]:
+                                is_recurring = PLANS[plan_id]['recurring']
+                            
+                            payment_type = "suscripción" if is_recurring else "pago único"
+                            
+                            # Determinar período basado en la duración
+                            if PLANS[plan_id]['duration_days'] <= 7:
+                                period = 'semana'
+                            else:
+                                period = 'mes'
+                            
+                            renewal_text = "(renovación automática)" if is_recurring else "(sin renovación automática)"
+                            
+                            # Mensaje kawaii para el enlace de pago listo - sin caracteres especiales problemáticos
+                            payment_text = (
+                                f"💌 𝗧𝘂 𝗲𝗻𝘁𝗿𝗮𝗱𝗮 𝗲𝘀𝘁á 𝗰𝗮𝘀𝗶 𝗹𝗶𝘀𝘁𝗮 ദ്ദി ˉ꒳ˉ )\n\n"
+                                f"📦 𝗣𝗹𝗮𝗻: {PLANS[plan_id]['display_name']}\n"
+                                f"💰 𝗣𝗿𝗲𝗰𝗶𝗼:【＄{PLANS[plan_id]['price_usd']:.2f} USD 】/ {period} {renewal_text}\n\n"
+                                f"Por favor, haz clic en el botón de aquí abajo para completar tu {payment_type} con PayPal.\n\n"
+                                "Una vez que termines, te daré tu entrada y te dejaré entrar 💌 (˶ˆᗜˆ˵)"
+                            )
+                            
+                            bot.edit_message_text(
+                                chat_id=chat_id,
+                                message_id=message_id,
+                                text=payment_text,
+                                reply_markup=markup
+                            )
+                            logger.info(f"Enlace de pago PayPal creado para usuario {chat_id}, plan {plan_id}")
+                        else:
+                            # Error al crear enlace de pago
+                            markup = types.InlineKeyboardMarkup()
+                            markup.add(types.InlineKeyboardButton("🔙 Volver", callback_data="view_plans"))
+                            
+                            bot.edit_message_text(
+                                chat_id=chat_id,
+                                message_id=message_id,
+                                text=(
+                                    "❌ Lo siento mucho, no pude crear el enlace de pago (ᵒ̴̶̷́ㅿᵒ̴̶̷̀)\n\n"
+                                    "Por favor, intenta nuevamente más tarde o contacta a soporte."
+                                ),
+                                reply_markup=markup
                             )
+                            logger.error(f"Error al crear enlace de pago PayPal para usuario {chat_id}")
+                    except Exception as e:
+                        # Asegurar que se detenga la animación en caso de error
+                        animation_scheduler.stop(chat_id, message_id).wait(5)
                         
+                        # Mostrar mensaje de error con estilo kawaii
                         markup = types.InlineKeyboardMarkup()
-                        markup.add(types.InlineKeyboardButton("🔙 Volver", callback_data="back_to_main"))
-                        
-                        bot.edit_message_text(
-                            chat_id=chat_id,
-                            message_id=message_id,
-                            text=terms_text,
-                            reply_markup=markup
-                        )
-                        logger.info(f"Términos mostrados a usuario {chat_id}")
-                        
-                    elif call.data == "back_to_main":
-                        # Volver al menú principal
-                        markup = bot_handlers.create_main_menu_markup()
+                        markup.add(types.InlineKeyboardButton("🔙 Volver", callback_data="view_plans"))
                         
                         bot.edit_message_text(
                             chat_id=chat_id,
                             message_id=message_id,
-                            text = (
-                                "👋 ¡𝗢𝗵𝗮𝘆𝗼𝘂~! ヾ(๑╹◡╹)ﾉ 𝗦𝗼𝘆 𝗹𝗮 𝗽𝗼𝗿𝘁𝗲𝗿𝗮 𝗱𝗲𝗹 𝗴𝗿𝘂𝗽𝗼 𝗩𝗜𝗣\n\n"
-                                "Este grupo es un espacio exclusivo con contenido premium y acceso limitado.\n\n"
-                                "Estoy aquí para ayudarte a ingresar correctamente al grupo 💫\n\n"
-                                "Por favor, elige una opción para continuar 👇"
-                            ),
+                            text=f"❌ Ocurrió un error inesperado (。•́︿•̀。)\n\nPor favor, intenta nuevamente más tarde.",
                             reply_markup=markup
                         )
-                        logger.info(f"Vuelto al menú principal para usuario {chat_id}")
+                        logger.error(f"Excepción en proceso de pago: {e}")
                     
-                    elif "_plan" in call.data:
-                        # Manejar selección de plan usando la función dinámica
-                        plan_id = bot_handlers.get_plan_from_callback(call.data)
-                        if plan_id and plan_id in PLANS:
-                            bot_handlers.show_plan_details(bot, chat_id, message_id, plan_id)
-                            logger.info(f"Detalles del plan {plan_id} mostrados a usuario {chat_id}")
-                        else:
-                            bot.answer_callback_query(call.id, "Plan no disponible")
-                            logger.error(f"Plan {plan_id} no encontrado")
+                    tracing.record_span(correlation_id, 'payment_method', checkout_started, user_id=chat_id,
+                                        status='ok' if subscription_url else 'error')
+                
+                # Responder al callback para quitar el "reloj de espera" en el cliente
+                bot.answer_callback_query(call.id)
+                logger.info(f"Callback respondido: {call.data}")
+                
+                return
+                
+            except Exception as e:
+                logger.error(f"Error al procesar callback directamente: {str(e)}")
+        
+        # Código seguro para manejar chat_member
+        elif hasattr(update, 'chat_member') and update.chat_member is not None:
+            try:
+                chat_id = update.chat_member.chat.id
+                user_id = update.chat_member.new_chat_member.user.id
+                status = update.chat_member.new_chat_member.status
+                old_status = update.chat_member.old_chat_member.status
+                
+                # Si un usuario se unió al grupo
+                if status == 'member' and old_status == 'left':
+                    from config import GROUP_CHAT_ID
                     
-                    elif call.data.startswith("payment_paypal_"):
-                        # Manejar pago con PayPal
-                        plan_id = call.data.split("_")[-1]  # Extraer el ID del plan
-                        
-                        # Verificar que el plan existe
-                        if plan_id not in PLANS:
-                            bot.answer_callback_query(call.id, "❌ Plan no válido")
-                            logger.error(f"Intento de pago con plan inválido: {plan_id}")
-                            return 'OK', 200
-                        
-                        # Mostrar mensaje inicial kawaii
-                        processing_message = bot.edit_message_text(
-                            chat_id=chat_id,
-                            message_id=message_id,
-                            text="✨ Preparando algo especial para ti... ✨"
-                        )
-                        
-                        # Variable para controlar la animación
-                        animation_active = True
-                        
-                        # Iniciar hilo de animación
-                        def animate_kawaii_messages():
-                            messages = [
-                                "🌸 Preparando tu entrada VIP... 🌸",
-                                "📝 Anotando tu nombre en mi lista secreta~",
-                                "✨ Qué nombre tan lindo... jeje~ ✨",
-                                "🎀 Abriendo las puertas del club VIP~",
-                                "🌟 Un momento más... ¡Todo listo! 🌟",
-                                "💰 Oh casi lo olvido, falta el pago... 💰"
-                            ]
-                            
-                            # Variable para rastrear el frame actual
-                            current_frame = 0
-                            
-                            # Primera fase: mostrar cada mensaje una vez
-                            for i, message_text in enumerate(messages):
-                                if not animation_active:
-                                    break
-                                    
-                                try:
-                                    bot.edit_message_text(
-                                        chat_id=chat_id,
-                                        message_id=message_id,
-                                        text=message_text
-                                    )
-                                    current_frame = i
-                                    # Tiempo más largo entre mensajes (3 segundos)
-                                    time.sleep(3)
-                                except Exception as e:
-                                    logger.error(f"Error en animación fase 1: {e}")
-                                    break
-                            
-                            # Segunda fase: continuar ciclo hasta que se desactive
-                            while animation_active:
-                                next_frame = (current_frame + 1) % len(messages)
-                                try:
-                                    bot.edit_message_text(
-                                        chat_id=chat_id,
-                                        message_id=message_id,
-                                        text=messages[next_frame]
-                                    )
-                                    current_frame = next_frame
-                                    time.sleep(3)
-                                except Exception as e:
-                                    logger.error(f"Error en ciclo de animación fase 2: {e}")
-                                    break
-                        
-                        # Iniciar hilo de animación
-                        animation_thread = threading.Thread(target=animate_kawaii_messages)
-                        animation_thread.daemon = True
-                        animation_thread.start()
+                    # Verificar si es el grupo VIP
+                    if str(chat_id) == str(GROUP_CHAT_ID):
+                        # Verificar si el usuario tiene suscripción activa
+                        subscription = db.get_active_subscription(user_id)
                         
-                        # Pausa para asegurar que el hilo de animación inicie correctamente
-                        time.sleep(1)
+                        # Omitir administradores
+                        if user_id in ADMIN_IDS:
+                            logger.info(f"Administrador {user_id} se unió al grupo")
+                            return
                         
-                        try:
-                            # Crear enlace de suscripción de PayPal
-                            subscription_url = pay.create_subscription_link(plan_id, chat_id)
-                            
-                            # Detener animación y dar tiempo para finalizar
-                            animation_active = False
-                            time.sleep(1.5)  # Tiempo suficiente para que termine su ciclo actual
+                        if not subscription:
+                            # No tiene suscripción activa, expulsar
+                            logger.warning(f"⚠️ USUARIO SIN SUSCRIPCIÓN DETECTADO: {user_id}")
                             
-                            if subscription_url:
-                                # Crear markup con botón para pagar
-                                markup = types.InlineKeyboardMarkup()
-                                markup.add(
-                                    types.InlineKeyboardButton("💳 Ir a pagar", url=subscription_url),
-                                    types.InlineKeyboardButton("🔙 Cancelar", callback_data="view_plans")
-                                )
-                                
-                                # Determinar tipo de plan
-                                is_recurring = RECURRING_PAYMENTS_ENABLED
-                                if 'recurring' in PLANS[plan_id]:
-                                    is_recurring = PLANS[plan_id]['recurring']
-                                
-                                payment_type = "suscripción" if is_recurring else "pago único"
-                                
-                                # Determinar período basado en la duración
-                                if PLANS[plan_id]['duration_days'] <= 7:
-                                    period = 'semana'
-                                else:
-                                    period = 'mes'
-                                
-                                renewal_text = "(renovación automática)" if is_recurring else "(sin renovación automática)"
+                            try:
+                                username = update.chat_member.new_chat_member.user.username
+                                first_name = update.chat_member.new_chat_member.user.first_name
                                 
-                                # Mensaje kawaii para el enlace de pago listo - sin caracteres especiales problemáticos
-                                payment_text = (
-                                    f"💌 𝗧𝘂 𝗲𝗻𝘁𝗿𝗮𝗱𝗮 𝗲𝘀𝘁á 𝗰𝗮𝘀𝗶 𝗹𝗶𝘀𝘁𝗮 ദ്ദി ˉ꒳ˉ )\n\n"
-                                    f"📦 𝗣𝗹𝗮𝗻: {PLANS[plan_id]['display_name']}\n"
-                                    f"💰 𝗣𝗿𝗲𝗰𝗶𝗼:【＄{PLANS[plan_id]['price_usd']:.2f} USD 】/ {period} {renewal_text}\n\n"
-                                    f"Por favor, haz clic en el botón de aquí abajo para completar tu {payment_type} con PayPal.\n\n"
-                                    "Una vez que termines, te daré tu entrada y te dejaré entrar 💌 (˶ˆᗜˆ˵)"
+                                # Enviar mensaje al grupo
+                                bot.send_message(
+                                    chat_id=chat_id,
+                                    text=f"🛑 SEGURIDAD: Usuario {first_name} (@{username or 'Sin username'}) no tiene suscripción activa y será expulsado automáticamente."
                                 )
                                 
-                                bot.edit_message_text(
+                                # Expulsar al usuario
+                                logger.info(f"Expulsando a usuario sin suscripción: {user_id}")
+                                bot.ban_chat_member(
                                     chat_id=chat_id,
-                                    message_id=message_id,
-                                    text=payment_text,
-                                    reply_markup=markup
+                                    user_id=user_id
                                 )
-                                logger.info(f"Enlace de pago PayPal creado para usuario {chat_id}, plan {plan_id}")
-                            else:
-                                # Error al crear enlace de pago
-                                markup = types.InlineKeyboardMarkup()
-                                markup.add(types.InlineKeyboardButton("🔙 Volver", callback_data="view_plans"))
                                 
-                                bot.edit_message_text(
+                                # Desbanear inmediatamente para permitir que vuelva a unirse si obtiene suscripción
+                                bot.unban_chat_member(
                                     chat_id=chat_id,
-                                    message_id=message_id,
-                                    text=(
-                                        "❌ Lo siento mucho, no pude crear el enlace de pago (ᵒ̴̶̷́ㅿᵒ̴̶̷̀)\n\n"
-                                        "Por favor, intenta nuevamente más tarde o contacta a soporte."
-                                    ),
-                                    reply_markup=markup
+                                    user_id=user_id,
+                                    only_if_banned=True
                                 )
-                                logger.error(f"Error al crear enlace de pago PayPal para usuario {chat_id}")
-                        except Exception as e:
-                            # Asegurar que se detenga la animación en caso de error
-                            animation_active = False
-                            time.sleep(1)
-                            
-                            # Mostrar mensaje de error con estilo kawaii
-                            markup = types.InlineKeyboardMarkup()
-                            markup.add(types.InlineKeyboardButton("🔙 Volver", callback_data="view_plans"))
-                            
-                            bot.edit_message_text(
-                                chat_id=chat_id,
-                                message_id=message_id,
-                                text=f"❌ Ocurrió un error inesperado (。•́︿•̀。)\n\nPor favor, intenta nuevamente más tarde.",
-                                reply_markup=markup
-                            )
-                            logger.error(f"Excepción en proceso de pago: {e}")
-                    
-                    # Responder al callback para quitar el "reloj de espera" en el cliente
-                    bot.answer_callback_query(call.id)
-                    logger.info(f"Callback respondido: {call.data}")
-                    
-                    return 'OK', 200
-                    
-                except Exception as e:
-                    logger.error(f"Error al procesar callback directamente: {str(e)}")
-            
-            # Código seguro para manejar chat_member
-            elif hasattr(update, 'chat_member') and update.chat_member is not None:
-                try:
-                    chat_id = update.chat_member.chat.id
-                    user_id = update.chat_member.new_chat_member.user.id
-                    status = update.chat_member.new_chat_member.status
-                    old_status = update.chat_member.old_chat_member.status
-                    
-                    # Si un usuario se unió al grupo
-                    if status == 'member' and old_status == 'left':
-                        from config import GROUP_CHAT_ID
-                        
-                        # Verificar si es el grupo VIP
-                        if str(chat_id) == str(GROUP_CHAT_ID):
-                            # Verificar si el usuario tiene suscripción activa
-                            subscription = db.get_active_subscription(user_id)
-                            
-                            # Omitir administradores
-                            if user_id in ADMIN_IDS:
-                                logger.info(f"Administrador {user_id} se unió al grupo")
-                                return 'OK', 200
-                            
-                            if not subscription:
-                                # No tiene suscripción activa, expulsar
-                                logger.warning(f"⚠️ USUARIO SIN SUSCRIPCIÓN DETECTADO: {user_id}")
                                 
+                                # Registrar la expulsión
+                                db.record_expulsion(user_id, "Verificación de nuevo miembro - Sin suscripción activa")
+                                
+                                # Enviar mensaje privado al usuario
                                 try:
-                                    username = update.chat_member.new_chat_member.user.username
-                                    first_name = update.chat_member.new_chat_member.user.first_name
-                                    
-                                    # Enviar mensaje al grupo
                                     bot.send_message(
-                                        chat_id=chat_id,
-                                        text=f"🛑 SEGURIDAD: Usuario {first_name} (@{username or 'Sin username'}) no tiene suscripción activa y será expulsado automáticamente."
-                                    )
-                                    
-                                    # Expulsar al usuario
-                                    logger.info(f"Expulsando a usuario sin suscripción: {user_id}")
-                                    bot.ban_chat_member(
-                                        chat_id=chat_id,
-                                        user_id=user_id
-                                    )
-                                    
-                                    # Desbanear inmediatamente para permitir que vuelva a unirse si obtiene suscripción
-                                    bot.unban_chat_member(
-                                        chat_id=chat_id,
-                                        user_id=user_id,
-                                        only_if_banned=True
+                                        chat_id=user_id,
+                                        text=f"SEGURIDAD! 🚨"
                                     )
-                                    
-                                    # Registrar la expulsión
-                                    db.record_expulsion(user_id, "Verificación de nuevo miembro - Sin suscripción activa")
-                                    
-                                    # Enviar mensaje privado al usuario
-                                    try:
-                                        bot.send_message(
-                                            chat_id=user_id,
-                                            text=f"SEGURIDAD! 🚨"
-                                        )
-                                    except Exception as e:
-                                        logger.error(f"No se pudo enviar mensaje privado a {user_id}: {e}")
-                                        
                                 except Exception as e:
-                                    logger.error(f"Error al expulsar nuevo miembro no autorizado {user_id}: {e}")
-                            else:
-                                logger.info(f"Usuario {user_id} se unió al grupo con suscripción válida")
-                    
-                    # AÑADIR ESTA NUEVA SECCIÓN: Verificar usuarios ya existentes en el grupo
-                    elif status == 'member' and old_status == 'member':
-                        # Este es un buen momento para verificar si algún usuario con suscripción expirada
-                        # sigue en el grupo (puede ocurrir si el bot se reinició)
-                        
-                        # Usar un hilo separado para no bloquear la respuesta
-                        def verify_expired_thread():
-                            try:
-                                from bot_handlers import force_security_check
-                                force_security_check(bot)
+                                    logger.error(f"No se pudo enviar mensaje privado a {user_id}: {e}")
+                                    
                             except Exception as e:
-                                logger.error(f"Error en verificación automática: {e}")
-                        
-                        # Ejecutar la verificación en segundo plano
-                        threading.Thread(target=verify_expired_thread, daemon=True).start()
-                        logger.info("Iniciada verificación automática en segundo plano")
+                                logger.error(f"Error al expulsar nuevo miembro no autorizado {user_id}: {e}")
+                        else:
+                            logger.info(f"Usuario {user_id} se unió al grupo con suscripción válida")
                 
-                    return 'OK', 200
+                # AÑADIR ESTA NUEVA SECCIÓN: Verificar usuarios ya existentes en el grupo
+                elif status == 'member' and old_status == 'member':
+                    # Este es un buen momento para verificar si algún usuario con suscripción expirada
+                    # sigue en el grupo (puede ocurrir si el bot se reinició)
                     
-                except Exception as e:
-                    logger.error(f"Error al procesar chat_member: {str(e)}")
-                    return 'OK', 200
+                    # Usar un hilo separado para no bloquear la respuesta
+                    def verify_expired_thread():
+                        try:
+                            from bot_handlers import force_security_check
+                            force_security_check(bot)
+                        except Exception as e:
+                            logger.error(f"Error en verificación automática: {e}")
+                    
+                    # Ejecutar la verificación en segundo plano
+                    threading.Thread(target=verify_expired_thread, daemon=True).start()
+                    logger.info("Iniciada verificación automática en segundo plano")
+            
+                return
+                
+            except Exception as e:
+                logger.error(f"Error al procesar chat_member: {str(e)}")
+                return
+        
+        # Procesar a través de los handlers normales como respaldo
+        bot.process_new_updates([update])
+    except Exception as e:
+        logger.error(f"Error al procesar actualización {update.update_id}: {str(e)}")
+
+
+# Pool de workers para procesar las actualizaciones fuera del ciclo de la petición
+update_dispatcher = UpdateDispatcher(
+    process_update,
+    workers=WEBHOOK_WORKERS,
+    max_pending=WEBHOOK_QUEUE_SIZE,
+    dedup_size=WEBHOOK_DEDUP_SIZE
+)
+
+# Componentes vigilados por el watchdog de salud (además de las tareas del planificador)
+health.register('webhook_workers', kind='pool', probe=update_dispatcher.is_healthy,
+                restart=update_dispatcher.ensure_workers, description="Workers de actualizaciones de Telegram")
+health.register('animations', kind='pool', probe=animation_scheduler.is_healthy,
+                restart=animation_scheduler.ensure_running, description="Planificador de animaciones de pago")
+health.register('log_listener', kind='pool', probe=logging_setup.is_listener_alive,
+                restart=logging_setup.restart_listener, description="Hilo que escribe los logs")
+
+@app.route(f'/webhook/{BOT_TOKEN}', methods=['POST'])
+def webhook():
+    """Recibe las actualizaciones de Telegram a través de webhook y las encola"""
+    try:
+        if request.headers.get('content-type') == 'application/json':
+            json_string = request.get_data().decode('utf-8')
+            
+            # Registrar el contenido de la actualización (muestreado y truncado por el pipeline de logging)
+            logger.info("Actualización recibida: %s", json_string, extra={'log_type': 'telegram_update'})
+            
+            update = telebot.types.Update.de_json(json_string)
             
-            # Procesar a través de los handlers normales como respaldo
-            bot.process_new_updates([update])
+            # Confirmar de inmediato; el procesamiento ocurre en segundo plano
+            result = update_dispatcher.submit(update)
+            if result == 'rejected':
+                # Cola llena: Telegram volverá a enviar la actualización más tarde
+                return 'Cola llena', 503
             
             return 'OK', 200
         else:
@@ -556,41 +578,6 @@ def webhook():
         logger.error(f"Error al procesar webhook: {str(e)}")
         return 'Error interno', 500
 
-def verify_all_memberships_on_startup():
-    """
-    Verifica todas las suscripciones al iniciar el bot y expulsa a los usuarios que ya no deberían estar en el grupo.
-    Esta función se llama una sola vez al iniciar el bot.
-    """
-    try:
-        logger.info("🔍 Verificando todas las suscripciones al iniciar...")
-        
-        # Importar las funciones necesarias
-        from bot_handlers import perform_group_security_check
-        import database as db
-        from config import GROUP_CHAT_ID
-        
-        # Obtener todas las suscripciones expiradas
-        expired_subscriptions = db.check_and_update_subscriptions(force=True)
-        
-        if expired_subscriptions:
-            logger.info(f"Encontradas {len(expired_subscriptions)} suscripciones expiradas")
-            
-            # Realizar expulsión de usuarios con suscripciones expiradas
-            if GROUP_CHAT_ID:
-                result = perform_group_security_check(bot, GROUP_CHAT_ID, expired_subscriptions)
-                
-                if result:
-                    logger.info(f"✅ Verificación inicial completada: {len(expired_subscriptions)} suscripciones procesadas")
-                else:
-                    logger.error("❌ Verificación inicial falló")
-            else:
-                logger.error("❌ GROUP_CHAT_ID no está configurado. No se puede realizar verificación inicial")
-        else:
-            logger.info("✅ No hay suscripciones expiradas al iniciar")
-            
-    except Exception as e:
-        logger.error(f"Error en verificación inicial: {e}")
-
 
 # Añade esta función a app.py, justo antes o después de la función webhook
 def handle_whitelist_command(message, bot):
@@ -749,11 +736,11 @@ def get_telegram_user():
         import requests
         
         # Primero intentamos obtener información del chat
-        api_url = f"https://api.telegram.org/bot{BOT_TOKEN}/getChat"
+        api_url = telegram_api.method_url("getChat")
         params = {"chat_id": target_user_id}
         
         logger.info(f"Consultando API de Telegram para usuario {target_user_id}")
-        response = requests.get(api_url, params=params)
+        response = telegram_api.telegram_request('GET', api_url, params=params)
         
         if response.status_code != 200:
             logger.error(f"Error al consultar API de Telegram: {response.status_code}, {response.text}")
@@ -790,10 +777,10 @@ def get_telegram_user():
             # Solo si hay un objeto de foto de perfil
             if result.get('photo'):
                 # Obtener la foto de perfil más reciente del usuario (foto pequeña)
-                photos_url = f"https://api.telegram.org/bot{BOT_TOKEN}/getUserProfilePhotos"
+                photos_url = telegram_api.method_url("getUserProfilePhotos")
                 photos_params = {"user_id": target_user_id, "limit": 1}
                 
-                photos_response = requests.get(photos_url, params=photos_params)
+                photos_response = telegram_api.telegram_request('GET', photos_url, params=photos_params)
                 photos_data = photos_response.json()
                 
                 if photos_data.get('ok') and photos_data.get('result', {}).get('total_count', 0) > 0:
@@ -802,17 +789,17 @@ def get_telegram_user():
                     file_id = photo.get('file_id')
                     
                     # Obtener información del archivo
-                    file_url = f"https://api.telegram.org/bot{BOT_TOKEN}/getFile"
+                    file_url = telegram_api.method_url("getFile")
                     file_params = {"file_id": file_id}
                     
-                    file_response = requests.get(file_url, params=file_params)
+                    file_response = telegram_api.telegram_request('GET', file_url, params=file_params)
                     file_data = file_response.json()
                     
                     if file_data.get('ok'):
                         file_path = file_data['result']['file_path']
                         
                         # Construir URL de la foto
-                        photo_url = f"https://api.telegram.org/file/bot{BOT_TOKEN}/{file_path}"
+                        photo_url = telegram_api.file_url(file_path)
                         user_info["photo_url"] = photo_url
         except Exception as e:
             logger.error(f"Error al obtener foto de perfil: {str(e)}")
@@ -836,38 +823,20 @@ def admin_renewal_stats():
         if not admin_id or int(admin_id) not in ADMIN_IDS:
             return jsonify({"error": "Acceso no autorizado"}), 401
         
-        # Obtener estadísticas de renovaciones
-        conn = db.get_db_connection()
+        # Obtener estadísticas de renovaciones (de la réplica de lectura si está al día)
+        conn = db.get_read_connection()
         cursor = conn.cursor()
         
-        # Total de renovaciones
-        cursor.execute("SELECT COUNT(*) FROM subscription_renewals")
-        total_renewals = cursor.fetchone()[0]
-        
-        # Renovaciones en los últimos 30 días
-        cursor.execute("""
-        SELECT COUNT(*) FROM subscription_renewals
-        WHERE renewal_date >= datetime('now', '-30 day')
-        """)
-        last_30_days = cursor.fetchone()[0]
-        
-        # Renovaciones en los últimos 7 días
-        cursor.execute("""
-        SELECT COUNT(*) FROM subscription_renewals
-        WHERE renewal_date >= datetime('now', '-7 day')
-        """)
-        last_7_days = cursor.fetchone()[0]
+        # Totales y ventanas de 30 y 7 días (contadores mantenidos por triggers)
+        total_renewals = db.get_stats_counters(conn).get('subscription_renewals', 0)
+        last_30_days = int(db.get_hourly_stat('subscription_renewals', 30 * 24, conn))
+        last_7_days = int(db.get_hourly_stat('subscription_renewals', 7 * 24, conn))
         
-        # Renovaciones por plan
-        cursor.execute("""
-        SELECT plan, COUNT(*) as count
-        FROM subscription_renewals
-        GROUP BY plan
-        ORDER BY count DESC
-        """)
-        plans = {}
-        for row in cursor.fetchall():
-            plans[row[0]] = row[1]
+        # Renovaciones por plan (rollups diarios, al día según su último refresco)
+        plan_totals = db.get_rollup_plan_totals()
+        plans = {plan: totals['renewals'] for plan, totals in
+                 sorted(plan_totals.items(), key=lambda item: item[1]['renewals'], reverse=True)
+                 if totals['renewals']}
         
         # Próximas renovaciones en los siguientes 7 días
         cursor.execute("""
@@ -887,6 +856,7 @@ def admin_renewal_stats():
         LIMIT 10
         """)
         recent = [dict(zip([column[0] for column in cursor.description], row)) for row in cursor.fetchall()]
+        data_source = conn.data_source
         
         conn.close()
         
@@ -896,8 +866,10 @@ def admin_renewal_stats():
             "last_30_days": last_30_days,
             "last_7_days": last_7_days,
             "by_plan": plans,
+            "by_plan_updated_at": (db.get_rollup_watermark() or {}).get('updated_at'),
             "upcoming_7_days": upcoming_7_days,
-            "recent": recent
+            "recent": recent,
+            "data_source": data_source
         }
         
         return jsonify({
@@ -909,6 +881,37 @@ def admin_renewal_stats():
         logger.error(f"Error al obtener estadísticas de renovaciones: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/admin/revenue-trend', methods=['GET'])
+def admin_revenue_trend():
+    """
+    Tendencia diaria de altas, renovaciones, ingresos, bajas, activas y MRR, con
+    el churn del periodo (de los rollups diarios, ver rollups.py)
+    
+    Parámetros: days (1-730, por defecto 30), plan (opcional) y refresh=1 para
+    recalcular los últimos días antes de responder
+    """
+    try:
+        admin_id = request.args.get('admin_id')
+        if not admin_id or int(admin_id) not in ADMIN_IDS:
+            return jsonify({"error": "Acceso no autorizado"}), 401
+        
+        days = min(max(request.args.get('days', 30, type=int), 1), 730)
+        plan = request.args.get('plan') or None
+        
+        refreshed = None
+        if request.args.get('refresh') == '1':
+            refreshed = rollups.refresh()
+        
+        return jsonify({
+            "success": True,
+            "refreshed": refreshed,
+            "trend": rollups.trend(days, plan)
+        })
+        
+    except Exception as e:
+        logger.error(f"Error al obtener la tendencia de ingresos: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/webhook/paypal', methods=['POST'])
 def paypal_webhook():
     """Maneja los webhooks de PayPal"""
@@ -922,7 +925,7 @@ def paypal_webhook():
         
         # Log detallado para diagnóstico
         logger.info(f"PayPal webhook recibido: {event_type}")
-        logger.info(f"Contenido del webhook: {json.dumps(event_data, indent=2)}")
+        logger.info("Contenido del webhook: %s", json.dumps(event_data), extra={'log_type': 'paypal_webhook'})
         
         # Extraer IDs relevantes para deduplicación
         resource = event_data.get("resource", {})
@@ -1255,140 +1258,336 @@ def paypal_webhook():
         logger.error(f"Error al procesar webhook de PayPal: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
         
-@app.route('/admin/panel')
-def admin_panel():
-    """Renderiza el panel de administración"""
-    try:
-        # Verificación básica de autenticación
-        admin_id = request.args.get('admin_id')
-        if not admin_id or int(admin_id) not in ADMIN_IDS:
-            return jsonify({"error": "Acceso no autorizado"}), 401
-        
-        # Obtener estadísticas para el panel
-        conn = db.get_db_connection()
-        
-        stats = {
-            "usuarios": db.get_total_users_count(conn),
-            "suscripciones": db.get_table_count(conn, "subscriptions"),
-            "suscripciones_activas": db.get_active_subscriptions_count(conn),
-            "enlaces_invitacion": db.get_table_count(conn, "invite_links")
-        }
+def build_admin_summary():
+    """
+    Instantánea de los datos del panel: contadores, suscripciones y usuarios recientes.
+    Su versión es un hash del contenido: si los datos no cambian, la versión tampoco
+    """
+    panel_data = db.get_admin_panel_data()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    
+    # Añadir a las suscripciones recientes la información de renovaciones
+    recent_subscriptions = []
+    for sub_dict in panel_data['recent_subscriptions']:
+        # Si hay renovaciones, añadir información adicional
+        if sub_dict.get('total_renovaciones', 0) > 0:
+            # Formatear la información de renovación
+            if sub_dict.get('ultima_renovacion'):
+                try:
+                    ultima_ren = datetime.datetime.fromisoformat(sub_dict['ultima_renovacion'])
+                    sub_dict['ultima_renovacion_formateada'] = ultima_ren.strftime('%d/%m/%Y %H:%M')
+                except:
+                    sub_dict['ultima_renovacion_formateada'] = 'Fecha no disponible'
+            
+            # Añadir texto descriptivo sobre renovaciones
+            if sub_dict['total_renovaciones'] == 1:
+                sub_dict['renovacion_texto'] = "1 renovación"
+            else:
+                sub_dict['renovacion_texto'] = f"{sub_dict['total_renovaciones']} renovaciones"
         
-        # Obtener últimas 5 suscripciones con fechas actualizadas por renovaciones
-        cursor = conn.cursor()
-        cursor.execute("""
-        SELECT 
-            s.sub_id, 
-            s.user_id, 
-            u.username, 
-            s.plan, 
-            s.price_usd, 
-            s.start_date,
-            -- Usar la fecha de fin más reciente considerando renovaciones
-            CASE 
-                WHEN sr.max_new_end_date IS NOT NULL AND sr.max_new_end_date > s.end_date 
-                THEN sr.max_new_end_date 
-                ELSE s.end_date 
-            END as end_date,
-            -- Mantener el estado original para la lógica
-            s.status, 
-            s.is_recurring, 
-            s.paypal_sub_id,
-            -- Contar renovaciones recientes
-            COALESCE(sr.recent_renewals_count, 0) as renovaciones_recientes,
-            -- Fecha de la última renovación
-            sr.last_renewal_date as ultima_renovacion,
-            -- Cantidad total de renovaciones
-            COALESCE(sr.total_renewals, 0) as total_renovaciones
-        FROM subscriptions s
-        LEFT JOIN users u ON s.user_id = u.user_id
-        -- Subconsulta para obtener información agregada de renovaciones
-        LEFT JOIN (
-            SELECT 
-                sub_id,
-                MAX(new_end_date) as max_new_end_date,
-                MAX(renewal_date) as last_renewal_date,
-                COUNT(*) as total_renewals,
-                SUM(CASE 
-                    WHEN renewal_date >= datetime('now', '-36 hour') 
-                    THEN 1 ELSE 0 
-                END) as recent_renewals_count
-            FROM subscription_renewals
-            GROUP BY sub_id
-        ) sr ON s.sub_id = sr.sub_id
-        ORDER BY 
-            CASE 
-                WHEN s.status = 'ACTIVE' THEN 0
-                WHEN s.status = 'CANCELLED' THEN 1
-                ELSE 2
-            END,
-            s.start_date DESC
-        LIMIT 10
-        """)
+        # Recurrente de PayPal marcada EXPIRED dentro del periodo de gracia: pendiente de renovarse
+        sub_dict['en_periodo_gracia'] = False
+        if sub_dict.get('status') == 'EXPIRED' and sub_dict.get('paypal_sub_id') and sub_dict.get('is_recurring') == 1:
+            try:
+                end_date = datetime.datetime.fromisoformat(sub_dict['end_date'])
+                if end_date.tzinfo is None:
+                    end_date = end_date.replace(tzinfo=datetime.timezone.utc)
+                sub_dict['en_periodo_gracia'] = (now - end_date).total_seconds() <= SUBSCRIPTION_GRACE_PERIOD_HOURS * 3600
+            except Exception:
+                pass
         
-        recent_subscriptions = []
-        for row in cursor.fetchall():
-            sub_dict = dict(zip([column[0] for column in cursor.description], row))
-            
-            # Si hay renovaciones, añadir información adicional
-            if sub_dict.get('total_renovaciones', 0) > 0:
-                # Formatear la información de renovación
-                if sub_dict.get('ultima_renovacion'):
-                    try:
-                        ultima_ren = datetime.datetime.fromisoformat(sub_dict['ultima_renovacion'])
-                        sub_dict['ultima_renovacion_formateada'] = ultima_ren.strftime('%d/%m/%Y %H:%M')
-                    except:
-                        sub_dict['ultima_renovacion_formateada'] = 'Fecha no disponible'
-                
-                # Añadir texto descriptivo sobre renovaciones
-                if sub_dict['total_renovaciones'] == 1:
-                    sub_dict['renovacion_texto'] = "1 renovación"
-                else:
-                    sub_dict['renovacion_texto'] = f"{sub_dict['total_renovaciones']} renovaciones"
-            
-            recent_subscriptions.append(sub_dict)
+        recent_subscriptions.append(sub_dict)
+    
+    data = {
+        "stats": panel_data['stats'],
+        "recent_subscriptions": recent_subscriptions,
+        "recent_users": panel_data['recent_users'],
+    }
+    version = hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()[:16]
+    return {"version": version, "generated_at": now.isoformat(), "data": data}
+
+def get_admin_summary():
+    """Instantánea del panel, reconstruida como mucho cada ADMIN_SUMMARY_CACHE_SECONDS (un solo hilo la construye)"""
+    return runtime.get_or_load('admin_summary', build_admin_summary, ttl=ADMIN_SUMMARY_CACHE_SECONDS)
+
+# Cualquier cambio publicado en el bus deja la instantánea obsoleta: los paneles la piden
+# de nuevo al recibir el evento y el primero que llega la reconstruye para todos
+events.bus.add_listener(lambda event: runtime.invalidate('admin_summary'))
+
+@app.route('/admin/panel')
+def admin_panel():
+    """Renderiza el panel de administración (sin datos: el JS los pide a /admin/api/summary)"""
+    try:
+        # Verificación básica de autenticación
+        admin_id = request.args.get('admin_id')
+        if not admin_id or int(admin_id) not in ADMIN_IDS:
+            return jsonify({"error": "Acceso no autorizado"}), 401
         
-        # Obtener usuarios recientes
-        cursor.execute("""
-        SELECT user_id, username, first_name, last_name, created_at
-        FROM users
-        ORDER BY created_at DESC
-        LIMIT 5
-        """)
-        recent_users = [dict(zip([column[0] for column in cursor.description], row)) for row in cursor.fetchall()]
+        return render_template('admin_panel.html', 
+                               admin_id=admin_id,
+                               refresh_seconds=ADMIN_PANEL_REFRESH_SECONDS,
+                               sql_max_rows=SQL_CONSOLE_MAX_ROWS)
         
-        # Obtener estadísticas adicionales de renovaciones
-        cursor.execute("""
-        SELECT 
-            COUNT(DISTINCT sub_id) as subs_con_renovaciones,
-            COUNT(*) as total_renovaciones,
-            SUM(amount_usd) as ingresos_renovaciones
-        FROM subscription_renewals
-        WHERE renewal_date >= datetime('now', '-30 day')
-        """)
-        renewal_stats = cursor.fetchone()
+    except Exception as e:
+        logger.error(f"Error en admin_panel: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/admin/api/summary', methods=['GET'])
+def admin_api_summary():
+    """
+    Datos del panel en JSON, de una instantánea cacheada unos segundos.
+    El ETag es la versión de la instantánea: si coincide con If-None-Match
+    se responde 304 sin cuerpo
+    """
+    try:
+        admin_id = request.args.get('admin_id')
+        if not admin_id or int(admin_id) not in ADMIN_IDS:
+            return jsonify({"error": "Acceso no autorizado"}), 401
         
-        if renewal_stats:
-            stats['subs_renovadas_30d'] = renewal_stats[0] or 0
-            stats['total_renovaciones_30d'] = renewal_stats[1] or 0
-            stats['ingresos_renovaciones_30d'] = renewal_stats[2] or 0.0
+        summary = get_admin_summary()
+        response = jsonify({
+            "success": True,
+            "version": summary['version'],
+            "generated_at": summary['generated_at'],
+            **summary['data']
+        })
+        response.set_etag(summary['version'])
+        # El navegador guarda la respuesta pero la revalida siempre con el ETag
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response.make_conditional(request)
         
-        conn.close()
+    except Exception as e:
+        logger.error(f"Error en admin_api_summary: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+def get_page_args():
+    """
+    Parámetros de paginación de los listados: after / before (cursores, uno solo)
+    y limit (1-ADMIN_PAGE_SIZE_MAX). Lanza ValueError si no son válidos
+    """
+    after = request.args.get('after') or None
+    before = request.args.get('before') or None
+    if after and before:
+        raise ValueError("Usa after o before, no los dos")
+    limit = request.args.get('limit', ADMIN_PAGE_SIZE, type=int)
+    return after, before, max(1, min(limit, ADMIN_PAGE_SIZE_MAX))
+
+@app.route('/admin/api/subscriptions', methods=['GET'])
+def admin_api_subscriptions():
+    """
+    Suscripciones paginadas por cursor, ordenadas por fecha de fin.
+    
+    Parámetros: status, plan, type (whitelist o paid), order (desc por defecto
+                o asc), limit y after / before con el next_cursor / prev_cursor
+                de la respuesta anterior
+    """
+    try:
+        admin_id = request.args.get('admin_id')
+        if not admin_id or int(admin_id) not in ADMIN_IDS:
+            return jsonify({"error": "Acceso no autorizado"}), 401
         
-        import datetime
-        now = datetime.datetime.now(datetime.timezone.utc)
+        order = request.args.get('order', 'desc')
+        if order not in ('asc', 'desc'):
+            return jsonify({"error": "order debe ser 'asc' o 'desc'"}), 400
+        
+        try:
+            after, before, limit = get_page_args()
+            page = db.list_subscriptions(
+                status=(request.args.get('status') or '').upper() or None,
+                plan=request.args.get('plan') or None,
+                sub_type=request.args.get('type') or None,
+                after=after, before=before, limit=limit,
+                descending=order == 'desc'
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        return jsonify({
+            "success": True,
+            "subscriptions": page['items'],
+            "next_cursor": page['next_cursor'],
+            "prev_cursor": page['prev_cursor'],
+            "limit": limit
+        })
+        
+    except Exception as e:
+        logger.error(f"Error en admin_api_subscriptions: {str(e)}")
+        return jsonify({"error": str(e)}), 500
 
-        # Renderizar el template con los datos actualizados
-        return render_template('admin_panel.html', 
-                               admin_id=admin_id,
-                               stats=stats,
-                               recent_subscriptions=recent_subscriptions,
-                               recent_users=recent_users,
-                               now=now, 
-                               grace_period=SUBSCRIPTION_GRACE_PERIOD_HOURS) 
+@app.route('/admin/api/users', methods=['GET'])
+def admin_api_users():
+    """
+    Usuarios paginados por cursor, ordenados por fecha de registro.
+    
+    Parámetros: order (desc por defecto o asc), limit y after / before
+    """
+    try:
+        admin_id = request.args.get('admin_id')
+        if not admin_id or int(admin_id) not in ADMIN_IDS:
+            return jsonify({"error": "Acceso no autorizado"}), 401
+        
+        order = request.args.get('order', 'desc')
+        if order not in ('asc', 'desc'):
+            return jsonify({"error": "order debe ser 'asc' o 'desc'"}), 400
+        
+        try:
+            after, before, limit = get_page_args()
+            page = db.list_users(after=after, before=before, limit=limit, descending=order == 'desc')
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        return jsonify({
+            "success": True,
+            "users": page['items'],
+            "next_cursor": page['next_cursor'],
+            "prev_cursor": page['prev_cursor'],
+            "limit": limit
+        })
         
     except Exception as e:
-        logger.error(f"Error en admin_panel: {str(e)}")
+        logger.error(f"Error en admin_api_users: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/admin/api/renewals', methods=['GET'])
+def admin_api_renewals():
+    """
+    Renovaciones paginadas por cursor, ordenadas por fecha de renovación.
+    
+    Parámetros: user_id, plan, order (desc por defecto o asc), limit y after / before
+    """
+    try:
+        admin_id = request.args.get('admin_id')
+        if not admin_id or int(admin_id) not in ADMIN_IDS:
+            return jsonify({"error": "Acceso no autorizado"}), 401
+        
+        order = request.args.get('order', 'desc')
+        if order not in ('asc', 'desc'):
+            return jsonify({"error": "order debe ser 'asc' o 'desc'"}), 400
+        
+        try:
+            after, before, limit = get_page_args()
+            page = db.list_renewals(
+                user_id=request.args.get('user_id', type=int),
+                plan=request.args.get('plan') or None,
+                after=after, before=before, limit=limit,
+                descending=order == 'desc'
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        return jsonify({
+            "success": True,
+            "renewals": page['items'],
+            "next_cursor": page['next_cursor'],
+            "prev_cursor": page['prev_cursor'],
+            "limit": limit
+        })
+        
+    except Exception as e:
+        logger.error(f"Error en admin_api_renewals: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/admin/api/expulsions', methods=['GET'])
+def admin_api_expulsions():
+    """
+    Expulsiones paginadas por cursor, ordenadas por fecha.
+    
+    Parámetros: user_id, order (desc por defecto o asc), limit y after / before
+    """
+    try:
+        admin_id = request.args.get('admin_id')
+        if not admin_id or int(admin_id) not in ADMIN_IDS:
+            return jsonify({"error": "Acceso no autorizado"}), 401
+        
+        order = request.args.get('order', 'desc')
+        if order not in ('asc', 'desc'):
+            return jsonify({"error": "order debe ser 'asc' o 'desc'"}), 400
+        
+        try:
+            after, before, limit = get_page_args()
+            page = db.list_expulsions(
+                user_id=request.args.get('user_id', type=int),
+                after=after, before=before, limit=limit,
+                descending=order == 'desc'
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        return jsonify({
+            "success": True,
+            "expulsions": page['items'],
+            "next_cursor": page['next_cursor'],
+            "prev_cursor": page['prev_cursor'],
+            "limit": limit
+        })
+        
+    except Exception as e:
+        logger.error(f"Error en admin_api_expulsions: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/admin/api/users/<int:user_id>/timeline', methods=['GET'])
+def admin_api_user_timeline(user_id):
+    """
+    Línea de tiempo de un usuario (registro de eventos de suscripciones), paginada
+    por cursor: altas, whitelist, extensiones, cancelaciones, expiraciones y
+    expulsiones con el estado de la suscripción tras cada una.
+    
+    Parámetros: sub_id (opcional), order (desc por defecto o asc), limit y after / before
+    """
+    try:
+        admin_id = request.args.get('admin_id')
+        if not admin_id or int(admin_id) not in ADMIN_IDS:
+            return jsonify({"error": "Acceso no autorizado"}), 401
+        
+        order = request.args.get('order', 'desc')
+        if order not in ('asc', 'desc'):
+            return jsonify({"error": "order debe ser 'asc' o 'desc'"}), 400
+        
+        try:
+            after, before, limit = get_page_args()
+            page = db.get_subscription_timeline(user_id, sub_id=request.args.get('sub_id', type=int),
+                                                after=after, before=before, limit=limit,
+                                                descending=order == 'desc')
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        return jsonify({
+            "success": True,
+            "user_id": user_id,
+            "events": page['items'],
+            "next_cursor": page['next_cursor'],
+            "prev_cursor": page['prev_cursor'],
+            "limit": limit
+        })
+        
+    except Exception as e:
+        logger.error(f"Error en admin_api_user_timeline: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/admin/events', methods=['GET'])
+def admin_events():
+    """
+    Cambios en vivo para el panel por Server-Sent Events (ver events.py).
+    Cada conexión dura como mucho SSE_STREAM_MAX_SECONDS; el navegador se
+    reconecta solo y, con Last-Event-ID, recibe los eventos que se perdió
+    """
+    try:
+        admin_id = request.args.get('admin_id')
+        if not admin_id or int(admin_id) not in ADMIN_IDS:
+            return jsonify({"error": "Acceso no autorizado"}), 401
+        
+        subscribed = events.bus.subscribe(request.headers.get('Last-Event-ID'))
+        if subscribed is None:
+            # El panel vuelve a pedir /admin/api/summary periódicamente
+            return jsonify({"error": "Demasiadas conexiones de eventos abiertas"}), 503
+        subscription, backlog, resync = subscribed
+        
+        return Response(events.stream(events.bus, subscription, backlog, resync),
+                        mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        
+    except Exception as e:
+        logger.error(f"Error en admin_events: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/admin/force-security-check', methods=['GET'])
@@ -1433,30 +1632,316 @@ def admin_check_security_thread():
         if not admin_id or int(admin_id) not in ADMIN_IDS:
             return jsonify({"error": "Acceso no autorizado"}), 401
         
-        # Importar la función desde bot_handlers
-        from bot_handlers import check_security_thread_status, security_thread_running
+        from bot_handlers import check_security_thread_status
+        from scheduler import job_scheduler
+        
+        previous = health.get_component_status('scheduler')
+        result = check_security_thread_status(bot)
+        
+        return jsonify({
+            "success": True,
+            "previous_status": previous['status'] if previous else None,
+            "current_status": result['scheduler']['status'] if result['scheduler'] else None,
+            "security_check": result['security_check'],
+            "restarted": result['restarted'],
+            "is_leader": job_scheduler.is_leader,
+            "message": "Hilo de seguridad verificado" + (" y reiniciado" if result['restarted'] else "")
+        })
+        
+    except Exception as e:
+        logger.error(f"Error en endpoint de verificación de hilo: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/admin/health', methods=['GET'])
+def admin_health():
+    """Estado de salud de las tareas y los hilos en segundo plano (?check=1 ejecuta el watchdog al momento)"""
+    try:
+        # Verificación básica de autenticación
+        admin_id = request.args.get('admin_id')
+        if not admin_id or int(admin_id) not in ADMIN_IDS:
+            return jsonify({"error": "Acceso no autorizado"}), 401
+        
+        from scheduler import job_scheduler
+        
+        response = {"success": True}
+        if request.args.get('check') == '1':
+            response["restarted"] = health.check()
+        
+        response["is_leader"] = job_scheduler.is_leader
+        response["health"] = health.get_report()
+        return jsonify(response)
+        
+    except Exception as e:
+        logger.error(f"Error en endpoint de salud: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/admin/profile', methods=['GET'])
+def admin_profile():
+    """
+    Perfila el proceso durante N segundos:
+    - mode=sample (por defecto): muestreo de pilas de todos los hilos, devuelve pilas colapsadas para un flamegraph
+      (&seconds=10, &interval_ms=10, &thread=prefijo)
+    - mode=job&job=nombre: ejecuta la tarea bajo cProfile (&format=text|pstats, &sort=cumulative|tottime).
+      Con &result=1 devuelve el último perfil de esa tarea sin ejecutarla
+    """
+    try:
+        # Verificación básica de autenticación
+        admin_id = request.args.get('admin_id')
+        if not admin_id or int(admin_id) not in ADMIN_IDS:
+            return jsonify({"error": "Acceso no autorizado"}), 401
+        
+        mode = request.args.get('mode', 'sample')
+        seconds = request.args.get('seconds', 10, type=float)
+        
+        if mode == 'sample':
+            result = profiler.sample_stacks(
+                seconds,
+                interval_ms=request.args.get('interval_ms', PROFILER_DEFAULT_INTERVAL_MS, type=float),
+                thread_prefix=request.args.get('thread')
+            )
+            response = Response(result['collapsed'], mimetype='text/plain')
+            response.headers['X-Profile-Samples'] = str(result['samples'])
+            return response
+        
+        if mode != 'job':
+            return jsonify({"error": "mode debe ser 'sample' o 'job'"}), 400
         
-        # Verificar el estado actual
-        current_status = security_thread_running
+        from scheduler import job_scheduler
         
-        # Intentar reiniciar el hilo si es necesario
-        if not current_status:
-            result = check_security_thread_status(bot)
-            new_status = security_thread_running
+        job_name = request.args.get('job')
+        if not job_name or not job_scheduler.has_job(job_name):
+            return jsonify({"error": f"Tarea desconocida: {job_name}"}), 400
+        
+        if request.args.get('result') == '1':
+            result = profiler.get_job_profile(job_name)
+            if result is None:
+                return jsonify({"error": "No hay perfil guardado para esta tarea"}), 404
         else:
-            result = True
-            new_status = current_status
+            if not job_scheduler.can_run_here():
+                return jsonify({
+                    "error": "Este proceso no es el líder del planificador; vuelve a intentarlo",
+                    "leader": job_scheduler.get_leader()
+                }), 409
+            outcome = profiler.profile_job(job_scheduler, job_name, seconds)
+            if not outcome['started']:
+                return jsonify({"error": "La tarea ya está en ejecución"}), 409
+            if not outcome['finished']:
+                return jsonify({
+                    "success": True,
+                    "finished": False,
+                    "message": f"La tarea sigue en ejecución; consulte el perfil con &result=1 cuando termine"
+                }), 202
+            result = outcome['result']
+        
+        if request.args.get('format') == 'pstats':
+            response = Response(profiler.format_profile_binary(result), mimetype='application/octet-stream')
+            response.headers['Content-Disposition'] = f'attachment; filename="{job_name}.pstats"'
+            return response
+        
+        return Response(profiler.format_profile_text(result, sort=request.args.get('sort', 'cumulative')),
+                        mimetype='text/plain')
+        
+    except profiler.ProfilerBusy as e:
+        return jsonify({"error": str(e)}), 409
+    except Exception as e:
+        logger.error(f"Error en endpoint de perfilado: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/admin/threads', methods=['GET'])
+def admin_threads():
+    """Pila actual de cada hilo vivo del proceso (&format=text para texto plano)"""
+    try:
+        # Verificación básica de autenticación
+        admin_id = request.args.get('admin_id')
+        if not admin_id or int(admin_id) not in ADMIN_IDS:
+            return jsonify({"error": "Acceso no autorizado"}), 401
+        
+        threads = profiler.dump_threads()
+        
+        if request.args.get('format') == 'text':
+            blocks = []
+            for thread in threads:
+                header = f"--- {thread['name']} (ident={thread['ident']}, daemon={thread['daemon']}) ---"
+                blocks.append(header + "\n" + "\n".join(thread['stack']))
+            return Response("\n\n".join(blocks) + "\n", mimetype='text/plain')
+        
+        return jsonify({"success": True, "pid": os.getpid(), "count": len(threads), "threads": threads})
+        
+    except Exception as e:
+        logger.error(f"Error en endpoint de hilos: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/admin/checkout-latency', methods=['GET'])
+def admin_checkout_latency():
+    """Latencia del checkout (percentiles del tiempo hasta el acceso y etapa dominante) de los últimos &days=N días"""
+    try:
+        # Verificación básica de autenticación
+        admin_id = request.args.get('admin_id')
+        if not admin_id or int(admin_id) not in ADMIN_IDS:
+            return jsonify({"error": "Acceso no autorizado"}), 401
+        
+        days = min(max(request.args.get('days', 30, type=int), 1), 365)
+        
+        return jsonify({"success": True, "report": tracing.get_report(days)})
+        
+    except Exception as e:
+        logger.error(f"Error en endpoint de latencia del checkout: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/admin/scheduler', methods=['GET'])
+def admin_scheduler():
+    """Endpoint para consultar las tareas en segundo plano (y lanzar una con ?run=nombre)"""
+    try:
+        # Verificación básica de autenticación
+        admin_id = request.args.get('admin_id')
+        if not admin_id or int(admin_id) not in ADMIN_IDS:
+            return jsonify({"error": "Acceso no autorizado"}), 401
+        
+        from scheduler import job_scheduler
+        
+        response = {"success": True}
+        
+        job_name = request.args.get('run')
+        if job_name:
+            if not job_scheduler.can_run_here():
+                # Un seguidor no lanza tareas: podría solaparse con la ejecución programada del líder
+                return jsonify({
+                    "error": "Este proceso no es el líder del planificador; vuelve a intentarlo",
+                    "leader": job_scheduler.get_leader()
+                }), 409
+            response["run"] = job_name
+            response["started"] = job_scheduler.run_now(job_name)
+        
+        response["scheduler"] = job_scheduler.get_stats()
+        return jsonify(response)
+        
+    except Exception as e:
+        logger.error(f"Error en endpoint del planificador: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/admin/webhook-queue', methods=['GET'])
+def admin_webhook_queue():
+    """Endpoint para consultar la cola de actualizaciones de Telegram"""
+    try:
+        # Verificación básica de autenticación
+        admin_id = request.args.get('admin_id')
+        if not admin_id or int(admin_id) not in ADMIN_IDS:
+            return jsonify({"error": "Acceso no autorizado"}), 401
         
         return jsonify({
             "success": True,
-            "previous_status": current_status,
-            "current_status": new_status,
-            "restarted": not current_status and new_status,
-            "message": "Hilo de seguridad verificado" + (" y reiniciado" if not current_status and new_status else "")
+            "queue": update_dispatcher.get_stats()
         })
         
     except Exception as e:
-        logger.error(f"Error en endpoint de verificación de hilo: {str(e)}")
+        logger.error(f"Error en endpoint de cola de webhook: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/admin/sql-profile', methods=['GET'])
+def admin_sql_profile():
+    """Endpoint con el tiempo de las consultas SQLite por sentencia y función (?sort=total|p95|count|max, ?reset=1)"""
+    try:
+        # Verificación básica de autenticación
+        admin_id = request.args.get('admin_id')
+        if not admin_id or int(admin_id) not in ADMIN_IDS:
+            return jsonify({"error": "Acceso no autorizado"}), 401
+        
+        profiler = db_profiler.query_profiler
+        if not profiler.enabled:
+            return jsonify({"error": "Perfilador de SQL desactivado (SQL_PROFILER_ENABLED=true para activarlo)"}), 400
+        
+        sort = request.args.get('sort', 'total')
+        limit = request.args.get('limit', 50, type=int)
+        stats = profiler.get_stats(sort=sort, limit=limit)
+        
+        if request.args.get('reset') == '1':
+            profiler.reset()
+            stats['reset'] = True
+        
+        return jsonify({"success": True, "profile": stats})
+        
+    except Exception as e:
+        logger.error(f"Error en endpoint del perfilador de SQL: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+def collect_background_metrics():
+    """Estado de los hilos en segundo plano, calculado en cada consulta a /metrics"""
+    from scheduler import job_scheduler
+
+    queue = update_dispatcher.get_stats()
+    animations = animation_scheduler.get_stats()
+    jobs = job_scheduler.get_jobs_snapshot()
+    logs = logging_setup.get_stats()
+    components = health.get_report()['components']
+    bus = events.bus.stats()
+
+    families = [
+        ('webhook_queue_depth', 'gauge', 'Actualizaciones de Telegram pendientes de procesar',
+         [({}, queue['queue_depth'])]),
+        ('webhook_queue_oldest_pending_seconds', 'gauge', 'Antigüedad de la actualización pendiente más antigua',
+         [({}, queue['oldest_pending_ms'] / 1000)]),
+        ('webhook_updates_total', 'counter', 'Actualizaciones de Telegram recibidas por resultado',
+         [({'result': name}, value) for name, value in sorted(queue['counters'].items())]),
+        ('background_thread_alive', 'gauge', 'Hilos en segundo plano vivos (1) o caídos (0)', [
+            ({'thread': 'webhook_workers'}, queue['workers_alive']),
+            ({'thread': 'scheduler'}, 1 if job_scheduler.is_running() else 0),
+            ({'thread': 'animations'}, 1 if animations['thread_alive'] else 0),
+        ]),
+        ('scheduler_is_leader', 'gauge', 'Este proceso ejecuta las tareas en segundo plano',
+         [({}, 1 if job_scheduler.is_leader else 0)]),
+        ('animations_active', 'gauge', 'Animaciones de pago en curso', [({}, animations['active'])]),
+        ('scheduler_job_running', 'gauge', 'La tarea se está ejecutando ahora',
+         [({'job': job['name']}, 1 if job['running'] else 0) for job in jobs]),
+        ('scheduler_job_last_success_timestamp_seconds', 'gauge', 'Último final correcto de la tarea (epoch)',
+         [({'job': job['name']}, job['last_success']) for job in jobs if job['last_success']]),
+        ('scheduler_job_last_duration_seconds', 'gauge', 'Duración de la última ejecución de la tarea',
+         [({'job': job['name']}, job['last_duration']) for job in jobs if job['last_duration'] is not None]),
+        ('scheduler_job_runs_total', 'counter', 'Ejecuciones de la tarea',
+         [({'job': job['name']}, job['run_count']) for job in jobs]),
+        ('scheduler_job_errors_total', 'counter', 'Ejecuciones de la tarea que terminaron con error',
+         [({'job': job['name']}, job['error_count']) for job in jobs]),
+        ('scheduler_job_skipped_overlaps_total', 'counter', 'Ejecuciones omitidas porque la anterior seguía en curso',
+         [({'job': job['name']}, job['skipped_overlaps']) for job in jobs]),
+        ('log_records_total', 'counter', 'Registros de log por resultado en el pipeline asíncrono',
+         [({'result': name}, logs[name]) for name in ('enqueued', 'dropped', 'sampled_out', 'rate_limited', 'truncated')]),
+        ('log_queue_size', 'gauge', 'Registros de log pendientes de escribir', [({}, logs['queue_size'])]),
+        ('health_component_up', 'gauge', 'Componente en segundo plano sano (1) o caído/atascado (0)',
+         [({'component': c['name']}, 0 if c['status'] in ('dead', 'stalled') else 1) for c in components]),
+        ('health_component_restarts_total', 'counter', 'Reinicios del componente hechos por el watchdog',
+         [({'component': c['name']}, c['restarts']) for c in components]),
+        ('admin_events_subscribers', 'gauge', 'Paneles conectados a /admin/events', [({}, bus['subscribers'])]),
+        ('admin_events_published_total', 'counter', 'Eventos publicados en el bus del panel por tipo',
+         [({'type': name}, value) for name, value in sorted(bus['published'].items())]),
+    ]
+    return families
+
+metrics.registry.register_collector(collect_background_metrics)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Métricas en formato de texto de Prometheus"""
+    try:
+        # Acceso con admin_id o con el token del scraper
+        admin_id = request.args.get('admin_id')
+        authorized = bool(admin_id) and admin_id.isdigit() and int(admin_id) in ADMIN_IDS
+        if not authorized and METRICS_TOKEN:
+            authorized = request.headers.get('Authorization') == f"Bearer {METRICS_TOKEN}"
+        if not authorized:
+            return jsonify({"error": "Acceso no autorizado"}), 401
+        
+        return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+        
+    except Exception as e:
+        logger.error(f"Error en endpoint de métricas: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
 
@@ -1465,46 +1950,41 @@ def admin_check_security_thread():
 
 @app.route('/admin/expired-subscriptions', methods=['GET'])
 def admin_expired_subscriptions():
-    """Endpoint para obtener información sobre suscripciones expiradas"""
+    """
+    Suscripciones expiradas, paginadas por cursor (de la fecha de fin más reciente
+    a la más antigua). La primera página ejecuta antes la verificación de
+    expiraciones; las siguientes (after / before) solo leen.
+    
+    Parámetros: plan, type (whitelist o paid), limit y after / before
+    """
     try:
         # Verificación básica de autenticación
         admin_id = request.args.get('admin_id')
         if not admin_id or int(admin_id) not in ADMIN_IDS:
             return jsonify({"error": "Acceso no autorizado"}), 401
         
-        # Importar la función desde database
-        import database as db
-        
-        # Obtener las suscripciones expiradas
-        expired_subscriptions = db.check_and_update_subscriptions(force=True)
-        
-        # Obtener información detallada de cada suscripción
-        detailed_info = []
-        for user_id, sub_id, plan in expired_subscriptions:
-            # Obtener información del usuario
-            user = db.get_user(user_id)
+        try:
+            after, before, limit = get_page_args()
             
-            # Obtener información de la suscripción
-            subscription = db.get_subscription_info(sub_id)
+            # Marcar como expiradas las suscripciones vencidas
+            newly_expired = [] if after or before else db.check_and_update_subscriptions(force=True)
             
-            if user and subscription:
-                detailed_info.append({
-                    "user_id": user_id,
-                    "username": user.get('username', 'Sin username'),
-                    "first_name": user.get('first_name', ''),
-                    "last_name": user.get('last_name', ''),
-                    "sub_id": sub_id,
-                    "plan": plan,
-                    "start_date": subscription.get('start_date', ''),
-                    "end_date": subscription.get('end_date', ''),
-                    "status": subscription.get('status', ''),
-                    "is_whitelist": db.is_whitelist_subscription(sub_id)
-                })
+            page = db.list_subscriptions(
+                status='EXPIRED',
+                plan=request.args.get('plan') or None,
+                sub_type=request.args.get('type') or None,
+                after=after, before=before, limit=limit
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
         return jsonify({
             "success": True,
-            "count": len(expired_subscriptions),
-            "subscriptions": detailed_info
+            "newly_expired": len(newly_expired),
+            "count": len(page['items']),
+            "subscriptions": page['items'],
+            "next_cursor": page['next_cursor'],
+            "prev_cursor": page['prev_cursor']
         })
         
     except Exception as e:
@@ -1514,26 +1994,172 @@ def admin_expired_subscriptions():
 # Añadir endpoint para descargar base de datos
 @app.route('/admin/download-database')
 def download_database():
-    """Permite descargar una copia de la base de datos"""
+    """
+    Descarga la última copia de seguridad comprimida (ver backups.py), nunca el
+    archivo en vivo. Si aún no hay ninguna, o con fresh=1, se crea antes;
+    name=<copia> descarga una concreta. La cabecera X-Checksum-SHA256 lleva el
+    SHA-256 del .gz
+    """
     try:
         # Verificación básica de autenticación
         admin_id = request.args.get('admin_id')
         if not admin_id or int(admin_id) not in ADMIN_IDS:
             return jsonify({"error": "Acceso no autorizado"}), 401
         
-        # Devolver el archivo de la base de datos
-        return send_file(DB_PATH, 
-                        mimetype='application/octet-stream',
-                        as_attachment=True,
-                        download_name='vip_bot_backup.db')
+        name = request.args.get('name')
+        if name:
+            backup = backups.get_backup(name)
+            if backup is None:
+                return jsonify({"error": f"Copia no encontrada: {name}"}), 404
+        elif request.args.get('fresh') == '1':
+            backup = backups.create_backup()
+        else:
+            backup = backups.latest_backup() or backups.create_backup()
+        
+        if backup is None:
+            return jsonify({"error": "Ya hay una copia de seguridad en curso, inténtalo en unos segundos"}), 409
+        
+        # send_file envía el archivo por bloques, sin cargarlo entero en memoria
+        response = send_file(backup['path'],
+                             mimetype='application/gzip',
+                             as_attachment=True,
+                             download_name=backup['name'])
+        response.headers['X-Checksum-SHA256'] = backup['sha256'] or ''
+        response.headers['X-Backup-Created-At'] = backup['created_at']
+        return response
         
     except Exception as e:
         logger.error(f"Error al descargar base de datos: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/admin/backups', methods=['GET'])
+def admin_backups():
+    """Copias de seguridad guardadas (run=1 crea una antes de responder)"""
+    try:
+        admin_id = request.args.get('admin_id')
+        if not admin_id or int(admin_id) not in ADMIN_IDS:
+            return jsonify({"error": "Acceso no autorizado"}), 401
+        
+        created = None
+        if request.args.get('run') == '1':
+            created = backups.create_backup()
+            if created is None:
+                return jsonify({"error": "Ya hay una copia de seguridad en curso"}), 409
+        
+        from scheduler import job_scheduler
+        
+        return jsonify({
+            "success": True,
+            "created": created['name'] if created else None,
+            "backups": [{key: value for key, value in backup.items() if key != 'path'}
+                        for backup in backups.list_backups()],
+            "retention": BACKUP_RETENTION_COUNT,
+            "schedule": BACKUP_CRON,
+            "job": job_scheduler.get_job_stats('database_backup')
+        })
+        
+    except Exception as e:
+        logger.error(f"Error en admin_backups: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/admin/retention', methods=['GET'])
+def admin_retention():
+    """
+    Políticas de retención y resultado de la última ejecución (ver retention.py).
+    dry_run=1 cuenta las filas que saldrían de cada tabla; run=1 las archiva ahora
+    """
+    try:
+        admin_id = request.args.get('admin_id')
+        if not admin_id or int(admin_id) not in ADMIN_IDS:
+            return jsonify({"error": "Acceso no autorizado"}), 401
+        
+        report = None
+        if request.args.get('run') == '1' or request.args.get('dry_run') == '1':
+            report = retention.run(dry_run=request.args.get('run') != '1')
+            if report is None:
+                return jsonify({"error": "Ya hay una ejecución de retención en curso"}), 409
+        
+        return jsonify({
+            "success": True,
+            "policies": retention.get_policies(),
+            "report": report,
+            "last_report": retention.get_last_report()
+        })
+        
+    except Exception as e:
+        logger.error(f"Error en admin_retention: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/admin/replica', methods=['GET'])
+def admin_replica():
+    """
+    Estado de la réplica de lectura de los informes (ver replica.py): antigüedad,
+    si se está usando y el último refresco. refresh=1 la vuelve a copiar ahora
+    """
+    try:
+        admin_id = request.args.get('admin_id')
+        if not admin_id or int(admin_id) not in ADMIN_IDS:
+            return jsonify({"error": "Acceso no autorizado"}), 401
+        
+        refreshed = None
+        if request.args.get('refresh') == '1':
+            refreshed = replica.refresh()
+            if refreshed is None:
+                return jsonify({"error": "Ya hay un refresco de la réplica en curso"}), 409
+        
+        return jsonify({
+            "success": True,
+            "refreshed": refreshed,
+            "replica": replica.get_status()
+        })
+        
+    except Exception as e:
+        logger.error(f"Error en admin_replica: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/admin/event-log', methods=['GET'])
+def admin_event_log():
+    """
+    Eventos de suscripciones registrados por tipo (ver event_log.py). verify=1
+    reconstruye subscriptions desde los eventos y la compara con la tabla
+    (source=primary para no leer de la réplica)
+    """
+    try:
+        admin_id = request.args.get('admin_id')
+        if not admin_id or int(admin_id) not in ADMIN_IDS:
+            return jsonify({"error": "Acceso no autorizado"}), 401
+        
+        verification = None
+        if request.args.get('verify') == '1':
+            verification = event_log.verify(use_replica=request.args.get('source') != 'primary')
+        
+        return jsonify({
+            "success": True,
+            "counts": event_log.get_event_counts(),
+            "verification": verification
+        })
+        
+    except Exception as e:
+        logger.error(f"Error en admin_event_log: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/paypal/return', methods=['GET'])
 def paypal_return():
     """Maneja el retorno desde PayPal después de un pago exitoso (suscripción o pago único)"""
+    # ID de correlación del checkout (parámetro cid de la URL de retorno, ver tracing.py)
+    correlation_id = request.args.get('cid')
+    trace_user_id = request.args.get('user_id', type=int)
+    returned_at = time.time()
+    tracing.record_checkout_return(correlation_id, trace_user_id, returned_at)
+    
+    response = _process_paypal_return(correlation_id)
+    
+    tracing.record_span(correlation_id, 'paypal_return', returned_at, user_id=trace_user_id,
+                        status='ok' if response[1] == 200 else 'error')
+    return response
+
+def _process_paypal_return(correlation_id):
+    """Verifica el pago con PayPal y activa la suscripción. Devuelve (respuesta, código)"""
     try:
         # Obtener parámetros
         user_id = request.args.get('user_id')
@@ -1554,7 +2180,10 @@ def paypal_return():
                                       message="ID de suscripción no proporcionado. Por favor, contacta a soporte."), 400
             
             # Verificar suscripción con PayPal
-            subscription_details = pay.verify_subscription(subscription_id)
+            with tracing.span(correlation_id, 'verify_payment', int(user_id)) as verify_span:
+                subscription_details = pay.verify_subscription(subscription_id)
+                if not subscription_details:
+                    verify_span['status'] = 'error'
             if not subscription_details:
                 return render_template('webhook_success.html', 
                                       message="No se pudo verificar la suscripción. Por favor, contacta a soporte."), 400
@@ -1563,9 +2192,13 @@ def paypal_return():
             payment_type_name = "suscripción" if payment_type == 'subscription' else "pago único"
             
             # Procesar la suscripción exitosa
-            success = bot_handlers.process_successful_subscription(
-                bot, int(user_id), plan_id, subscription_id, subscription_details, is_recurring=True
-            )
+            with tracing.span(correlation_id, 'process_subscription', int(user_id)) as process_span:
+                success = bot_handlers.process_successful_subscription(
+                    bot, int(user_id), plan_id, subscription_id, subscription_details, is_recurring=True,
+                    correlation_id=correlation_id
+                )
+                if not success:
+                    process_span['status'] = 'error'
             
         elif payment_type == 'order':
             # ... (código existente para pagos únicos)
@@ -1576,7 +2209,10 @@ def paypal_return():
                                       message="ID de orden no proporcionado. Por favor, contacta a soporte."), 400
             
             # Verificar y capturar la orden
-            order_details = pay.verify_and_capture_order(order_id)
+            with tracing.span(correlation_id, 'verify_payment', int(user_id)) as verify_span:
+                order_details = pay.verify_and_capture_order(order_id)
+                if not order_details or order_details.get('status') != 'COMPLETED':
+                    verify_span['status'] = 'error'
             if not order_details:
                 return render_template('webhook_success.html', 
                                       message="No se pudo verificar o capturar el pago. Por favor, contacta a soporte."), 400
@@ -1590,9 +2226,13 @@ def paypal_return():
             payment_type_name = "pago único"
             
             # Procesar el pago único exitoso
-            success = bot_handlers.process_successful_subscription(
-                bot, int(user_id), plan_id, order_id, order_details, is_recurring=False
-            )
+            with tracing.span(correlation_id, 'process_subscription', int(user_id)) as process_span:
+                success = bot_handlers.process_successful_subscription(
+                    bot, int(user_id), plan_id, order_id, order_details, is_recurring=False,
+                    correlation_id=correlation_id
+                )
+                if not success:
+                    process_span['status'] = 'error'
         
         else:
             return render_template('webhook_success.html', 
@@ -1662,7 +2302,7 @@ def paypal_diagnostic():
                 "Content-Type": "application/json"
             }
             
-            response = requests.get(f"{pay.BASE_URL}/v1/catalogs/products?page_size=10", headers=headers)
+            response = pay.paypal_request('GET', f"{pay.BASE_URL}/v1/catalogs/products?page_size=10", headers=headers)
             results["products_api_status"] = response.status_code
             
             if response.status_code == 200:
@@ -1726,7 +2366,11 @@ def admin_check_renewals():
 
 @app.route('/admin/database', methods=['GET', 'POST'])
 def admin_database():
-    """Endpoint para ver y consultar la base de datos"""
+    """
+    Endpoint para ver y consultar la base de datos. Las consultas van a la consola
+    de solo lectura (sql_console.py); para escribir en la base de datos en vivo
+    hay que enviar además allow_write=1
+    """
     try:
         # Verificación básica de autenticación
         admin_id = request.args.get('admin_id')
@@ -1742,45 +2386,38 @@ def admin_database():
         tables = [table[0] for table in cursor.fetchall()]
         
         if request.method == 'POST':
-            # Si se envía una consulta SQL, ejecutarla
+            # Si se envía una consulta SQL, ejecutarla en la consola de solo lectura
             query = request.form.get('query', '')
+            if query and request.form.get('allow_write') != '1':
+                conn.close()
+                try:
+                    result = sql_console.run_query(query)
+                except ValueError as e:
+                    return jsonify({"tables": tables, "query": query, "error": str(e)}), 400
+                return jsonify({"tables": tables, "query": query, **result})
             if query:
+                # Escritura explícita en la base de datos en vivo (botones de corrección del panel)
                 try:
                     cursor.execute(query)
-                    # Verificar si es una consulta SELECT
-                    if query.strip().upper().startswith('SELECT'):
-                        columns = [description[0] for description in cursor.description]
-                        results = cursor.fetchall()
-                        results_list = [dict(zip(columns, row)) for row in results]
-                        return jsonify({
-                            "tables": tables,
-                            "query": query,
-                            "columns": columns,
-                            "results": results_list,
-                            "count": len(results_list)
-                        })
-                    else:
-                        conn.commit()
-                        return jsonify({
-                            "tables": tables,
-                            "query": query,
-                            "message": "Consulta ejecutada correctamente",
-                            "rows_affected": cursor.rowcount
-                        })
+                    conn.commit()
+                    logger.info(f"Consulta de escritura ejecutada por el admin {admin_id}: {query[:200]}")
+                    return jsonify({
+                        "tables": tables,
+                        "query": query,
+                        "message": "Consulta ejecutada correctamente",
+                        "rows_affected": cursor.rowcount
+                    })
                 except Exception as e:
                     return jsonify({
                         "tables": tables,
                         "query": query,
                         "error": str(e)
                     }), 400
+                finally:
+                    conn.close()
         
         # Consultas predefinidas
-        stats = {
-            "usuarios": db.get_total_users_count(conn),
-            "suscripciones": db.get_table_count(conn, "subscriptions"),
-            "suscripciones_activas": db.get_active_subscriptions_count(conn),
-            "enlaces_invitacion": db.get_table_count(conn, "invite_links")
-        }
+        stats = db.get_dashboard_counts(conn)
         
         # Obtener últimas 5 suscripciones
         cursor.execute("""
@@ -1804,63 +2441,189 @@ def admin_database():
         logger.error(f"Error en admin_database: {str(e)}")
         return jsonify({"error": str(e)}), 500
     
-from bot_handlers import schedule_security_verification, force_security_check, schedule_renewal_checks,  register_handlers
-
-# 3. Modificar la función initialize_security para iniciar también las renovaciones
-def initialize_security():
-    """Inicializa el sistema de seguridad y renovaciones al iniciar"""
+@app.route('/admin/sql', methods=['GET', 'POST'])
+def admin_sql():
+    """
+    Consola SQL de solo lectura (ver sql_console.py).
+    
+    Parámetros: query, format (json por defecto, csv o ndjson), limit y
+    source=primary para no leer de la réplica. En JSON se devuelven como mucho
+    SQL_CONSOLE_MAX_ROWS filas (truncated indica si había más); csv y ndjson se
+    envían por trozos como descarga, hasta SQL_CONSOLE_EXPORT_MAX_ROWS filas
+    """
     try:
-        import logging
-        
-        logger = logging.getLogger(__name__)
-        logger.info("🔐 Inicializando sistema de seguridad y renovaciones...")
-        
-        # Registrar handlers del bot
-        register_handlers(bot)
-        logger.info("✅ Handlers registrados correctamente")
+        admin_id = request.args.get('admin_id')
+        if not admin_id or int(admin_id) not in ADMIN_IDS:
+            return jsonify({"error": "Acceso no autorizado"}), 401
         
-        # Realizar verificación inicial completa de membresías
-        from app import verify_all_memberships_on_startup
-        verify_all_memberships_on_startup()
-        logger.info("✅ Verificación inicial de membresías completada")
+        query = (request.values.get('query') or '').strip()
+        output_format = request.values.get('format', 'json')
+        if not query:
+            return jsonify({"error": "Falta el parámetro query"}), 400
+        if output_format not in ('json', 'csv', 'ndjson'):
+            return jsonify({"error": "format debe ser 'json', 'csv' o 'ndjson'"}), 400
+        use_replica = request.values.get('source') != 'primary'
         
-        # Iniciar hilo de verificación periódica de seguridad
-        schedule_security_verification(bot)
+        if output_format == 'json':
+            limit = request.values.get('limit', SQL_CONSOLE_MAX_ROWS, type=int)
+            try:
+                result = sql_console.run_query(query, max_rows=max(1, min(limit, SQL_CONSOLE_MAX_ROWS)),
+                                               use_replica=use_replica)
+            except ValueError as e:
+                return jsonify({"query": query, "error": str(e)}), 400
+            return jsonify({"success": True, "query": query, **result})
         
-        # NUEVO: Iniciar hilo de verificación periódica de renovaciones
-        schedule_renewal_checks(bot)
+        limit = request.values.get('limit', SQL_CONSOLE_EXPORT_MAX_ROWS, type=int)
+        try:
+            # Los errores de sintaxis o de permisos salen aquí, antes de empezar la respuesta
+            console_query = sql_console.ReadOnlyQuery(query, timeout=SQL_CONSOLE_EXPORT_TIMEOUT_SECONDS,
+                                                      max_rows=max(1, min(limit, SQL_CONSOLE_EXPORT_MAX_ROWS)),
+                                                      use_replica=use_replica)
+        except ValueError as e:
+            return jsonify({"query": query, "error": str(e)}), 400
+        
+        filename = f"consulta_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.{output_format}"
+        if output_format == 'csv':
+            body, mimetype = sql_console.stream_csv(console_query), 'text/csv'
+        else:
+            body, mimetype = sql_console.stream_ndjson(console_query), 'application/x-ndjson'
+        
+        logger.info(f"Exportación {output_format} de la consola SQL solicitada por el admin {admin_id}")
+        return Response(body, mimetype=mimetype, headers={
+            'Content-Disposition': f'attachment; filename={filename}',
+            'X-Row-Limit': str(console_query.max_rows),
+            'X-Data-Source': console_query.data_source['source'],
+            'X-Data-Age-Seconds': str(console_query.data_source['age_seconds']),
+        })
         
-        # Forzar una verificación inicial
-        force_security_check(bot)
+    except Exception as e:
+        logger.error(f"Error en admin_sql: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+from bot_handlers import schedule_security_verification, schedule_renewal_checks, schedule_stats_maintenance, register_handlers
+from bot_handlers import schedule_database_backups, schedule_data_retention, schedule_replica_refresh
+from startup import startup
+
+def notify_admins_health(message):
+    """Envía a los administradores las alertas del watchdog de salud"""
+    for admin_id in ADMIN_IDS:
+        try:
+            bot.send_message(chat_id=admin_id, text=message)
+        except Exception as e:
+            logger.error(f"No se pudo enviar alerta de salud al admin {admin_id}: {e}")
+
+health.set_alert_handler(notify_admins_health)
+
+def notify_admins_startup():
+    """Avisa a los administradores de que el bot se reinició"""
+    for admin_id in ADMIN_IDS:
+        try:
+            bot.send_message(
+                chat_id=admin_id,
+                text="🔐 Bot reiniciado y sistema de seguridad inicializado correctamente.\n"
+                     "Se ha iniciado la verificación periódica de suscripciones y renovaciones automáticas."
+            )
+        except Exception as e:
+            logger.error(f"No se pudo notificar al admin {admin_id}: {e}")
+
+# Pasos del warm-up: cada uno deja su resultado en el contexto de ejecución compartido
+def warm_bot_identity():
+    """Precarga la identidad del bot (getMe)"""
+    info = get_bot_info(bot)
+    logger.info(f"Identidad del bot precargada: @{info.username} ({info.id})")
+
+def warm_paypal_token():
+    """Precarga el token de acceso de PayPal"""
+    if not pay.get_access_token():
+        raise RuntimeError("No se pudo obtener el token de PayPal")
+
+def warm_paypal_catalog():
+    """Precarga el producto de PayPal y los planes de suscripción recurrente"""
+    product_id = pay.create_product_if_not_exists()
+    if not product_id:
+        raise RuntimeError("No se pudo obtener/crear el producto de PayPal")
+    
+    for plan_id, plan in PLANS.items():
+        is_recurring = plan.get('recurring')
+        if is_recurring is None:
+            is_recurring = RECURRING_PAYMENTS_ENABLED
+        if is_recurring and not pay.get_or_create_plan(plan_id, product_id):
+            raise RuntimeError(f"No se pudo crear el plan de PayPal para {plan_id}")
+
+def warm_group_permissions():
+    """Precarga la verificación de permisos del bot en el grupo VIP"""
+    if not bot_handlers.verify_bot_permissions(bot):
+        raise RuntimeError("El bot no tiene los permisos necesarios en el grupo VIP")
+
+def warm_templates():
+    """Compila las plantillas HTML para que la primera visita no pague el coste"""
+    for template_name in ('admin_panel.html', 'webhook_success.html'):
+        app.jinja_env.get_template(template_name)
+
+# 3. Modificar la función initialize_security para iniciar también las renovaciones
+def initialize_security():
+    """
+    Inicializa el bot en dos fases:
+    - boot: handlers y workers del webhook (síncrona, en milisegundos)
+    - warmup: planificador de tareas, precarga de cachés y avisos (en segundo plano)
+    
+    La auditoría inicial de membresías es la primera ejecución de la tarea
+    'security_check', que corre en segundo plano en el proceso líder.
+    """
+    try:
+        logger.info("🔐 Inicializando sistema de seguridad y renovaciones...")
         
-        logger.info("✅ Sistema de seguridad y renovaciones inicializado correctamente")
+        # Fase 1: lo imprescindible para atender webhooks
+        startup.run_phase('boot', [
+            ('register_handlers', lambda: register_handlers(bot)),
+            ('update_workers', update_dispatcher.start),
+            ('health_watchdog', health.start_watchdog),
+        ])
+        
+        # Fase 2: todo lo que depende de servicios externos, en paralelo y sin bloquear el arranque
+        startup.run_phase_in_background('warmup', [
+            ('security_scheduler', lambda: schedule_security_verification(bot)),
+            ('renewal_scheduler', lambda: schedule_renewal_checks(bot)),
+            ('stats_scheduler', schedule_stats_maintenance),
+            ('backup_scheduler', schedule_database_backups),
+            ('retention_scheduler', schedule_data_retention),
+            ('replica_scheduler', schedule_replica_refresh),
+            ('bot_identity', warm_bot_identity),
+            ('paypal_token', warm_paypal_token),
+            ('paypal_catalog', warm_paypal_catalog),
+            ('group_permissions', warm_group_permissions),
+            ('templates', warm_templates),
+            ('notify_admins', notify_admins_startup),
+        ], concurrent=True)
         
-        # Notificar a los administradores
-        from config import ADMIN_IDS
-        for admin_id in ADMIN_IDS:
-            try:
-                bot.send_message(
-                    chat_id=admin_id,
-                    text="🔐 Bot reiniciado y sistema de seguridad inicializado correctamente.\n"
-                         "Se ha iniciado la verificación periódica de suscripciones y renovaciones automáticas."
-                )
-            except Exception as e:
-                logger.error(f"No se pudo notificar al admin {admin_id}: {e}")
-                
     except Exception as e:
         logger.error(f"❌ Error al inicializar sistema de seguridad y renovaciones: {e}")
-        
-        # Intentar notificar a los administradores sobre el error
-        from config import ADMIN_IDS
-        for admin_id in ADMIN_IDS:
-            try:
-                bot.send_message(
-                    chat_id=admin_id,
-                    text=f"⚠️ ERROR AL INICIALIZAR SEGURIDAD Y RENOVACIONES: {e}\n"
-                         "El bot está activo pero los sistemas automáticos podrían no funcionar correctamente."
-                )
-            except:
-                pass
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Estado de arranque: 200 cuando el webhook ya puede atender actualizaciones"""
+    from scheduler import job_scheduler
+    
+    status = startup.get_status()
+    boot_ready = startup.is_phase_ready('boot')
+    
+    # La auditoría inicial de membresías la ejecuta el proceso líder
+    audit = job_scheduler.get_job_stats('security_check')
+    if audit is None:
+        audit_status = 'pending'
+    elif not job_scheduler.is_leader:
+        audit_status = 'delegated'
+    elif audit['run_count'] == 0:
+        audit_status = 'running' if audit['running'] else 'pending'
+    else:
+        audit_status = audit['last_status']
+    
+    status['ready'] = boot_ready
+    status['warm'] = startup.is_phase_ready('warmup')
+    status['membership_audit'] = audit_status
+    status['runtime_cache'] = runtime.describe()
+    
+    return jsonify(status), 200 if boot_ready else 503
 
 # AÑADE esta línea al final del archivo para llamar a la función
 # directamente cuando la aplicación arranca
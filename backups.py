@@ -0,0 +1,158 @@
+"""
+Copias de seguridad consistentes de la base de datos.
+
+create_backup() copia la base de datos con la API de backup de SQLite
+(sqlite3.Connection.backup) en pasos de BACKUP_PAGES_PER_STEP páginas: cada paso
+toma un bloqueo de lectura breve y entre pasos los escritores siguen trabajando.
+Si otra conexión escribe durante la copia, SQLite la reinicia, así que el
+resultado siempre es una instantánea coherente (copiar el archivo en vivo puede
+mezclar páginas de antes y después de una escritura).
+
+La instantánea se comprueba con PRAGMA quick_check, se comprime con gzip y se
+guarda en BACKUP_DIR junto con su SHA-256 (archivo .sha256 en el formato de
+sha256sum). La tarea 'database_backup' crea una según BACKUP_CRON y conserva las
+BACKUP_RETENTION_COUNT más recientes; /admin/download-database envía la última.
+"""
+import datetime
+import gzip
+import hashlib
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+
+from config import DB_PATH, BACKUP_DIR, BACKUP_RETENTION_COUNT, BACKUP_PAGES_PER_STEP, BACKUP_STEP_SLEEP_SECONDS
+
+logger = logging.getLogger(__name__)
+
+BACKUP_PREFIX = os.path.splitext(os.path.basename(DB_PATH))[0]
+BACKUP_NAME_RE = re.compile(rf"^{re.escape(BACKUP_PREFIX)}_\d{{8}}_\d{{6}}\.db\.gz$")
+CHUNK_SIZE = 1024 * 1024  # Bloque de lectura al comprimir y al calcular el SHA-256
+COMPRESS_LEVEL = 6  # Nivel 9 (el de gzip por defecto) tarda 4 veces más y solo reduce un 2-3 %
+
+_backup_lock = threading.Lock()
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def copy_database(target_path):
+    """Copia la base de datos en vivo a target_path por pasos (también la usa replica.py). Devuelve el número de páginas"""
+    source = sqlite3.connect(DB_PATH)
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target, pages=BACKUP_PAGES_PER_STEP, sleep=BACKUP_STEP_SLEEP_SECONDS)
+        check = target.execute("PRAGMA quick_check").fetchone()[0]
+        if check != 'ok':
+            raise RuntimeError(f"La copia no superó quick_check: {check}")
+        return target.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+        target.close()
+        source.close()
+
+
+def _compress(source_path, target_path):
+    with open(source_path, 'rb') as source, open(target_path, 'wb') as raw:
+        with gzip.GzipFile(filename=os.path.basename(DB_PATH), mode='wb', compresslevel=COMPRESS_LEVEL,
+                           fileobj=raw) as target:
+            shutil.copyfileobj(source, target, CHUNK_SIZE)
+
+
+def _describe(path):
+    checksum_path = path + '.sha256'
+    sha256 = None
+    if os.path.exists(checksum_path):
+        with open(checksum_path) as f:
+            sha256 = f.read().split()[0]
+    stat = os.stat(path)
+    return {
+        'name': os.path.basename(path),
+        'path': path,
+        'size_bytes': stat.st_size,
+        'created_at': datetime.datetime.fromtimestamp(stat.st_mtime, datetime.timezone.utc).isoformat(),
+        'sha256': sha256,
+    }
+
+
+def list_backups():
+    """Copias guardadas, de la más reciente a la más antigua"""
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    names = sorted((name for name in os.listdir(BACKUP_DIR) if BACKUP_NAME_RE.match(name)), reverse=True)
+    return [_describe(os.path.join(BACKUP_DIR, name)) for name in names]
+
+
+def get_backup(name):
+    """Copia por nombre (solo nombres de copia válidos, nunca rutas) o None"""
+    if not name or not BACKUP_NAME_RE.match(name):
+        return None
+    path = os.path.join(BACKUP_DIR, name)
+    return _describe(path) if os.path.exists(path) else None
+
+
+def latest_backup():
+    backups = list_backups()
+    return backups[0] if backups else None
+
+
+def prune_backups(keep=BACKUP_RETENTION_COUNT):
+    """Borra las copias más antiguas que las `keep` más recientes. Devuelve cuántas borró"""
+    removed = 0
+    for backup in list_backups()[keep:]:
+        for path in (backup['path'], backup['path'] + '.sha256'):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        removed += 1
+    return removed
+
+
+def create_backup():
+    """
+    Crea una copia comprimida de la base de datos y aplica la retención.
+
+    Returns:
+        dict: la copia creada (ver list_backups) o None si ya había una en curso
+    """
+    if not _backup_lock.acquire(blocking=False):
+        logger.warning("⚠️ Ya hay una copia de seguridad en curso")
+        return None
+    try:
+        started = time.perf_counter()
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+        name = f"{BACKUP_PREFIX}_{datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%d_%H%M%S')}.db.gz"
+        path = os.path.join(BACKUP_DIR, name)
+        snapshot_path = path[:-len('.gz')] + '.tmp'
+        compressed_path = path + '.tmp'
+
+        try:
+            pages = copy_database(snapshot_path)
+            _compress(snapshot_path, compressed_path)
+            sha256 = _file_sha256(compressed_path)
+            # Primero el checksum y después el archivo: una copia visible siempre tiene su .sha256
+            with open(path + '.sha256', 'w') as f:
+                f.write(f"{sha256}  {name}\n")
+            os.replace(compressed_path, path)
+        finally:
+            for tmp_path in (snapshot_path, compressed_path):
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            if not os.path.exists(path) and os.path.exists(path + '.sha256'):
+                os.remove(path + '.sha256')
+
+        removed = prune_backups()
+        backup = _describe(path)
+        logger.info(f"💾 Copia de seguridad {name} creada: {pages} páginas, {backup['size_bytes']} bytes comprimidos "
+                    f"en {time.perf_counter() - started:.2f}s ({removed} antiguas eliminadas)")
+        return backup
+    finally:
+        _backup_lock.release()
@@ -0,0 +1,252 @@
+"""
+Benchmarks de las consultas de database.py sobre bases de datos sintéticas.
+
+Mide, sobre una copia de la base generada con generate_dataset.py, las
+funciones que recorren las tablas completas o que el bot llama por usuario:
+
+- check_and_update_subscriptions (se restaura la copia antes de cada ronda,
+  porque marca suscripciones como EXPIRED)
+- has_valid_subscription (lote de usuarios por ronda: activos, en gracia,
+  expirados y whitelist)
+- get_users_to_expel
+- get_pending_renewal_subscriptions
+- get_admin_panel_data (consultas de /admin/panel)
+- get_bot_stats (consultas de /stats)
+- refresh_rollups_backfill, refresh_rollups y revenue_trend (rollups diarios:
+  cálculo del historial completo, refresco incremental y /admin/revenue-trend)
+
+Cada benchmark se repite hasta --rounds rondas o --max-time segundos e
+informa min/media/mediana/desviación/máx y las consultas SQL por llamada.
+Los resultados se guardan como línea base (benchmarks/baselines/<dataset>.json)
+y se comparan con ella: una mediana más lenta que el umbral es una regresión
+y el proceso termina con código 1.
+
+Uso:
+    python benchmarks/generate_dataset.py --size 10k
+    python benchmarks/bench_database.py --dataset 10k --save-baseline
+    python benchmarks/bench_database.py --dataset 10k --compare --threshold 0.2
+    python benchmarks/bench_database.py --dataset 100k --only has_valid_subscription,get_bot_stats
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.generate_dataset import DATA_DIR, SIZES, prepare_environment  # noqa: E402
+
+BASELINE_DIR = os.path.join(ROOT, 'benchmarks', 'baselines')
+LOOKUP_BATCH = 200  # Usuarios consultados por ronda en has_valid_subscription
+
+
+def percent(value):
+    return f"{value * 100:+.1f}%"
+
+
+class Benchmark:
+    """Una función medida: setup() antes de cada ronda (fuera del tiempo) y run()"""
+
+    def __init__(self, name, run, setup=None, calls_per_round=1):
+        self.name = name
+        self.run = run
+        self.setup = setup
+        self.calls_per_round = calls_per_round
+
+
+def build_benchmarks(db, rollups, pristine_path, work_path):
+    """Benchmarks sobre work_path; pristine_path es la copia original para restaurar"""
+    conn = sqlite3.connect(work_path)
+    # Muestra estable (pseudoaleatoria) de usuarios: mezcla activos, en gracia, expirados y whitelist
+    sample_users = [row[0] for row in conn.execute(f"""
+        SELECT user_id FROM users ORDER BY (user_id * 2654435761) % 4294967296 LIMIT {LOOKUP_BATCH}
+    """)]
+    conn.close()
+
+    def restore():
+        shutil.copyfile(pristine_path, work_path)
+
+    def lookup_batch():
+        for user_id in sample_users:
+            db.has_valid_subscription(user_id)
+
+    def ensure_rollups():
+        if not db.get_rollup_watermark():
+            rollups.refresh()
+
+    return [
+        Benchmark('check_and_update_subscriptions', db.check_and_update_subscriptions, setup=restore),
+        Benchmark('has_valid_subscription', lookup_batch, calls_per_round=len(sample_users)),
+        Benchmark('get_users_to_expel', db.get_users_to_expel),
+        Benchmark('get_pending_renewal_subscriptions', lambda: db.get_pending_renewal_subscriptions(minutes_before=24 * 60)),
+        Benchmark('get_admin_panel_data', db.get_admin_panel_data),
+        Benchmark('get_bot_stats', db.get_bot_stats),
+        Benchmark('refresh_rollups_backfill', lambda: rollups.refresh(full=True)),
+        Benchmark('refresh_rollups', rollups.refresh, setup=ensure_rollups),
+        Benchmark('revenue_trend', lambda: rollups.trend(90), setup=ensure_rollups),
+    ]
+
+
+class QueryCounter:
+    """Observador de db_instrumentation que cuenta las consultas ejecutadas"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, site, sql, parameters, duration, connection):
+        self.count += 1
+
+
+def measure(benchmark, rounds, max_time, warmup, counter):
+    """Ejecuta las rondas y devuelve estadísticas en milisegundos por llamada"""
+    for _ in range(warmup):
+        if benchmark.setup:
+            benchmark.setup()
+        benchmark.run()
+
+    timings = []
+    queries = 0
+    deadline = time.perf_counter() + max_time
+    while len(timings) < rounds and (not timings or time.perf_counter() < deadline):
+        if benchmark.setup:
+            benchmark.setup()
+        counter.count = 0
+        started = time.perf_counter()
+        benchmark.run()
+        timings.append((time.perf_counter() - started) * 1000 / benchmark.calls_per_round)
+        queries = counter.count / benchmark.calls_per_round
+
+    return {
+        'rounds': len(timings),
+        'calls_per_round': benchmark.calls_per_round,
+        'min_ms': round(min(timings), 3),
+        'max_ms': round(max(timings), 3),
+        'mean_ms': round(statistics.fmean(timings), 3),
+        'median_ms': round(statistics.median(timings), 3),
+        'stddev_ms': round(statistics.stdev(timings), 3) if len(timings) > 1 else 0.0,
+        'queries_per_call': round(queries, 2),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Lista de (nombre, mediana base, mediana actual, cambio, es_regresión)"""
+    rows = []
+    for name, result in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous:
+            continue
+        change = (result['median_ms'] - previous['median_ms']) / previous['median_ms'] if previous['median_ms'] else 0.0
+        rows.append((name, previous['median_ms'], result['median_ms'], change, change > threshold))
+    return rows
+
+
+def print_results(dataset, results):
+    print(f"\nBenchmarks de database.py - dataset {dataset} (ms por llamada)")
+    print(f"{'benchmark':<36}{'rondas':>7}{'mín':>11}{'mediana':>11}{'media':>11}{'desv':>10}{'máx':>11}{'SQL/llamada':>13}")
+    for name, r in results.items():
+        print(f"{name:<36}{r['rounds']:>7}{r['min_ms']:>11.3f}{r['median_ms']:>11.3f}{r['mean_ms']:>11.3f}"
+              f"{r['stddev_ms']:>10.3f}{r['max_ms']:>11.3f}{r['queries_per_call']:>13}")
+
+
+def resolve_dataset(value):
+    """'10k' -> benchmarks/data/users_10k.db; también acepta una ruta"""
+    if os.path.exists(value):
+        return os.path.splitext(os.path.basename(value))[0].replace('users_', ''), value
+    return value, os.path.join(DATA_DIR, f"users_{value}.db")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dataset', default='10k', help=f"{', '.join(SIZES)} o ruta a una base generada")
+    parser.add_argument('--only', help="Benchmarks a ejecutar, separados por comas")
+    parser.add_argument('--rounds', type=int, default=20, help="Rondas máximas por benchmark")
+    parser.add_argument('--max-time', type=float, default=10.0, help="Segundos máximos por benchmark")
+    parser.add_argument('--warmup', type=int, default=1, help="Rondas de calentamiento (no se miden)")
+    parser.add_argument('--save-baseline', action='store_true', help="Guardar los resultados como línea base")
+    parser.add_argument('--compare', action='store_true', help="Comparar con la línea base guardada")
+    parser.add_argument('--threshold', type=float, default=0.25, help="Aumento de la mediana tolerado (0.25 = 25%%)")
+    parser.add_argument('--baseline-dir', default=BASELINE_DIR)
+    parser.add_argument('--json', help="Guardar los resultados en este archivo")
+    args = parser.parse_args()
+
+    dataset, source_path = resolve_dataset(args.dataset)
+    if not os.path.exists(source_path):
+        parser.error(f"No existe {source_path}; generarlo con: python benchmarks/generate_dataset.py --size {dataset}")
+
+    # Se trabaja sobre una copia: check_and_update_subscriptions modifica la base
+    work_dir = tempfile.mkdtemp(prefix='subsbot-bench-')
+    pristine_path = os.path.join(work_dir, 'pristine.db')
+    work_path = os.path.join(work_dir, 'vip_bot.db')
+    shutil.copyfile(source_path, pristine_path)
+    shutil.copyfile(source_path, work_path)
+    prepare_environment(work_path)
+
+    import database as db
+    import db_instrumentation
+    import rollups
+
+    counter = QueryCounter()
+    db_instrumentation.add_query_observer(counter)
+    benchmarks = build_benchmarks(db, rollups, pristine_path, work_path)
+    if args.only:
+        selected = {name.strip() for name in args.only.split(',')}
+        unknown = selected - {b.name for b in benchmarks}
+        if unknown:
+            parser.error(f"Benchmarks desconocidos: {', '.join(sorted(unknown))}")
+        benchmarks = [b for b in benchmarks if b.name in selected]
+
+    results = {}
+    try:
+        for benchmark in benchmarks:
+            print(f"  {benchmark.name}...", flush=True)
+            results[benchmark.name] = measure(benchmark, args.rounds, args.max_time, args.warmup, counter)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_results(dataset, results)
+    report = {
+        'dataset': dataset,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'results': results,
+    }
+    baseline_path = os.path.join(args.baseline_dir, f"{dataset}.json")
+    exit_code = 0
+
+    if args.compare:
+        if not os.path.exists(baseline_path):
+            print(f"\nNo hay línea base en {baseline_path}")
+        else:
+            with open(baseline_path) as f:
+                baseline = json.load(f)
+            print(f"\nComparación con la línea base del {baseline.get('created_at')} (umbral {percent(args.threshold)})")
+            for name, before, after, change, regression in compare(results, baseline, args.threshold):
+                mark = "❌ REGRESIÓN" if regression else "✅"
+                print(f"  {name:<36}{before:>11.3f} -> {after:>11.3f} ms  {percent(change):>8}  {mark}")
+                if regression:
+                    exit_code = 1
+
+    if args.save_baseline:
+        os.makedirs(args.baseline_dir, exist_ok=True)
+        with open(baseline_path, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"\nLínea base guardada en {baseline_path}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,325 @@
+"""
+Benchmark de la verificación de seguridad del grupo (perform_group_security_check)
+cuando vencen muchas suscripciones a la vez, por ejemplo al terminar una promoción.
+
+Siembra una base de datos temporal con N suscripciones repartidas en casos
+con una decisión conocida y ejecuta la verificación contra un bot real de
+pyTelegramBotAPI apuntado a los stubs de benchmarks/stubs.py, que simulan el
+grupo (quién es miembro, a quién se expulsó) y PayPal:
+
+- expired:      ACTIVE vencida hace días, PayPal EXPIRED        -> expulsar
+- whitelist:    whitelist vencida (sin paypal_sub_id)           -> expulsar
+- cancelled:    CANCELLED, PayPal CANCELLED                     -> expulsar
+- left:         vencida, pero el usuario ya no está en el grupo -> omitir
+- resubscribed: una CANCELLED y otra ACTIVE vigente             -> omitir
+- grace:        recurrente vencida hace menos de 24 h           -> no tocar
+- admin:        suscripción vencida de un administrador         -> omitir
+
+Informa del tiempo total, las llamadas a Telegram y PayPal por usuario
+expulsado, las consultas SQL por suscripción y la memoria máxima
+(tracemalloc), y comprueba cada decisión: expulsar a quien debía omitirse
+es siempre un fallo; no expulsar a quien debía expulsarse solo se tolera
+si se inyectan errores o 429. La segunda ejecución (--runs 2) mide el coste
+de una verificación sin nada nuevo que hacer y comprueba que no se repiten
+expulsiones. Termina con código 1 si alguna decisión es incorrecta.
+
+Uso:
+    python benchmarks/bench_sweep.py --subscriptions 5000
+    python benchmarks/bench_sweep.py --subscriptions 2000 --stub-latency-ms 50 --stub-rate-limit-per-second 30
+    python benchmarks/bench_sweep.py --mix expired=80,cancelled=20 --json sweep.json
+"""
+import argparse
+import datetime
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks import stubs  # noqa: E402
+
+DEFAULT_MIX = 'expired=45,whitelist=10,cancelled=20,left=10,resubscribed=10,grace=5'
+GROUP_CHAT_ID = -1001234567890
+BOT_TOKEN = '700000002:sweep-benchmark-token'
+ADMIN_ID = 42
+FIRST_USER_ID = 6_000_000_000
+
+# Decisión esperada de cada caso
+EXPECTED = {
+    'expired': 'expel',
+    'whitelist': 'expel',
+    'cancelled': 'expel',
+    'left': 'skip',
+    'resubscribed': 'skip',
+    'grace': 'untouched',
+    'admin': 'skip',
+}
+
+
+def parse_mix(value):
+    """'expired=80,cancelled=20' -> [('expired', 80.0), ('cancelled', 20.0)]"""
+    mix = []
+    for item in value.split(','):
+        name, weight = item.split('=', 1)
+        if name.strip() not in EXPECTED or name.strip() == 'admin':
+            raise argparse.ArgumentTypeError(f"Caso desconocido: {name}")
+        mix.append((name.strip(), float(weight)))
+    return mix
+
+
+def configure_environment(args, stub_environment):
+    """Variables de entorno de la app (antes de importar config)"""
+    db_dir = tempfile.mkdtemp(prefix='subsbot-sweep-')
+    os.environ.update(stub_environment)
+    os.environ.update({
+        'BOT_TOKEN': BOT_TOKEN,
+        'GROUP_CHAT_ID': str(GROUP_CHAT_ID),
+        'ADMIN_IDS': str(ADMIN_ID),
+        'PAYPAL_CLIENT_ID': 'sweep-benchmark-client-id',
+        'PAYPAL_CLIENT_SECRET': 'sweep-benchmark-client-secret',
+        'DB_PATH': os.path.join(db_dir, 'vip_bot.db'),
+        'SCHEDULER_ENABLED': 'false',
+        'LOG_LEVEL': args.log_level,
+        'LOG_FORMAT': 'text',
+    })
+
+
+def build_cases(total, mix):
+    """Lista de (user_id, caso) con los casos repartidos según el mix, más un administrador"""
+    weight_total = sum(weight for _, weight in mix)
+    counts = [(name, int(total * weight / weight_total)) for name, weight in mix]
+    counts[0] = (counts[0][0], counts[0][1] + total - sum(count for _, count in counts))
+    cases = [(ADMIN_ID, 'admin')]
+    user_id = FIRST_USER_ID
+    for name, count in counts:
+        for _ in range(count):
+            cases.append((user_id, name))
+            user_id += 1
+    return cases
+
+
+def seed(db_path, cases, telegram, paypal):
+    """Inserta usuarios y suscripciones y prepara el estado del grupo y de PayPal"""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    users = []
+    subscriptions = []
+
+    def add(user_id, plan, start, end, status, paypal_sub_id, recurring):
+        subscriptions.append((user_id, plan, 5.00 if paypal_sub_id else 0.0, str(start), str(end), status,
+                              paypal_sub_id, recurring))
+
+    for index, (user_id, case) in enumerate(cases):
+        users.append((user_id, f"sweep{user_id}", f"Barrido{index}", now.strftime('%Y-%m-%d %H:%M:%S')))
+        paypal_id = f"I-SWEEP{index:08d}"
+        expired_end = now - datetime.timedelta(days=2, minutes=index % 1440)
+        if case in ('expired', 'left', 'admin'):
+            add(user_id, 'monthly', expired_end - datetime.timedelta(days=30), expired_end, 'ACTIVE', paypal_id, 1)
+            paypal.set_subscription_status(paypal_id, 'EXPIRED')
+        elif case == 'whitelist':
+            add(user_id, 'monthly', expired_end - datetime.timedelta(days=30), expired_end, 'ACTIVE', None, 0)
+        elif case == 'cancelled':
+            add(user_id, 'weekly', expired_end - datetime.timedelta(days=7), expired_end, 'CANCELLED', paypal_id, 1)
+            paypal.set_subscription_status(paypal_id, 'CANCELLED')
+        elif case == 'resubscribed':
+            add(user_id, 'weekly', expired_end - datetime.timedelta(days=7), expired_end, 'CANCELLED', paypal_id, 1)
+            paypal.set_subscription_status(paypal_id, 'CANCELLED')
+            add(user_id, 'monthly', now - datetime.timedelta(days=1), now + datetime.timedelta(days=29), 'ACTIVE',
+                f"I-SWEEP{index:08d}B", 1)
+        elif case == 'grace':
+            end = now - datetime.timedelta(hours=1 + index % 20)
+            add(user_id, 'monthly', end - datetime.timedelta(days=30), end, 'ACTIVE', paypal_id, 1)
+        if case == 'left':
+            telegram.set_member_status(user_id, 'left')
+
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.executemany('INSERT INTO users (user_id, username, first_name, created_at) VALUES (?, ?, ?, ?)', users)
+        conn.executemany('''
+            INSERT INTO subscriptions (user_id, plan, price_usd, start_date, end_date, status, paypal_sub_id, is_recurring)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', subscriptions)
+    conn.close()
+    return len(subscriptions)
+
+
+def count_expulsions(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute('SELECT COUNT(*) FROM expulsions').fetchone()[0]
+    finally:
+        conn.close()
+
+
+class QueryCounter:
+    """Observador de db_instrumentation que cuenta las consultas ejecutadas"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, site, sql, parameters, duration, connection):
+        self.count += 1
+
+
+def run_sweep(bot_handlers, bot, telegram, paypal, counter, trace_memory):
+    """Una ejecución de la verificación con sus mediciones"""
+    telegram.httpd.calls.clear()
+    paypal.httpd.calls.clear()
+    counter.count = 0
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    result = bot_handlers.perform_group_security_check(bot, GROUP_CHAT_ID)
+    elapsed = time.perf_counter() - started
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {
+        'result': result,
+        'seconds': round(elapsed, 3),
+        'queries': counter.count,
+        'telegram_calls': dict(telegram.stats()['calls']),
+        'paypal_calls': dict(paypal.stats()['calls']),
+        'peak_memory_mb': round(peak / 1024 / 1024, 2) if peak is not None else None,
+    }
+
+
+def check_decisions(db_path, cases, kicks_before, kicks_after, tolerate_missed):
+    """Compara las expulsiones reales con las esperadas en una ejecución"""
+    conn = sqlite3.connect(db_path)
+    expulsions = Counter(row[0] for row in conn.execute('SELECT user_id FROM expulsions'))
+    grace_statuses = dict(conn.execute("""
+        SELECT user_id, status FROM subscriptions WHERE user_id IN (%s)
+    """ % ",".join(str(user_id) for user_id, case in cases if case == 'grace') or "NULL"))
+    conn.close()
+
+    wrong = []
+    missed = []
+    outcomes = Counter()
+    for user_id, case in cases:
+        kicked = kicks_after.get(user_id, 0) - kicks_before.get(user_id, 0)
+        expected = EXPECTED[case]
+        outcomes[(case, 'expelled' if kicked else 'kept')] += 1
+        if expected == 'expel' and not kicks_before.get(user_id):
+            if not kicked or not expulsions.get(user_id):
+                missed.append((user_id, case))
+        elif expected != 'expel' and kicked:
+            wrong.append((user_id, case, 'expulsado'))
+        if case == 'grace' and grace_statuses.get(user_id) != 'ACTIVE':
+            wrong.append((user_id, case, f"estado {grace_statuses.get(user_id)}"))
+        if kicked > 1:
+            wrong.append((user_id, case, f"expulsado {kicked} veces"))
+
+    return {
+        'ok': not wrong and (tolerate_missed or not missed),
+        'wrong': wrong,
+        'missed': missed,
+        'outcomes': {f"{case}/{outcome}": count for (case, outcome), count in sorted(outcomes.items())},
+    }
+
+
+def summarize_run(run, seeded, expelled):
+    telegram_total = sum(run['telegram_calls'].values())
+    paypal_total = sum(run['paypal_calls'].values())
+    return dict(run, **{
+        'expelled': expelled,
+        'telegram_calls_per_expelled': round(telegram_total / expelled, 2) if expelled else None,
+        'paypal_calls_per_expelled': round(paypal_total / expelled, 2) if expelled else None,
+        'queries_per_subscription': round(run['queries'] / seeded, 2) if seeded else None,
+        'expelled_per_second': round(expelled / run['seconds'], 1) if run['seconds'] else None,
+    })
+
+
+def print_report(report):
+    print(f"\nVerificación de seguridad: {report['users']} usuarios, {report['subscriptions']} suscripciones")
+    print(f"Stubs: {report['stub_behavior']}")
+    for number, run in enumerate(report['runs'], 1):
+        memory = f"{run['peak_memory_mb']} MB" if run['peak_memory_mb'] is not None else "no medida"
+        print(f"\nEjecución {number}: {run['seconds']} s | expulsados {run['expelled']} "
+              f"({run['expelled_per_second']}/s) | memoria máxima {memory}")
+        print(f"  Telegram por expulsado: {run['telegram_calls_per_expelled']} | "
+              f"PayPal por expulsado: {run['paypal_calls_per_expelled']} | "
+              f"SQL por suscripción: {run['queries_per_subscription']} ({run['queries']} consultas)")
+        print("  Llamadas: " + ", ".join(f"{name}={count}" for name, count in
+                                        sorted({**run['telegram_calls'], **run['paypal_calls']}.items())))
+        decisions = run['decisions']
+        print("  Decisiones: " + ", ".join(f"{name}={count}" for name, count in decisions['outcomes'].items()))
+        if decisions['wrong']:
+            print(f"  ❌ {len(decisions['wrong'])} decisiones incorrectas, p. ej. {decisions['wrong'][:5]}")
+        if decisions['missed']:
+            mark = "⚠️" if decisions['ok'] else "❌"
+            print(f"  {mark} {len(decisions['missed'])} usuarios sin expulsar, p. ej. {decisions['missed'][:5]}")
+        if decisions['ok'] and not decisions['missed']:
+            print("  ✅ Todas las decisiones son correctas")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--subscriptions', type=int, default=5000, help="Usuarios sembrados (sin contar al administrador)")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"Reparto de casos ({DEFAULT_MIX})")
+    parser.add_argument('--runs', type=int, default=2, help="Ejecuciones seguidas de la verificación")
+    parser.add_argument('--no-tracemalloc', action='store_true', help="No medir memoria (tracemalloc ralentiza)")
+    parser.add_argument('--seed', type=int, default=1234, help="Semilla de la inyección de fallos")
+    parser.add_argument('--log-level', default='ERROR')
+    parser.add_argument('--json', help="Guardar el informe en este archivo")
+    stubs.add_behavior_arguments(parser, prefix='stub-')
+    args = parser.parse_args()
+
+    behavior = stubs.behavior_from_args(args, prefix='stub-')
+    telegram, paypal = stubs.start_stubs(seed=args.seed, **behavior)
+    configure_environment(args, stubs.environment_for(telegram, paypal))
+
+    import telebot
+    import database as db
+    import db_instrumentation
+    import telegram_api
+    import bot_handlers
+
+    telegram_api.install()
+    bot = telebot.TeleBot(BOT_TOKEN, threaded=False)
+    counter = QueryCounter()
+    db_instrumentation.add_query_observer(counter)
+
+    cases = build_cases(args.subscriptions, args.mix)
+    print(f"Sembrando {len(cases)} usuarios...", flush=True)
+    seeded = seed(db.DB_PATH, cases, telegram, paypal)
+    faults_injected = any(behavior[name] for name in ('error_rate', 'rate_limit_rate', 'rate_limit_per_second'))
+
+    report = {
+        'users': len(cases),
+        'subscriptions': seeded,
+        'stub_behavior': {name: value for name, value in behavior.items() if value and name != 'retry_after'} or 'sin fallos',
+        'runs': [],
+    }
+    exit_code = 0
+    for number in range(args.runs):
+        print(f"Ejecución {number + 1}...", flush=True)
+        kicks_before = Counter(telegram.state.kicks)
+        expulsions_before = count_expulsions(db.DB_PATH)
+        run = run_sweep(bot_handlers, bot, telegram, paypal, counter, not args.no_tracemalloc)
+        kicks_after = Counter(telegram.state.kicks)
+        expelled = count_expulsions(db.DB_PATH) - expulsions_before
+        run = summarize_run(run, seeded, expelled)
+        run['decisions'] = check_decisions(db.DB_PATH, cases, kicks_before, kicks_after, faults_injected)
+        if not run['decisions']['ok']:
+            exit_code = 1
+        report['runs'].append(run)
+
+    telegram.stop()
+    paypal.stop()
+    print_report(report)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+        print(f"\nInforme guardado en {args.json}")
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
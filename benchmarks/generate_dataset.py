@@ -0,0 +1,334 @@
+"""
+Generador de bases de datos sintéticas de gran tamaño para los benchmarks.
+
+Crea el esquema con database.init_db() y lo llena con usuarios repartidos a lo
+largo de varios años, cada uno con su historial de suscripciones (expiradas,
+canceladas, activas, en periodo de gracia y whitelist), renovaciones,
+notificaciones de renovación, enlaces de invitación, expulsiones y pagos
+procesados. Las fechas mezclan los formatos que el bot ha ido guardando con
+el tiempo:
+
+- '2024-05-01 10:00:00.123456+00:00' (datetime con zona, adaptador de sqlite3)
+- '2024-05-01T10:00:00.123456+00:00' (isoformat)
+- '2024-05-01 10:00:00'              (CURRENT_TIMESTAMP, sin zona)
+- '2024-05-01T10:00:00Z'             (fechas de PayPal)
+
+El resultado es reproducible con la misma semilla.
+
+Uso:
+    python benchmarks/generate_dataset.py --size 10k
+    python benchmarks/generate_dataset.py --size 1m --years 5 --output /tmp/users_1m.db
+"""
+import argparse
+import datetime
+import os
+import random
+import sqlite3
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DATA_DIR = os.path.join(ROOT, 'benchmarks', 'data')
+SIZES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+FIRST_USER_ID = 1_000_000_000
+BATCH_SIZE = 50_000
+
+PLAN_PRICES = {'weekly': (3.50, 7), 'monthly': (5.00, 30), 'prueba': (0.10, 1)}
+PLAN_WEIGHTS = (('weekly', 45), ('monthly', 50), ('prueba', 5))
+
+# Estado de la suscripción más reciente de cada usuario
+FINAL_STATES = (
+    ('active', 30),        # ACTIVE con fecha de fin futura
+    ('grace', 4),          # ACTIVE vencida hace menos que el periodo de gracia
+    ('overdue', 6),        # ACTIVE vencida fuera del periodo de gracia (a expulsar)
+    ('expired', 40),       # EXPIRED
+    ('cancelled', 12),     # CANCELLED
+    ('whitelist', 8),      # Manual, sin paypal_sub_id
+)
+EXPULSION_REASONS = (
+    'Suscripción expirada',
+    'Suscripción cancelada',
+    'Acceso no autorizado',
+    'Verificación de seguridad',
+)
+
+
+def parse_size(value):
+    """'10k', '100k', '1m' o un número entero"""
+    if value.lower() in SIZES:
+        return SIZES[value.lower()]
+    try:
+        return int(value.replace('_', ''))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Tamaño no válido: {value}")
+
+
+class TimestampFormatter:
+    """Reparte las fechas entre los formatos históricos de la base de datos"""
+
+    FORMATS = ('sqlite_aware', 'isoformat', 'naive', 'zulu')
+    WEIGHTS = (55, 20, 15, 10)
+
+    def __init__(self, rng):
+        self.rng = rng
+
+    def __call__(self, value):
+        fmt = self.rng.choices(self.FORMATS, self.WEIGHTS)[0]
+        if fmt == 'sqlite_aware':
+            return str(value)
+        if fmt == 'isoformat':
+            return value.isoformat()
+        if fmt == 'naive':
+            return value.strftime('%Y-%m-%d %H:%M:%S')
+        return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def weighted(rng, choices):
+    names, weights = zip(*choices)
+    return rng.choices(names, weights)[0]
+
+
+class DatasetBuilder:
+    """Genera las filas de cada tabla por lotes de usuarios"""
+
+    def __init__(self, users, years, seed, grace_hours, now=None):
+        self.users = users
+        self.years = years
+        self.rng = random.Random(seed)
+        self.fmt = TimestampFormatter(self.rng)
+        self.grace = datetime.timedelta(hours=grace_hours)
+        self.now = now or datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+        self.history_start = self.now - datetime.timedelta(days=365 * years)
+        self.next_sub_id = 1
+        self.counts = dict.fromkeys(
+            ('users', 'subscriptions', 'subscription_renewals', 'renewal_notifications',
+             'invite_links', 'expulsions', 'processed_payments'), 0)
+        self.final_states = dict.fromkeys(name for name, _ in FINAL_STATES)
+
+    def _random_moment(self, start, end):
+        span = max((end - start).total_seconds(), 1)
+        return start + datetime.timedelta(seconds=self.rng.uniform(0, span),
+                                          microseconds=self.rng.randrange(1_000_000))
+
+    def _final_window(self, state, days):
+        """(inicio, fin) de la suscripción más reciente según su estado"""
+        duration = datetime.timedelta(days=days)
+        if state in ('active', 'whitelist'):
+            end = self.now + datetime.timedelta(seconds=self.rng.uniform(60, duration.total_seconds()))
+        elif state == 'grace':
+            end = self.now - datetime.timedelta(seconds=self.rng.uniform(60, self.grace.total_seconds() - 60))
+        elif state == 'overdue':
+            end = self.now - self.grace - datetime.timedelta(hours=self.rng.uniform(1, 24 * 30))
+        else:
+            end = self._random_moment(self.history_start + duration, self.now - datetime.timedelta(hours=1))
+        return end - duration, end
+
+    def user_rows(self, user_index):
+        """Todas las filas de un usuario: dict tabla -> lista de tuplas"""
+        rng = self.rng
+        user_id = FIRST_USER_ID + user_index
+        created_at = self._random_moment(self.history_start, self.now - datetime.timedelta(days=1))
+        rows = {table: [] for table in self.counts}
+        rows['users'].append((
+            user_id,
+            f"user{user_id}" if rng.random() < 0.8 else None,
+            f"Nombre{user_index % 5000}",
+            f"Apellido{user_index % 7000}" if rng.random() < 0.6 else None,
+            created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        ))
+
+        state = weighted(rng, FINAL_STATES)
+        self.final_states[state] = (self.final_states[state] or 0) + 1
+        plan = weighted(rng, PLAN_WEIGHTS)
+        price, days = PLAN_PRICES[plan]
+        final_start, final_end = self._final_window(state, days)
+
+        # Suscripciones anteriores (ya cerradas), antes de la más reciente
+        history = []
+        cursor_end = min(final_start, self.now) - datetime.timedelta(days=rng.uniform(1, 60))
+        for _ in range(rng.choices((0, 1, 2, 3, 5), (35, 30, 18, 10, 7))[0]):
+            old_plan = weighted(rng, PLAN_WEIGHTS)
+            old_price, old_days = PLAN_PRICES[old_plan]
+            old_start = cursor_end - datetime.timedelta(days=old_days)
+            if old_start < created_at:
+                break
+            history.append((old_plan, old_price, old_start, cursor_end, rng.choice(('EXPIRED', 'EXPIRED', 'CANCELLED'))))
+            cursor_end = old_start - datetime.timedelta(days=rng.uniform(1, 90))
+
+        if state == 'whitelist':
+            final = (plan, 0.0, final_start, final_end, 'ACTIVE')
+        else:
+            final_status = {'expired': 'EXPIRED', 'cancelled': 'CANCELLED'}.get(state, 'ACTIVE')
+            final = (plan, price, final_start, final_end, final_status)
+
+        for index, (sub_plan, sub_price, start, end, status) in enumerate(list(reversed(history)) + [final]):
+            is_final = index == len(history)
+            sub_id = self.next_sub_id
+            self.next_sub_id += 1
+            whitelist = is_final and state == 'whitelist'
+            recurring = 0 if whitelist else int(rng.random() < 0.85)
+            paypal_sub_id = None if whitelist else (f"I-{sub_id:012d}" if recurring else f"ORDER-{sub_id:010d}")
+
+            # Las recurrentes renovadas empezaron N ciclos antes; cada renovación extendió end_date
+            cycle = datetime.timedelta(days=PLAN_PRICES[sub_plan][1])
+            renewals = rng.randint(1, 6) if recurring and rng.random() < 0.5 else 0
+            start = start - cycle * renewals
+            rows['subscriptions'].append((
+                sub_id, user_id, sub_plan, sub_price, self.fmt(start), self.fmt(end), status,
+                paypal_sub_id, recurring,
+            ))
+
+            # Enlace de invitación (la mayoría se usó)
+            link_created = start + datetime.timedelta(seconds=rng.uniform(1, 30))
+            rows['invite_links'].append((
+                sub_id, f"https://t.me/+synthetic{sub_id:x}", self.fmt(link_created),
+                self.fmt(link_created + datetime.timedelta(hours=24)), int(rng.random() < 0.9),
+            ))
+
+            if paypal_sub_id:
+                event = 'BILLING.SUBSCRIPTION.ACTIVATED' if recurring else 'PAYMENT.CAPTURE.COMPLETED'
+                rows['processed_payments'].append((paypal_sub_id, event, sub_id, link_created.strftime('%Y-%m-%d %H:%M:%S')))
+
+            # Renovaciones: un cobro por ciclo, unos minutos antes del vencimiento anterior
+            for renewal_index in range(renewals):
+                previous_end = start + cycle * (renewal_index + 1)
+                new_end = previous_end + cycle
+                renewal_date = previous_end - datetime.timedelta(minutes=rng.uniform(1, 120))
+                payment_id = f"SALE-{sub_id}-{renewal_index}"
+                rows['subscription_renewals'].append((
+                    sub_id, user_id, sub_plan, sub_price, self.fmt(previous_end), self.fmt(new_end),
+                    self.fmt(renewal_date), payment_id, 'COMPLETED',
+                ))
+                rows['processed_payments'].append((payment_id, 'PAYMENT.SALE.COMPLETED', sub_id,
+                                                   renewal_date.strftime('%Y-%m-%d %H:%M:%S')))
+                rows['renewal_notifications'].append((
+                    sub_id, user_id, (renewal_date - datetime.timedelta(minutes=10)).strftime('%Y-%m-%d %H:%M:%S'),
+                ))
+
+            # Expulsión al cerrar la suscripción
+            if status in ('EXPIRED', 'CANCELLED') and rng.random() < 0.6:
+                expelled_at = end + datetime.timedelta(hours=rng.uniform(0.1, 48))
+                if expelled_at < self.now:
+                    rows['expulsions'].append((
+                        user_id, rng.choice(EXPULSION_REASONS), expelled_at.strftime('%Y-%m-%d %H:%M:%S'),
+                    ))
+
+        return rows
+
+    def batches(self):
+        """Filas agrupadas en lotes de BATCH_SIZE usuarios"""
+        for batch_start in range(0, self.users, BATCH_SIZE):
+            batch = {table: [] for table in self.counts}
+            for user_index in range(batch_start, min(batch_start + BATCH_SIZE, self.users)):
+                for table, table_rows in self.user_rows(user_index).items():
+                    batch[table].extend(table_rows)
+            for table, table_rows in batch.items():
+                self.counts[table] += len(table_rows)
+            yield batch
+
+
+INSERTS = {
+    'users': 'INSERT INTO users (user_id, username, first_name, last_name, created_at) VALUES (?, ?, ?, ?, ?)',
+    'subscriptions': '''INSERT INTO subscriptions
+        (sub_id, user_id, plan, price_usd, start_date, end_date, status, paypal_sub_id, is_recurring)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+    'invite_links': '''INSERT INTO invite_links (sub_id, invite_link, created_at, expires_at, used)
+        VALUES (?, ?, ?, ?, ?)''',
+    'subscription_renewals': '''INSERT INTO subscription_renewals
+        (sub_id, user_id, plan, amount_usd, previous_end_date, new_end_date, renewal_date, payment_id, status)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+    'renewal_notifications': 'INSERT INTO renewal_notifications (sub_id, user_id, sent_date) VALUES (?, ?, ?)',
+    'expulsions': 'INSERT INTO expulsions (user_id, reason, date) VALUES (?, ?, ?)',
+    'processed_payments': '''INSERT OR IGNORE INTO processed_payments (payment_id, event_type, subscription_id, processed_at)
+        VALUES (?, ?, ?, ?)''',
+}
+
+
+def prepare_environment(db_path):
+    """config.py exige algunas variables; el esquema se crea en db_path"""
+    os.environ['DB_PATH'] = db_path
+    os.environ.setdefault('GROUP_CHAT_ID', '-1001234567890')
+    os.environ.setdefault('BOT_TOKEN', '700000001:benchmark-token')
+    os.environ.setdefault('LOG_LEVEL', 'CRITICAL')
+
+
+def generate(db_path, users, years=3, seed=1234, quiet=False):
+    """
+    Crea (o reemplaza) la base de datos sintética en db_path.
+
+    Returns:
+        dict: filas por tabla, reparto de estados finales y segundos empleados
+    """
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    prepare_environment(db_path)
+
+    import database as db  # init_db() crea el esquema al importar
+    from config import SUBSCRIPTION_GRACE_PERIOD_HOURS
+    if db.DB_PATH != db_path:
+        db.DB_PATH = db_path
+        db.init_db()
+
+    started = time.perf_counter()
+    builder = DatasetBuilder(users, years, seed, SUBSCRIPTION_GRACE_PERIOD_HOURS)
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+        for batch in builder.batches():
+            with conn:
+                for table, table_rows in batch.items():
+                    if table_rows:
+                        conn.executemany(INSERTS[table], table_rows)
+            if not quiet:
+                print(f"  {builder.counts['users']:>9} usuarios, {builder.counts['subscriptions']:>9} suscripciones", flush=True)
+    finally:
+        conn.close()
+    # Los triggers de estadísticas crearon horas de todo el historial; solo se guardan las recientes
+    db.prune_stats_hourly()
+
+    # Los triggers intercalan páginas de estadísticas con las de las tablas: VACUUM deja
+    # la base compacta (como la de la línea base) y ANALYZE da estadísticas al planificador
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute('VACUUM')
+        conn.execute('ANALYZE')
+    finally:
+        conn.close()
+
+    return {
+        'path': db_path,
+        'users': users,
+        'years': years,
+        'seed': seed,
+        'rows': builder.counts,
+        'final_states': builder.final_states,
+        'seconds': round(time.perf_counter() - started, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=parse_size, default=SIZES['10k'], help="10k, 100k, 1m o un número de usuarios")
+    parser.add_argument('--years', type=int, default=3, help="Años de historial")
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--output', help="Ruta de la base de datos (por defecto benchmarks/data/users_<tamaño>.db)")
+    args = parser.parse_args()
+
+    label = next((name for name, value in SIZES.items() if value == args.size), str(args.size))
+    output = args.output or os.path.join(DATA_DIR, f"users_{label}.db")
+    print(f"Generando {args.size} usuarios ({args.years} años de historial) en {output}")
+    summary = generate(output, args.size, args.years, args.seed)
+
+    print(f"\nListo en {summary['seconds']} s")
+    for table, count in summary['rows'].items():
+        print(f"  {table:<24} {count:>10}")
+    print("  Estado de la última suscripción: " +
+          ", ".join(f"{state}={count or 0}" for state, count in summary['final_states'].items()))
+
+
+if __name__ == '__main__':
+    main()
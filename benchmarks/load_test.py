@@ -0,0 +1,393 @@
+"""
+Prueba de carga del servidor Flask con tráfico sintético de Telegram y PayPal.
+
+Genera actualizaciones realistas (/start, callbacks de planes y de pago,
+entradas al grupo VIP) y webhooks de PayPal (PAYMENT.SALE.COMPLETED,
+BILLING.SUBSCRIPTION.CANCELLED) y los envía a app.app, ya sea con el test
+client de Flask (en proceso) o contra un servidor HTTP local. Telegram y
+PayPal se sustituyen por los stubs de benchmarks/stubs.py (con latencia,
+errores y 429 configurables) y la base de datos es un archivo temporal con
+usuarios y suscripciones sembrados.
+
+Informa, por ruta, del throughput y de la latencia p50/p95/p99, y del ritmo
+al que los workers del webhook terminan de procesar las actualizaciones.
+
+Uso:
+    python benchmarks/load_test.py --requests 2000 --concurrency 8
+    python benchmarks/load_test.py --mode http --mix start=50,join=30,sale=20 --json resultado.json
+    python benchmarks/load_test.py --stub-latency-ms 80 --stub-rate-limit-per-second 30
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks import stubs  # noqa: E402
+
+DEFAULT_MIX = 'start=35,plan=20,payment=5,join=20,sale=15,cancel=5'
+GROUP_CHAT_ID = -1001234567890
+BOT_TOKEN = '700000001:load-test-token'
+ADMIN_ID = 42
+
+
+def parse_mix(value):
+    """'start=35,join=20' -> [('start', 35), ('join', 20)]"""
+    mix = []
+    for item in value.split(','):
+        name, weight = item.split('=', 1)
+        if name.strip() not in EVENT_BUILDERS:
+            raise argparse.ArgumentTypeError(f"Tipo de evento desconocido: {name}")
+        mix.append((name.strip(), float(weight)))
+    return mix
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class TrafficGenerator:
+    """Construye peticiones sintéticas sobre una población de usuarios sembrada"""
+
+    def __init__(self, users, subscribed_fraction, seed):
+        self.random = random.Random(seed)
+        self.users = list(range(5_000_000_000, 5_000_000_000 + users))
+        self.subscribed = self.users[:int(users * subscribed_fraction)]
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._payment_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _next(self, counter):
+        with self._lock:
+            return next(counter)
+
+    def _user(self, user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f"Carga{user_id % 1000}", 'username': f"load{user_id}"}
+
+    def _message(self, user_id, chat, **fields):
+        message = {
+            'message_id': self._next(self._message_ids),
+            'from': self._user(user_id),
+            'chat': chat,
+            'date': int(time.time()),
+        }
+        message.update(fields)
+        return message
+
+    def _telegram(self, label, payload):
+        payload['update_id'] = self._next(self._update_ids)
+        return label, f"/webhook/{BOT_TOKEN}", payload
+
+    def start(self):
+        user_id = self.random.choice(self.users)
+        chat = {'id': user_id, 'type': 'private', 'first_name': 'Carga'}
+        return self._telegram('telegram:/start', {'message': self._message(
+            user_id, chat, text='/start', entities=[{'type': 'bot_command', 'offset': 0, 'length': 6}])})
+
+    def _callback(self, label, data):
+        user_id = self.random.choice(self.users)
+        chat = {'id': user_id, 'type': 'private', 'first_name': 'Carga'}
+        message = self._message(user_id, chat, text='menú')
+        message['from'] = {'id': int(BOT_TOKEN.split(':')[0]), 'is_bot': True, 'first_name': 'Bot'}
+        return self._telegram(label, {'callback_query': {
+            'id': str(self._next(self._update_ids)),
+            'from': self._user(user_id),
+            'message': message,
+            'chat_instance': str(user_id),
+            'data': data,
+        }})
+
+    def plan(self):
+        return self._callback('telegram:plan_callback', self.random.choice(['view_plans', 'weekly_plan', 'monthly_plan']))
+
+    def payment(self):
+        return self._callback('telegram:payment_callback', f"payment_paypal_{self.random.choice(['weekly', 'monthly'])}")
+
+    def join(self):
+        # Sobre todo usuarios con suscripción; una parte sin ella (expulsión)
+        pool = self.subscribed if self.subscribed and self.random.random() < 0.8 else self.users
+        user_id = self.random.choice(pool)
+        chat = {'id': GROUP_CHAT_ID, 'type': 'supergroup', 'title': 'VIP'}
+        return self._telegram('telegram:join', {'message': self._message(
+            user_id, chat, new_chat_members=[self._user(user_id)])})
+
+    def _paypal(self, label, event_type, resource):
+        return label, '/webhook/paypal', {
+            'id': f"WH-{self._next(self._payment_ids)}",
+            'event_type': event_type,
+            'resource': resource,
+        }
+
+    def sale(self):
+        index = self.random.randrange(len(self.subscribed)) if self.subscribed else 0
+        return self._paypal('paypal:PAYMENT.SALE.COMPLETED', 'PAYMENT.SALE.COMPLETED', {
+            'id': f"SALE-{self._next(self._payment_ids)}",
+            'billing_agreement_id': f"I-LOAD{index}",
+            'amount': {'total': '3.50', 'currency': 'USD'},
+        })
+
+    def cancel(self):
+        index = self.random.randrange(len(self.subscribed)) if self.subscribed else 0
+        return self._paypal('paypal:BILLING.SUBSCRIPTION.CANCELLED', 'BILLING.SUBSCRIPTION.CANCELLED', {
+            'id': f"I-LOAD{index}",
+        })
+
+
+EVENT_BUILDERS = {
+    'start': TrafficGenerator.start,
+    'plan': TrafficGenerator.plan,
+    'payment': TrafficGenerator.payment,
+    'join': TrafficGenerator.join,
+    'sale': TrafficGenerator.sale,
+    'cancel': TrafficGenerator.cancel,
+}
+
+
+def configure_environment(args, stub_environment):
+    """Variables de entorno de la app bajo prueba (antes de importar config)"""
+    db_dir = tempfile.mkdtemp(prefix='subsbot-load-')
+    os.environ.update(stub_environment)
+    defaults = {
+        'BOT_TOKEN': BOT_TOKEN,
+        'GROUP_CHAT_ID': str(GROUP_CHAT_ID),
+        'ADMIN_IDS': str(ADMIN_ID),
+        'WEBHOOK_URL': 'http://127.0.0.1',
+        'PAYPAL_CLIENT_ID': 'load-test-client-id',
+        'PAYPAL_CLIENT_SECRET': 'load-test-client-secret',
+        'DB_PATH': args.db or os.path.join(db_dir, 'vip_bot.db'),
+        'SCHEDULER_ENABLED': 'false',
+        'LOG_LEVEL': args.log_level,
+        'LOG_FORMAT': 'text',
+    }
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+    if args.workers:
+        os.environ['WEBHOOK_WORKERS'] = str(args.workers)
+    os.environ['WEBHOOK_QUEUE_SIZE'] = str(max(args.requests, 1000))
+
+
+def seed_database(generator):
+    """Usuarios con suscripción activa (paypal_sub_id I-LOAD<n>) creada hace 10 días"""
+    import datetime
+    import database as db
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    for index, user_id in enumerate(generator.subscribed):
+        db.save_user(user_id, f"load{user_id}", "Carga")
+        db.create_subscription(user_id, 'monthly', 10.0, now - datetime.timedelta(days=10),
+                               now + datetime.timedelta(days=20), 'ACTIVE', f"I-LOAD{index}", True)
+
+
+def build_requests(generator, mix, total):
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    return [EVENT_BUILDERS[name](generator) for name in generator.random.choices(names, weights, k=total)]
+
+
+class InProcessClient:
+    """Envía con el test client de Flask (uno por hilo)"""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self._local = threading.local()
+
+    def post(self, path, payload):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.flask_app.test_client()
+        return client.post(path, data=json.dumps(payload), content_type='application/json').status_code
+
+
+class HttpClient:
+    """Envía por HTTP a un servidor werkzeug multihilo levantado en un puerto local"""
+
+    def __init__(self, flask_app):
+        import requests
+        from werkzeug.serving import make_server
+
+        self._requests = requests
+        self.server = make_server('127.0.0.1', 0, flask_app, threaded=True)
+        threading.Thread(target=self.server.serve_forever, name="load-test-http", daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+        self._local = threading.local()
+
+    def post(self, path, payload):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+        return session.post(self.base_url + path, json=payload).status_code
+
+
+def run_load(client, requests_to_send, concurrency):
+    """Envía las peticiones desde N hilos. Devuelve (resultados por ruta, duración)"""
+    results = defaultdict(list)  # ruta -> [(latencia, status)]
+    results_lock = threading.Lock()
+    queue_iter = iter(requests_to_send)
+    iter_lock = threading.Lock()
+
+    def worker():
+        local = defaultdict(list)
+        while True:
+            with iter_lock:
+                item = next(queue_iter, None)
+            if item is None:
+                break
+            label, path, payload = item
+            started = time.perf_counter()
+            try:
+                status = client.post(path, payload)
+            except Exception:
+                status = 'exception'
+            local[label].append((time.perf_counter() - started, status))
+        with results_lock:
+            for label, samples in local.items():
+                results[label].extend(samples)
+
+    threads = [threading.Thread(target=worker, name=f"load-client-{i}") for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started
+
+
+def wait_for_drain(dispatcher, timeout):
+    """Espera a que los workers del webhook vacíen la cola. Devuelve True si lo logran"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = dispatcher.get_stats()
+        if stats['queue_depth'] == 0 and stats['active_workers'] == 0:
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def summarize(results, elapsed):
+    routes = []
+    for label in sorted(results):
+        samples = results[label]
+        latencies = [latency for latency, _ in samples]
+        errors = sum(1 for _, status in samples if status == 'exception' or not 200 <= status < 300)
+        routes.append({
+            'route': label,
+            'count': len(samples),
+            'errors': errors,
+            'throughput_rps': round(len(samples) / elapsed, 1) if elapsed else None,
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+            'max_ms': round(max(latencies) * 1000, 2),
+        })
+    return routes
+
+
+def print_report(report):
+    print(f"\nModo: {report['mode']} | Concurrencia: {report['concurrency']} | "
+          f"Peticiones: {report['requests']} en {report['elapsed_seconds']} s "
+          f"({report['throughput_rps']} req/s)")
+    header = f"{'ruta':<40} {'n':>6} {'err':>5} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    print(header)
+    print('-' * len(header))
+    for route in report['routes']:
+        print(f"{route['route']:<40} {route['count']:>6} {route['errors']:>5} {route['throughput_rps']:>8} "
+              f"{route['p50_ms']:>9} {route['p95_ms']:>9} {route['p99_ms']:>9} {route['max_ms']:>9}")
+
+    workers = report['webhook_workers']
+    print(f"\nWorkers del webhook: {workers['workers']} | procesadas: {workers['processed']} "
+          f"(errores: {workers['errors']}, rechazadas: {workers['rejected']}) en {workers['drain_seconds']} s "
+          f"-> {workers['updates_per_second']} actualizaciones/s"
+          + ("" if workers['drained'] else " [la cola no se vació a tiempo]"))
+    print(f"Procesamiento por actualización: p50 {workers['processing']['p50_ms']} ms, "
+          f"p95 {workers['processing']['p95_ms']} ms (últimas {workers['processing']['count']})")
+    print(f"Llamadas a Telegram: {sum(report['stub_calls']['telegram'].values())} "
+          f"(fallos inyectados: {sum(report['stub_injected']['telegram'].values())}) | "
+          f"a PayPal: {sum(report['stub_calls']['paypal'].values())} "
+          f"(fallos inyectados: {sum(report['stub_injected']['paypal'].values())})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de los webhooks de Telegram y PayPal")
+    parser.add_argument('--requests', type=int, default=2000, help="Peticiones a enviar")
+    parser.add_argument('--concurrency', type=int, default=8, help="Hilos cliente en paralelo")
+    parser.add_argument('--mode', choices=('client', 'http'), default='client',
+                        help="client: test client de Flask en proceso; http: servidor HTTP local")
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX, help=f"Pesos por tipo de evento (por defecto {DEFAULT_MIX})")
+    parser.add_argument('--users', type=int, default=2000, help="Tamaño de la población de usuarios")
+    parser.add_argument('--subscribed', type=float, default=0.5, help="Fracción de usuarios con suscripción activa")
+    parser.add_argument('--workers', type=int, help="WEBHOOK_WORKERS de la app (por defecto el de config)")
+    parser.add_argument('--db', help="Base de datos a usar (por defecto un archivo temporal nuevo)")
+    parser.add_argument('--drain-timeout', type=float, default=120, help="Segundos máximos esperando a los workers")
+    parser.add_argument('--seed', type=int, default=1, help="Semilla del generador de tráfico")
+    parser.add_argument('--log-level', default='ERROR', help="LOG_LEVEL de la app durante la prueba")
+    parser.add_argument('--json', help="Guardar el informe en este archivo")
+    stubs.add_behavior_arguments(parser, prefix='stub-')
+    args = parser.parse_args()
+    if isinstance(args.mix, str):
+        args.mix = parse_mix(args.mix)
+
+    # Los stubs se arrancan antes de importar app, que al arrancar ya habla con ambas APIs
+    telegram_stub, paypal_stub = stubs.start_stubs(seed=args.seed, **stubs.behavior_from_args(args, prefix='stub-'))
+    configure_environment(args, stubs.environment_for(telegram_stub, paypal_stub))
+
+    import app
+
+    generator = TrafficGenerator(args.users, args.subscribed, args.seed)
+    seed_database(generator)
+    requests_to_send = build_requests(generator, args.mix, args.requests)
+
+    client = HttpClient(app.app) if args.mode == 'http' else InProcessClient(app.app)
+    dispatcher = app.update_dispatcher
+    before = dispatcher.get_stats()['counters']
+
+    load_started = time.perf_counter()
+    results, elapsed = run_load(client, requests_to_send, args.concurrency)
+    drained = wait_for_drain(dispatcher, args.drain_timeout)
+    # Desde el primer envío hasta que los workers terminan la última actualización
+    drain_seconds = round(time.perf_counter() - load_started, 3)
+    stats = dispatcher.get_stats()
+
+    processed = stats['counters']['processed'] - before['processed']
+    total = sum(len(samples) for samples in results.values())
+    report = {
+        'mode': args.mode,
+        'concurrency': args.concurrency,
+        'requests': total,
+        'elapsed_seconds': round(elapsed, 3),
+        'throughput_rps': round(total / elapsed, 1) if elapsed else None,
+        'routes': summarize(results, elapsed),
+        'webhook_workers': {
+            'workers': stats['workers'],
+            'processed': processed,
+            'errors': stats['counters']['errors'] - before['errors'],
+            'rejected': stats['counters']['rejected'] - before['rejected'],
+            'drained': drained,
+            'drain_seconds': drain_seconds,
+            'updates_per_second': round(processed / drain_seconds, 1) if drain_seconds else None,
+            'processing': stats['processing'],
+        },
+        'stub_calls': {'telegram': dict(telegram_stub.calls), 'paypal': dict(paypal_stub.calls)},
+        'stub_injected': {'telegram': telegram_stub.stats()['injected'], 'paypal': paypal_stub.stats()['injected']},
+    }
+
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
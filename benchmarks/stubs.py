@@ -0,0 +1,517 @@
+"""
+Servidores HTTP locales que imitan la API de Bot de Telegram y la API REST de
+PayPal, para pruebas de rendimiento sin red.
+
+Cubren los endpoints que usa el bot:
+- Telegram: getMe, getChat, getChatMember, banChatMember, unbanChatMember,
+  sendMessage, sendPhoto, editMessageText, deleteMessage, answerCallbackQuery,
+  createChatInviteLink, getUserProfilePhotos, getFile y los del webhook.
+- PayPal: oauth2/token, catalogs/products, billing/plans,
+  billing/subscriptions (crear, consultar, cancelar) y checkout/orders
+  (crear, consultar, capturar).
+
+Guardan el estado mínimo para simular el grupo y los pagos: la membresía de
+cada usuario en el grupo (getChatMember responde 'member' salvo que el
+usuario haya sido expulsado o se haya configurado otro estado con
+set_member_status) y el estado de las suscripciones de PayPal (ACTIVE salvo
+que se cambie con set_subscription_status o se cancelen). Toda orden
+consultada aparece como aprobada o completada. Se puede inyectar latencia (con variación), errores 5xx y
+respuestas 429, de forma global o por método/endpoint, y limitar las
+peticiones por segundo como hace Telegram. El comportamiento se cambia en
+caliente con POST /_stub/config y las llamadas se consultan en GET /_stub/stats.
+
+Para apuntar el bot a los stubs basta con definir TELEGRAM_API_URL y
+PAYPAL_API_URL con las URLs que imprime:
+
+    python benchmarks/stubs.py --latency-ms 80 --jitter-ms 40 --rate-limit-per-second 30
+"""
+import argparse
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+_ids = itertools.count(1000)
+
+# Segmentos de ruta de PayPal que son IDs (para agrupar las llamadas por endpoint)
+_PAYPAL_ID_SEGMENT = re.compile(r'^(?![a-z][a-z0-9_-]*$).+$')
+
+DEFAULT_BEHAVIOR = {
+    'latency_ms': 0.0,             # Retardo de cada respuesta
+    'jitter_ms': 0.0,              # Variación aleatoria añadida (0..jitter_ms)
+    'error_rate': 0.0,             # Fracción de respuestas 500
+    'rate_limit_rate': 0.0,        # Fracción de respuestas 429
+    'rate_limit_per_second': 0.0,  # Límite de peticiones por segundo (0: sin límite); el exceso recibe 429
+    'retry_after': 1,              # Segundos indicados en las respuestas 429
+}
+
+
+class StubBehavior:
+    """Latencia y fallos inyectados, con valores por defecto y por endpoint"""
+
+    def __init__(self, seed=None, **defaults):
+        self.random = random.Random(seed)
+        self.defaults = dict(DEFAULT_BEHAVIOR)
+        self.overrides = {}
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self.update(defaults)
+
+    def update(self, values, endpoint=None):
+        """Cambia el comportamiento global o el de un endpoint concreto"""
+        unknown = set(values) - set(DEFAULT_BEHAVIOR)
+        if unknown:
+            raise ValueError(f"Opciones desconocidas: {', '.join(sorted(unknown))}")
+        with self._lock:
+            target = self.defaults if endpoint is None else self.overrides.setdefault(endpoint, {})
+            target.update({name: type(DEFAULT_BEHAVIOR[name])(value) for name, value in values.items()})
+
+    def for_endpoint(self, endpoint):
+        with self._lock:
+            return dict(self.defaults, **self.overrides.get(endpoint, {}))
+
+    def _over_rate_limit(self, per_second):
+        """Ventana fija de un segundo compartida por todos los endpoints del servidor"""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_start >= 1:
+                self._window_start = now
+                self._window_count = 0
+            self._window_count += 1
+            return self._window_count > per_second
+
+    def decide(self, endpoint):
+        """Devuelve (resultado, segundos de espera, retry_after) para una petición"""
+        config = self.for_endpoint(endpoint)
+        with self._lock:
+            delay = (config['latency_ms'] + self.random.uniform(0, config['jitter_ms'])) / 1000
+            roll = self.random.random()
+
+        if config['rate_limit_per_second'] and self._over_rate_limit(config['rate_limit_per_second']):
+            return 'rate_limited', delay, config['retry_after']
+        if roll < config['rate_limit_rate']:
+            return 'rate_limited', delay, config['retry_after']
+        if roll < config['rate_limit_rate'] + config['error_rate']:
+            return 'error', delay, None
+        return 'ok', delay, None
+
+    def describe(self):
+        with self._lock:
+            return {'defaults': dict(self.defaults), 'overrides': {k: dict(v) for k, v in self.overrides.items()}}
+
+
+def _user(user_id, is_bot=False, first_name="Stub", username=None):
+    data = {'id': user_id, 'is_bot': is_bot, 'first_name': first_name}
+    if username:
+        data['username'] = username
+    return data
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Cabeceras y cuerpo van en escrituras separadas: sin TCP_NODELAY, el ACK
+    # retardado añade ~40 ms a cada respuesta en conexiones keep-alive
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_params(self):
+        """Parámetros de la query string y del cuerpo (JSON o formulario)"""
+        path, _, query = self.path.partition('?')
+        params = dict(parse_qsl(query))
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        content_type = self.headers.get('Content-Type', '')
+        try:
+            if 'json' in content_type and body:
+                params.update(json.loads(body))
+            elif 'x-www-form-urlencoded' in content_type and body:
+                params.update(parse_qsl(body.decode('utf-8')))
+        except ValueError:
+            pass
+        return path.rstrip('/'), params
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle_control(self, path, params):
+        """/_stub/stats, /_stub/config y /_stub/reset"""
+        server = self.server
+        if path == '/_stub/stats':
+            self._send_json(200, server.stats())
+        elif path == '/_stub/config' and self.command == 'POST':
+            try:
+                values = {k: v for k, v in params.items() if k != 'endpoint'}
+                server.behavior.update(values, params.get('endpoint'))
+            except (ValueError, TypeError) as e:
+                self._send_json(400, {'error': str(e)})
+                return
+            self._send_json(200, server.behavior.describe())
+        elif path == '/_stub/config':
+            self._send_json(200, server.behavior.describe())
+        elif path == '/_stub/reset' and self.command == 'POST':
+            server.reset()
+            self._send_json(200, {'reset': True})
+        else:
+            self._send_json(404, {'error': 'Not Found'})
+
+    def _handle(self):
+        path, params = self._read_params()
+        if path.startswith('/_stub/'):
+            self._handle_control(path, params)
+            return
+
+        endpoint = self.endpoint_name(path)
+        if endpoint is None:
+            self._send_json(404, self.not_found_payload(path))
+            return
+
+        outcome, delay, retry_after = self.server.behavior.decide(endpoint)
+        if delay:
+            time.sleep(delay)
+        self.server.record(endpoint, outcome)
+
+        if outcome == 'rate_limited':
+            self._send_json(429, self.rate_limited_payload(retry_after), {'Retry-After': retry_after})
+        elif outcome == 'error':
+            self._send_json(500, self.error_payload())
+        else:
+            status, payload = self.result(endpoint, path, params)
+            self._send_json(status, payload)
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    # A implementar por cada API
+    def endpoint_name(self, path):
+        raise NotImplementedError
+
+    def result(self, endpoint, path, params):
+        raise NotImplementedError
+
+    def not_found_payload(self, path):
+        return {'error': 'Not Found'}
+
+    def rate_limited_payload(self, retry_after):
+        return {'error': 'Too Many Requests'}
+
+    def error_payload(self):
+        return {'error': 'Internal Server Error'}
+
+
+class TelegramHandler(_StubHandler):
+    """/bot<token>/<método>: el endpoint es el nombre del método"""
+
+    def endpoint_name(self, path):
+        parts = path.strip('/').split('/')
+        if len(parts) != 2 or not parts[0].startswith('bot'):
+            return None
+        token = parts[0][3:]
+        prefix = token.split(':', 1)[0]
+        self.bot_id = int(prefix) if prefix.isdigit() else 1
+        return parts[1]
+
+    def not_found_payload(self, path):
+        return {'ok': False, 'error_code': 404, 'description': 'Not Found'}
+
+    def rate_limited_payload(self, retry_after):
+        return {'ok': False, 'error_code': 429, 'description': f"Too Many Requests: retry after {retry_after}",
+                'parameters': {'retry_after': retry_after}}
+
+    def error_payload(self):
+        return {'ok': False, 'error_code': 500, 'description': 'Internal Server Error'}
+
+    def _message(self, params):
+        chat_id = params.get('chat_id', 1)
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            pass
+        return {'message_id': int(params.get('message_id') or next(_ids)), 'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private' if isinstance(chat_id, int) and chat_id > 0 else 'supergroup'},
+                'text': params.get('text', '')}
+
+    def result(self, method, path, params):
+        bot_id = self.bot_id
+        if method == 'getMe':
+            result = dict(_user(bot_id, is_bot=True, first_name="Bot", username="stub_bot"),
+                          can_join_groups=True, can_read_all_group_messages=False, supports_inline_queries=False)
+        elif method in ('sendMessage', 'editMessageText', 'sendPhoto', 'editMessageReplyMarkup', 'editMessageCaption'):
+            result = self._message(params)
+        elif method == 'getChatMember':
+            user_id = int(params.get('user_id') or 0)
+            if user_id == bot_id:
+                result = {'status': 'administrator', 'user': _user(bot_id, is_bot=True),
+                          'can_be_edited': False, 'is_anonymous': False, 'can_manage_chat': True,
+                          'can_delete_messages': True, 'can_manage_video_chats': False, 'can_restrict_members': True,
+                          'can_promote_members': False, 'can_change_info': False, 'can_invite_users': True}
+            else:
+                result = {'status': self.server.state.member_status(user_id), 'user': _user(user_id)}
+        elif method == 'createChatInviteLink':
+            result = {'invite_link': f"https://t.me/+stub{next(_ids)}", 'creator': _user(bot_id, is_bot=True),
+                      'creates_join_request': False, 'is_primary': False, 'is_revoked': False,
+                      'member_limit': int(params.get('member_limit') or 1)}
+        elif method == 'getChat':
+            chat_id = int(params.get('chat_id') or 1)
+            result = {'id': chat_id, 'type': 'private' if chat_id > 0 else 'supergroup', 'first_name': 'Stub'}
+        elif method == 'getUserProfilePhotos':
+            result = {'total_count': 0, 'photos': []}
+        elif method == 'getFile':
+            result = {'file_id': params.get('file_id', ''), 'file_unique_id': 'stub', 'file_path': 'photos/stub.jpg'}
+        elif method in ('banChatMember', 'kickChatMember'):
+            self.server.state.set_member(int(params.get('user_id') or 0), 'kicked')
+            result = True
+        elif method == 'unbanChatMember':
+            user_id = int(params.get('user_id') or 0)
+            only_if_banned = str(params.get('only_if_banned', '')).lower() in ('true', '1')
+            if not only_if_banned or self.server.state.member_status(user_id) == 'kicked':
+                self.server.state.set_member(user_id, 'left')
+            result = True
+        elif method == 'getWebhookInfo':
+            result = {'url': '', 'has_custom_certificate': False, 'pending_update_count': 0}
+        else:
+            # answerCallbackQuery, deleteMessage, setWebhook, deleteWebhook...
+            result = True
+        return 200, {'ok': True, 'result': result}
+
+
+class PayPalHandler(_StubHandler):
+    """Endpoints de la API REST de PayPal que usa payments.py ('MÉTODO /ruta/{id}')"""
+
+    def endpoint_name(self, path):
+        segments = path.strip('/').split('/')
+        self.segments = segments
+        return f"{self.command} /" + '/'.join('{id}' if _PAYPAL_ID_SEGMENT.match(s) else s for s in segments)
+
+    def not_found_payload(self, path):
+        return {'name': 'RESOURCE_NOT_FOUND', 'message': path}
+
+    def rate_limited_payload(self, retry_after):
+        return {'name': 'RATE_LIMIT_REACHED', 'message': 'Too many requests. Blocked due to rate limiting.'}
+
+    def error_payload(self):
+        return {'name': 'INTERNAL_SERVICE_ERROR', 'message': 'An internal service error occurred.'}
+
+    def _approve_link(self, resource_id):
+        host = self.headers.get('Host', 'localhost')
+        return [{'rel': 'approve', 'href': f"http://{host}/checkoutnow?token={resource_id}", 'method': 'GET'}]
+
+    def result(self, endpoint, path, params):
+        segments = self.segments
+        if endpoint == 'POST /v1/oauth2/token':
+            return 200, {'access_token': f"stub-token-{next(_ids)}", 'token_type': 'Bearer', 'expires_in': 32400}
+        if endpoint == 'GET /v1/catalogs/products':
+            return 200, {'products': [{'id': 'PROD-STUB', 'name': 'Grupo VIP'}]}
+        if endpoint == 'POST /v1/catalogs/products':
+            return 201, {'id': f"PROD-{next(_ids)}", 'name': params.get('name', 'Grupo VIP')}
+        if endpoint == 'GET /v1/billing/plans':
+            return 200, {'plans': []}
+        if endpoint == 'POST /v1/billing/plans':
+            return 201, {'id': f"P-{next(_ids)}", 'status': 'ACTIVE', 'product_id': params.get('product_id')}
+        if endpoint == 'POST /v1/billing/subscriptions':
+            subscription_id = f"I-{next(_ids)}"
+            return 201, {'id': subscription_id, 'status': 'APPROVAL_PENDING', 'links': self._approve_link(subscription_id)}
+        if endpoint == 'GET /v1/billing/subscriptions/{id}':
+            return 200, {'id': segments[-1], 'status': self.server.state.subscription_status(segments[-1]), 'plan_id': 'P-STUB'}
+        if endpoint == 'POST /v1/billing/subscriptions/{id}/cancel':
+            self.server.state.set_subscription(segments[-2], 'CANCELLED')
+            return 204, {}
+        if endpoint == 'POST /v2/checkout/orders':
+            order_id = f"O-{next(_ids)}"
+            return 201, {'id': order_id, 'status': 'CREATED', 'links': self._approve_link(order_id)}
+        if endpoint == 'GET /v2/checkout/orders/{id}':
+            return 200, {'id': segments[-1], 'status': 'APPROVED'}
+        if endpoint == 'POST /v2/checkout/orders/{id}/capture':
+            return 201, {'id': segments[-2], 'status': 'COMPLETED'}
+        return 404, self.not_found_payload(path)
+
+
+class StubState:
+    """Membresía del grupo simulado y estado de las suscripciones de PayPal"""
+
+    def __init__(self, default_member_status='member', default_subscription_status='ACTIVE'):
+        self.default_member_status = default_member_status
+        self.default_subscription_status = default_subscription_status
+        self.members = {}
+        self.subscriptions = {}
+        self.kicks = Counter()  # Expulsiones recibidas por usuario
+        self._lock = threading.Lock()
+
+    def member_status(self, user_id):
+        with self._lock:
+            return self.members.get(user_id, self.default_member_status)
+
+    def set_member(self, user_id, status):
+        with self._lock:
+            self.members[user_id] = status
+            if status == 'kicked':
+                self.kicks[user_id] += 1
+
+    def subscription_status(self, subscription_id):
+        with self._lock:
+            return self.subscriptions.get(subscription_id, self.default_subscription_status)
+
+    def set_subscription(self, subscription_id, status):
+        with self._lock:
+            self.subscriptions[subscription_id] = status
+
+    def clear(self):
+        with self._lock:
+            self.members.clear()
+            self.subscriptions.clear()
+            self.kicks.clear()
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, handler, behavior):
+        super().__init__(address, handler)
+        self.behavior = behavior
+        self.state = StubState()
+        self.calls = Counter()
+        self.outcomes = Counter()
+        self._stats_lock = threading.Lock()
+
+    def record(self, endpoint, outcome):
+        with self._stats_lock:
+            self.calls[endpoint] += 1
+            if outcome != 'ok':
+                self.outcomes[f"{endpoint} {outcome}"] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            return {'calls': dict(self.calls), 'injected': dict(self.outcomes), 'total': sum(self.calls.values())}
+
+    def reset(self):
+        with self._stats_lock:
+            self.calls.clear()
+            self.outcomes.clear()
+        self.state.clear()
+
+
+class StubServer:
+    """Servidor de stubs en un hilo daemon (puerto 0: el sistema elige uno libre)"""
+
+    def __init__(self, handler, host='127.0.0.1', port=0, behavior=None):
+        self.behavior = behavior or StubBehavior()
+        self.httpd = _StubHTTPServer((host, port), handler, self.behavior)
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def calls(self):
+        return self.httpd.calls
+
+    @property
+    def state(self):
+        return self.httpd.state
+
+    def stats(self):
+        return self.httpd.stats()
+
+    def set_member_status(self, user_id, status):
+        """Estado del usuario en el grupo simulado ('member', 'left', 'kicked'...)"""
+        self.state.set_member(user_id, status)
+
+    def set_subscription_status(self, subscription_id, status):
+        """Estado que devolverá PayPal para una suscripción ('ACTIVE', 'CANCELLED', 'EXPIRED'...)"""
+        self.state.set_subscription(subscription_id, status)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="stub-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def start_stubs(host='127.0.0.1', telegram_port=0, paypal_port=0, seed=None, **behavior):
+    """Arranca ambos stubs con el mismo comportamiento inicial. Devuelve (telegram, paypal)"""
+    telegram = StubServer(TelegramHandler, host, telegram_port, StubBehavior(seed, **behavior)).start()
+    paypal = StubServer(PayPalHandler, host, paypal_port, StubBehavior(seed, **behavior)).start()
+    return telegram, paypal
+
+
+def environment_for(telegram, paypal):
+    """Variables de entorno que apuntan el bot a los stubs"""
+    return {'TELEGRAM_API_URL': telegram.url, 'PAYPAL_API_URL': paypal.url}
+
+
+def _parse_override(value):
+    """'banChatMember:latency_ms=300,error_rate=0.1' -> ('banChatMember', {...})"""
+    endpoint, _, options = value.partition(':')
+    values = dict(item.split('=', 1) for item in options.split(',') if '=' in item)
+    return endpoint, values
+
+
+def add_behavior_arguments(parser, prefix=''):
+    """Opciones de latencia y fallos (compartidas con load_test.py)"""
+    parser.add_argument(f'--{prefix}latency-ms', type=float, default=0, help="Latencia de cada respuesta")
+    parser.add_argument(f'--{prefix}jitter-ms', type=float, default=0, help="Variación aleatoria de la latencia")
+    parser.add_argument(f'--{prefix}error-rate', type=float, default=0, help="Fracción de respuestas 500")
+    parser.add_argument(f'--{prefix}rate-limit-rate', type=float, default=0, help="Fracción de respuestas 429")
+    parser.add_argument(f'--{prefix}rate-limit-per-second', type=float, default=0,
+                        help="Peticiones por segundo antes de responder 429 (0: sin límite)")
+    parser.add_argument(f'--{prefix}retry-after', type=int, default=1, help="retry_after de las respuestas 429")
+
+
+def behavior_from_args(args, prefix=''):
+    prefix = prefix.replace('-', '_')
+    return {name: getattr(args, prefix + name) for name in DEFAULT_BEHAVIOR}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stubs locales de las APIs de Telegram y PayPal")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--telegram-port', type=int, default=8081)
+    parser.add_argument('--paypal-port', type=int, default=8082)
+    parser.add_argument('--seed', type=int, help="Semilla para que la inyección de fallos sea reproducible")
+    parser.add_argument('--override', action='append', default=[], type=_parse_override,
+                        help="Comportamiento de un endpoint, p. ej. banChatMember:latency_ms=300,rate_limit_rate=0.2 "
+                             "o 'POST /v2/checkout/orders:error_rate=0.5'")
+    add_behavior_arguments(parser)
+    args = parser.parse_args()
+
+    telegram, paypal = start_stubs(args.host, args.telegram_port, args.paypal_port, args.seed, **behavior_from_args(args))
+    for endpoint, values in args.override:
+        server = paypal if ' /' in endpoint else telegram
+        server.behavior.update(values, endpoint)
+
+    print("Stubs en marcha. Para apuntar el bot a ellos:")
+    for name, value in environment_for(telegram, paypal).items():
+        print(f"  export {name}={value}")
+    print("Estadísticas: GET /_stub/stats | Cambiar comportamiento: POST /_stub/config", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        telegram.stop()
+        paypal.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,21 @@ from telebot import types
 import database as db
 from config import ADMIN_IDS, PLANS, INVITE_LINK_EXPIRY_HOURS, INVITE_LINK_MEMBER_LIMIT, GROUP_INVITE_LINK, WEBHOOK_URL, GROUP_CHAT_ID, RECURRING_PAYMENTS_ENABLED
 import payments as pay
+from animations import animation_scheduler
+from scheduler import job_scheduler
+from health import health
+from runtime import runtime, get_bot_id
+import metrics
+import tracing
+import rollups
+import events
+import backups
+import retention
+import replica
+from config import (SECURITY_CHECK_INTERVAL_SECONDS, FAILED_EXPULSIONS_INTERVAL_SECONDS, RENEWAL_CHECK_CRON,
+                    SCHEDULER_JITTER_SECONDS, SECURITY_MAX_CONSECUTIVE_FAILURES, BOT_PERMISSIONS_CACHE_SECONDS,
+                    STATS_PRUNE_INTERVAL_SECONDS, ROLLUP_REFRESH_INTERVAL_SECONDS, WHITELIST_PAGE_SIZE, BACKUP_CRON,
+                    RETENTION_CRON, REPLICA_ENABLED, REPLICA_REFRESH_SECONDS, HEALTH_LONG_JOB_STALL_SECONDS)
 import datetime
 import threading
 import time
@@ -11,19 +26,15 @@ import os
 import re
 from typing import Dict, Optional, Tuple, Any
 
-# Configurar logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Logger del módulo (el pipeline de logging se configura en config.py)
 logger = logging.getLogger(__name__)
 
-global security_thread_running
-security_thread_running = False
+# Fallos consecutivos de la verificación periódica de seguridad
+security_failures_count = 0
 
 # admin_states será asignado desde app.py
 admin_states = None  # Será asignado desde app.py
 
-# Diccionario para almacenar las animaciones de pago en curso
-payment_animations = {}
-
 # Variables para seguimiento de suscripciones procesadas
 processed_cancelled_subs = set()  # Conjunto para almacenar IDs de suscripciones canceladas ya procesadas
 last_cleanup_time = datetime.datetime.now()  # Para limpiar periódicamente el conjunto
@@ -160,112 +171,124 @@ def create_invite_link(bot, user_id, sub_id):
 # Modificaciones a realizar en bot_handlers.py
 
 # 1. Agregar función para iniciar el proceso de verificación diaria de renovaciones
-def schedule_renewal_checks(bot):
-    """
-    Inicia un hilo separado para verificar renovaciones de suscripciones pendientes
+def run_renewal_check(bot):
+    """Tarea programada: procesa las renovaciones pendientes y avisa a los administradores si hay errores"""
+    logger.info("🔍 Iniciando verificación completa de renovaciones")
     
-    Args:
-        bot: Instancia del bot de Telegram
-        
-    Returns:
-        threading.Thread: Hilo iniciado para verificaciones
-    """
-    import threading
-    import time
-    import logging
-    import datetime
+    notified, errors = pay.process_subscription_renewals(bot)
     
-    logger = logging.getLogger(__name__)
+    logger.info(f"✅ Verificación de renovaciones completada: {notified} notificaciones enviadas, {errors} errores")
     
-    def renewal_check_thread():
-        """Función ejecutada en un hilo separado para verificar renovaciones periódicamente"""
-        # Indicador para saber si el hilo está activo
-        global renewal_thread_running
-        renewal_thread_running = True
-        
-        logger.info("🔄 HILO DE RENOVACIONES INICIADO - Verificación periódica activada")
-        
-        # Notificar a los administradores
-        from config import ADMIN_IDS
+    # Notificar a los administradores si hubo errores
+    if errors > 0:
         for admin_id in ADMIN_IDS:
             try:
                 bot.send_message(
                     chat_id=admin_id,
-                    text="🔄 Sistema de renovación automática iniciado: Se procesarán renovaciones diariamente."
+                    text=f"⚠️ Alerta: Se encontraron {errors} errores durante el procesamiento de renovaciones automáticas."
                 )
             except Exception:
-                pass  # Ignorar errores al notificar
-        
-        # Variable para rastrear la última fecha de verificación completa
-        last_full_check_date = None
-        
-        while renewal_thread_running:
-            try:
-                # Realizar verificaciones cada hora, pero procesamiento completo solo una vez al día
-                current_time = datetime.datetime.now()
-                
-                # Verificar si debemos hacer una verificación completa (cada 24 horas)
-                do_full_check = False
-                
-                if last_full_check_date is None:
-                    # Primera ejecución
-                    do_full_check = True
-                elif (current_time - last_full_check_date).total_seconds() >= 86400:  # 24 horas
-                    # Han pasado 24 horas desde la última verificación
-                    do_full_check = True
-                
-                if do_full_check:
-                    logger.info("🔍 Iniciando verificación completa de renovaciones")
-                    
-                    # Importar función de procesamiento
-                    import payments as pay
-                    
-                    # Procesar renovaciones
-                    notified, errors = pay.process_subscription_renewals(bot)
-                    
-                    logger.info(f"✅ Verificación de renovaciones completada: {notified} notificaciones enviadas, {errors} errores")
-                    
-                    # Actualizar fecha de última verificación
-                    last_full_check_date = current_time
-                    
-                    # Notificar a los administradores si hubo errores
-                    if errors > 0:
-                        from config import ADMIN_IDS
-                        for admin_id in ADMIN_IDS:
-                            try:
-                                bot.send_message(
-                                    chat_id=admin_id,
-                                    text=f"⚠️ Alerta: Se encontraron {errors} errores durante el procesamiento de renovaciones automáticas."
-                                )
-                            except Exception:
-                                pass
-                else:
-                    # En verificaciones no completas, solo registrar actividad
-                    logger.info("Hilo de renovaciones activo - Próxima verificación completa en: " + 
-                               str(datetime.timedelta(seconds=86400 - (current_time - last_full_check_date).total_seconds())))
-                
-                # Esperar antes de la próxima verificación (1 hora)
-                # Dividir en intervalos pequeños para poder responder a señales de parada
-                for _ in range(30):  # 60 minutos = 1 hora
-                    if not renewal_thread_running:
-                        break
-                    time.sleep(1)  # 60 segundos = 1 minuto
-                
-            except Exception as e:
-                logger.error(f"❌ Error en ciclo de verificación de renovaciones: {e}")
-                # En caso de error, esperar y continuar
-                time.sleep(300)  # 5 minutos
+                pass
+
+def schedule_renewal_checks(bot):
+    """
+    Registra la verificación diaria de renovaciones en el planificador de tareas
+    
+    Args:
+        bot: Instancia del bot de Telegram
         
-        logger.warning("⚠️ HILO DE RENOVACIONES TERMINADO")
-        renewal_thread_running = False
+    Returns:
+        threading.Thread: Hilo del planificador si se inició en esta llamada
+    """
+    job_scheduler.add_job(
+        'renewal_check',
+        lambda: run_renewal_check(bot),
+        cron=RENEWAL_CHECK_CRON,
+        jitter=SCHEDULER_JITTER_SECONDS,
+        run_on_start=True,
+        description="Notificaciones de renovación de suscripciones"
+    )
     
-    # Crear e iniciar el hilo
-    thread = threading.Thread(target=renewal_check_thread, daemon=True)
-    thread.start()
+    logger.info("🔄 Verificación de renovaciones programada en el planificador de tareas")
     
-    logger.info("🔄 Hilo de verificación de renovaciones iniciado en segundo plano")
+    return job_scheduler.start()
+
+def schedule_stats_maintenance():
+    """
+    Registra en el planificador de tareas la limpieza de los contadores horarios
+    y el refresco de los rollups diarios (el primero, al arrancar, calcula el
+    historial si aún no existe)
+    """
+    job_scheduler.add_job(
+        'stats_prune',
+        db.prune_stats_hourly,
+        interval=STATS_PRUNE_INTERVAL_SECONDS,
+        jitter=SCHEDULER_JITTER_SECONDS,
+        description="Limpieza de los contadores horarios de estadísticas"
+    )
     
-    return thread
+    job_scheduler.add_job(
+        'daily_rollups',
+        rollups.refresh,
+        interval=ROLLUP_REFRESH_INTERVAL_SECONDS,
+        jitter=SCHEDULER_JITTER_SECONDS,
+        run_on_start=True,
+        description="Refresco incremental de los rollups diarios de ingresos y bajas"
+    )
+    
+    return job_scheduler.start()
+
+def schedule_database_backups():
+    """Registra en el planificador de tareas las copias de seguridad periódicas (ver backups.py)"""
+    job_scheduler.add_job(
+        'database_backup',
+        backups.create_backup,
+        cron=BACKUP_CRON,
+        jitter=SCHEDULER_JITTER_SECONDS,
+        description="Copia de seguridad comprimida de la base de datos",
+        stall_after=HEALTH_LONG_JOB_STALL_SECONDS
+    )
+    
+    logger.info(f"💾 Copias de seguridad programadas ({BACKUP_CRON})")
+    
+    return job_scheduler.start()
+
+def schedule_data_retention():
+    """Registra en el planificador de tareas el archivado de filas antiguas (ver retention.py)"""
+    job_scheduler.add_job(
+        'data_retention',
+        retention.run,
+        cron=RETENTION_CRON,
+        jitter=SCHEDULER_JITTER_SECONDS,
+        description="Archivado de filas antiguas y recuperación de espacio",
+        stall_after=HEALTH_LONG_JOB_STALL_SECONDS
+    )
+    
+    logger.info(f"🧹 Retención de datos programada ({RETENTION_CRON})")
+    
+    return job_scheduler.start()
+
+def schedule_replica_refresh():
+    """
+    Registra en el planificador de tareas el refresco de la réplica de lectura de
+    los informes (ver replica.py); el primero, al arrancar
+    """
+    if not REPLICA_ENABLED:
+        logger.info("Réplica de lectura desactivada: los informes leen de la base de datos principal")
+        return None
+    
+    job_scheduler.add_job(
+        'replica_refresh',
+        replica.refresh,
+        interval=REPLICA_REFRESH_SECONDS,
+        jitter=SCHEDULER_JITTER_SECONDS,
+        run_on_start=True,
+        description="Copia de la base de datos a la réplica de lectura de los informes"
+    )
+    
+    logger.info(f"📡 Réplica de lectura programada (cada {REPLICA_REFRESH_SECONDS}s)")
+    
+    return job_scheduler.start()
 
 def generate_plans_text():
     """
@@ -303,72 +326,12 @@ def generate_plans_text():
 
 
 def start_processing_animation(bot, chat_id, message_id):
-    """Inicia una animación de procesamiento con mensajes kawaii en el mensaje"""
+    """Inicia la animación de procesamiento con mensajes kawaii (no bloquea)"""
     try:
-        # Mensajes kawaii más entretenidos y personalizados
-        animation_messages = [
-            "🌸 Preparando tu entrada VIP... 🌸",
-            "📝 Anotando tu nombre en mi lista secreta~",
-            "✨ Qué nombre tan lindo... jeje~ ✨",
-            "🎀 Abriendo las puertas del club VIP~",
-            "🌟 Un momento más... ¡Todo listo! 🌟",
-            "💰 Oh casi lo olvido, falta el pago... 💰"
-        ]
-        
-        # Registrar la animación
-        payment_animations[chat_id] = {
-            'active': True,
-            'message_id': message_id,
-            'current_frame': 0  # Añadimos un contador para saber qué frame estamos mostrando
-        }
-        
-        # Este bucle muestra cada mensaje una vez, garantizando la secuencia completa
-        for i, message in enumerate(animation_messages):
-            # Verificar si la animación debe detenerse
-            if chat_id not in payment_animations or not payment_animations[chat_id]['active']:
-                logger.info(f"Animación detenida para chat {chat_id}")
-                break
-                
-            try:
-                bot.edit_message_text(
-                    chat_id=chat_id,
-                    message_id=message_id,
-                    text=message
-                )
-                
-                # Actualizar el frame actual
-                if chat_id in payment_animations:
-                    payment_animations[chat_id]['current_frame'] = i
-                
-                # Esperar más tiempo para que cada mensaje sea visible (3 segundos)
-                time.sleep(3)
-            except Exception as e:
-                logger.error(f"Error al mostrar mensaje de animación: {str(e)}")
-                break
-        
-        # Si la animación sigue activa después de mostrar todos los mensajes, 
-        # continuar mostrando mensajes hasta que se desactive
-        while chat_id in payment_animations and payment_animations[chat_id]['active']:
-            frame = payment_animations[chat_id].get('current_frame', 0)
-            next_frame = (frame + 1) % len(animation_messages)
-            
-            try:
-                bot.edit_message_text(
-                    chat_id=chat_id,
-                    message_id=message_id,
-                    text=animation_messages[next_frame]
-                )
-                
-                # Actualizar el frame actual
-                payment_animations[chat_id]['current_frame'] = next_frame
-                
-                # Esperar antes de la siguiente actualización
-                time.sleep(3)
-            except Exception as e:
-                logger.error(f"Error en ciclo de animación: {str(e)}")
-                break
+        animation_scheduler.start(bot, chat_id, message_id)
     except Exception as e:
         logger.error(f"Error en start_processing_animation: {str(e)}")
+
 def generate_invite_link(bot, user_id, sub_id):
     """Genera un enlace de invitación para el grupo VIP"""
     try:
@@ -387,7 +350,8 @@ def generate_invite_link(bot, user_id, sub_id):
         return None
 
 def process_successful_subscription(bot, user_id: int, plan_id: str, payment_id: str, 
-                                   payment_details: Dict, is_recurring: bool = None) -> bool:
+                                   payment_details: Dict, is_recurring: bool = None,
+                                   correlation_id: str = None) -> bool:
     """
     Procesa un pago exitoso (suscripción recurrente o pago único)
     
@@ -398,6 +362,7 @@ def process_successful_subscription(bot, user_id: int, plan_id: str, payment_id:
         payment_id: ID del pago (subscription_id o order_id)
         payment_details: Detalles del pago de PayPal
         is_recurring: Si es un pago recurrente o único. Si es None, se usa la configuración global
+        correlation_id: ID de correlación del checkout (se guarda con la suscripción, ver tracing.py)
         
     Returns:
         bool: True si el proceso fue exitoso, False en caso contrario
@@ -453,7 +418,8 @@ def process_successful_subscription(bot, user_id: int, plan_id: str, payment_id:
             end_date=end_date,
             status='ACTIVE',
             paypal_sub_id=payment_id,
-            is_recurring=is_recurring
+            is_recurring=is_recurring,
+            correlation_id=correlation_id
         )
         
         # Send provisional message while generating the invitation link
@@ -464,7 +430,10 @@ def process_successful_subscription(bot, user_id: int, plan_id: str, payment_id:
         )
         
         # Generate unique invitation link
-        invite_link = generate_invite_link(bot, user_id, sub_id)
+        with tracing.span(correlation_id, 'create_invite_link', user_id) as invite_span:
+            invite_link = generate_invite_link(bot, user_id, sub_id)
+            if not invite_link:
+                invite_span['status'] = 'error'
         
         if not invite_link:
             logger.error(f"No se pudo generar enlace de invitación para usuario {user_id}")
@@ -1113,7 +1082,7 @@ def perform_group_security_check(bot, group_id, expired_subscriptions=None):
         
         # PASO 1: Verificar permisos del bot en el grupo
         try:
-            bot_info = bot.get_chat_member(group_id, bot.get_me().id)
+            bot_info = bot.get_chat_member(group_id, get_bot_id(bot))
             logger.info(f"Bot status en grupo: {bot_info.status}")
             logger.info(f"Can restrict members: {getattr(bot_info, 'can_restrict_members', False)}")
             
@@ -1157,6 +1126,7 @@ def perform_group_security_check(bot, group_id, expired_subscriptions=None):
         
         if not expired_subscriptions:
             logger.info("No hay suscripciones expiradas que procesar")
+            metrics.SWEEP_DURATION.observe((datetime.datetime.now() - start_time).total_seconds())
             return True
         
         # Contadores para estadísticas
@@ -1399,6 +1369,11 @@ def perform_group_security_check(bot, group_id, expired_subscriptions=None):
         
         logger.info(summary)
         
+        metrics.SWEEP_DURATION.observe(duration)
+        metrics.SWEEP_USERS.inc(success, outcome='expelled')
+        metrics.SWEEP_USERS.inc(skipped, outcome='skipped')
+        metrics.SWEEP_USERS.inc(errors, outcome='error')
+        
         # Si hay errores, pero también hay éxitos, consideramos que la operación fue parcialmente exitosa
         if errors > 0 and success > 0:
             logger.warning("⚠️ Verificación parcialmente exitosa (algunos usuarios no pudieron ser expulsados)")
@@ -1411,247 +1386,136 @@ def perform_group_security_check(bot, group_id, expired_subscriptions=None):
         logger.error(f"ERROR CRÍTICO en verificación de seguridad: {e}")
         return False
 
-def schedule_security_verification(bot):
-    """Inicia el hilo de verificación periódica de seguridad"""
-    global security_thread_running
+def run_security_check(bot):
+    """Tarea programada: verifica permisos, marca suscripciones expiradas y expulsa a sus usuarios"""
+    global security_failures_count
     
-    if security_thread_running:
-        logger.info("⚠️ Hilo de verificación ya está en ejecución. No se iniciará otro.")
-        return None
+    logger.info(f"🔍 VERIFICACIÓN DE SEGURIDAD INICIADA en {datetime.datetime.now()}")
     
-    def security_check_thread():
-        global security_thread_running
-        security_thread_running = True
-        verify_count = 0
-        failures_count = 0
-        max_failures = 3  # Permitir hasta 3 fallos consecutivos
-        
-        # Crear archivo de seguimiento para diagnóstico
-        heartbeat_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'security_heartbeat.txt')
-        
-        try:
-            os.makedirs(os.path.dirname(heartbeat_file), exist_ok=True)
-            with open(heartbeat_file, 'w') as f:
-                f.write(f"Hilo de seguridad iniciado: {datetime.datetime.now()}\n")
-        except Exception as e:
-            logger.error(f"No se pudo crear archivo de heartbeat: {e}")
-        
-        logger.info("🔐 HILO DE SEGURIDAD INICIADO - Verificación periódica activada")
-        
-        # Registro inicial de actividad del hilo
-        try:
+    # 1. Verificar permisos del bot primero
+    try:
+        has_permissions = verify_bot_permissions(bot)
+        if not has_permissions:
+            logger.error("🚨 El bot no tiene los permisos necesarios para expulsar usuarios")
+            # Enviar alerta a todos los administradores
             for admin_id in ADMIN_IDS:
                 try:
                     bot.send_message(
-                        chat_id=admin_id,
-                        text="🔐 Sistema de seguridad activado: Se realizará verificación periódica de suscripciones"
+                        chat_id=admin_id, 
+                        text="🚨 ALERTA DE SEGURIDAD: El bot no tiene permisos para realizar expulsiones automáticas. Por favor, verifique los permisos del bot en el grupo."
                     )
                 except Exception:
-                    pass  # Ignorar errores al notificar
-        except Exception:
-            pass  # Continuar incluso si los mensajes fallan
+                    pass  # Continuar incluso si los mensajes fallan
+    except Exception as perm_error:
+        logger.error(f"Error al verificar permisos: {perm_error}")
+    
+    # 2. Verificar y obtener suscripciones expiradas en la BD
+    sweep_started = time.monotonic()
+    sweep_summary = {'expired': 0, 'ok': False}
+    try:
+        expired_subscriptions = db.check_and_update_subscriptions(force=True)
+        sweep_summary['expired'] = len(expired_subscriptions)
+        logger.info(f"Suscripciones expiradas encontradas: {len(expired_subscriptions)}")
         
-        # Intervalo de verificación configurable (en segundos)
-        check_interval = 60  
+        if not expired_subscriptions:
+            logger.info("✅ No hay suscripciones expiradas para procesar")
+            sweep_summary['ok'] = True
         
-        # Contador de ciclos para determinar cuándo procesar fallos de expulsión
-        cycle_counter = 0
+        elif not GROUP_CHAT_ID:
+            sweep_summary['error'] = "GROUP_CHAT_ID no está configurado"
+            logger.error("⚠️ GROUP_CHAT_ID no está configurado. No se puede realizar expulsión automática.")
         
-        while security_thread_running:
-            try:
-                verify_count += 1
-                current_time = datetime.datetime.now()
-                cycle_counter += 1
-                
-                # Actualizar archivo de heartbeat
-                try:
-                    with open(heartbeat_file, 'a') as f:
-                        f.write(f"Verificación #{verify_count}: {current_time}\n")
-                except Exception:
-                    pass  # No interrumpir el proceso si no se puede escribir el heartbeat
-                
-                logger.info(f"🔍 VERIFICACIÓN #{verify_count} INICIADA en {current_time}")
-                
-                # 1. Verificar permisos del bot primero
-                try:
-                    has_permissions = verify_bot_permissions(bot)
-                    if not has_permissions:
-                        logger.error("🚨 El bot no tiene los permisos necesarios para expulsar usuarios")
-                        # Enviar alerta a todos los administradores
-                        for admin_id in ADMIN_IDS:
-                            try:
-                                bot.send_message(
-                                    chat_id=admin_id, 
-                                    text="🚨 ALERTA DE SEGURIDAD: El bot no tiene permisos para realizar expulsiones automáticas. Por favor, verifique los permisos del bot en el grupo."
-                                )
-                            except Exception:
-                                pass  # Continuar incluso si los mensajes fallan
-                except Exception as perm_error:
-                    logger.error(f"Error al verificar permisos: {perm_error}")
-                
-                # 2. Verificar y obtener suscripciones expiradas en la BD
-                try:
-                    # Usamos FORCE=False para usar solo las suscripciones ya marcadas como expiradas
-                    expired_subscriptions = db.check_and_update_subscriptions(force=True)
-                    logger.info(f"Suscripciones expiradas encontradas: {len(expired_subscriptions)}")
-                    
-                    # 3. Si hay expiradas, expulsar usuarios
-                    if expired_subscriptions:
-                        logger.info(f"🚨 EXPULSANDO {len(expired_subscriptions)} USUARIOS CON SUSCRIPCIONES EXPIRADAS")
-                        
-                        # Realizar expulsión de usuarios con suscripciones expiradas
-                        if GROUP_CHAT_ID:
-                            result = perform_group_security_check(
-                                bot,
-                                GROUP_CHAT_ID,
-                                expired_subscriptions
-                            )
-                            
-                            if result:
-                                logger.info("✅ Verificación completada exitosamente")
-                                failures_count = 0  # Reiniciar contador de fallos
-                            else:
-                                failures_count += 1
-                                logger.error(f"❌ Verificación fallida (intento #{failures_count})")
-                                
-                                # Si hay fallos consecutivos, notificar a los admins
-                                if failures_count >= max_failures:
-                                    for admin_id in ADMIN_IDS:
-                                        try:
-                                            bot.send_message(
-                                                chat_id=admin_id,
-                                                text=f"🚨 ALERTA: Han ocurrido {failures_count} fallos consecutivos en el sistema de expulsión automática. Por favor, revise los registros."
-                                            )
-                                        except Exception:
-                                            pass
-                        else:
-                            logger.error("⚠️ GROUP_CHAT_ID no está configurado. No se puede realizar expulsión automática.")
-                    else:
-                        logger.info("✅ No hay suscripciones expiradas para procesar")
-                        failures_count = 0  # Reiniciar contador de fallos
-                        
-                except Exception as exp_error:
-                    failures_count += 1
-                    logger.error(f"Error al verificar suscripciones expiradas: {exp_error}")
-                
-                # 4. Cada 10 ciclos, procesar fallos de expulsión previos
-                if cycle_counter >= 10:
-                    try:
-                        logger.info("🔄 Procesando fallos de expulsión pendientes...")
-                        processed = process_failed_expulsions(bot)
-                        if processed > 0:
-                            logger.info(f"✅ Procesados {processed} fallos de expulsión pendientes")
-                        cycle_counter = 0  # Reiniciar contador
-                    except Exception as fail_error:
-                        logger.error(f"Error al procesar fallos de expulsión: {fail_error}")
-                
-                # Esperar antes de la próxima verificación
-                logger.info(f"Hilo de seguridad esperando {check_interval} segundos para próxima verificación...")
-                
-                # Dividir el sleep en intervalos más pequeños para poder responder rápido a señales de parada
-                for _ in range(check_interval):
-                    if not security_thread_running:
-                        break
-                    time.sleep(1)
-                
-            except Exception as cycle_error:
-                failures_count += 1
-                logger.error(f"🔥 ERROR EN CICLO DE VERIFICACIÓN: {cycle_error}")
-                # En caso de error, esperar y continuar
-                time.sleep(5)
-                
-                # Reiniciar el ciclo si hay demasiados fallos
-                if failures_count >= 10:
-                    logger.critical("🔥 DEMASIADOS FALLOS CONSECUTIVOS. REINICIANDO EL CICLO DE VERIFICACIÓN.")
-                    # Notificar a los admins
-                    for admin_id in ADMIN_IDS:
-                        try:
-                            bot.send_message(
-                                chat_id=admin_id,
-                                text="🚨 ALERTA CRÍTICA: El sistema de seguridad ha detectado errores graves y está intentando recuperarse. Se recomienda revisar los logs."
-                            )
-                        except Exception:
-                            pass
-                    
-                    # Reiniciar contadores
-                    failures_count = 0
-                    
-                    # Guardar registro del reinicio
-                    try:
-                        with open(heartbeat_file, 'a') as f:
-                            f.write(f"REINICIO DE EMERGENCIA: {datetime.datetime.now()}\n")
-                    except Exception:
-                        pass
+        else:
+            # 3. Si hay expiradas, expulsar usuarios
+            logger.info(f"🚨 EXPULSANDO {len(expired_subscriptions)} USUARIOS CON SUSCRIPCIONES EXPIRADAS")
+            
+            if perform_group_security_check(bot, GROUP_CHAT_ID, expired_subscriptions):
+                logger.info("✅ Verificación completada exitosamente")
+                sweep_summary['ok'] = True
+            else:
+                sweep_summary['error'] = "La expulsión de usuarios expirados falló"
         
-        logger.warning("⚠️ HILO DE SEGURIDAD TERMINADO - La verificación periódica se ha detenido")
-        security_thread_running = False
+    except Exception as exp_error:
+        sweep_summary['error'] = str(exp_error)
+        logger.error(f"Error al verificar suscripciones expiradas: {exp_error}")
         
-        # Intentar reiniciar automáticamente
-        try:
-            logger.info("🔄 Intentando reiniciar el hilo de seguridad automáticamente...")
-            security_thread_running = False
-            time.sleep(2)
-            # Crear un nuevo hilo
-            new_thread = threading.Thread(target=security_check_thread, daemon=True)
-            new_thread.start()
-            logger.info("✅ Hilo de seguridad reiniciado automáticamente")
-        except Exception as restart_error:
-            logger.critical(f"❌ No se pudo reiniciar el hilo de seguridad: {restart_error}")
-            # Notificar a los admins
-            for admin_id in ADMIN_IDS:
-                try:
-                    bot.send_message(
-                        chat_id=admin_id,
-                        text="🚨 ALERTA CRÍTICA: El sistema de seguridad ha fallado y no se pudo reiniciar automáticamente. Por favor, reinicie el bot."
-                    )
-                except Exception:
-                    pass
+    finally:
+        sweep_summary['duration_seconds'] = round(time.monotonic() - sweep_started, 3)
+        events.publish('sweep_completed', sweep_summary)
+    
+    if sweep_summary['ok']:
+        security_failures_count = 0
+        return
+    
+    security_failures_count += 1
+    logger.error(f"❌ Verificación fallida (intento #{security_failures_count})")
+    
+    # Si hay fallos consecutivos, notificar a los admins
+    if security_failures_count >= SECURITY_MAX_CONSECUTIVE_FAILURES:
+        for admin_id in ADMIN_IDS:
+            try:
+                bot.send_message(
+                    chat_id=admin_id,
+                    text=f"🚨 ALERTA: Han ocurrido {security_failures_count} fallos consecutivos en el sistema de expulsión automática. Por favor, revise los registros."
+                )
+            except Exception:
+                pass
+    
+    # El planificador registra la tarea como fallida (last_status y /admin/health)
+    raise RuntimeError(f"Verificación de seguridad fallida: {sweep_summary.get('error')}")
+
+def run_failed_expulsions(bot):
+    """Tarea programada: reintenta las expulsiones que fallaron anteriormente"""
+    logger.info("🔄 Procesando fallos de expulsión pendientes...")
+    processed = process_failed_expulsions(bot)
+    if processed > 0:
+        logger.info(f"✅ Procesados {processed} fallos de expulsión pendientes")
+
+def schedule_security_verification(bot):
+    """Registra la verificación periódica de seguridad en el planificador de tareas y lo inicia"""
+    job_scheduler.add_job(
+        'security_check',
+        lambda: run_security_check(bot),
+        interval=SECURITY_CHECK_INTERVAL_SECONDS,
+        jitter=SCHEDULER_JITTER_SECONDS,
+        run_on_start=True,
+        description="Expulsión de usuarios con suscripciones expiradas",
+        stall_after=HEALTH_LONG_JOB_STALL_SECONDS
+    )
+    job_scheduler.add_job(
+        'failed_expulsions',
+        lambda: run_failed_expulsions(bot),
+        interval=FAILED_EXPULSIONS_INTERVAL_SECONDS,
+        jitter=SCHEDULER_JITTER_SECONDS,
+        description="Reintento de expulsiones fallidas"
+    )
     
-    # Crear y arrancar hilo en modo daemon
-    thread = threading.Thread(target=security_check_thread, daemon=True)
-    thread.start()
-    logger.info("✅ Hilo de verificación periódica iniciado en segundo plano")
+    thread = job_scheduler.start()
+    
+    if thread:
+        logger.info("✅ Verificación periódica de seguridad programada en segundo plano")
     
     return thread
 
-# Añade esta nueva función al archivo:
 def check_security_thread_status(bot):
     """
-    Verifica el estado del hilo de seguridad y lo reinicia si es necesario.
-    Esta función debe llamarse periódicamente para garantizar que el hilo esté activo.
+    Verifica en el registro de salud que el planificador y la tarea de seguridad estén activos.
+    Si no lo están, los registra/reinicia y ejecuta una pasada del watchdog.
+    
+    Returns:
+        dict: Estado del planificador y de la tarea 'security_check' tras la verificación
     """
-    global security_thread_running
+    if not (job_scheduler.is_running() and job_scheduler.has_job('security_check')):
+        logger.warning("⚠️ Planificador de seguridad no detectado. Iniciando uno nuevo...")
+        schedule_security_verification(bot)
     
-    # Si el hilo no está ejecutándose, reiniciarlo
-    if not security_thread_running:
-        logger.warning("⚠️ Hilo de seguridad no detectado. Iniciando uno nuevo...")
-        
-        # Esperar un momento por si el hilo está en proceso de inicialización
-        time.sleep(2)
-        
-        # Si aún no está ejecutándose, iniciar uno nuevo
-        if not security_thread_running:
-            new_thread = schedule_security_verification(bot)
-            
-            if new_thread:
-                logger.info("✅ Hilo de seguridad reiniciado exitosamente")
-                
-                # Notificar a los administradores
-                for admin_id in ADMIN_IDS:
-                    try:
-                        bot.send_message(
-                            chat_id=admin_id,
-                            text="🔄 El sistema de seguridad se ha reiniciado automáticamente"
-                        )
-                    except Exception:
-                        pass
-                
-                return True
-            else:
-                logger.error("❌ No se pudo reiniciar el hilo de seguridad")
-                return False
+    restarted = health.check()
     
-    return True
+    return {
+        'scheduler': health.get_component_status('scheduler'),
+        'security_check': health.get_component_status('job:security_check'),
+        'restarted': restarted,
+    }
 
 
 # Modificación 4: Añadir una función para forzar la expulsión inmediata de todos los usuarios con suscripciones expiradas
@@ -1848,7 +1712,7 @@ def check_and_fix_bot_permissions(message, bot):
             
         # Obtener información del bot en el grupo
         try:
-            bot_member = bot.get_chat_member(GROUP_CHAT_ID, bot.get_me().id)
+            bot_member = bot.get_chat_member(GROUP_CHAT_ID, get_bot_id(bot))
             
             status_message = f"📊 Estado del bot en el grupo:\n"
             
@@ -1955,11 +1819,27 @@ def handle_verify_all_members(message, bot):
 # 3. FUNCIÓN DE VERIFICACIÓN DE PERMISOS DEL BOT
 # Añade esta función al archivo app.py, justo antes de set_webhook()
 
-def verify_bot_permissions(bot):
-    """Verifica que el bot tenga los permisos correctos en el grupo VIP"""
+def verify_bot_permissions(bot, use_cache=True):
+    """
+    Verifica que el bot tenga los permisos correctos en el grupo VIP.
+    Un resultado correcto se reutiliza durante BOT_PERMISSIONS_CACHE_SECONDS salvo que use_cache
+    sea False; los fallos se vuelven a comprobar siempre.
+    """
+    if use_cache and runtime.get('bot_group_permissions'):
+        return True
+    
+    result = _check_bot_permissions(bot)
+    if result:
+        runtime.set('bot_group_permissions', True, ttl=BOT_PERMISSIONS_CACHE_SECONDS)
+    else:
+        runtime.invalidate('bot_group_permissions')
+    return result
+
+def _check_bot_permissions(bot):
+    """Consulta a Telegram los permisos del bot en el grupo VIP y avisa a los admins si faltan"""
     try:
-        from config import GROUP_CHAT_ID, ADMIN_IDS, BOT_TOKEN
-        import requests
+        from config import GROUP_CHAT_ID, ADMIN_IDS
+        from telegram_api import telegram_request, method_url
         import json
         
         if not GROUP_CHAT_ID:
@@ -1967,20 +1847,20 @@ def verify_bot_permissions(bot):
             return False
         
         # Usar la API directamente para evitar circularidad de importaciones
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/getChatMember"
+        url = method_url("getChatMember")
         params = {
             "chat_id": GROUP_CHAT_ID,
-            "user_id": bot.get_me().id
+            "user_id": get_bot_id(bot)
         }
         
-        response = requests.get(url, params=params)
+        response = telegram_request('GET', url, params=params)
         data = response.json()
         
         if not data.get("ok"):
             logger.error(f"Error al verificar permisos del bot: {data.get('description')}")
             for admin_id in ADMIN_IDS:
-                requests.get(
-                    f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage",
+                telegram_request('GET',
+                    method_url("sendMessage"),
                     params={
                         "chat_id": admin_id,
                         "text": f"⚠️ ALERTA: El bot no puede acceder al grupo VIP (ID: {GROUP_CHAT_ID}).\n\nPor favor, añada el bot al grupo y asígnele permisos de administrador."
@@ -1994,8 +1874,8 @@ def verify_bot_permissions(bot):
         if status not in ["administrator", "creator"]:
             logger.error(f"El bot no es administrador en el grupo VIP. Status: {status}")
             for admin_id in ADMIN_IDS:
-                requests.get(
-                    f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage",
+                telegram_request('GET',
+                    method_url("sendMessage"),
                     params={
                         "chat_id": admin_id,
                         "text": f"⚠️ ALERTA: El bot no es administrador en el grupo VIP (ID: {GROUP_CHAT_ID}).\n\nPara poder generar enlaces de invitación únicos y expulsar usuarios no autorizados, el bot debe ser administrador del grupo."
@@ -2020,8 +1900,8 @@ def verify_bot_permissions(bot):
             error_msg = f"⚠️ ALERTA: El bot es administrador pero le faltan permisos esenciales en el grupo VIP:\n\n" + "\n".join(permission_errors) + "\n\nPor favor, edite los permisos del bot y active estos permisos para que funcione correctamente."
             
             for admin_id in ADMIN_IDS:
-                requests.get(
-                    f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage",
+                telegram_request('GET',
+                    method_url("sendMessage"),
                     params={
                         "chat_id": admin_id,
                         "text": error_msg
@@ -2052,7 +1932,7 @@ def handle_new_chat_members(message, bot):
         # Obtener los nuevos miembros
         for new_member in message.new_chat_members:
             # Omitir si es el propio bot
-            if new_member.id == bot.get_me().id:
+            if new_member.id == get_bot_id(bot):
                 logger.info("El bot se unió al grupo, ignorando")
                 continue
                 
@@ -2123,6 +2003,8 @@ def handle_new_chat_members(message, bot):
                     logger.error(f"Error al expulsar nuevo miembro no autorizado {user_id}: {e}")
             else:
                 logger.info(f"Usuario {username} (ID: {user_id}) se unió al grupo con suscripción válida")
+                # Último tramo de la traza del checkout (entrada al grupo)
+                tracing.record_join(user_id)
     
     except Exception as e:
         logger.error(f"Error general en handle_new_chat_members: {str(e)}")
@@ -2497,6 +2379,8 @@ def handle_plans_callback(call, bot):
 
 def handle_payment_method(call, bot):
     """Maneja la selección del método de pago"""
+    checkout_started = time.time()
+    correlation_id = None
     try:
         chat_id = call.message.chat.id
         message_id = call.message.message_id
@@ -2524,27 +2408,21 @@ def handle_payment_method(call, bot):
                 reply_markup=None
             )
             
-            # Start processing animation in a separate thread with proper daemon flag
-            animation_thread = threading.Thread(
-                target=start_processing_animation,
-                args=(bot, chat_id, processing_message.message_id)
-            )
-            animation_thread.daemon = True
-            animation_thread.start()
-
-            # Pequeña pausa para asegurar que el hilo de animación comience
-            time.sleep(1)
+            # Start processing animation (driven by the shared animation scheduler)
+            start_processing_animation(bot, chat_id, processing_message.message_id)
             
-            # Create payment link (will handle both one-time and recurring)
+            # Create payment link (will handle both one-time and recurring).
+            # The correlation ID comes back in the PayPal return URL
             from payments import create_payment_link
-            payment_url = create_payment_link(plan_id, user_id)
+            correlation_id = tracing.new_correlation_id()
+            with tracing.span(correlation_id, 'create_payment_link', user_id) as link_span:
+                payment_url = create_payment_link(plan_id, user_id, correlation_id=correlation_id)
+                if not payment_url:
+                    link_span['status'] = 'error'
             
-            # Stop the animation
-            if chat_id in payment_animations:
-                logger.info(f"Desactivando animación para chat {chat_id}")
-                payment_animations[chat_id]['active'] = False
-                # Dar tiempo para que se detenga la animación
-                time.sleep(1)
+            # Stop the animation; only wait if a frame edit is still in flight
+            logger.info(f"Desactivando animación para chat {chat_id}")
+            animation_scheduler.stop(chat_id, processing_message.message_id).wait(5)
             
             if payment_url:
                 # Create markup with pay button
@@ -2615,25 +2493,29 @@ def handle_payment_method(call, bot):
                 )
                 
                 logger.error(f"Error al crear enlace de pago PayPal para usuario {user_id}, plan {plan_id}")
+            
+            tracing.record_span(correlation_id, 'payment_method', checkout_started, user_id=user_id,
+                                status='ok' if payment_url else 'error')
         
         # Answer callback to remove the waiting clock in the client
         bot.answer_callback_query(call.id)
         
     except Exception as e:
         logger.error(f"Error en handle_payment_method: {str(e)}")
+        tracing.record_span(correlation_id, 'payment_method', checkout_started, status='error', detail=e)
         try:
             bot.answer_callback_query(call.id, "❌ Ocurrió un error. Intenta nuevamente.")
             
             # Stop any ongoing animation
-            if chat_id in payment_animations:
-                payment_animations[chat_id]['active'] = False
+            if animation_scheduler.is_active(chat_id, message_id):
+                animation_scheduler.stop(chat_id, message_id).wait(5)
                 
                 markup = types.InlineKeyboardMarkup()
                 markup.add(types.InlineKeyboardButton("🔙 Volver", callback_data="view_plans"))
                 
                 bot.edit_message_text(
                     chat_id=chat_id,
-                    message_id=payment_animations[chat_id]['message_id'],
+                    message_id=message_id,
                     text="❌ Ocurrió un error. Por favor, intenta nuevamente.",
                     reply_markup=markup
                 )
@@ -3084,8 +2966,91 @@ def handle_subinfo(message, bot):
             text="❌ Ocurrió un error al consultar la información. Por favor, intenta nuevamente."
         )
 
+def format_whitelist_entry(sub, current_time):
+    """Línea de /whitelist list: nombre, username, ID y tiempo restante"""
+    user_id = sub['user_id']
+    start_date_str = sub['start_date']
+    end_date_str = sub['end_date']
+    
+    # Nombre para mostrar
+    display_name = f"{sub['first_name'] or ''} {sub['last_name'] or ''}".strip() or "Sin nombre"
+    display_username = f"@{sub['username']}" if sub['username'] else "Sin username"
+    
+    # Calcular tiempo restante
+    try:
+        end_date = datetime.datetime.fromisoformat(end_date_str)
+        start_date = datetime.datetime.fromisoformat(start_date_str)
+        remaining = end_date - current_time
+        total_duration = end_date - start_date
+        
+        # Calcular porcentaje de tiempo transcurrido
+        total_seconds = total_duration.total_seconds()
+        remaining_seconds = remaining.total_seconds()
+        
+        # Formatear tiempo restante con más precisión
+        if remaining.total_seconds() > 0:
+            if total_seconds > 3600:  # Más de una hora
+                if remaining.days > 0:
+                    days_left = remaining.days
+                    days_total = total_duration.days
+                    status_text = f"{days_left} de {days_total} días restantes"
+                else:
+                    hours_left = int(remaining.total_seconds() / 3600)
+                    hours_total = int(total_seconds / 3600)
+                    status_text = f"{hours_left} de {hours_total} horas restantes"
+            else:
+                # Para duraciones cortas, mostrar minutos
+                minutes_left = int(remaining.total_seconds() / 60)
+                minutes_total = int(total_seconds / 60)
+                status_text = f"{minutes_left} de {minutes_total} minutos restantes"
+        else:
+            status_text = "Expirado"
+        
+    except Exception as e:
+        logger.error(f"Error al procesar fecha {end_date_str}: {e}")
+        status_text = f"Fecha: {end_date_str}"
+    
+    return f"• {display_name} ({display_username})\n  ID: `{user_id}` - {status_text}"
+
+def build_whitelist_page(after=None, before=None):
+    """
+    Página de /whitelist list (WHITELIST_PAGE_SIZE usuarios, de la fecha de fin más
+    cercana a la más lejana) con los botones de anterior / siguiente.
+    
+    Los botones llevan el sub_id de la primera o la última fila
+    (whitelist_prev_<sub_id> / whitelist_next_<sub_id>) y se convierten de nuevo
+    en el cursor del listado al pulsarlos.
+    
+    Returns:
+        tuple: (texto, markup o None)
+    """
+    page = db.list_subscriptions(status='ACTIVE', sub_type='whitelist', unexpired_only=True,
+                                 after=after, before=before, limit=WHITELIST_PAGE_SIZE, descending=False)
+    
+    if not page['items']:
+        return "📋 *Lista de Whitelist*\n\nNo hay usuarios en la whitelist actualmente.", None
+    
+    current_time = datetime.datetime.now()
+    whitelist_entries = [format_whitelist_entry(sub, current_time) for sub in page['items']]
+    whitelist_text = "📋 *Lista de Whitelist*\n\n" + "\n\n".join(whitelist_entries)
+    
+    buttons = []
+    if page['prev_cursor']:
+        buttons.append(types.InlineKeyboardButton(
+            "⬅️ Anterior", callback_data=f"whitelist_prev_{page['items'][0]['sub_id']}"))
+    if page['next_cursor']:
+        buttons.append(types.InlineKeyboardButton(
+            "Siguiente ➡️", callback_data=f"whitelist_next_{page['items'][-1]['sub_id']}"))
+    
+    markup = None
+    if buttons:
+        markup = types.InlineKeyboardMarkup()
+        markup.row(*buttons)
+    
+    return whitelist_text, markup
+
 def handle_whitelist_list(message, bot):
-    """Muestra la lista de usuarios en whitelist"""
+    """Muestra la primera página de usuarios en whitelist"""
     try:
         admin_id = message.from_user.id
         chat_id = message.chat.id
@@ -3094,89 +3059,14 @@ def handle_whitelist_list(message, bot):
         if admin_id not in ADMIN_IDS:
             return
         
-        # Obtener suscripciones activas (whitelist son todas las suscripciones manuales)
-        conn = db.get_db_connection()
-        cursor = conn.cursor()
-        
-        # Consulta para obtener usuarios en whitelist (donde paypal_sub_id es NULL)
-        cursor.execute('''
-        SELECT s.user_id, u.username, u.first_name, u.last_name, 
-               s.start_date, s.end_date, s.status
-        FROM subscriptions s
-        JOIN users u ON s.user_id = u.user_id
-        WHERE s.paypal_sub_id IS NULL AND 
-              s.status = 'ACTIVE' AND 
-              s.end_date > datetime('now')
-        ORDER BY s.end_date ASC
-        ''')
-        
-        whitelist_users = cursor.fetchall()
-        conn.close()
-        
-        if not whitelist_users:
-            bot.send_message(
-                chat_id=chat_id,
-                text="📋 *Lista de Whitelist*\n\nNo hay usuarios en la whitelist actualmente.",
-                parse_mode='Markdown'
-            )
-            return
-        
-        # Formatear la lista de usuarios
-        current_time = datetime.datetime.now()
-        whitelist_entries = []
-        
-        for user in whitelist_users:
-            user_id, username, first_name, last_name, start_date_str, end_date_str, status = user
-            
-            # Nombre para mostrar
-            display_name = f"{first_name or ''} {last_name or ''}".strip() or "Sin nombre"
-            display_username = f"@{username}" if username else "Sin username"
-            
-            # Calcular tiempo restante
-            try:
-                end_date = datetime.datetime.fromisoformat(end_date_str)
-                start_date = datetime.datetime.fromisoformat(start_date_str)
-                remaining = end_date - current_time
-                total_duration = end_date - start_date
-                
-                # Calcular porcentaje de tiempo transcurrido
-                total_seconds = total_duration.total_seconds()
-                remaining_seconds = remaining.total_seconds()
-                
-                # Formatear tiempo restante con más precisión
-                if remaining.total_seconds() > 0:
-                    if total_seconds > 3600:  # Más de una hora
-                        if remaining.days > 0:
-                            days_left = remaining.days
-                            days_total = total_duration.days
-                            status_text = f"{days_left} de {days_total} días restantes"
-                        else:
-                            hours_left = int(remaining.total_seconds() / 3600)
-                            hours_total = int(total_seconds / 3600)
-                            status_text = f"{hours_left} de {hours_total} horas restantes"
-                    else:
-                        # Para duraciones cortas, mostrar minutos
-                        minutes_left = int(remaining.total_seconds() / 60)
-                        minutes_total = int(total_seconds / 60)
-                        status_text = f"{minutes_left} de {minutes_total} minutos restantes"
-                else:
-                    status_text = "Expirado"
-                
-            except Exception as e:
-                logger.error(f"Error al procesar fecha {end_date_str}: {e}")
-                status_text = f"Fecha: {end_date_str}"
-            
-            # Crear entrada para la lista
-            entry = f"• {display_name} ({display_username})\n  ID: `{user_id}` - {status_text}"
-            whitelist_entries.append(entry)
-        
-        # Enviar mensaje con la lista
-        whitelist_text = "📋 *Lista de Whitelist*\n\n" + "\n\n".join(whitelist_entries)
+        # Whitelist son las suscripciones manuales (paypal_sub_id NULL) activas
+        whitelist_text, markup = build_whitelist_page()
         
         bot.send_message(
             chat_id=chat_id,
             text=whitelist_text,
-            parse_mode='Markdown'
+            parse_mode='Markdown',
+            reply_markup=markup
         )
         
     except Exception as e:
@@ -3216,6 +3106,24 @@ def handle_whitelist_callback(call, bot):
                 
             bot.answer_callback_query(call.id, "Operación cancelada")
             return
+        
+        # Botones de página de /whitelist list
+        if call.data.startswith(("whitelist_next_", "whitelist_prev_")):
+            _, direction, sub_id = call.data.split('_')
+            cursor = db.get_subscription_cursor(int(sub_id))
+            if direction == 'next':
+                whitelist_text, markup = build_whitelist_page(after=cursor)
+            else:
+                whitelist_text, markup = build_whitelist_page(before=cursor)
+            
+            bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=message_id,
+                text=whitelist_text,
+                parse_mode='Markdown',
+                reply_markup=markup
+            )
+            return
             
     except Exception as e:
         logger.error(f"Error en handle_whitelist_callback: {str(e)}")
@@ -3260,67 +3168,8 @@ def handle_stats_command(message, bot):
             "🔄 Recopilando estadísticas..."
         )
         
-        # Obtener conexión a la base de datos
-        conn = db.get_db_connection()
-        cursor = conn.cursor()
-        
-        # Estadísticas principales
-        stats = {
-            "usuarios": db.get_table_count(conn, "users"),
-            "suscripciones": db.get_table_count(conn, "subscriptions"),
-            "suscripciones_activas": db.get_active_subscriptions_count(conn),
-            "enlaces_invitacion": db.get_table_count(conn, "invite_links"),
-            # NUEVO: Contador de renovaciones
-            "renovaciones_totales": db.get_table_count(conn, "subscription_renewals")
-        }
-        
-        # Estadísticas adicionales
-        
-        # Usuarios nuevos en las últimas 24 horas
-        cursor.execute("""
-        SELECT COUNT(*) FROM users
-        WHERE created_at > datetime('now', '-1 day')
-        """)
-        stats["usuarios_nuevos_24h"] = cursor.fetchone()[0]
-        
-        # Suscripciones nuevas en las últimas 24 horas
-        cursor.execute("""
-        SELECT COUNT(*) FROM subscriptions
-        WHERE start_date > datetime('now', '-1 day')
-        """)
-        stats["suscripciones_nuevas_24h"] = cursor.fetchone()[0]
-        
-        # NUEVO: Renovaciones en las últimas 24 horas
-        cursor.execute("""
-        SELECT COUNT(*) FROM subscription_renewals
-        WHERE renewal_date > datetime('now', '-1 day')
-        """)
-        stats["renovaciones_24h"] = cursor.fetchone()[0]
-        
-        # Cantidad de expulsiones
-        cursor.execute("SELECT COUNT(*) FROM expulsions")
-        stats["expulsiones_totales"] = cursor.fetchone()[0]
-        
-        # Planes más populares
-        cursor.execute("""
-        SELECT plan, COUNT(*) as total
-        FROM subscriptions
-        GROUP BY plan
-        ORDER BY total DESC
-        """)
-        plan_stats = cursor.fetchall()
-        
-        # NUEVO: Próximas renovaciones en los siguientes 7 días
-        cursor.execute("""
-        SELECT COUNT(*) FROM subscriptions 
-        WHERE status = 'ACTIVE' 
-        AND is_recurring = 1
-        AND date(end_date) BETWEEN date('now') AND date('now', '+7 day')
-        """)
-        stats["renovaciones_proximas_7d"] = cursor.fetchone()[0]
-        
-        # Cerrar conexión
-        conn.close()
+        # Contadores y suscripciones por plan
+        stats, plan_stats = db.get_bot_stats()
         
         # Construir mensaje de estadísticas
         stats_text = (
@@ -3372,6 +3221,11 @@ def handle_stats_command(message, bot):
             "📅 Actualizado: " + datetime.datetime.now().strftime("%d/%m/%Y %H:%M:%S")
         )
         
+        # Origen de los datos: réplica de lectura (con su antigüedad) o base de datos principal
+        data_source = stats.get('data_source') or {}
+        if data_source.get('source') == 'replica':
+            stats_text += f"\n📡 Datos de la réplica de lectura (hace {int(data_source['age_seconds'])}s)"
+        
         # Enviar estadísticas
         bot.edit_message_text(
             chat_id=chat_id,
@@ -3427,7 +3281,7 @@ def handle_test_invite(message, bot):
         # Verificar que el bot tenga los permisos necesarios
         try:
             # Obtener información del bot en el grupo
-            chat_member = bot.get_chat_member(GROUP_CHAT_ID, bot.get_me().id)
+            chat_member = bot.get_chat_member(GROUP_CHAT_ID, get_bot_id(bot))
             
             if chat_member.status not in ['administrator', 'creator']:
                 bot.edit_message_text(
@@ -3626,7 +3480,7 @@ def register_admin_commands(bot):
     
     # Comando de verificación de permisos para admins
     bot.register_message_handler(
-        lambda message: verify_bot_permissions(bot) and bot.reply_to(message, "✅ Verificación de permisos del bot completada. Revisa los mensajes privados para detalles."),
+        lambda message: verify_bot_permissions(bot, use_cache=False) and bot.reply_to(message, "✅ Verificación de permisos del bot completada. Revisa los mensajes privados para detalles."),
         func=lambda message: message.from_user.id in ADMIN_IDS and message.text == '/check_permissions'
     )
     
@@ -3680,22 +3534,4 @@ def register_handlers(bot):
     
     # Handler por defecto para mensajes no reconocidos
     bot.register_message_handler(lambda message: handle_unknown_message(message, bot), func=lambda message: True)
-    
-    # Iniciar verificación periódica automática
-    security_thread = schedule_security_verification(bot)
-    
-    # Forzar una verificación inicial completa
-    force_security_check(bot)
-    
-    # Programar verificaciones periódicas del estado del hilo
-    def check_thread_periodically():
-        while True:
-            time.sleep(300)  # Comprobar cada 5 minutos
-            try:
-                check_security_thread_status(bot)
-            except Exception as e:
-                logger.error(f"Error en la verificación periódica del hilo: {e}")
-    
-    # Iniciar hilo de supervisión
-    monitor_thread = threading.Thread(target=check_thread_periodically, daemon=True)
-    monitor_thread.start()
\ No newline at end of file
+
@@ -2,13 +2,14 @@ import os
 from dotenv import load_dotenv
 import logging
 
-# Configurar logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-logger = logging.getLogger(__name__)
-
 # Cargar variables de entorno si hay un archivo .env (desarrollo local)
 load_dotenv()
 
+# Configurar logging (cola asíncrona, JSON, muestreo y límite de repeticiones)
+import logging_setup
+logging_setup.configure_logging()
+logger = logging.getLogger(__name__)
+
 # Bot Token de Telegram
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 if not BOT_TOKEN:
@@ -60,7 +61,7 @@ else:
     logger.info(f"Webhook URL: {WEBHOOK_URL}")
 
 # Ruta de la base de datos
-DB_PATH = os.path.join('/opt/render/project/data', 'vip_bot.db')
+DB_PATH = os.getenv('DB_PATH', os.path.join('/opt/render/project/data', 'vip_bot.db'))
 
 # Asegurar que el directorio de datos existe
 os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
@@ -190,4 +191,107 @@ SUBSCRIPTION_GRACE_PERIOD_HOURS = 10
 
 # Configuración de invitaciones
 INVITE_LINK_EXPIRY_HOURS = 2  # Enlaces expiran en 24 horas
-INVITE_LINK_MEMBER_LIMIT = 1  # Enlaces de un solo uso
\ No newline at end of file
+INVITE_LINK_MEMBER_LIMIT = 1  # Enlaces de un solo uso
+
+# Configuración de la cola de actualizaciones de Telegram (webhook)
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 4))  # Workers que procesan actualizaciones
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000))  # Máximo de actualizaciones pendientes
+WEBHOOK_DEDUP_SIZE = int(os.getenv('WEBHOOK_DEDUP_SIZE', 5000))  # update_id recordados para evitar duplicados
+
+# Configuración de las animaciones de mensajes
+ANIMATION_FRAME_INTERVAL = 3  # Segundos entre fotogramas de una animación
+ANIMATION_MAX_EDITS_PER_SECOND = int(os.getenv('ANIMATION_MAX_EDITS_PER_SECOND', 10))  # Límite global de ediciones
+ANIMATION_MAX_AGE_SECONDS = 120  # Las animaciones olvidadas se detienen solas
+ANIMATION_EDIT_WORKERS = 4  # Hilos que envían las ediciones a Telegram
+
+# Configuración del planificador de tareas en segundo plano
+SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', 'true').lower() == 'true'  # Desactivar en pruebas de carga
+SCHEDULER_LEASE_NAME = 'background-jobs'  # Lease en SQLite que decide el proceso líder
+SCHEDULER_LEASE_TTL_SECONDS = 90  # Si el líder no renueva en este tiempo, otro proceso lo reemplaza
+SCHEDULER_JITTER_SECONDS = 5  # Retraso aleatorio máximo añadido a cada ejecución
+SECURITY_CHECK_INTERVAL_SECONDS = 60  # Verificación de suscripciones expiradas
+FAILED_EXPULSIONS_INTERVAL_SECONDS = 600  # Reintento de expulsiones fallidas
+SECURITY_MAX_CONSECUTIVE_FAILURES = 3  # Fallos seguidos antes de alertar a los administradores
+RENEWAL_CHECK_CRON = '0 14 * * *'  # Verificación diaria de renovaciones (UTC)
+
+# Configuración del contexto de ejecución (cachés precargadas en el arranque)
+PAYPAL_TOKEN_REFRESH_MARGIN_SECONDS = 300  # Renovar el token de PayPal 5 minutos antes de expirar
+BOT_PERMISSIONS_CACHE_SECONDS = 300  # Reutilizar la verificación de permisos del bot en el grupo
+
+# Configuración de métricas (/metrics)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')  # Token opcional para el scraper (cabecera Authorization: Bearer)
+
+# Configuración del perfilador de SQL (/admin/sql-profile)
+SQL_PROFILER_ENABLED = os.getenv('SQL_PROFILER_ENABLED', 'false').lower() == 'true'  # Desactivado por defecto
+SQL_SLOW_QUERY_MS = float(os.getenv('SQL_SLOW_QUERY_MS', 100))  # Umbral para registrar una consulta lenta
+SQL_PROFILER_SAMPLES = 500  # Duraciones recientes guardadas por sentencia para calcular el p95
+SQL_SLOW_QUERY_LOG_INTERVAL_SECONDS = 300  # Como máximo un aviso por sentencia lenta en este intervalo
+
+# Configuración del registro de salud y watchdog (/admin/health)
+HEALTH_WATCHDOG_INTERVAL_SECONDS = 30  # Frecuencia de revisión de los componentes en segundo plano
+HEALTH_JOB_STALL_SECONDS = 900  # Una ejecución de tarea más larga que esto se considera atascada
+HEALTH_LONG_JOB_STALL_SECONDS = 3 * 3600  # Lo mismo para las tareas largas (seguridad, retención, copias de seguridad)
+HEALTH_ALERT_INTERVAL_SECONDS = 1800  # Como máximo una alerta por componente en este intervalo
+
+# Configuración del perfilador bajo demanda (/admin/profile, /admin/threads)
+PROFILER_MAX_SECONDS = 25  # Por debajo del timeout de 30 s de los workers de gunicorn
+PROFILER_DEFAULT_INTERVAL_MS = 10  # Intervalo entre muestras de pilas
+
+# Configuración de las URLs de las APIs externas (en pruebas, los stubs de benchmarks/stubs.py)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org').rstrip('/')  # API de Bot de Telegram
+PAYPAL_API_URL = (os.getenv('PAYPAL_API_URL') or '').rstrip('/')  # Vacía: la de PAYPAL_MODE (sandbox o live)
+
+# Configuración de los contadores de estadísticas (panel y /stats)
+STATS_HOURLY_RETENTION_DAYS = 35  # Horas guardadas por contador: la ventana más larga consultada es de 30 días
+STATS_PRUNE_INTERVAL_SECONDS = 3600  # Limpieza de las horas antiguas
+
+# Configuración de los rollups diarios de ingresos y bajas (/admin/revenue-trend)
+ROLLUP_REFRESH_INTERVAL_SECONDS = 900  # Cada cuánto se recalculan los últimos días
+ROLLUP_LOOKBACK_DAYS = 2  # Días anteriores a la marca de agua que se recalculan (se amplía para cubrir el periodo de gracia)
+
+# Configuración del panel de administración (/admin/panel y /admin/api/summary)
+ADMIN_SUMMARY_CACHE_SECONDS = 15  # Vida de la instantánea de datos del panel
+ADMIN_PANEL_REFRESH_SECONDS = 30  # Cada cuánto el panel vuelve a pedir la instantánea (304 si no cambió)
+
+# Configuración de los eventos en vivo del panel (/admin/events, Server-Sent Events)
+EVENTS_HISTORY_SIZE = 500  # Eventos recientes guardados para los clientes que se reconectan
+EVENTS_CLIENT_QUEUE_SIZE = 200  # Eventos pendientes por cliente antes de pedirle que se resincronice
+SSE_MAX_CLIENTS = 10  # Conexiones abiertas a la vez (cada una ocupa un hilo del servidor)
+SSE_HEARTBEAT_SECONDS = 15  # Comentario keepalive cuando no hay eventos
+SSE_STREAM_MAX_SECONDS = 300  # Duración máxima de una conexión; el navegador se reconecta solo
+
+# Configuración de los listados paginados (/admin/api/subscriptions, /admin/api/users y /whitelist list)
+ADMIN_PAGE_SIZE = 50  # Filas por página si no se indica limit
+ADMIN_PAGE_SIZE_MAX = 500  # Máximo de filas por página
+WHITELIST_PAGE_SIZE = 10  # Usuarios por mensaje en /whitelist list (límite de 4096 caracteres de Telegram)
+
+# Configuración de la consola SQL de solo lectura (/admin/sql)
+SQL_CONSOLE_TIMEOUT_SECONDS = 5  # Tiempo máximo de una consulta con respuesta JSON
+SQL_CONSOLE_MAX_ROWS = 1000  # Filas devueltas en JSON (truncated indica si había más)
+SQL_CONSOLE_EXPORT_TIMEOUT_SECONDS = 120  # Tiempo máximo de una exportación CSV/NDJSON, envío incluido
+SQL_CONSOLE_EXPORT_MAX_ROWS = 500000  # Filas máximas de una exportación
+
+# Configuración de las copias de seguridad (/admin/backups y /admin/download-database)
+BACKUP_DIR = os.getenv('BACKUP_DIR', os.path.join(os.path.dirname(DB_PATH), 'backups'))  # En el mismo disco persistente que la base de datos
+BACKUP_CRON = os.getenv('BACKUP_CRON', '15 */6 * * *')  # Cada 6 horas (UTC)
+BACKUP_RETENTION_COUNT = int(os.getenv('BACKUP_RETENTION_COUNT', 8))  # Copias guardadas; las más antiguas se borran
+BACKUP_PAGES_PER_STEP = 256  # Páginas copiadas por paso; entre pasos los escritores no esperan
+BACKUP_STEP_SLEEP_SECONDS = 0.005  # Pausa entre pasos de la copia
+
+# Configuración de la retención y el archivado de datos antiguos (/admin/retention)
+RETENTION_CRON = os.getenv('RETENTION_CRON', '45 3 * * *')  # Diaria (UTC), después de la copia de las 03:15
+RETENTION_BATCH_SIZE = 500  # Filas movidas por transacción
+RETENTION_BATCH_PAUSE_SECONDS = 0.05  # Pausa entre lotes para dejar pasar a los escritores
+RETENTION_ARCHIVE_DIR = os.getenv('RETENTION_ARCHIVE_DIR', os.path.join(os.path.dirname(DB_PATH), 'archive'))  # NDJSON comprimidos
+RETENTION_PROCESSED_PAYMENTS_DAYS = 90  # Eventos de pago procesados (PayPal reintenta los webhooks durante pocos días)
+RETENTION_RENEWAL_NOTIFICATIONS_DAYS = 90  # Avisos de renovación enviados
+RETENTION_FAILED_EXPULSIONS_DAYS = 30  # Expulsiones fallidas ya procesadas
+RETENTION_EXPULSIONS_DAYS = 365  # Historial de expulsiones (pasa a expulsions_archive)
+RETENTION_INVITE_LINKS_DAYS = 30  # Enlaces de invitación caducados (pasan a invite_links_archive)
+RETENTION_EXPIRED_SUBSCRIPTIONS_DAYS = 365  # Suscripciones EXPIRED desde su fecha de fin (pasan a subscriptions_archive)
+
+# Configuración de la réplica de solo lectura para informes (/stats, estadísticas de renovaciones y consola SQL)
+REPLICA_ENABLED = os.getenv('REPLICA_ENABLED', 'true').lower() == 'true'  # false: todos los informes leen de la base de datos principal
+REPLICA_DB_PATH = os.getenv('REPLICA_DB_PATH', os.path.join(os.path.dirname(DB_PATH), 'replica', os.path.basename(DB_PATH)))
+REPLICA_REFRESH_SECONDS = int(os.getenv('REPLICA_REFRESH_SECONDS', 120))  # Cada cuánto se vuelve a copiar la principal
+REPLICA_MAX_STALENESS_SECONDS = int(os.getenv('REPLICA_MAX_STALENESS_SECONDS', 600))  # Más antigua que esto: se lee de la principal
@@ -1,24 +1,49 @@
 import sqlite3
 import datetime
+import time
+import base64
+import json
 from typing import Dict, List, Optional, Tuple, Any
 from config import DB_PATH
 from config import SUBSCRIPTION_GRACE_PERIOD_HOURS
+from config import STATS_HOURLY_RETENTION_DAYS
 import logging  # Añade esta línea
+from db_instrumentation import InstrumentedConnection
+import events
+import replica
 
 # Configurar logging si no está configurado
 logger = logging.getLogger(__name__)
 
 def get_db_connection():
     """Establece una conexión a la base de datos SQLite"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH, factory=InstrumentedConnection)
     conn.row_factory = sqlite3.Row  # Para acceder a las columnas por nombre
     return conn
 
+def get_read_connection():
+    """
+    Conexión de solo lectura para informes: la réplica si está al día (ver
+    replica.py) o la base de datos principal. Nunca para escrituras ni para
+    decisiones de pago o acceso. conn.data_source indica de dónde leyó
+    """
+    path, source = replica.select_read_path()
+    if source['source'] == 'replica':
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, factory=InstrumentedConnection)
+        conn.row_factory = sqlite3.Row
+    else:
+        conn = get_db_connection()
+    conn.data_source = source
+    return conn
+
 def init_db():
     """Inicializa la base de datos creando las tablas si no existen"""
     conn = get_db_connection()
     cursor = conn.cursor()
     
+    # Solo tiene efecto al crear el archivo; las bases de datos existentes las convierte retention.py
+    cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    
     # Tabla de usuarios (existente)
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS users (
@@ -102,10 +127,94 @@ def init_db():
     )
     ''')
     
+    # Tabla de leases del planificador (elección de líder entre procesos)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS scheduler_leases (
+        name TEXT PRIMARY KEY,
+        owner TEXT,
+        acquired_at REAL,
+        expires_at REAL
+    )
+    ''')
+    
+    # ID de correlación del checkout (une la suscripción con sus spans de trazas)
+    cursor.execute("PRAGMA table_info(subscriptions)")
+    subscription_columns = [column[1] for column in cursor.fetchall()]
+    if 'correlation_id' not in subscription_columns:
+        cursor.execute('ALTER TABLE subscriptions ADD COLUMN correlation_id TEXT')
+    
+    # Fecha del último cambio de estado (fecha de las cancelaciones en los rollups diarios)
+    if 'status_changed_at' not in subscription_columns:
+        cursor.execute('ALTER TABLE subscriptions ADD COLUMN status_changed_at TIMESTAMP')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS subscriptions_status_changed
+    AFTER UPDATE OF status ON subscriptions
+    WHEN OLD.status IS NOT NEW.status
+    BEGIN
+        UPDATE subscriptions SET status_changed_at = CURRENT_TIMESTAMP WHERE sub_id = NEW.sub_id;
+    END
+    ''')
+    # Bajas de la ventana del refresco incremental de los rollups (ver compute_daily_rollups)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_subscriptions_status_changed ON subscriptions (status_changed_at)')
+    
+    # Tabla de spans de trazas del checkout (tiempo por etapa, ver tracing.py)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS trace_spans (
+        span_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        correlation_id TEXT NOT NULL,
+        stage TEXT NOT NULL,
+        user_id INTEGER,
+        started_at REAL,
+        ended_at REAL,
+        duration_ms REAL,
+        status TEXT,
+        detail TEXT
+    )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_trace_spans_correlation ON trace_spans (correlation_id, stage)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_trace_spans_started ON trace_spans (started_at)')
+    
+    # Índices de las consultas del panel (suscripciones y usuarios recientes, renovaciones,
+    # listados paginados por end_date y created_at) y de las consultas por usuario (has_valid_subscription). No se indexa status: con
+    # pocos valores distintos, recorrer la tabla es más rápido que saltar por el índice
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_subscriptions_start ON subscriptions (start_date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_subscriptions_end ON subscriptions (end_date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_subscriptions_user ON subscriptions (user_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_created ON users (created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_subscription_renewals_sub ON subscription_renewals (sub_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_subscription_renewals_date ON subscription_renewals (renewal_date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_expulsions_date ON expulsions (date)')
+    
+    # Rollups diarios por plan (altas, renovaciones, ingresos, bajas y activas al cierre, ver rollups.py)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS daily_rollups (
+        day TEXT NOT NULL,
+        plan TEXT NOT NULL,
+        new_subscriptions INTEGER NOT NULL DEFAULT 0,
+        renewals INTEGER NOT NULL DEFAULT 0,
+        revenue_usd REAL NOT NULL DEFAULT 0,
+        cancellations INTEGER NOT NULL DEFAULT 0,
+        expirations INTEGER NOT NULL DEFAULT 0,
+        active_end_of_day INTEGER NOT NULL DEFAULT 0,
+        active_value_usd REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, plan)
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS rollup_watermarks (
+        name TEXT PRIMARY KEY,
+        day TEXT,
+        updated_at TIMESTAMP
+    )
+    ''')
+    
     create_processed_payments_table()
 
     conn.commit()
     conn.close()
+    
+    init_stats_counters()
+    init_subscription_events()
 
 def record_subscription_renewal(sub_id, user_id, plan, amount_usd, previous_end_date, new_end_date, payment_id=None, status="COMPLETED"):
     """
@@ -137,6 +246,11 @@ def record_subscription_renewal(sub_id, user_id, plan, amount_usd, previous_end_
     conn.commit()
     conn.close()
     
+    events.publish('subscription_renewed', {
+        'renewal_id': renewal_id, 'sub_id': sub_id, 'user_id': user_id, 'plan': plan,
+        'amount_usd': amount_usd, 'new_end_date': new_end_date
+    })
+    
     return renewal_id
 
 def record_renewal_notification(sub_id, user_id):
@@ -409,7 +523,8 @@ def create_subscription(
     end_date: datetime.datetime, 
     status: str = 'ACTIVE', 
     paypal_sub_id: str = None,
-    is_recurring: bool = None  # Opcional
+    is_recurring: bool = None,  # Opcional
+    correlation_id: str = None  # ID de correlación del checkout (trazas)
 ) -> int:
     """
     Crea una nueva suscripción con duración exacta calculada en horas
@@ -442,13 +557,18 @@ def create_subscription(
         logger.info(f"Fecha inicio: {start_date}, Fecha fin calculada: {end_date}")
         
         cursor.execute('''
-        INSERT INTO subscriptions (user_id, plan, price_usd, start_date, end_date, status, paypal_sub_id, is_recurring)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, plan, price_usd, start_date, end_date, status, paypal_sub_id, is_recurring))
+        INSERT INTO subscriptions (user_id, plan, price_usd, start_date, end_date, status, paypal_sub_id, is_recurring, correlation_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, plan, price_usd, start_date, end_date, status, paypal_sub_id, is_recurring, correlation_id))
         
         sub_id = cursor.lastrowid
         conn.commit()
         
+        events.publish('subscription_created', {
+            'sub_id': sub_id, 'user_id': user_id, 'plan': plan, 'price_usd': price_usd,
+            'status': status, 'end_date': end_date, 'whitelist': paypal_sub_id is None
+        })
+        
         return sub_id
     
     except Exception as e:
@@ -533,6 +653,10 @@ def update_subscription_status(sub_id: int, status: str) -> bool:
     conn.commit()
     conn.close()
     
+    if affected > 0:
+        event_type = {'CANCELLED': 'subscription_cancelled', 'EXPIRED': 'subscription_expired'}.get(status, 'subscription_status')
+        events.publish(event_type, {'sub_id': sub_id, 'status': status})
+    
     return affected > 0
 
 def extend_subscription(sub_id: int, new_end_date: datetime.datetime) -> bool:
@@ -785,6 +909,8 @@ def record_expulsion(user_id: int, reason: str) -> int:
     conn.commit()
     conn.close()
     
+    events.publish('user_expelled', {'expel_id': expel_id, 'user_id': user_id, 'reason': reason})
+    
     return expel_id
 
 def get_user_expulsions(user_id: int) -> List[Dict]:
@@ -833,20 +959,24 @@ def get_active_subscriptions_count(conn=None):
         conn = get_db_connection()
         close_conn = True
     
+    # Vigentes: ACTIVE normales o en periodo de gracia
+    valid_condition = f"""
+        status = 'ACTIVE' AND (
+            end_date > datetime('now')
+            OR (is_recurring = 1 AND paypal_sub_id IS NOT NULL 
+                AND datetime(end_date) BETWEEN datetime('now', '-{SUBSCRIPTION_GRACE_PERIOD_HOURS} hour') AND datetime('now'))
+        )
+    """
     cursor = conn.cursor()
     cursor.execute(f"""
-    SELECT COUNT(*) FROM subscriptions 
-    WHERE 
-        -- Suscripciones ACTIVE normales
-        (status = 'ACTIVE' AND end_date > datetime('now'))
-        OR
-        -- Suscripciones en periodo de gracia con renovaciones recientes
-        (status = 'ACTIVE' AND is_recurring = 1 AND paypal_sub_id IS NOT NULL 
-         AND datetime(end_date) BETWEEN datetime('now', '-{SUBSCRIPTION_GRACE_PERIOD_HOURS} hour') AND datetime('now'))
-        OR
-        -- Suscripciones con renovaciones recientes (detectadas por la tabla de renovaciones)
-        (sub_id IN (SELECT sub_id FROM subscription_renewals 
-                   WHERE renewal_date >= datetime('now', '-36 hour')))
+    SELECT
+        (SELECT COUNT(*) FROM subscriptions WHERE {valid_condition})
+        +
+        -- Suscripciones con renovaciones recientes (detectadas por la tabla de renovaciones) que no se contaron ya
+        (SELECT COUNT(*) FROM subscriptions
+         WHERE sub_id IN (SELECT sub_id FROM subscription_renewals 
+                          WHERE renewal_date >= datetime('now', '-36 hour'))
+         AND NOT COALESCE(({valid_condition}), 0))
     """)
     count = cursor.fetchone()[0]
     
@@ -855,6 +985,963 @@ def get_active_subscriptions_count(conn=None):
     
     return count
 
+# Contadores de estadísticas mantenidos por triggers
+#
+# stats_counters guarda el total de filas de cada tabla (y de suscripciones por
+# plan) y stats_hourly cuántas filas se crearon en cada hora, según la fecha de
+# la propia fila. Los triggers los actualizan dentro de la misma transacción
+# que inserta o borra la fila, así que el panel y /stats los leen sin recorrer
+# las tablas. Las ventanas (últimas 24 horas, 30 días) se suman por horas
+# completas.
+
+# Tabla contada -> columna con la fecha de creación de la fila
+STATS_COUNTED_TABLES = {
+    'users': 'created_at',
+    'subscriptions': 'start_date',
+    'invite_links': 'created_at',
+    'subscription_renewals': 'renewal_date',
+    'expulsions': 'date',
+}
+
+def _hour_bucket(expression):
+    """Expresión SQL de la hora (UTC) de una fecha; si no se puede interpretar, la hora actual"""
+    return f"COALESCE(strftime('%Y-%m-%d %H:00:00', {expression}), strftime('%Y-%m-%d %H:00:00', 'now'))"
+
+def _stats_triggers():
+    """Sentencias CREATE TRIGGER de los contadores"""
+    triggers = []
+    for table, column in STATS_COUNTED_TABLES.items():
+        insert_actions = [
+            f"INSERT INTO stats_counters (name, value) VALUES ('{table}', 1) "
+            f"ON CONFLICT(name) DO UPDATE SET value = value + 1;",
+            f"INSERT INTO stats_hourly (bucket, name, value) VALUES ({_hour_bucket('NEW.' + column)}, '{table}', 1) "
+            f"ON CONFLICT(bucket, name) DO UPDATE SET value = value + 1;",
+        ]
+        delete_actions = [
+            f"UPDATE stats_counters SET value = value - 1 WHERE name = '{table}';",
+        ]
+        if table == 'subscriptions':
+            insert_actions.append(
+                "INSERT INTO stats_counters (name, value) VALUES ('subscriptions_plan:' || COALESCE(NEW.plan, ''), 1) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + 1;")
+            delete_actions.append(
+                "UPDATE stats_counters SET value = value - 1 WHERE name = 'subscriptions_plan:' || COALESCE(OLD.plan, '');")
+        if table == 'subscription_renewals':
+            insert_actions.append(
+                f"INSERT INTO stats_hourly (bucket, name, value) "
+                f"VALUES ({_hour_bucket('NEW.renewal_date')}, 'renewal_amount_usd', COALESCE(NEW.amount_usd, 0)) "
+                f"ON CONFLICT(bucket, name) DO UPDATE SET value = value + excluded.value;")
+        triggers.append(f"CREATE TRIGGER IF NOT EXISTS stats_{table}_insert AFTER INSERT ON {table} "
+                        f"BEGIN {' '.join(insert_actions)} END")
+        triggers.append(f"CREATE TRIGGER IF NOT EXISTS stats_{table}_delete AFTER DELETE ON {table} "
+                        f"BEGIN {' '.join(delete_actions)} END")
+    return triggers
+
+def init_stats_counters():
+    """
+    Crea las tablas y los triggers de los contadores. La primera vez (contadores
+    vacíos) los inicializa con los datos existentes, en la misma transacción que
+    crea los triggers para que ninguna inserción concurrente se cuente dos veces
+    ni se pierda.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+        ''')
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stats_hourly (
+            bucket TEXT NOT NULL,
+            name TEXT NOT NULL,
+            value REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (bucket, name)
+        )
+        ''')
+        conn.commit()
+        
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('SELECT COUNT(*) FROM stats_counters')
+        if cursor.fetchone()[0] == 0:
+            since = f"strftime('%Y-%m-%d %H:00:00', 'now', '-{STATS_HOURLY_RETENTION_DAYS} day')"
+            for table, column in STATS_COUNTED_TABLES.items():
+                cursor.execute(f"INSERT INTO stats_counters (name, value) SELECT '{table}', COUNT(*) FROM {table}")
+                cursor.execute(f'''
+                INSERT INTO stats_hourly (bucket, name, value)
+                SELECT bucket, '{table}', COUNT(*) FROM (
+                    SELECT {_hour_bucket(column)} AS bucket FROM {table}
+                ) WHERE bucket >= {since}
+                GROUP BY bucket
+                ''')
+            cursor.execute('''
+            INSERT INTO stats_counters (name, value)
+            SELECT 'subscriptions_plan:' || COALESCE(plan, ''), COUNT(*) FROM subscriptions GROUP BY plan
+            ''')
+            cursor.execute(f'''
+            INSERT INTO stats_hourly (bucket, name, value)
+            SELECT bucket, 'renewal_amount_usd', SUM(amount) FROM (
+                SELECT {_hour_bucket('renewal_date')} AS bucket, COALESCE(amount_usd, 0) AS amount
+                FROM subscription_renewals
+            ) WHERE bucket >= {since}
+            GROUP BY bucket
+            ''')
+            logger.info("📊 Contadores de estadísticas inicializados con los datos existentes")
+        
+        for trigger in _stats_triggers():
+            cursor.execute(trigger)
+        conn.commit()
+        
+    except Exception as e:
+        logger.error(f"Error al inicializar los contadores de estadísticas: {e}")
+        conn.rollback()
+        
+    finally:
+        conn.close()
+
+def get_stats_counters(conn=None) -> Dict[str, int]:
+    """Todos los contadores: nombre de tabla -> filas, 'subscriptions_plan:<plan>' -> suscripciones"""
+    close_conn = False
+    if conn is None:
+        conn = get_db_connection()
+        close_conn = True
+    
+    cursor = conn.cursor()
+    cursor.execute("SELECT name, value FROM stats_counters")
+    counters = {row[0]: row[1] for row in cursor.fetchall()}
+    
+    if close_conn:
+        conn.close()
+    
+    return counters
+
+def get_hourly_stat(name: str, hours: int, conn=None) -> float:
+    """Suma de un contador horario en las últimas N horas completas (incluida la actual)"""
+    close_conn = False
+    if conn is None:
+        conn = get_db_connection()
+        close_conn = True
+    
+    cursor = conn.cursor()
+    cursor.execute("""
+    SELECT COALESCE(SUM(value), 0) FROM stats_hourly
+    WHERE name = ? AND bucket >= strftime('%Y-%m-%d %H:00:00', 'now', ?)
+    """, (name, f"-{max(int(hours) - 1, 0)} hour"))
+    total = cursor.fetchone()[0]
+    
+    if close_conn:
+        conn.close()
+    
+    return total
+
+def prune_stats_hourly(days: int = STATS_HOURLY_RETENTION_DAYS) -> int:
+    """Borra las horas más antiguas que la ventana más larga que se consulta"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute("""
+        DELETE FROM stats_hourly WHERE bucket < strftime('%Y-%m-%d %H:00:00', 'now', ?)
+        """, (f"-{int(days)} day",))
+        deleted = cursor.rowcount
+        conn.commit()
+        return deleted
+        
+    finally:
+        conn.close()
+
+# Registro de eventos de suscripciones (solo inserción)
+#
+# Cada cambio de una fila de subscriptions añade un evento a subscription_events
+# desde un trigger, en la misma transacción que el cambio: ninguna ruta de
+# escritura (funciones de este módulo, UPDATE en lote del barrido, consola SQL
+# con allow_write, retención) puede cambiar el estado sin dejar rastro. Cada
+# evento guarda el estado completo de la suscripción después del cambio, así que
+# el último evento de cada sub_id es su fila actual (ver event_log.py, que
+# reconstruye y verifica la tabla). Las expulsiones se registran también, como
+# eventos del usuario sin estado. Otros triggers impiden modificar o borrar eventos.
+
+SUBSCRIPTION_EVENT_COLUMNS = ('user_id', 'plan', 'price_usd', 'start_date', 'end_date', 'status',
+                              'paypal_sub_id', 'is_recurring', 'correlation_id', 'status_changed_at')
+SUBSCRIPTION_EVENT_TYPES = ('snapshot', 'created', 'whitelisted', 'extended', 'cancelled', 'expired',
+                            'updated', 'deleted', 'expelled')
+# Eventos que no cambian el estado de la suscripción (no cuentan al reconstruirla)
+STATELESS_EVENT_TYPES = ('expelled',)
+
+def subscription_event_triggers():
+    """Sentencias CREATE TRIGGER del registro de eventos (también las recrea event_log.apply)"""
+    columns = ', '.join(SUBSCRIPTION_EVENT_COLUMNS)
+    
+    def values(row, overrides=None):
+        overrides = overrides or {}
+        return ', '.join(overrides.get(column, f"{row}.{column}") for column in SUBSCRIPTION_EVENT_COLUMNS)
+    
+    # status_changed_at lo actualiza después el trigger subscriptions_status_changed
+    # con el mismo CURRENT_TIMESTAMP (fijo durante toda la sentencia)
+    update_values = values('NEW', {'status_changed_at': "CASE WHEN OLD.status IS NOT NEW.status "
+                                                        "THEN CURRENT_TIMESTAMP ELSE NEW.status_changed_at END"})
+    # Solo las columnas del estado: la actualización de status_changed_at no es un evento nuevo
+    changed = ' OR '.join(f"OLD.{column} IS NOT NEW.{column}" for column in SUBSCRIPTION_EVENT_COLUMNS
+                          if column != 'status_changed_at')
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS subscription_events_insert AFTER INSERT ON subscriptions
+        BEGIN
+            INSERT INTO subscription_events (sub_id, event_type, {columns})
+            VALUES (NEW.sub_id, CASE WHEN NEW.paypal_sub_id IS NULL THEN 'whitelisted' ELSE 'created' END,
+                    {values('NEW')});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS subscription_events_update AFTER UPDATE ON subscriptions
+        WHEN {changed}
+        BEGIN
+            INSERT INTO subscription_events (sub_id, event_type, {columns}, details)
+            VALUES (NEW.sub_id,
+                    CASE
+                        WHEN NEW.status = 'CANCELLED' AND OLD.status IS NOT 'CANCELLED' THEN 'cancelled'
+                        WHEN NEW.status = 'EXPIRED' AND OLD.status IS NOT 'EXPIRED' THEN 'expired'
+                        WHEN datetime(NEW.end_date) > datetime(OLD.end_date) THEN 'extended'
+                        ELSE 'updated'
+                    END,
+                    {update_values},
+                    json_object('previous_status', OLD.status, 'previous_end_date', OLD.end_date));
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS subscription_events_delete AFTER DELETE ON subscriptions
+        BEGIN
+            INSERT INTO subscription_events (sub_id, event_type, {columns})
+            VALUES (OLD.sub_id, 'deleted', {values('OLD')});
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS subscription_events_expulsion AFTER INSERT ON expulsions
+        BEGIN
+            INSERT INTO subscription_events (sub_id, event_type, user_id, details)
+            VALUES ((SELECT MAX(sub_id) FROM subscriptions WHERE user_id = NEW.user_id), 'expelled',
+                    NEW.user_id, json_object('reason', NEW.reason));
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS subscription_events_no_update BEFORE UPDATE ON subscription_events
+        BEGIN SELECT RAISE(ABORT, 'subscription_events es de solo inserción'); END""",
+        """CREATE TRIGGER IF NOT EXISTS subscription_events_no_delete BEFORE DELETE ON subscription_events
+        BEGIN SELECT RAISE(ABORT, 'subscription_events es de solo inserción'); END""",
+    ]
+
+def init_subscription_events():
+    """
+    Crea el registro de eventos y sus triggers. La primera vez guarda un evento
+    'snapshot' con el estado actual de cada suscripción existente, en la misma
+    transacción que crea los triggers (como init_stats_counters)
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS subscription_events (
+            event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sub_id INTEGER,
+            user_id INTEGER,
+            event_type TEXT NOT NULL,
+            occurred_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            plan TEXT,
+            price_usd REAL,
+            start_date TIMESTAMP,
+            end_date TIMESTAMP,
+            status TEXT,
+            paypal_sub_id TEXT,
+            is_recurring BOOLEAN,
+            correlation_id TEXT,
+            status_changed_at TIMESTAMP,
+            details TEXT
+        )
+        ''')
+        # Reconstrucción (último evento de cada sub_id) y línea de tiempo de cada usuario
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_subscription_events_sub ON subscription_events (sub_id, event_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_subscription_events_user ON subscription_events (user_id, event_id)')
+        conn.commit()
+        
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('SELECT 1 FROM subscription_events LIMIT 1')
+        if cursor.fetchone() is None:
+            columns = ', '.join(SUBSCRIPTION_EVENT_COLUMNS)
+            cursor.execute(f'''
+            INSERT INTO subscription_events (sub_id, event_type, {columns}, details)
+            SELECT sub_id, 'snapshot', {columns}, json_object('backfill', 1) FROM subscriptions ORDER BY sub_id
+            ''')
+            if cursor.rowcount > 0:
+                logger.info(f"📜 Registro de eventos inicializado con {cursor.rowcount} suscripciones existentes")
+        
+        for trigger in subscription_event_triggers():
+            cursor.execute(trigger)
+        conn.commit()
+        
+    except Exception as e:
+        logger.error(f"Error al inicializar el registro de eventos de suscripciones: {e}")
+        conn.rollback()
+        
+    finally:
+        conn.close()
+
+def get_dashboard_counts(conn=None) -> Dict:
+    """Contadores de cabecera del panel y de /admin/database"""
+    close_conn = False
+    if conn is None:
+        conn = get_db_connection()
+        close_conn = True
+    
+    try:
+        counters = get_stats_counters(conn)
+        return {
+            "usuarios": counters.get('users', 0),
+            "suscripciones": counters.get('subscriptions', 0),
+            "suscripciones_activas": get_active_subscriptions_count(conn),
+            "enlaces_invitacion": counters.get('invite_links', 0)
+        }
+        
+    finally:
+        if close_conn:
+            conn.close()
+
+def get_bot_stats() -> Tuple[Dict, List]:
+    """
+    Estadísticas del comando /stats (de los contadores, ver init_stats_counters)
+
+    Se lee de la réplica (ver get_read_connection); stats['data_source'] indica su antigüedad
+
+    Returns:
+        Tuple[Dict, List]: (contadores, [(plan, total), ...] ordenado por popularidad)
+    """
+    conn = get_read_connection()
+    cursor = conn.cursor()
+    
+    try:
+        counters = get_stats_counters(conn)
+        
+        # Estadísticas principales
+        stats = {
+            "usuarios": counters.get('users', 0),
+            "suscripciones": counters.get('subscriptions', 0),
+            "suscripciones_activas": get_active_subscriptions_count(conn),
+            "enlaces_invitacion": counters.get('invite_links', 0),
+            "renovaciones_totales": counters.get('subscription_renewals', 0),
+            "expulsiones_totales": counters.get('expulsions', 0)
+        }
+        
+        # Altas en las últimas 24 horas
+        stats["usuarios_nuevos_24h"] = int(get_hourly_stat('users', 24, conn))
+        stats["suscripciones_nuevas_24h"] = int(get_hourly_stat('subscriptions', 24, conn))
+        stats["renovaciones_24h"] = int(get_hourly_stat('subscription_renewals', 24, conn))
+        
+        # Planes más populares
+        plan_stats = sorted(
+            ((name.split(':', 1)[1], value) for name, value in counters.items()
+             if name.startswith('subscriptions_plan:') and value > 0),
+            key=lambda item: item[1], reverse=True
+        )
+        
+        # Próximas renovaciones en los siguientes 7 días
+        cursor.execute("""
+        SELECT COUNT(*) FROM subscriptions 
+        WHERE status = 'ACTIVE' 
+        AND is_recurring = 1
+        AND date(end_date) BETWEEN date('now') AND date('now', '+7 day')
+        """)
+        stats["renovaciones_proximas_7d"] = cursor.fetchone()[0]
+        stats["data_source"] = conn.data_source
+        
+        return stats, plan_stats
+        
+    finally:
+        conn.close()
+
+def _get_recent_subscriptions(cursor, limit: int) -> List[Dict]:
+    """
+    Últimas suscripciones para el panel: primero las ACTIVE, luego las CANCELLED
+    y después el resto, cada grupo de la más reciente a la más antigua. Cada
+    grupo se lee recorriendo el índice de start_date desde el final, y solo si
+    hace falta.
+    """
+    status_filters = (
+        "s.status = 'ACTIVE'",
+        "s.status = 'CANCELLED'",
+        "(s.status NOT IN ('ACTIVE', 'CANCELLED') OR s.status IS NULL)",
+    )
+    subscriptions = []
+    for status_filter in status_filters:
+        if len(subscriptions) >= limit:
+            break
+        cursor.execute(f"""
+        SELECT 
+            s.sub_id, s.user_id, u.username, s.plan, s.price_usd, s.start_date, s.end_date,
+            s.status, s.is_recurring, s.paypal_sub_id
+        FROM subscriptions s
+        LEFT JOIN users u ON s.user_id = u.user_id
+        WHERE {status_filter}
+        ORDER BY s.start_date DESC
+        LIMIT ?
+        """, (limit - len(subscriptions),))
+        subscriptions.extend(dict(row) for row in cursor.fetchall())
+    
+    if not subscriptions:
+        return subscriptions
+    
+    # Información de renovaciones solo de las suscripciones mostradas
+    sub_ids = [sub['sub_id'] for sub in subscriptions]
+    cursor.execute(f"""
+    SELECT 
+        sub_id,
+        MAX(new_end_date) as max_new_end_date,
+        MAX(renewal_date) as last_renewal_date,
+        COUNT(*) as total_renewals,
+        SUM(CASE 
+            WHEN renewal_date >= datetime('now', '-36 hour') 
+            THEN 1 ELSE 0 
+        END) as recent_renewals_count
+    FROM subscription_renewals
+    WHERE sub_id IN ({','.join('?' * len(sub_ids))})
+    GROUP BY sub_id
+    """, sub_ids)
+    renewals = {row['sub_id']: row for row in cursor.fetchall()}
+    
+    for sub in subscriptions:
+        renewal = renewals.get(sub['sub_id'])
+        # Usar la fecha de fin más reciente considerando renovaciones
+        if (renewal and renewal['max_new_end_date'] is not None and sub['end_date'] is not None
+                and renewal['max_new_end_date'] > sub['end_date']):
+            sub['end_date'] = renewal['max_new_end_date']
+        sub['renovaciones_recientes'] = renewal['recent_renewals_count'] if renewal else 0
+        sub['ultima_renovacion'] = renewal['last_renewal_date'] if renewal else None
+        sub['total_renovaciones'] = renewal['total_renewals'] if renewal else 0
+    
+    return subscriptions
+
+def get_admin_panel_data(subscriptions_limit: int = 10, users_limit: int = 5) -> Dict:
+    """
+    Datos del panel de administración: contadores, suscripciones recientes
+    (con la fecha de fin más reciente según sus renovaciones) y usuarios recientes
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        stats = get_dashboard_counts(conn)
+        
+        recent_subscriptions = _get_recent_subscriptions(cursor, subscriptions_limit)
+        
+        # Usuarios recientes
+        cursor.execute("""
+        SELECT user_id, username, first_name, last_name, created_at
+        FROM users
+        ORDER BY created_at DESC
+        LIMIT ?
+        """, (users_limit,))
+        recent_users = [dict(row) for row in cursor.fetchall()]
+        
+        # Estadísticas de renovaciones de los últimos 30 días
+        cursor.execute("""
+        SELECT COUNT(DISTINCT sub_id) FROM subscription_renewals
+        WHERE renewal_date >= datetime('now', '-30 day')
+        """)
+        stats['subs_renovadas_30d'] = cursor.fetchone()[0] or 0
+        stats['total_renovaciones_30d'] = int(get_hourly_stat('subscription_renewals', 30 * 24, conn))
+        stats['ingresos_renovaciones_30d'] = round(get_hourly_stat('renewal_amount_usd', 30 * 24, conn), 2)
+        
+        return {
+            'stats': stats,
+            'recent_subscriptions': recent_subscriptions,
+            'recent_users': recent_users,
+        }
+        
+    finally:
+        conn.close()
+
+# Listados paginados por cursor (keyset)
+#
+# Cada página continúa desde la clave de la última fila de la anterior
+# ((end_date, sub_id) en suscripciones, (created_at, user_id) en usuarios) en
+# lugar de usar OFFSET: leer la página 100 cuesta lo mismo que leer la primera
+# y las filas insertadas mientras se navega no desplazan ni duplican resultados.
+# La clave recorre el índice de la fecha (que termina en el rowid). Las fechas se
+# comparan como texto: con formatos mixtos el orden dentro de un mismo día puede
+# no ser cronológico, pero cada fila aparece una sola vez.
+
+SUBSCRIPTION_TYPES = ('whitelist', 'paid')
+
+def encode_cursor(key) -> str:
+    """Cursor opaco (base64 de la clave en JSON) para las URLs y los botones"""
+    raw = json.dumps(list(key), separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str, size: int) -> List:
+    """Clave de un cursor. Lanza ValueError si no es válido"""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError("Cursor no válido") from None
+    if not isinstance(key, list) or len(key) != size or not isinstance(key[-1], int):
+        raise ValueError("Cursor no válido")
+    return key
+
+def _keyset_page(cursor, select_sql: str, conditions: List[str], params: List, key: Tuple[Tuple[str, str], ...],
+                 descending: bool, after: str = None, before: str = None, limit: int = 50) -> Dict:
+    """
+    Lee una página ordenada por las columnas de key ((columna SQL, campo), ...).
+    after devuelve la página siguiente a un cursor y before la anterior.
+    
+    Returns:
+        dict: items, next_cursor y prev_cursor (None si no hay más en ese sentido)
+    """
+    backwards = before is not None
+    anchor = before if backwards else after
+    conditions = list(conditions)
+    params = list(params)
+    # Hacia atrás se recorre el índice en sentido contrario y se invierte el resultado
+    reverse = descending != backwards
+    columns = ', '.join(column for column, _ in key)
+    
+    if anchor is not None:
+        values = decode_cursor(anchor, len(key))
+        conditions.append(f"({columns}) {'<' if reverse else '>'} ({', '.join('?' * len(values))})")
+        params.extend(values)
+    
+    query = select_sql
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY " + ", ".join(f"{column} {'DESC' if reverse else 'ASC'}" for column, _ in key)
+    query += " LIMIT ?"
+    params.append(limit + 1)
+    
+    cursor.execute(query, params)
+    items = [dict(row) for row in cursor.fetchall()]
+    has_more = len(items) > limit
+    items = items[:limit]
+    if backwards:
+        items.reverse()
+    
+    def cursor_of(item):
+        return encode_cursor(item[field] for _, field in key)
+    
+    if backwards:
+        next_cursor = cursor_of(items[-1]) if items else None
+        prev_cursor = cursor_of(items[0]) if has_more else None
+    else:
+        next_cursor = cursor_of(items[-1]) if has_more else None
+        prev_cursor = cursor_of(items[0]) if anchor is not None and items else None
+    
+    return {'items': items, 'next_cursor': next_cursor, 'prev_cursor': prev_cursor}
+
+def list_subscriptions(status: str = None, plan: str = None, sub_type: str = None, unexpired_only: bool = False,
+                       after: str = None, before: str = None, limit: int = 50, descending: bool = True) -> Dict:
+    """
+    Página de suscripciones (con los datos del usuario) ordenada por (end_date, sub_id).
+    
+    Args:
+        status: ACTIVE, CANCELLED, EXPIRED...
+        plan: ID del plan
+        sub_type: 'whitelist' (sin paypal_sub_id) o 'paid'
+        unexpired_only: solo las que aún no han llegado a su fecha de fin
+        after / before: cursor de la página siguiente / anterior
+    """
+    if sub_type is not None and sub_type not in SUBSCRIPTION_TYPES:
+        raise ValueError(f"Tipo de suscripción no válido: {sub_type}")
+    
+    conditions, params = [], []
+    if status:
+        conditions.append("s.status = ?")
+        params.append(status)
+    if plan:
+        conditions.append("s.plan = ?")
+        params.append(plan)
+    if sub_type == 'whitelist':
+        conditions.append("s.paypal_sub_id IS NULL")
+    elif sub_type == 'paid':
+        conditions.append("s.paypal_sub_id IS NOT NULL")
+    if unexpired_only:
+        conditions.append("datetime(s.end_date) > datetime('now')")
+    
+    conn = get_db_connection()
+    try:
+        page = _keyset_page(conn.cursor(), """
+        SELECT s.sub_id, s.user_id, u.username, u.first_name, u.last_name, s.plan, s.price_usd,
+               s.start_date, s.end_date, s.status, s.is_recurring, s.paypal_sub_id
+        FROM subscriptions s
+        LEFT JOIN users u ON u.user_id = s.user_id
+        """, conditions, params, (('s.end_date', 'end_date'), ('s.sub_id', 'sub_id')),
+            descending, after, before, limit)
+    finally:
+        conn.close()
+    
+    for item in page['items']:
+        item['is_whitelist'] = item['paypal_sub_id'] is None
+        item['is_recurring'] = bool(item['is_recurring'])
+    return page
+
+def list_users(after: str = None, before: str = None, limit: int = 50, descending: bool = True) -> Dict:
+    """Página de usuarios ordenada por (created_at, user_id)"""
+    conn = get_db_connection()
+    try:
+        return _keyset_page(conn.cursor(), """
+        SELECT user_id, username, first_name, last_name, created_at
+        FROM users
+        """, [], [], (('created_at', 'created_at'), ('user_id', 'user_id')),
+            descending, after, before, limit)
+    finally:
+        conn.close()
+
+def list_renewals(user_id: int = None, plan: str = None, after: str = None, before: str = None,
+                  limit: int = 50, descending: bool = True) -> Dict:
+    """Página de renovaciones (con los datos del usuario) ordenada por (renewal_date, renewal_id)"""
+    conditions, params = [], []
+    if user_id is not None:
+        conditions.append("r.user_id = ?")
+        params.append(user_id)
+    if plan:
+        conditions.append("r.plan = ?")
+        params.append(plan)
+    
+    conn = get_db_connection()
+    try:
+        return _keyset_page(conn.cursor(), """
+        SELECT r.renewal_id, r.sub_id, r.user_id, u.username, u.first_name, u.last_name, r.plan, r.amount_usd,
+               r.previous_end_date, r.new_end_date, r.renewal_date, r.payment_id, r.status
+        FROM subscription_renewals r
+        LEFT JOIN users u ON u.user_id = r.user_id
+        """, conditions, params, (('r.renewal_date', 'renewal_date'), ('r.renewal_id', 'renewal_id')),
+            descending, after, before, limit)
+    finally:
+        conn.close()
+
+def list_expulsions(user_id: int = None, after: str = None, before: str = None,
+                    limit: int = 50, descending: bool = True) -> Dict:
+    """Página de expulsiones (con los datos del usuario) ordenada por (date, expel_id)"""
+    conditions, params = [], []
+    if user_id is not None:
+        conditions.append("e.user_id = ?")
+        params.append(user_id)
+    
+    conn = get_db_connection()
+    try:
+        return _keyset_page(conn.cursor(), """
+        SELECT e.expel_id, e.user_id, u.username, u.first_name, u.last_name, e.reason, e.date
+        FROM expulsions e
+        LEFT JOIN users u ON u.user_id = e.user_id
+        """, conditions, params, (('e.date', 'date'), ('e.expel_id', 'expel_id')),
+            descending, after, before, limit)
+    finally:
+        conn.close()
+
+def get_subscription_cursor(sub_id: int) -> Optional[str]:
+    """
+    Cursor de list_subscriptions situado en una suscripción. Los botones de
+    Telegram guardan solo el sub_id (callback_data admite 64 bytes)
+    """
+    conn = get_db_connection()
+    try:
+        row = conn.execute('SELECT end_date, sub_id FROM subscriptions WHERE sub_id = ?', (sub_id,)).fetchone()
+        return encode_cursor(row) if row else None
+    finally:
+        conn.close()
+
+def get_subscription_timeline(user_id: int, sub_id: int = None, after: str = None, before: str = None,
+                              limit: int = 50, descending: bool = True) -> Dict:
+    """
+    Página de la línea de tiempo de un usuario (ver init_subscription_events),
+    ordenada por event_id: altas, extensiones, cancelaciones, expiraciones,
+    expulsiones... con el estado de la suscripción tras cada evento
+    """
+    conditions, params = ["user_id = ?"], [user_id]
+    if sub_id is not None:
+        conditions.append("sub_id = ?")
+        params.append(sub_id)
+    
+    conn = get_db_connection()
+    try:
+        page = _keyset_page(conn.cursor(), """
+        SELECT event_id, sub_id, event_type, occurred_at, plan, price_usd, start_date, end_date,
+               status, paypal_sub_id, is_recurring, details
+        FROM subscription_events
+        """, conditions, params, (('event_id', 'event_id'),), descending, after, before, limit)
+    finally:
+        conn.close()
+    
+    for item in page['items']:
+        item['details'] = json.loads(item['details']) if item['details'] else None
+    return page
+
+# Rollups diarios de ingresos y bajas
+#
+# daily_rollups guarda por día (UTC) y plan: altas, renovaciones, ingresos
+# (precio de las altas más importe de las renovaciones), cancelaciones,
+# expiraciones y suscripciones activas al cierre del día (con la suma de sus
+# precios, para el MRR). Estas funciones calculan y guardan una ventana de
+# días; la marca de agua y el refresco incremental están en rollups.py.
+
+# Momento en que una suscripción deja de estar activa: su fecha de fin o, si es
+# anterior, el paso a CANCELLED/EXPIRED (cancelación o baja en PayPal antes del fin)
+SUBSCRIPTION_STOP_SQL = """CASE WHEN status IN ('CANCELLED', 'EXPIRED')
+    THEN COALESCE(MIN(datetime(status_changed_at), datetime(end_date)), datetime(status_changed_at), datetime(end_date))
+    ELSE datetime(end_date) END"""
+
+ROLLUP_METRICS = ('new_subscriptions', 'renewals', 'revenue_usd', 'cancellations', 'expirations',
+                  'active_end_of_day', 'active_value_usd')
+
+# Columnas de subscriptions que leen los rollups
+ROLLUP_SUBSCRIPTION_COLUMNS = 'plan, price_usd, start_date, end_date, status, status_changed_at'
+
+def _rollup_subscriptions_source(cursor) -> str:
+    """
+    Origen de las suscripciones de los rollups: la tabla viva más las que la
+    retención movió a subscriptions_archive (ver retention.py), para que un
+    recálculo completo no borre del historial las suscripciones archivadas
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'subscriptions_archive'")
+    if cursor.fetchone() is None:
+        return 'subscriptions'
+    return f"""(SELECT {ROLLUP_SUBSCRIPTION_COLUMNS} FROM subscriptions
+        UNION ALL SELECT {ROLLUP_SUBSCRIPTION_COLUMNS} FROM subscriptions_archive)"""
+
+def _text_date_bounds(first_day: str, last_day: str) -> Tuple[str, str]:
+    """
+    Límites de texto para filtrar por los índices de fechas. Las fechas se guardan
+    en formatos mixtos ('T' o espacio, con o sin zona), así que se deja un día de
+    margen y el filtro exacto se hace con date()
+    """
+    first = datetime.date.fromisoformat(first_day) - datetime.timedelta(days=1)
+    last = datetime.date.fromisoformat(last_day) + datetime.timedelta(days=2)
+    return first.isoformat(), last.isoformat()
+
+def compute_daily_rollups(first_day: str, last_day: str, conn=None,
+                          incremental: bool = False) -> Dict[Tuple[str, str], Dict]:
+    """
+    Calcula los rollups de los días first_day..last_day ('YYYY-MM-DD', incluidos)
+    
+    Con incremental=True, las activas al abrir la ventana se toman de los rollups
+    guardados del día anterior a first_day, y solo se leen las suscripciones con
+    alta, fin o cambio de estado dentro de la ventana (por sus índices). Sin él,
+    se recorren todas las suscripciones (historial completo).
+    
+    Returns:
+        Dict[Tuple[str, str], Dict]: (día, plan) -> métricas de ROLLUP_METRICS
+    """
+    close_conn = False
+    if conn is None:
+        conn = get_db_connection()
+        close_conn = True
+    
+    cursor = conn.cursor()
+    lower, upper = _text_date_bounds(first_day, last_day)
+    rollups = {}
+    
+    def rollup(day, plan):
+        return rollups.setdefault((day, plan), {metric: 0 for metric in ROLLUP_METRICS})
+    
+    try:
+        source = _rollup_subscriptions_source(cursor)
+        
+        # Altas e ingresos de las altas
+        cursor.execute(f"""
+        SELECT day, plan, COUNT(*), SUM(price) FROM (
+            SELECT date(start_date) AS day, COALESCE(plan, '') AS plan, COALESCE(price_usd, 0) AS price
+            FROM {source}
+            WHERE start_date >= ? AND start_date < ?
+        ) WHERE day BETWEEN ? AND ?
+        GROUP BY day, plan
+        """, (lower, upper, first_day, last_day))
+        for day, plan, count, amount in cursor.fetchall():
+            rollup(day, plan)['new_subscriptions'] = count
+            rollup(day, plan)['revenue_usd'] += amount or 0
+        
+        # Renovaciones e ingresos de las renovaciones
+        cursor.execute("""
+        SELECT day, plan, COUNT(*), SUM(amount) FROM (
+            SELECT date(renewal_date) AS day, COALESCE(plan, '') AS plan, COALESCE(amount_usd, 0) AS amount
+            FROM subscription_renewals
+            WHERE renewal_date >= ? AND renewal_date < ?
+        ) WHERE day BETWEEN ? AND ?
+        GROUP BY day, plan
+        """, (lower, upper, first_day, last_day))
+        for day, plan, count, amount in cursor.fetchall():
+            rollup(day, plan)['renewals'] = count
+            rollup(day, plan)['revenue_usd'] += amount or 0
+        
+        # La baja es end_date o status_changed_at: si cae en la ventana, uno de los dos también.
+        # En el cálculo incremental se filtra por ambos índices (y por el de start_date, porque
+        # una baja anterior al alta se cuenta el día del alta)
+        if incremental:
+            window_filter = """AND ((end_date >= ? AND end_date < ?) OR (status_changed_at >= ? AND status_changed_at < ?)
+                OR (start_date >= ? AND start_date < ?))"""
+            window_params = (lower, upper) * 3
+        else:
+            window_filter = ""
+            window_params = ()
+        
+        # Cancelaciones y expiraciones, en el día en que la suscripción dejó de estar activa
+        cursor.execute(f"""
+        SELECT day, plan, SUM(status = 'CANCELLED'), SUM(status = 'EXPIRED') FROM (
+            SELECT date({SUBSCRIPTION_STOP_SQL}) AS day, COALESCE(plan, '') AS plan, status
+            FROM {source}
+            WHERE status IN ('CANCELLED', 'EXPIRED') {window_filter}
+        ) WHERE day BETWEEN ? AND ?
+        GROUP BY day, plan
+        """, (*window_params, first_day, last_day))
+        for day, plan, cancellations, expirations in cursor.fetchall():
+            rollup(day, plan)['cancellations'] = cancellations
+            rollup(day, plan)['expirations'] = expirations
+        
+        # Activas al cierre de cada día: altas hasta ese día menos bajas hasta ese día.
+        # Todo lo anterior a la ventana se acumula en un solo grupo ('')
+        start_filter = "AND start_date >= ? AND start_date < ?" if incremental else ""
+        start_params = (lower, upper) if incremental else ()
+        cursor.execute(f"""
+        SELECT CASE WHEN day < ? THEN '' ELSE day END AS bucket, plan, SUM(delta), SUM(value) FROM (
+            SELECT date(start_date) AS day, COALESCE(plan, '') AS plan,
+                   1 AS delta, COALESCE(price_usd, 0) AS value
+            FROM {source}
+            WHERE date(start_date) IS NOT NULL {start_filter}
+            UNION ALL
+            SELECT MAX(date(start_date), date({SUBSCRIPTION_STOP_SQL})), COALESCE(plan, ''),
+                   -1, -COALESCE(price_usd, 0)
+            FROM {source}
+            WHERE date(start_date) IS NOT NULL AND date({SUBSCRIPTION_STOP_SQL}) IS NOT NULL {window_filter}
+        ) WHERE day <= ?
+        GROUP BY bucket, plan
+        """, (first_day, *start_params, *window_params, last_day))
+        opening = {}
+        deltas = {}
+        for bucket, plan, delta, value in cursor.fetchall():
+            if bucket == '':
+                opening[plan] = (delta, value)
+            else:
+                deltas[(bucket, plan)] = (delta, value)
+        
+        if incremental:
+            # El grupo '' solo tiene las filas del margen de los índices: la apertura es el cierre guardado
+            opening_day = (datetime.date.fromisoformat(first_day) - datetime.timedelta(days=1)).isoformat()
+            cursor.execute("""
+            SELECT plan, active_end_of_day, active_value_usd FROM daily_rollups WHERE day = ?
+            """, (opening_day,))
+            opening = {plan: (active, value) for plan, active, value in cursor.fetchall()}
+        
+        first = datetime.date.fromisoformat(first_day)
+        last = datetime.date.fromisoformat(last_day)
+        for plan in set(opening) | {plan for _, plan in deltas}:
+            active, value = opening.get(plan, (0, 0.0))
+            day = first
+            while day <= last:
+                key = (day.isoformat(), plan)
+                if key in deltas:
+                    active += deltas[key][0]
+                    value += deltas[key][1]
+                if active or key in rollups:
+                    rollup(*key)['active_end_of_day'] = active
+                    rollup(*key)['active_value_usd'] = value
+                day += datetime.timedelta(days=1)
+        
+        for metrics in rollups.values():
+            metrics['revenue_usd'] = round(metrics['revenue_usd'], 2)
+            metrics['active_value_usd'] = round(metrics['active_value_usd'], 2)
+        
+        return rollups
+        
+    finally:
+        if close_conn:
+            conn.close()
+
+def replace_daily_rollups(first_day: str, last_day: str, rollups: Dict[Tuple[str, str], Dict],
+                          watermark: str = 'daily_rollups') -> int:
+    """
+    Sustituye los rollups de first_day..last_day y avanza la marca de agua hasta
+    last_day, en una sola transacción (los lectores nunca ven la ventana a medias)
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute("DELETE FROM daily_rollups WHERE day BETWEEN ? AND ?", (first_day, last_day))
+        cursor.executemany(f"""
+        INSERT INTO daily_rollups (day, plan, {', '.join(ROLLUP_METRICS)})
+        VALUES (?, ?, {', '.join('?' for _ in ROLLUP_METRICS)})
+        """, [(day, plan, *(metrics[metric] for metric in ROLLUP_METRICS))
+              for (day, plan), metrics in sorted(rollups.items())])
+        cursor.execute("""
+        INSERT INTO rollup_watermarks (name, day, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(name) DO UPDATE SET day = excluded.day, updated_at = excluded.updated_at
+        """, (watermark, last_day))
+        conn.commit()
+        return len(rollups)
+        
+    except Exception:
+        conn.rollback()
+        raise
+        
+    finally:
+        conn.close()
+
+def get_rollup_watermark(watermark: str = 'daily_rollups') -> Optional[Dict]:
+    """Último día calculado y fecha del último refresco, o None si nunca se calculó"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute("SELECT day, updated_at FROM rollup_watermarks WHERE name = ?", (watermark,))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+        
+    finally:
+        conn.close()
+
+def get_first_activity_day() -> Optional[str]:
+    """Día de la primera alta o renovación (inicio del backfill de los rollups)"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute(f"""
+        SELECT MIN(day) FROM (
+            SELECT MIN(date(start_date)) AS day FROM {_rollup_subscriptions_source(cursor)}
+            UNION ALL
+            SELECT MIN(date(renewal_date)) FROM subscription_renewals
+        )
+        """)
+        return cursor.fetchone()[0]
+        
+    finally:
+        conn.close()
+
+def get_daily_rollups(first_day: str, last_day: str, plan: str = None) -> List[Dict]:
+    """Rollups de first_day..last_day, ordenados por día y plan"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        query = "SELECT * FROM daily_rollups WHERE day BETWEEN ? AND ?"
+        params = [first_day, last_day]
+        if plan is not None:
+            query += " AND plan = ?"
+            params.append(plan)
+        cursor.execute(query + " ORDER BY day, plan", params)
+        return [dict(row) for row in cursor.fetchall()]
+        
+    finally:
+        conn.close()
+
+def get_rollup_plan_totals() -> Dict[str, Dict]:
+    """Totales históricos por plan: altas, renovaciones, ingresos, cancelaciones y expiraciones"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute("""
+        SELECT plan, SUM(new_subscriptions) AS new_subscriptions, SUM(renewals) AS renewals,
+               ROUND(SUM(revenue_usd), 2) AS revenue_usd, SUM(cancellations) AS cancellations,
+               SUM(expirations) AS expirations
+        FROM daily_rollups
+        GROUP BY plan
+        """)
+        return {row['plan']: dict(row) for row in cursor.fetchall()}
+        
+    finally:
+        conn.close()
+
 def remove_expired_subscriptions():
     """
     Elimina suscripciones expiradas, incluyendo whitelist temporales
@@ -913,6 +2000,29 @@ def close_expired_subscriptions(bot=None):
     
     return expired_users
 
+def _parse_utc(value):
+    """Convierte una fecha ISO de la base de datos en datetime con zona horaria UTC"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+        return parsed if parsed.tzinfo else parsed.replace(tzinfo=datetime.timezone.utc)
+    except Exception as e:
+        logger.error(f"Error parsing date {value}: {e}")
+        return None
+
+def _log_expired_subscription_detail(sub, current_time):
+    """Registra en una línea (nivel DEBUG) el detalle de una suscripción expirada o cancelada"""
+    user_id, sub_id, plan, end_date_str, start_date_str, status, sub_type, is_recurring, paypal_sub_id = sub[:9]
+    end_date = _parse_utc(end_date_str)
+    time_diff = current_time - end_date if end_date else "N/A"
+    logger.debug(
+        "Suscripción %s: user_id=%s sub_id=%s plan=%s tipo=%s recurrente=%s paypal_id=%s inicio=%s fin=%s expirada_hace=%s",
+        status, user_id, sub_id, plan, sub_type, is_recurring, paypal_sub_id,
+        _parse_utc(start_date_str), end_date, time_diff,
+        extra={'log_type': 'subscription_expiry'}
+    )
+
 def check_and_update_subscriptions(force=False) -> List[Tuple[int, int, str]]:
     """
     Verifica y actualiza el estado de las suscripciones expiradas y canceladas
@@ -945,6 +2055,13 @@ def check_and_update_subscriptions(force=False) -> List[Tuple[int, int, str]]:
         affected_rows = cursor.rowcount
         logger.info(f"Suscripciones actualizadas a EXPIRED: {affected_rows}")
         
+        # Confirmar ya: has_valid_subscription abre otras conexiones y, si esta
+        # transacción siguiera abierta con muchas páginas modificadas, quedarían
+        # bloqueadas (y cada usuario se consideraría válido tras el timeout)
+        conn.commit()
+        if affected_rows > 0:
+            events.publish('subscriptions_expired', {'count': affected_rows})
+        
         # PASO 2: Obtener todas las suscripciones expiradas o canceladas para procesamiento
         # MEJORA: Siempre incluir suscripciones CANCELLED en la verificación
         if force:
@@ -990,39 +2107,8 @@ def check_and_update_subscriptions(force=False) -> List[Tuple[int, int, str]]:
         
         for sub in expired_subscriptions:
             try:
-                user_id = sub[0]
-                sub_id = sub[1]
-                plan = sub[2]
-                
-                # Fix: Handle timezone consistently when parsing dates
-                end_date_str = sub[3] if sub[3] else None
-                start_date_str = sub[4] if sub[4] else None
-                
-                # Create timezone-aware datetime objects
-                end_date = None
-                if end_date_str:
-                    try:
-                        # Parse the date and make it timezone-aware if it isn't already
-                        end_date = datetime.datetime.fromisoformat(end_date_str.replace('Z', '+00:00'))
-                        if not end_date.tzinfo:
-                            end_date = end_date.replace(tzinfo=datetime.timezone.utc)
-                    except Exception as date_err:
-                        logger.error(f"Error parsing end_date: {date_err}")
-                
-                start_date = None
-                if start_date_str:
-                    try:
-                        # Parse the date and make it timezone-aware if it isn't already
-                        start_date = datetime.datetime.fromisoformat(start_date_str.replace('Z', '+00:00'))
-                        if not start_date.tzinfo:
-                            start_date = start_date.replace(tzinfo=datetime.timezone.utc)
-                    except Exception as date_err:
-                        logger.error(f"Error parsing start_date: {date_err}")
-                
-                status = sub[5] 
+                status = sub[5]
                 sub_type = sub[6]
-                is_recurring = sub[7]
-                paypal_sub_id = sub[8]
                 
                 # Contar por tipo
                 if sub_type == 'WHITELIST':
@@ -1034,37 +2120,10 @@ def check_and_update_subscriptions(force=False) -> List[Tuple[int, int, str]]:
                     cancelled_count += 1
                 elif status == 'EXPIRED':
                     expired_count += 1
-                    
-                time_diff = "N/A"
-                if end_date:
-                    try:
-                        # Asegúrese de que ambas fechas tienen información de zona horaria
-                        if not end_date.tzinfo:
-                            # Si end_date no tiene zona horaria, asignar UTC
-                            end_date = end_date.replace(tzinfo=datetime.timezone.utc)
-                            
-                        if not current_time.tzinfo:
-                            # Si current_time no tiene zona horaria, asignar UTC
-                            current_time = current_time.replace(tzinfo=datetime.timezone.utc)
-                            
-                        # Ahora ambas fechas tienen información de zona horaria y pueden restarse
-                        time_diff = current_time - end_date
-                    except Exception as e:
-                        logger.error(f"Error al calcular diferencia de tiempo: {e}")
-                        time_diff = "N/A"
-                    
-                logger.info(f"""
-                Suscripción {status}:
-                - User ID: {user_id}
-                - Sub ID: {sub_id}
-                - Plan: {plan}
-                - Tipo: {sub_type}
-                - Recurrente: {is_recurring}
-                - PayPal ID: {paypal_sub_id}
-                - Fecha de inicio: {start_date}
-                - Fecha de fin: {end_date}
-                - Tiempo transcurrido desde expiración: {time_diff}
-                """)
+                
+                # El detalle por suscripción solo se calcula con LOG_LEVEL=DEBUG
+                if logger.isEnabledFor(logging.DEBUG):
+                    _log_expired_subscription_detail(sub, current_time)
                 
             except Exception as e:
                 logger.error(f"Error al procesar datos de suscripción: {e}")
@@ -1081,16 +2140,19 @@ def check_and_update_subscriptions(force=False) -> List[Tuple[int, int, str]]:
             
             # MEJORA: Si la suscripción está cancelada, siempre incluirla
             if status == 'CANCELLED':
-                logger.info(f"Incluyendo usuario {user_id} con suscripción CANCELADA (sub_id: {sub_id})")
+                logger.info("Incluyendo usuario %s con suscripción CANCELADA (sub_id: %s)", user_id, sub_id,
+                            extra={'log_type': 'sweep_candidate'})
                 filtered_subscriptions.append((user_id, sub_id, plan))
                 continue
             
             # Verificar que el usuario no tenga ninguna suscripción válida
             if not has_valid_subscription(user_id):  # LÍNEA CORREGIDA - sin el prefijo db.
-                logger.info(f"Usuario {user_id} no tiene suscripciones válidas, incluyendo para expulsión")
+                logger.info("Usuario %s no tiene suscripciones válidas, incluyendo para expulsión", user_id,
+                            extra={'log_type': 'sweep_candidate'})
                 filtered_subscriptions.append((user_id, sub_id, plan))
             else:
-                logger.info(f"Omitiendo usuario {user_id} (sub_id: {sub_id}) porque tiene otra suscripción válida")
+                logger.info("Omitiendo usuario %s (sub_id: %s) porque tiene otra suscripción válida", user_id, sub_id,
+                            extra={'log_type': 'sweep_candidate'})
         
         logger.info(f"Total de suscripciones a procesar después de filtrado: {len(filtered_subscriptions)} de {len(expired_subscriptions)}")
         
@@ -1174,15 +2236,17 @@ def get_users_to_expel() -> List[Tuple[int, str, str]]:
     cursor = conn.cursor()
     
     try:
-        # Obtener usuarios con suscripciones expiradas o canceladas
+        # Obtener usuarios con suscripciones expiradas o canceladas.
+        # CROSS JOIN fija el recorrido desde subscriptions (el filtro no usa índices):
+        # recorrer users e ir por idx_subscriptions_user es más lento
         cursor.execute("""
         SELECT 
             u.user_id, 
             s.status, 
             s.end_date,
             CASE WHEN s.paypal_sub_id IS NULL THEN 'WHITELIST' ELSE 'PAID' END as subscription_type
-        FROM users u
-        JOIN subscriptions s ON u.user_id = s.user_id
+        FROM subscriptions s
+        CROSS JOIN users u ON u.user_id = s.user_id
         WHERE s.status IN ('EXPIRED', 'CANCELLED')
         OR datetime(s.end_date) <= datetime('now')
         GROUP BY u.user_id
@@ -1360,5 +2424,153 @@ def is_whitelist_subscription(sub_id: int) -> bool:
     # Es whitelist si paypal_sub_id es NULL
     return result is not None and result[0] is None
 
+def acquire_lease(name: str, owner: str, ttl_seconds: float) -> bool:
+    """
+    Adquiere o renueva un lease con nombre. Solo un dueño puede tenerlo a la vez;
+    otro proceso puede quedárselo únicamente cuando el lease ha expirado.
+    
+    Args:
+        name (str): Nombre del lease
+        owner (str): Identificador del proceso que lo solicita
+        ttl_seconds (float): Segundos de validez del lease
+        
+    Returns:
+        bool: True si el proceso es el dueño del lease tras la llamada
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        now = time.time()
+        # Bloqueo de escritura inmediato para que la lectura y la escritura sean atómicas
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("SELECT owner, expires_at FROM scheduler_leases WHERE name = ?", (name,))
+        row = cursor.fetchone()
+        
+        if row is not None and row['owner'] != owner and row['expires_at'] > now:
+            conn.rollback()
+            return False
+        
+        acquired_at = now if row is None or row['owner'] != owner else None
+        cursor.execute("""
+        INSERT INTO scheduler_leases (name, owner, acquired_at, expires_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET
+            owner = excluded.owner,
+            acquired_at = COALESCE(?, scheduler_leases.acquired_at),
+            expires_at = excluded.expires_at
+        """, (name, owner, now, now + ttl_seconds, acquired_at))
+        
+        conn.commit()
+        return True
+        
+    except Exception as e:
+        logger.error(f"Error al adquirir lease {name}: {e}")
+        conn.rollback()
+        return False
+        
+    finally:
+        conn.close()
+
+def release_lease(name: str, owner: str) -> None:
+    """Libera un lease si pertenece al proceso indicado"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute("DELETE FROM scheduler_leases WHERE name = ? AND owner = ?", (name, owner))
+        conn.commit()
+    except Exception as e:
+        logger.error(f"Error al liberar lease {name}: {e}")
+    finally:
+        conn.close()
+
+def get_lease(name: str) -> Optional[Dict]:
+    """Obtiene el estado actual de un lease"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute("SELECT * FROM scheduler_leases WHERE name = ?", (name,))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
 # Inicializar la base de datos al importar el módulo
+def record_trace_span(correlation_id: str, stage: str, started_at: float, ended_at: float,
+                      user_id: int = None, status: str = 'ok', detail: str = None) -> bool:
+    """Guarda un span (etapa con inicio y fin en epoch) de una traza de checkout"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('''
+        INSERT INTO trace_spans (correlation_id, stage, user_id, started_at, ended_at, duration_ms, status, detail)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (correlation_id, stage, user_id, started_at, ended_at,
+              round((ended_at - started_at) * 1000, 2), status, detail))
+        conn.commit()
+        return True
+        
+    except Exception as e:
+        logger.error(f"Error al guardar span {stage} de la traza {correlation_id}: {e}")
+        return False
+        
+    finally:
+        conn.close()
+
+def get_trace_span(correlation_id: str, stage: str) -> Optional[Dict]:
+    """Último span de una etapa dentro de una traza"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('''
+        SELECT * FROM trace_spans
+        WHERE correlation_id = ? AND stage = ?
+        ORDER BY span_id DESC LIMIT 1
+        ''', (correlation_id, stage))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+        
+    finally:
+        conn.close()
+
+def get_latest_correlation_id(user_id: int) -> Optional[str]:
+    """ID de correlación de la suscripción más reciente del usuario que tenga uno"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('''
+        SELECT correlation_id FROM subscriptions
+        WHERE user_id = ? AND correlation_id IS NOT NULL
+        ORDER BY sub_id DESC LIMIT 1
+        ''', (user_id,))
+        row = cursor.fetchone()
+        return row['correlation_id'] if row else None
+        
+    finally:
+        conn.close()
+
+def get_trace_spans_since(since_ts: float) -> List[Dict]:
+    """Spans de todas las trazas que empezaron después de since_ts (epoch)"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('''
+        SELECT correlation_id, stage, user_id, started_at, ended_at, duration_ms, status
+        FROM trace_spans
+        WHERE correlation_id IN (
+            SELECT DISTINCT correlation_id FROM trace_spans WHERE started_at >= ?
+        )
+        ORDER BY correlation_id, started_at
+        ''', (since_ts,))
+        return [dict(row) for row in cursor.fetchall()]
+        
+    finally:
+        conn.close()
+
 init_db()
\ No newline at end of file
@@ -0,0 +1,126 @@
+"""
+Instrumentación de las conexiones SQLite.
+
+get_db_connection() abre las conexiones con InstrumentedConnection, que mide
+cada consulta y avisa a los observadores registrados con el SQL, la duración
+y la función que la lanzó (call site). Las métricas y el perfilador de SQL se
+enganchan aquí como observadores; los hooks de conexión se ejecutan al abrir
+cada conexión (por ejemplo, para instalar set_trace_callback).
+"""
+import logging
+import sqlite3
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+# Funciones observer(site, sql, parameters, duration, connection) llamadas tras cada consulta
+_observers = []
+
+# Funciones hook(connection) llamadas al abrir cada conexión
+_connection_hooks = []
+
+# Módulos que se saltan al buscar el call site
+_internal_modules = {__name__}
+
+
+def add_query_observer(observer):
+    """Registra un observador de consultas (idempotente)"""
+    if observer not in _observers:
+        _observers.append(observer)
+
+
+def remove_query_observer(observer):
+    if observer in _observers:
+        _observers.remove(observer)
+
+
+def add_connection_hook(hook):
+    """Registra una función que se ejecuta sobre cada conexión nueva (idempotente)"""
+    if hook not in _connection_hooks:
+        _connection_hooks.append(hook)
+
+
+def register_internal_module(module_name):
+    """Marca un módulo como parte de la instrumentación para que no aparezca como call site"""
+    _internal_modules.add(module_name)
+
+
+def get_call_site():
+    """Devuelve 'modulo.funcion' del primer llamador fuera de esta capa"""
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_globals.get('__name__') in _internal_modules:
+        frame = frame.f_back
+    if frame is None:
+        return 'unknown'
+    return f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_name}"
+
+
+def _notify(sql, parameters, started, connection):
+    if not _observers:
+        return
+    duration = time.perf_counter() - started
+    site = get_call_site()
+    for observer in list(_observers):
+        try:
+            observer(site, sql, parameters, duration, connection)
+        except Exception as e:
+            logger.error(f"Error en observador de consultas SQLite: {e}")
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor que mide execute/executemany/executescript"""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _notify(sql, parameters, started, self.connection)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _notify(sql, None, started, self.connection)
+
+    def executescript(self, sql_script):
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            _notify(sql_script, None, started, self.connection)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Conexión cuyos cursores (y atajos execute*) están instrumentados"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for hook in list(_connection_hooks):
+            try:
+                hook(self)
+            except Exception as e:
+                logger.error(f"Error en hook de conexión SQLite: {e}")
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # Connection.execute no pasa por cursor(), así que se redirige explícitamente
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+    def commit(self):
+        # El COMMIT es donde SQLite escribe a disco: se mide como una consulta más
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            _notify('COMMIT', None, started, self)
@@ -0,0 +1,194 @@
+"""
+Perfilador de consultas SQLite (opcional, SQL_PROFILER_ENABLED=true).
+
+Se engancha a cada conexión abierta con get_db_connection():
+- El observador de db_instrumentation mide cada execute y agrupa por sentencia
+  normalizada (literales sustituidos por ?) y función que la lanza.
+- set_trace_callback cuenta las sentencias que SQLite ejecuta realmente,
+  incluidas las que no pasan por execute (BEGIN implícitos, triggers).
+
+Las consultas que superan SQL_SLOW_QUERY_MS se registran en el log junto con
+su EXPLAIN QUERY PLAN. La tabla agregada se consulta en /admin/sql-profile.
+"""
+import collections
+import logging
+import math
+import re
+import threading
+import time
+
+import db_instrumentation
+from config import SQL_PROFILER_ENABLED, SQL_SLOW_QUERY_MS, SQL_PROFILER_SAMPLES, SQL_SLOW_QUERY_LOG_INTERVAL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+# Solo estas sentencias admiten EXPLAIN QUERY PLAN
+_EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'WITH')
+
+
+def normalize_sql(sql):
+    """Normaliza una sentencia para agrupar ejecuciones con distintos valores"""
+    sql = _WHITESPACE.sub(' ', sql).strip().rstrip(';')
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _PLACEHOLDER_LIST.sub('(?)', sql)
+    return sql[:500]
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, math.ceil(fraction * len(ordered)) - 1)
+    return ordered[index]
+
+
+class QueryProfiler:
+    """Agrega tiempos de consultas por (sentencia normalizada, call site)"""
+
+    def __init__(self, slow_query_ms=SQL_SLOW_QUERY_MS, samples=SQL_PROFILER_SAMPLES,
+                 log_interval=SQL_SLOW_QUERY_LOG_INTERVAL_SECONDS):
+        self.slow_query_ms = slow_query_ms
+        self.samples = samples
+        self.log_interval = log_interval
+        self.enabled = False
+        self.started_at = time.time()
+        self._entries = {}
+        self._last_logged = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def install(self):
+        """Registra el observador y el trace callback en las conexiones nuevas"""
+        db_instrumentation.register_internal_module(__name__)
+        db_instrumentation.add_query_observer(self.observe)
+        db_instrumentation.add_connection_hook(self._install_trace)
+        self.enabled = True
+        logger.info(f"🔬 Perfilador de SQL activado (consultas lentas: >{self.slow_query_ms} ms)")
+
+    def _entry(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = {
+                'count': 0,
+                'traced': 0,
+                'total': 0.0,
+                'max': 0.0,
+                'slow_count': 0,
+                'durations': collections.deque(maxlen=self.samples),
+            }
+            self._entries[key] = entry
+        return entry
+
+    def _install_trace(self, connection):
+        connection.set_trace_callback(self._on_trace)
+
+    def _on_trace(self, statement):
+        if getattr(self._local, 'explaining', False):
+            return
+        key = (normalize_sql(statement), db_instrumentation.get_call_site())
+        with self._lock:
+            self._entry(key)['traced'] += 1
+
+    def observe(self, site, sql, parameters, duration, connection):
+        if getattr(self._local, 'explaining', False):
+            return
+        normalized = normalize_sql(sql)
+        key = (normalized, site)
+        duration_ms = duration * 1000
+        is_slow = duration_ms >= self.slow_query_ms
+
+        with self._lock:
+            entry = self._entry(key)
+            entry['count'] += 1
+            entry['total'] += duration
+            entry['max'] = max(entry['max'], duration)
+            entry['durations'].append(duration)
+            should_log = False
+            if is_slow:
+                entry['slow_count'] += 1
+                now = time.monotonic()
+                if now - self._last_logged.get(key, -math.inf) >= self.log_interval:
+                    self._last_logged[key] = now
+                    should_log = True
+
+        if should_log:
+            plan = self._explain(connection, sql, parameters)
+            logger.warning(
+                f"🐢 Consulta lenta ({duration_ms:.1f} ms) en {site}: {normalized}"
+                + (f"\nPlan:\n{plan}" if plan else "")
+            )
+
+    def _explain(self, connection, sql, parameters):
+        """EXPLAIN QUERY PLAN de la sentencia con los mismos parámetros"""
+        if parameters is None or not sql.lstrip().upper().startswith(_EXPLAINABLE):
+            return None
+        self._local.explaining = True
+        try:
+            rows = connection.execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+            # Filas (id, parent, notused, detail): se indenta según la profundidad
+            depth = {0: 0}
+            lines = []
+            for row in rows:
+                node_id, parent, detail = row[0], row[1], row[3]
+                depth[node_id] = depth.get(parent, 0) + 1
+                lines.append("  " * depth[node_id] + str(detail))
+            return "\n".join(lines)
+        except Exception as e:
+            return f"(no disponible: {e})"
+        finally:
+            self._local.explaining = False
+
+    def get_stats(self, sort='total', limit=50):
+        """Tabla agregada ordenada por 'total', 'p95', 'count' o 'max'"""
+        with self._lock:
+            items = [(key, dict(entry, durations=list(entry['durations']))) for key, entry in self._entries.items()]
+
+        statements = []
+        for (sql, site), entry in items:
+            p95 = _percentile(entry['durations'], 0.95)
+            statements.append({
+                'sql': sql,
+                'site': site,
+                'count': entry['count'],
+                'traced': entry['traced'],
+                'total_ms': round(entry['total'] * 1000, 2),
+                'avg_ms': round(entry['total'] * 1000 / entry['count'], 3) if entry['count'] else None,
+                'p95_ms': round(p95 * 1000, 3) if p95 is not None else None,
+                'max_ms': round(entry['max'] * 1000, 3),
+                'slow_count': entry['slow_count'],
+            })
+
+        sort_keys = {'total': 'total_ms', 'p95': 'p95_ms', 'count': 'count', 'max': 'max_ms'}
+        sort_field = sort_keys.get(sort, 'total_ms')
+        statements.sort(key=lambda item: item[sort_field] or 0, reverse=True)
+
+        return {
+            'enabled': self.enabled,
+            'slow_query_ms': self.slow_query_ms,
+            'since': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self.started_at)),
+            'distinct_statements': len(statements),
+            'statements': statements[:limit],
+        }
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+            self._last_logged.clear()
+        self.started_at = time.time()
+
+
+# Instancia compartida por toda la aplicación
+query_profiler = QueryProfiler()
+
+
+def install_if_enabled():
+    """Activa el perfilador si SQL_PROFILER_ENABLED está definido"""
+    if SQL_PROFILER_ENABLED and not query_profiler.enabled:
+        query_profiler.install()
+    return query_profiler.enabled
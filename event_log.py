@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+"""
+Reconstrucción y verificación de la tabla subscriptions a partir del registro de
+eventos (subscription_events, ver database.init_subscription_events).
+
+El último evento con estado de cada sub_id es su fila actual; si es 'deleted'
+(la fila se borró o se archivó) la suscripción no existe. La reconstrucción es
+una sola consulta agrupada que recorre el índice (sub_id, event_id) y deja el
+resultado en una tabla TEMP de la conexión: no escribe en la base de datos.
+
+- verify(): reconstruye y compara con subscriptions. Por defecto lee de la
+  réplica (ver replica.py), que es una instantánea coherente de ambas tablas,
+  sin bloquear a los escritores de la principal
+- apply(): reconstruye sobre la principal y corrige subscriptions (inserta las
+  que faltan, borra las que no tienen eventos y actualiza las que difieren) en
+  una sola transacción. Los triggers del registro se desactivan mientras tanto:
+  la corrección no es un cambio de estado nuevo
+
+Uso: python event_log.py verify [--primary] | apply | timeline USER_ID [--limit N]
+"""
+import argparse
+import json
+import logging
+import time
+
+import database as db
+import replica
+
+logger = logging.getLogger(__name__)
+
+REBUILD_TABLE = 'temp.subscriptions_rebuilt'
+MISMATCH_SAMPLE_SIZE = 20  # Suscripciones distintas detalladas en el informe
+# Triggers que escriben eventos al cambiar subscriptions (apply los quita y los recrea)
+WRITE_TRIGGERS = ('subscription_events_insert', 'subscription_events_update', 'subscription_events_delete')
+
+COLUMNS = db.SUBSCRIPTION_EVENT_COLUMNS
+
+
+def rebuild(conn):
+    """Reconstruye las suscripciones en REBUILD_TABLE. Devuelve cuántas hay"""
+    column_list = ', '.join(COLUMNS)
+    stateless = ', '.join(f"'{event_type}'" for event_type in db.STATELESS_EVENT_TYPES)
+    conn.execute(f"DROP TABLE IF EXISTS {REBUILD_TABLE}")
+    conn.execute(f"CREATE TABLE {REBUILD_TABLE} (sub_id INTEGER PRIMARY KEY, {column_list})")
+    conn.execute(f"""
+    INSERT INTO {REBUILD_TABLE} (sub_id, {column_list})
+    SELECT sub_id, {column_list} FROM subscription_events
+    WHERE event_id IN (
+        SELECT MAX(event_id) FROM subscription_events
+        WHERE sub_id IS NOT NULL AND event_type NOT IN ({stateless})
+        GROUP BY sub_id
+    ) AND event_type != 'deleted'
+    """)
+    return conn.execute(f"SELECT COUNT(*) FROM {REBUILD_TABLE}").fetchone()[0]
+
+
+def _differences(conn):
+    """(sub_id sin eventos, sub_id solo en los eventos, sub_id con columnas distintas)"""
+    missing = [row[0] for row in conn.execute(f"""
+    SELECT sub_id FROM main.subscriptions WHERE sub_id NOT IN (SELECT sub_id FROM {REBUILD_TABLE}) ORDER BY sub_id
+    """)]
+    unexpected = [row[0] for row in conn.execute(f"""
+    SELECT sub_id FROM {REBUILD_TABLE} WHERE sub_id NOT IN (SELECT sub_id FROM main.subscriptions) ORDER BY sub_id
+    """)]
+    changed = ' OR '.join(f"s.{column} IS NOT r.{column}" for column in COLUMNS)
+    mismatched = [row[0] for row in conn.execute(f"""
+    SELECT s.sub_id FROM main.subscriptions s JOIN {REBUILD_TABLE} r ON r.sub_id = s.sub_id
+    WHERE {changed} ORDER BY s.sub_id
+    """)]
+    return missing, unexpected, mismatched
+
+
+def _mismatch_detail(conn, sub_ids):
+    """Columnas distintas de cada suscripción: {columna: [tabla, eventos]}"""
+    column_list = ', '.join(f"s.{column}, r.{column}" for column in COLUMNS)
+    detail = []
+    for sub_id in sub_ids[:MISMATCH_SAMPLE_SIZE]:
+        row = conn.execute(f"""
+        SELECT {column_list} FROM main.subscriptions s JOIN {REBUILD_TABLE} r ON r.sub_id = s.sub_id
+        WHERE s.sub_id = ?
+        """, (sub_id,)).fetchone()
+        detail.append({
+            'sub_id': sub_id,
+            'columns': {column: [row[2 * i], row[2 * i + 1]] for i, column in enumerate(COLUMNS)
+                        if row[2 * i] != row[2 * i + 1]},
+        })
+    return detail
+
+
+def verify(use_replica=True):
+    """
+    Compara subscriptions con su reconstrucción desde los eventos.
+
+    Returns:
+        dict: ok, recuentos, sub_id distintos (con detalle de los primeros) y origen de los datos
+    """
+    started = time.perf_counter()
+    conn = db.get_read_connection() if use_replica else db.get_db_connection()
+    try:
+        data_source = getattr(conn, 'data_source', replica.source_info(None))
+        # Una sola transacción de lectura: eventos y tabla de la misma instantánea
+        conn.execute('BEGIN')
+        rebuilt = rebuild(conn)
+        rebuild_seconds = time.perf_counter() - started
+        missing, unexpected, mismatched = _differences(conn)
+        report = {
+            'ok': not (missing or unexpected or mismatched),
+            'events': conn.execute("SELECT COUNT(*) FROM subscription_events").fetchone()[0],
+            'subscriptions': conn.execute("SELECT COUNT(*) FROM main.subscriptions").fetchone()[0],
+            'rebuilt': rebuilt,
+            'missing_events': missing,
+            'unexpected': unexpected,
+            'mismatched': mismatched,
+            'mismatch_detail': _mismatch_detail(conn, mismatched),
+            'rebuild_seconds': round(rebuild_seconds, 3),
+            'seconds': round(time.perf_counter() - started, 3),
+            'data_source': data_source,
+        }
+        conn.rollback()
+    finally:
+        conn.close()
+
+    if not report['ok']:
+        logger.warning(f"⚠️ subscriptions no coincide con su registro de eventos: {len(missing)} sin eventos, "
+                       f"{len(unexpected)} solo en los eventos, {len(mismatched)} distintas")
+    return report
+
+
+def apply():
+    """
+    Corrige subscriptions para que coincida con su reconstrucción desde los eventos.
+
+    Returns:
+        dict: filas insertadas, borradas y actualizadas, y duración
+    """
+    started = time.perf_counter()
+    column_list = ', '.join(COLUMNS)
+    conn = db.get_db_connection()
+    # Transacción explícita: el DDL de los triggers y las correcciones se confirman juntos
+    conn.isolation_level = None
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rebuilt = rebuild(conn)
+            missing, unexpected, mismatched = _differences(conn)
+            for trigger in WRITE_TRIGGERS:
+                conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+            conn.execute(f"DELETE FROM main.subscriptions WHERE sub_id NOT IN (SELECT sub_id FROM {REBUILD_TABLE})")
+            conn.execute(f"""
+            INSERT INTO main.subscriptions (sub_id, {column_list})
+            SELECT sub_id, {column_list} FROM {REBUILD_TABLE}
+            WHERE sub_id NOT IN (SELECT sub_id FROM main.subscriptions)
+            """)
+            if mismatched:
+                placeholders = ','.join('?' * len(mismatched))
+                conn.execute(f"""
+                UPDATE main.subscriptions SET ({column_list}) =
+                    (SELECT {column_list} FROM {REBUILD_TABLE} r WHERE r.sub_id = subscriptions.sub_id)
+                WHERE sub_id IN ({placeholders})
+                """, mismatched)
+                # subscriptions_status_changed pone CURRENT_TIMESTAMP al cambiar status: restaurar el de los eventos
+                conn.execute(f"""
+                UPDATE main.subscriptions SET status_changed_at =
+                    (SELECT status_changed_at FROM {REBUILD_TABLE} r WHERE r.sub_id = subscriptions.sub_id)
+                WHERE sub_id IN ({placeholders})
+                """, mismatched)
+
+            for trigger in db.subscription_event_triggers():
+                conn.execute(trigger)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute(f"DROP TABLE IF EXISTS {REBUILD_TABLE}")
+    finally:
+        conn.close()
+
+    result = {
+        'rebuilt': rebuilt,
+        'inserted': len(unexpected),
+        'deleted': len(missing),
+        'updated': len(mismatched),
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+    logger.warning(f"📜 subscriptions reconstruida desde los eventos: {result}")
+    return result
+
+
+def get_event_counts():
+    """Eventos registrados por tipo"""
+    conn = db.get_read_connection()
+    try:
+        rows = conn.execute("SELECT event_type, COUNT(*) FROM subscription_events GROUP BY event_type").fetchall()
+        return {event_type: count for event_type, count in rows}
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Registro de eventos de suscripciones")
+    commands = parser.add_subparsers(dest='command', required=True)
+    verify_parser = commands.add_parser('verify', help="Reconstruye subscriptions y la compara con la tabla")
+    verify_parser.add_argument('--primary', action='store_true', help="Leer de la base de datos principal")
+    commands.add_parser('apply', help="Corrige subscriptions con su reconstrucción desde los eventos")
+    timeline_parser = commands.add_parser('timeline', help="Línea de tiempo de un usuario")
+    timeline_parser.add_argument('user_id', type=int)
+    timeline_parser.add_argument('--limit', type=int, default=50)
+    args = parser.parse_args()
+
+    if args.command == 'verify':
+        result = verify(use_replica=not args.primary)
+    elif args.command == 'apply':
+        result = apply()
+    else:
+        result = db.get_subscription_timeline(args.user_id, limit=args.limit)
+    print(json.dumps(result, indent=2, ensure_ascii=False, default=str))
+    return 0 if args.command != 'verify' or result['ok'] else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,179 @@
+"""
+Bus de eventos en proceso para las actualizaciones en vivo del panel.
+
+Las funciones que escriben las filas publican un evento después de confirmar la
+transacción:
+
+- subscription_created: database.create_subscription
+- subscription_renewed: database.record_subscription_renewal
+- subscription_cancelled / subscription_expired / subscription_status:
+  database.update_subscription_status
+- subscriptions_expired: database.check_and_update_subscriptions (en lote)
+- user_expelled: database.record_expulsion
+- sweep_completed: fin de la verificación de seguridad (bot_handlers)
+
+/admin/events los reparte por Server-Sent Events. Cada panel abierto tiene su
+propia cola y publicar solo copia el evento a cada cola, sin consultar la base
+de datos. Los últimos eventos se guardan en un búfer circular: un navegador que
+se reconecta envía Last-Event-ID y recibe lo que se perdió. Si ya no está en el
+búfer (o el proceso se reinició) recibe 'resync' y recarga la instantánea.
+
+El bus es de cada proceso: con varios workers de gunicorn, un panel solo ve los
+eventos escritos por el worker al que está conectado.
+"""
+import collections
+import itertools
+import json
+import logging
+import queue
+import threading
+import time
+
+from config import EVENTS_HISTORY_SIZE, EVENTS_CLIENT_QUEUE_SIZE, SSE_MAX_CLIENTS
+from config import SSE_HEARTBEAT_SECONDS, SSE_STREAM_MAX_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Prefijo de los IDs: distingue los eventos de este proceso de los de uno anterior
+BOOT_ID = format(int(time.time()), 'x')
+RECONNECT_DELAY_MS = 3000  # Espera del navegador antes de reconectarse (campo retry de SSE)
+
+
+class Subscription:
+    """Cola de eventos de un cliente. Si se llena, el cliente debe resincronizarse"""
+
+    def __init__(self, maxsize):
+        self.queue = queue.Queue(maxsize)
+        self.overflowed = False
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBus:
+    """Reparte cada evento publicado a las suscripciones abiertas y a los oyentes internos"""
+
+    def __init__(self, history_size=EVENTS_HISTORY_SIZE, queue_size=EVENTS_CLIENT_QUEUE_SIZE,
+                 max_subscribers=SSE_MAX_CLIENTS):
+        self._lock = threading.Lock()
+        self._sequence = itertools.count(1)
+        self._history = collections.deque(maxlen=history_size)
+        self._subscriptions = set()
+        self._listeners = []
+        self._queue_size = queue_size
+        self._max_subscribers = max_subscribers
+        self._published = collections.Counter()
+
+    def add_listener(self, listener):
+        """listener(event) se llama en el hilo que publica; debe ser rápido"""
+        self._listeners.append(listener)
+
+    def publish(self, event_type, data=None):
+        """Publica un evento. Nunca lanza excepciones: un evento perdido no debe romper una escritura"""
+        try:
+            with self._lock:
+                event = {
+                    'id': f"{BOOT_ID}-{next(self._sequence)}",
+                    'type': event_type,
+                    'data': data or {},
+                    'ts': time.time(),
+                }
+                self._history.append(event)
+                self._published[event_type] += 1
+                subscriptions = list(self._subscriptions)
+            for subscription in subscriptions:
+                subscription.put(event)
+            for listener in self._listeners:
+                listener(event)
+            return event
+        except Exception as e:
+            logger.error(f"Error al publicar el evento {event_type}: {e}")
+            return None
+
+    def subscribe(self, last_event_id=None):
+        """
+        Abre una suscripción. Devuelve (suscripción, eventos perdidos, resync) o
+        None si ya hay SSE_MAX_CLIENTS abiertas
+        """
+        with self._lock:
+            if len(self._subscriptions) >= self._max_subscribers:
+                return None
+            subscription = Subscription(self._queue_size)
+            self._subscriptions.add(subscription)
+
+            backlog, resync = [], False
+            if last_event_id:
+                boot_id, _, sequence = str(last_event_id).partition('-')
+                last_sequence = int(sequence) if sequence.isdigit() else -1
+                oldest = int(self._history[0]['id'].partition('-')[2]) if self._history else None
+                if boot_id != BOOT_ID or last_sequence < 0:
+                    resync = True
+                elif oldest is not None and last_sequence < oldest - 1:
+                    resync = True
+                else:
+                    backlog = [event for event in self._history
+                               if int(event['id'].partition('-')[2]) > last_sequence]
+            return subscription, backlog, resync
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'subscribers': len(self._subscriptions),
+                'max_subscribers': self._max_subscribers,
+                'history': len(self._history),
+                'published': dict(self._published),
+            }
+
+
+def format_event(event):
+    """Evento en formato SSE (id, tipo y datos JSON)"""
+    payload = json.dumps({'type': event['type'], 'data': event['data'], 'ts': event['ts']}, default=str)
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {payload}\n\n"
+
+
+def stream(bus, subscription, backlog=(), resync=False,
+           heartbeat=SSE_HEARTBEAT_SECONDS, max_seconds=SSE_STREAM_MAX_SECONDS):
+    """
+    Generador de la respuesta SSE. Termina a los max_seconds (el navegador se
+    reconecta solo) para no retener un hilo del servidor indefinidamente
+    """
+    deadline = time.monotonic() + max_seconds
+    try:
+        yield f"retry: {RECONNECT_DELAY_MS}\n\n"
+        if resync:
+            yield "event: resync\ndata: {}\n\n"
+        for event in backlog:
+            yield format_event(event)
+
+        while time.monotonic() < deadline:
+            if subscription.overflowed:
+                # El cliente no daba abasto: vaciar la cola y que recargue la instantánea
+                while subscription.get(timeout=0) is not None:
+                    pass
+                subscription.overflowed = False
+                yield "event: resync\ndata: {}\n\n"
+            event = subscription.get(timeout=min(heartbeat, max(deadline - time.monotonic(), 0.1)))
+            yield format_event(event) if event else ": keepalive\n\n"
+    finally:
+        bus.unsubscribe(subscription)
+
+
+# Bus compartido por toda la aplicación
+bus = EventBus()
+
+
+def publish(event_type, data=None):
+    return bus.publish(event_type, data)
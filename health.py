@@ -0,0 +1,265 @@
+"""
+Registro de salud de los componentes en segundo plano.
+
+Cada componente (tarea del planificador, bucle o pool de hilos) informa en
+memoria de su actividad:
+- Tareas: inicio, éxito o error y duración de cada ciclo.
+- Bucles: un latido (beat) por iteración.
+- Opcionalmente, una sonda (probe) que indica si sus hilos siguen vivos.
+
+El watchdog revisa el registro periódicamente y, si un componente está caído
+(dead) o atascado (stalled), llama a su función de reinicio y avisa a los
+administradores. El estado completo se consulta en /admin/health.
+"""
+import datetime
+import logging
+import threading
+import time
+
+from config import HEALTH_WATCHDOG_INTERVAL_SECONDS, HEALTH_ALERT_INTERVAL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Estados que el watchdog intenta corregir
+UNHEALTHY_STATUSES = ('dead', 'stalled')
+
+
+def _fmt(ts):
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).isoformat() if ts else None
+
+
+class Component:
+    """Estado de salud de un componente en segundo plano"""
+
+    def __init__(self, name, kind, stall_after=None, probe=None, restart=None, description=""):
+        self.name = name
+        self.kind = kind  # job, loop o pool
+        self.stall_after = stall_after
+        self.probe = probe
+        self.restart = restart
+        self.description = description
+
+        self.running_since = None
+        self.last_start = None
+        self.last_success = None
+        self.last_error = None
+        self.last_error_at = None
+        self.last_duration = None
+        self.last_beat = None
+        self.cycles = 0
+        self.errors = 0
+        self.restarts = 0
+        self.last_restart = None
+        self.last_alert = None
+
+    def evaluate(self, now):
+        """Devuelve (estado, detalle) del componente"""
+        if self.probe is not None:
+            try:
+                if not self.probe():
+                    return 'dead', "Hilo no activo"
+            except Exception as e:
+                return 'dead', f"Error en la sonda: {e}"
+
+        if self.stall_after:
+            if self.running_since is not None and now - self.running_since > self.stall_after:
+                return 'stalled', f"Ciclo en curso desde hace {int(now - self.running_since)} s"
+            if self.kind == 'loop' and self.last_beat is not None and now - self.last_beat > self.stall_after:
+                return 'stalled', f"Sin latidos desde hace {int(now - self.last_beat)} s"
+
+        if self.last_error_at is not None and (self.last_success is None or self.last_error_at > self.last_success):
+            return 'failing', self.last_error
+        if self.last_start is None and self.last_beat is None and self.kind != 'pool':
+            return 'pending', None
+        return 'ok', None
+
+    def to_dict(self, now):
+        status, detail = self.evaluate(now)
+        return {
+            'name': self.name,
+            'kind': self.kind,
+            'description': self.description,
+            'status': status,
+            'detail': detail,
+            'running': self.running_since is not None,
+            'last_start': _fmt(self.last_start),
+            'last_success': _fmt(self.last_success),
+            'last_error': self.last_error,
+            'last_error_at': _fmt(self.last_error_at),
+            'last_duration_seconds': round(self.last_duration, 3) if self.last_duration is not None else None,
+            'last_beat': _fmt(self.last_beat),
+            'stall_after_seconds': self.stall_after,
+            'cycles': self.cycles,
+            'errors': self.errors,
+            'restarts': self.restarts,
+            'last_restart': _fmt(self.last_restart),
+        }
+
+
+class HealthRegistry:
+    """Registro en memoria de componentes y watchdog que reinicia los atascados"""
+
+    def __init__(self, watchdog_interval=HEALTH_WATCHDOG_INTERVAL_SECONDS, alert_interval=HEALTH_ALERT_INTERVAL_SECONDS):
+        self.watchdog_interval = watchdog_interval
+        self.alert_interval = alert_interval
+        self._components = {}
+        self._lock = threading.Lock()
+        self._alert_handler = None
+        self._watchdog = None
+        self._watchdog_runs = 0
+        self._last_watchdog_run = None
+
+    def register(self, name, kind='loop', stall_after=None, probe=None, restart=None, description=""):
+        """Registra (o actualiza) un componente"""
+        with self._lock:
+            component = self._components.get(name)
+            if component is None:
+                component = Component(name, kind, stall_after, probe, restart, description)
+                self._components[name] = component
+            else:
+                component.kind = kind
+                component.stall_after = stall_after
+                component.probe = probe
+                component.restart = restart
+                component.description = description or component.description
+            return component
+
+    def _get(self, name):
+        with self._lock:
+            component = self._components.get(name)
+            if component is None:
+                component = Component(name, 'loop')
+                self._components[name] = component
+            return component
+
+    def beat(self, name):
+        """Latido de un bucle: una iteración completada"""
+        self._get(name).last_beat = time.time()
+
+    def cycle_started(self, name):
+        component = self._get(name)
+        now = time.time()
+        component.running_since = now
+        component.last_start = now
+
+    def cycle_succeeded(self, name):
+        component = self._get(name)
+        now = time.time()
+        if component.running_since is not None:
+            component.last_duration = now - component.running_since
+        component.running_since = None
+        component.last_success = now
+        component.cycles += 1
+
+    def cycle_failed(self, name, error):
+        component = self._get(name)
+        now = time.time()
+        if component.running_since is not None:
+            component.last_duration = now - component.running_since
+        component.running_since = None
+        component.last_error = str(error)[:300]
+        component.last_error_at = now
+        component.cycles += 1
+        component.errors += 1
+
+    def set_alert_handler(self, handler):
+        """handler(mensaje) se llama cuando el watchdog detecta o corrige un problema"""
+        self._alert_handler = handler
+
+    def _alert(self, component, message, now):
+        if component.last_alert is not None and now - component.last_alert < self.alert_interval:
+            return
+        component.last_alert = now
+        if self._alert_handler is None:
+            return
+        try:
+            self._alert_handler(message)
+        except Exception as e:
+            logger.error(f"Error al enviar alerta de salud: {e}")
+
+    def check(self):
+        """Una pasada del watchdog. Devuelve los nombres de los componentes reiniciados"""
+        now = time.time()
+        with self._lock:
+            components = list(self._components.values())
+
+        restarted = []
+        for component in components:
+            status, detail = component.evaluate(now)
+            if status not in UNHEALTHY_STATUSES:
+                continue
+
+            logger.error(f"🚨 Componente '{component.name}' en estado {status}: {detail}")
+            if component.restart is None:
+                self._alert(component, f"🚨 ALERTA: '{component.name}' está {status} ({detail}) y no se puede reiniciar automáticamente.", now)
+                continue
+
+            try:
+                if component.restart() is False:
+                    # El componente no se puede reiniciar ahora (p. ej. una tarea cuyo hilo sigue vivo)
+                    self._alert(component, f"🚨 ALERTA: '{component.name}' está {status} ({detail}); se espera a que termine antes de relanzarlo.", now)
+                    continue
+                component.restarts += 1
+                component.last_restart = now
+                restarted.append(component.name)
+                logger.warning(f"🔄 Watchdog reinició '{component.name}'")
+                self._alert(component, f"🔄 El watchdog reinició '{component.name}' (estaba {status}: {detail}).", now)
+            except Exception as e:
+                logger.error(f"❌ No se pudo reiniciar '{component.name}': {e}")
+                self._alert(component, f"🚨 ALERTA: '{component.name}' está {status} y el reinicio falló: {e}", now)
+
+        self._watchdog_runs += 1
+        self._last_watchdog_run = now
+        return restarted
+
+    def _watchdog_loop(self):
+        logger.info(f"🐕 Watchdog de salud iniciado (cada {self.watchdog_interval} s)")
+        while True:
+            time.sleep(self.watchdog_interval)
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Error en el watchdog de salud: {e}")
+
+    def start_watchdog(self):
+        """Inicia el watchdog en un hilo daemon (idempotente)"""
+        with self._lock:
+            if self._watchdog is not None and self._watchdog.is_alive():
+                return self._watchdog
+            self._watchdog = threading.Thread(target=self._watchdog_loop, name="health-watchdog", daemon=True)
+            self._watchdog.start()
+        return self._watchdog
+
+    def get_component_status(self, name):
+        with self._lock:
+            component = self._components.get(name)
+        return component.to_dict(time.time()) if component else None
+
+    def get_report(self):
+        """Estado de todos los componentes, sin acceso a disco ni a la base de datos"""
+        now = time.time()
+        with self._lock:
+            components = [component.to_dict(now) for component in self._components.values()]
+
+        statuses = [component['status'] for component in components]
+        if any(status in UNHEALTHY_STATUSES for status in statuses):
+            overall = 'unhealthy'
+        elif 'failing' in statuses:
+            overall = 'degraded'
+        else:
+            overall = 'ok'
+
+        return {
+            'status': overall,
+            'watchdog': {
+                'running': self._watchdog is not None and self._watchdog.is_alive(),
+                'interval_seconds': self.watchdog_interval,
+                'runs': self._watchdog_runs,
+                'last_run': _fmt(self._last_watchdog_run),
+            },
+            'components': sorted(components, key=lambda item: item['name']),
+        }
+
+
+# Instancia compartida por toda la aplicación
+health = HealthRegistry()
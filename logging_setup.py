@@ -0,0 +1,248 @@
+"""
+Configuración de logging asíncrona.
+
+Los hilos que registran mensajes (peticiones, workers, tareas) solo los
+preparan y los dejan en una cola en memoria; un QueueListener en segundo plano
+es el único que escribe a la salida. Si la cola se llena, los mensajes se
+descartan y se cuentan en lugar de bloquear.
+
+Antes de encolar se aplican tres filtros:
+- Muestreo por tipo de mensaje (extra={'log_type': ...}), según LOG_SAMPLE_RATES.
+- Límite de repeticiones: como máximo LOG_RATE_LIMIT_PER_MINUTE mensajes por
+  tipo (o por línea de código que los emite) cada minuto; el siguiente que pasa indica
+  cuántos se omitieron. Los avisos y errores solo se limitan si su texto se repite.
+- Truncado de los mensajes más largos que LOG_MAX_MESSAGE_CHARS.
+
+Se configura desde config.py (el primer módulo que se importa), por eso lee
+sus ajustes directamente de las variables de entorno.
+"""
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').lower()  # json o text
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+LOG_MAX_MESSAGE_CHARS = int(os.getenv('LOG_MAX_MESSAGE_CHARS', 2000))
+LOG_RATE_LIMIT_PER_MINUTE = int(os.getenv('LOG_RATE_LIMIT_PER_MINUTE', 30))
+
+# Fracción de mensajes que se conservan por tipo (los WARNING o superiores nunca se muestrean)
+DEFAULT_SAMPLE_RATES = {
+    'telegram_update': 0.1,
+    'paypal_webhook': 1.0,
+    'subscription_expiry': 0.0,
+}
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+def parse_sample_rates(value):
+    """Convierte 'tipo=0.1,otro=1' en un diccionario sobre los valores por defecto"""
+    rates = dict(DEFAULT_SAMPLE_RATES)
+    for item in (value or '').split(','):
+        if '=' not in item:
+            continue
+        name, rate = item.split('=', 1)
+        try:
+            rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+        except ValueError:
+            pass
+    return rates
+
+
+LOG_SAMPLE_RATES = parse_sample_rates(os.getenv('LOG_SAMPLE_RATES'))
+
+# Contadores del pipeline (consultables con get_stats)
+_stats = {'enqueued': 0, 'dropped': 0, 'sampled_out': 0, 'rate_limited': 0, 'truncated': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+class SamplingFilter(logging.Filter):
+    """Descarta una fracción de los mensajes de cada log_type"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        log_type = getattr(record, 'log_type', None)
+        if log_type is None or record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(log_type, 1.0)
+        if rate >= 1.0 or random.random() < rate:
+            return True
+        _count('sampled_out')
+        return False
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Limita los mensajes repetidos por ventana de un minuto. La clave es el log_type
+    del registro o, si no tiene, el punto del código que lo emite (logger, nivel,
+    fichero y línea): los mensajes con f-string cambian de texto en cada llamada.
+    En los avisos y errores la clave incluye además el texto del mensaje: solo se
+    limitan los idénticos, y un error distinto por usuario nunca se pierde.
+    Los omitidos se informan en el primer mensaje de esa clave en la ventana siguiente.
+    """
+
+    def __init__(self, per_minute):
+        super().__init__()
+        self.per_minute = per_minute
+        self.window = 60
+        self._windows = {}  # clave -> [inicio de ventana, emitidos, omitidos]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.per_minute <= 0:
+            return True
+        key = getattr(record, 'log_type', None) or (record.name, record.levelno, record.pathname, record.lineno)
+        if record.levelno >= logging.WARNING:
+            key = (key, record.getMessage())
+        now = time.monotonic()
+        with self._lock:
+            state = self._windows.get(key)
+            if state is None or now - state[0] >= self.window:
+                suppressed = state[2] if state else 0
+                state = [now, 0, 0]
+                self._windows[key] = state
+                if suppressed:
+                    record.suppressed = suppressed
+                # Evita que el diccionario crezca sin límite con claves antiguas (conserva
+                # las que tienen omitidos pendientes de informar)
+                if len(self._windows) > 5000:
+                    self._windows = {k: v for k, v in self._windows.items() if now - v[0] < self.window or v[2]}
+                    self._windows[key] = state
+            if state[1] >= self.per_minute:
+                state[2] += 1
+                _count('rate_limited')
+                return False
+            state[1] += 1
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que descarta (y cuenta) en lugar de bloquear si la cola está llena"""
+
+    def __init__(self, log_queue, max_chars):
+        super().__init__(log_queue)
+        self.max_chars = max_chars
+
+    def prepare(self, record):
+        record = super().prepare(record)
+        message = record.msg
+        if self.max_chars and len(message) > self.max_chars:
+            extra = len(message) - self.max_chars
+            record.msg = message[:self.max_chars] + f"… [truncado {extra} caracteres]"
+            _count('truncated')
+        if getattr(record, 'suppressed', 0):
+            record.msg += f" (+{record.suppressed} mensajes similares omitidos)"
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            _count('enqueued')
+        except queue.Full:
+            _count('dropped')
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro"""
+
+    def format(self, record):
+        data = {
+            'ts': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for field in ('log_type', 'suppressed'):
+            value = getattr(record, field, None)
+            if value:
+                data[field] = value
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data['exception'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+_listener = None
+_queue_handler = None
+
+
+def _build_output_handler():
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else logging.Formatter(TEXT_FORMAT))
+    return handler
+
+
+def _start_listener():
+    global _listener
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, _build_output_handler(), respect_handler_level=True)
+    _listener.start()
+
+
+def _stop_listener():
+    if _listener is not None:
+        try:
+            _listener.stop()
+        except Exception:
+            pass
+
+
+def configure_logging():
+    """Instala el pipeline en el logger raíz (idempotente)"""
+    global _queue_handler
+    if _queue_handler is not None:
+        return
+
+    _queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE), LOG_MAX_MESSAGE_CHARS)
+    _queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_RATES))
+    _queue_handler.addFilter(RateLimitFilter(LOG_RATE_LIMIT_PER_MINUTE))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(LOG_LEVEL)
+
+    _start_listener()
+    # Vaciar la cola al terminar y arrancar un listener nuevo en procesos hijos (fork)
+    atexit.register(_stop_listener)
+    os.register_at_fork(after_in_child=_start_listener)
+
+
+def is_listener_alive():
+    """True si el hilo que escribe los logs sigue activo"""
+    thread = getattr(_listener, '_thread', None)
+    return thread is not None and thread.is_alive()
+
+
+def restart_listener():
+    """Arranca un listener nuevo sobre la misma cola (los registros pendientes no se pierden)"""
+    if _queue_handler is not None and not is_listener_alive():
+        _start_listener()
+
+
+def get_stats():
+    """Contadores del pipeline y ocupación actual de la cola"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['queue_size'] = _queue_handler.queue.qsize() if _queue_handler is not None else 0
+    stats['queue_capacity'] = LOG_QUEUE_SIZE
+    return stats
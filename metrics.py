@@ -0,0 +1,260 @@
+"""
+Registro de métricas en memoria con exposición en formato de texto de Prometheus.
+
+No depende de ningún servicio externo: /metrics se puede consultar con curl o
+con un scraper local. Incluye contadores, gauges, histogramas y colectores que
+calculan sus valores en el momento de la consulta.
+"""
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Buckets por defecto (segundos), pensados para latencias de HTTP y SQLite
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+class _Metric:
+    metric_type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Etiquetas inválidas para {self.name}: {sorted(labels)}")
+        return tuple((name, str(labels[name])) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+
+
+class Counter(_Metric):
+    metric_type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def collect(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    metric_type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def collect(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._values = {}  # clave -> [conteos por bucket, suma, total]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = [[0] * len(self.buckets), 0.0, 0]
+                self._values[key] = state
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels):
+        """Context manager que mide la duración del bloque"""
+        return _Timer(self, labels)
+
+    def collect(self):
+        with self._lock:
+            items = sorted((key, ([*state[0]], state[1], state[2])) for key, state in self._values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = key + (('le', _format_value(float(bound))),)
+                lines.append(f"{self.name}_bucket{_format_labels(labels)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class Registry:
+    """Conjunto de métricas y colectores que se exponen en /metrics"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector):
+        """
+        Registra una función que se evalúa en cada consulta.
+        Debe devolver una lista de tuplas (nombre, tipo, ayuda, [(etiquetas_dict, valor), ...]).
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        """Genera el texto en formato de exposición de Prometheus"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.collect())
+
+        for collector in collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                logger.error(f"Error en colector de métricas: {e}")
+                continue
+            for name, metric_type, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+                    lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+# Registro compartido por toda la aplicación
+registry = Registry()
+
+# Peticiones HTTP a Flask
+HTTP_REQUEST_DURATION = registry.histogram(
+    'http_request_duration_seconds', 'Duración de las peticiones HTTP por endpoint', ('endpoint', 'method'))
+HTTP_REQUESTS = registry.counter(
+    'http_requests_total', 'Peticiones HTTP por endpoint y código de estado', ('endpoint', 'status'))
+
+# PayPal
+PAYPAL_REQUEST_DURATION = registry.histogram(
+    'paypal_request_duration_seconds', 'Latencia de las llamadas a la API de PayPal', ('endpoint',))
+PAYPAL_ERRORS = registry.counter(
+    'paypal_errors_total', 'Errores de la API de PayPal (código HTTP o excepción)', ('endpoint', 'reason'))
+
+# Telegram
+TELEGRAM_REQUESTS = registry.counter(
+    'telegram_api_requests_total', 'Llamadas a la API de Telegram por método y código', ('method', 'status'))
+TELEGRAM_RATE_LIMITED = registry.counter(
+    'telegram_api_rate_limited_total', 'Respuestas 429 (Too Many Requests) de Telegram', ('method',))
+TELEGRAM_REQUEST_DURATION = registry.histogram(
+    'telegram_api_request_duration_seconds', 'Latencia de las llamadas a la API de Telegram', ('method',))
+
+# SQLite
+SQLITE_QUERY_DURATION = registry.histogram(
+    'sqlite_query_duration_seconds', 'Tiempo de ejecución de consultas SQLite por función que las lanza', ('site',))
+
+# Verificación de seguridad (expulsiones)
+SWEEP_DURATION = registry.histogram(
+    'security_sweep_duration_seconds', 'Duración de cada verificación de seguridad del grupo', (),
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600))
+SWEEP_USERS = registry.counter(
+    'security_sweep_users_total', 'Usuarios procesados por la verificación de seguridad', ('outcome',))
+
+
+def _observe_sqlite_query(site, sql, parameters, duration, connection):
+    SQLITE_QUERY_DURATION.observe(duration, site=site)
+
+
+def install_sqlite_observer():
+    """Alimenta sqlite_query_duration_seconds con las consultas de get_db_connection()"""
+    import db_instrumentation
+    db_instrumentation.add_query_observer(_observe_sqlite_query)
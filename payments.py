@@ -3,17 +3,79 @@ import json
 import base64
 import datetime
 import os
+import threading
 from typing import Dict, Optional, Tuple
 import logging
+import re
+import time
 
-from config import PAYPAL_CLIENT_ID, PAYPAL_CLIENT_SECRET, PAYPAL_MODE, PLANS, WEBHOOK_URL, DB_PATH, RECURRING_PAYMENTS_ENABLED
+from config import PAYPAL_CLIENT_ID, PAYPAL_CLIENT_SECRET, PAYPAL_MODE, PAYPAL_API_URL, PLANS, WEBHOOK_URL, DB_PATH, RECURRING_PAYMENTS_ENABLED
+from config import PAYPAL_TOKEN_REFRESH_MARGIN_SECONDS
+from runtime import runtime
+import metrics
 
-# Configuración de logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Logger del módulo (el pipeline de logging se configura en config.py)
 logger = logging.getLogger(__name__)
 
 # URLs base según el modo (sandbox o producción)
-BASE_URL = "https://api-m.sandbox.paypal.com" if PAYPAL_MODE == 'sandbox' else "https://api-m.paypal.com"
+BASE_URL = PAYPAL_API_URL or ("https://api-m.sandbox.paypal.com" if PAYPAL_MODE == 'sandbox' else "https://api-m.paypal.com")
+
+# Evita que varios hilos pidan un token nuevo a la vez
+_token_lock = threading.Lock()
+
+# Segmentos de ruta que no son IDs: PayPal usa IDs en mayúsculas y las rutas van en minúscula (v1, oauth2, ...)
+_STATIC_PATH_SEGMENT = re.compile(r'^[a-z][a-z0-9_-]*$')
+
+def _paypal_endpoint_label(url):
+    """Convierte la URL en una etiqueta estable: los IDs de órdenes, planes, etc. pasan a {id}"""
+    path = url.split('?', 1)[0]
+    if path.startswith(BASE_URL):
+        path = path[len(BASE_URL):]
+    segments = [seg if _STATIC_PATH_SEGMENT.match(seg) else '{id}' for seg in path.strip('/').split('/')]
+    return '/' + '/'.join(segments)
+
+def paypal_request(method, url, **kwargs):
+    """
+    Realiza una petición a la API de PayPal registrando latencia y errores por endpoint.
+    Devuelve la respuesta tal cual para que cada llamador mantenga su manejo de errores.
+    
+    Si PayPal rechaza el token de acceso cacheado (401: revocado o credenciales
+    rotadas), lo descarta, obtiene uno nuevo y repite la petición una sola vez.
+    """
+    response = _send_paypal_request(method, url, **kwargs)
+    
+    headers = kwargs.get('headers') or {}
+    authorization = headers.get('Authorization', '')
+    if response.status_code == 401 and authorization.startswith('Bearer '):
+        token = _replace_rejected_token(authorization[len('Bearer '):])
+        if token:
+            logger.warning(f"PayPal rechazó el token de acceso en {_paypal_endpoint_label(url)}; reintentando con uno nuevo")
+            kwargs['headers'] = {**headers, 'Authorization': f"Bearer {token}"}
+            response = _send_paypal_request(method, url, **kwargs)
+    return response
+
+def _replace_rejected_token(rejected: str) -> Optional[str]:
+    """Descarta el token rechazado (si otro hilo no lo ha renovado ya) y devuelve uno distinto, o None"""
+    with _token_lock:
+        if runtime.get('paypal_access_token') == rejected:
+            runtime.invalidate('paypal_access_token')
+    token = get_access_token()
+    return token if token and token != rejected else None
+
+def _send_paypal_request(method, url, **kwargs):
+    endpoint = _paypal_endpoint_label(url)
+    started = time.perf_counter()
+    try:
+        response = requests.request(method, url, **kwargs)
+    except Exception:
+        metrics.PAYPAL_ERRORS.inc(endpoint=endpoint, reason='exception')
+        raise
+    finally:
+        metrics.PAYPAL_REQUEST_DURATION.observe(time.perf_counter() - started, endpoint=endpoint)
+
+    if response.status_code >= 400:
+        metrics.PAYPAL_ERRORS.inc(endpoint=endpoint, reason=str(response.status_code))
+    return response
 
 def normalize_datetime(dt, default_timezone=datetime.timezone.utc):
     """
@@ -40,7 +102,20 @@ def normalize_datetime(dt, default_timezone=datetime.timezone.utc):
     return dt
 
 def get_access_token() -> Optional[str]:
-    """Obtiene un token de acceso para la API de PayPal"""
+    """Obtiene un token de acceso para la API de PayPal (reutilizado hasta poco antes de expirar)"""
+    token = runtime.get('paypal_access_token')
+    if token:
+        return token
+    
+    # Un solo hilo solicita el token; los demás esperan y reutilizan el resultado
+    with _token_lock:
+        token = runtime.get('paypal_access_token')
+        if token:
+            return token
+        return _request_access_token()
+
+def _request_access_token() -> Optional[str]:
+    """Solicita un token nuevo a PayPal y lo guarda en el contexto de ejecución"""
     try:
         auth = base64.b64encode(f"{PAYPAL_CLIENT_ID}:{PAYPAL_CLIENT_SECRET}".encode()).decode()
         headers = {
@@ -52,7 +127,7 @@ def get_access_token() -> Optional[str]:
         # Añadir logs para depuración
         logger.info(f"Obteniendo token de acceso de PayPal desde: {BASE_URL}/v1/oauth2/token")
         
-        response = requests.post(f"{BASE_URL}/v1/oauth2/token", headers=headers, data=data)
+        response = paypal_request('POST', f"{BASE_URL}/v1/oauth2/token", headers=headers, data=data)
         
         # Registrar respuesta para depuración (sin exponer información sensible)
         if response.status_code != 200:
@@ -62,15 +137,27 @@ def get_access_token() -> Optional[str]:
             
         response.raise_for_status()
         token_data = response.json()
+        access_token = token_data.get("access_token")
+        
+        if access_token:
+            # Renovar con margen antes de que PayPal lo invalide
+            expires_in = int(token_data.get("expires_in", 0))
+            ttl = max(60, expires_in - PAYPAL_TOKEN_REFRESH_MARGIN_SECONDS)
+            runtime.set('paypal_access_token', access_token, ttl=ttl)
         
         logger.info("Token de acceso obtenido correctamente")
-        return token_data.get("access_token")
+        return access_token
     except Exception as e:
         logger.error(f"Error al obtener token de PayPal: {str(e)}")
         return None
 
 def create_product_if_not_exists() -> Optional[str]:
     """Crea un producto en PayPal si no existe aún y devuelve su ID"""
+    # El producto se crea una vez por proceso y se reutiliza en todas las suscripciones
+    return runtime.get_or_load('paypal_product_id', _create_product)
+
+def _create_product() -> Optional[str]:
+    """Crea un producto nuevo en PayPal y devuelve su ID"""
     try:
         # VERIFICAR MODO ACTUAL
         logger.info(f"Modo PayPal actual: {PAYPAL_MODE}")
@@ -97,7 +184,7 @@ def create_product_if_not_exists() -> Optional[str]:
         }
         
         logger.info(f"Creando producto en PayPal: {product_name}")
-        response = requests.post(f"{BASE_URL}/v1/catalogs/products", headers=headers, json=data)
+        response = paypal_request('POST', f"{BASE_URL}/v1/catalogs/products", headers=headers, json=data)
         
         # Log detallado de la respuesta
         logger.info(f"Respuesta de creación de producto: Status={response.status_code}")
@@ -125,7 +212,11 @@ def create_product_if_not_exists() -> Optional[str]:
         logger.error(f"Error al crear producto en PayPal: {str(e)}")
         return None
 
-def create_order(plan_id: str, user_id: int) -> Optional[str]:
+def _correlation_query(correlation_id: Optional[str]) -> str:
+    """Parámetro que lleva el ID de correlación del checkout a través de la redirección de PayPal"""
+    return f"&cid={correlation_id}" if correlation_id else ""
+
+def create_order(plan_id: str, user_id: int, correlation_id: Optional[str] = None) -> Optional[str]:
     """Crea una orden de pago único en PayPal"""
     try:
         token = get_access_token()
@@ -149,8 +240,8 @@ def create_order(plan_id: str, user_id: int) -> Optional[str]:
         }
         
         # Configure return URLs with user_id and plan_id
-        return_url = f"{WEBHOOK_URL}/paypal/return?user_id={user_id}&plan_id={plan_id}&payment_type=order"
-        cancel_url = f"{WEBHOOK_URL}/paypal/cancel?user_id={user_id}&plan_id={plan_id}&payment_type=order"
+        return_url = f"{WEBHOOK_URL}/paypal/return?user_id={user_id}&plan_id={plan_id}&payment_type=order{_correlation_query(correlation_id)}"
+        cancel_url = f"{WEBHOOK_URL}/paypal/cancel?user_id={user_id}&plan_id={plan_id}&payment_type=order{_correlation_query(correlation_id)}"
         
         data = {
             "intent": "CAPTURE",
@@ -175,7 +266,7 @@ def create_order(plan_id: str, user_id: int) -> Optional[str]:
         }
         
         logger.info(f"Creando orden de pago único en PayPal para usuario {user_id}, plan {plan_id}")
-        response = requests.post(f"{BASE_URL}/v2/checkout/orders", headers=headers, json=data)
+        response = paypal_request('POST', f"{BASE_URL}/v2/checkout/orders", headers=headers, json=data)
         
         # Log response for debugging
         if response.status_code not in [200, 201, 202]:
@@ -384,7 +475,7 @@ def verify_and_capture_order(order_id: str) -> Optional[Dict]:
         }
         
         logger.info(f"Verificando orden con ID: {order_id}")
-        response = requests.get(f"{BASE_URL}/v2/checkout/orders/{order_id}", headers=headers)
+        response = paypal_request('GET', f"{BASE_URL}/v2/checkout/orders/{order_id}", headers=headers)
         
         if response.status_code != 200:
             logger.error(f"Error al verificar orden: Status code {response.status_code}")
@@ -401,8 +492,7 @@ def verify_and_capture_order(order_id: str) -> Optional[Dict]:
             logger.info(f"Orden {order_id} aprobada, procediendo a capturar el pago")
             
             # Capture the payment
-            capture_response = requests.post(
-                f"{BASE_URL}/v2/checkout/orders/{order_id}/capture",
+            capture_response = paypal_request('POST', f"{BASE_URL}/v2/checkout/orders/{order_id}/capture",
                 headers=headers
             )
             
@@ -429,10 +519,11 @@ def verify_and_capture_order(order_id: str) -> Optional[Dict]:
         logger.error(f"Error al verificar y capturar orden: {str(e)}")
         return None
     
-def create_payment_link(plan_id: str, user_id: int) -> Optional[str]:
+def create_payment_link(plan_id: str, user_id: int, correlation_id: Optional[str] = None) -> Optional[str]:
     """
     Crea un enlace de pago para que el usuario pague a través de PayPal.
     Maneja tanto pagos únicos como recurrentes según la configuración.
+    El correlation_id (si se indica) vuelve en la URL de retorno como parámetro cid.
     """
     try:
         # Determine if this should be a recurring payment
@@ -449,10 +540,10 @@ def create_payment_link(plan_id: str, user_id: int) -> Optional[str]:
         # Create the appropriate payment link
         if is_recurring:
             logger.info(f"Creando enlace de pago RECURRENTE para usuario {user_id}, plan {plan_id}")
-            return create_subscription_link(plan_id, user_id)
+            return create_subscription_link(plan_id, user_id, correlation_id)
         else:
             logger.info(f"Creando enlace de pago ÚNICO para usuario {user_id}, plan {plan_id}")
-            return create_order(plan_id, user_id)
+            return create_order(plan_id, user_id, correlation_id)
             
     except Exception as e:
         logger.error(f"Error al crear enlace de pago: {str(e)}")
@@ -460,6 +551,10 @@ def create_payment_link(plan_id: str, user_id: int) -> Optional[str]:
     
 
 
+def get_or_create_plan(plan_id: str, product_id: str) -> Optional[str]:
+    """Devuelve el plan de PayPal para el plan local, creándolo solo la primera vez en el proceso"""
+    return runtime.get_or_load(f'paypal_plan:{plan_id}:{product_id}', lambda: create_plan(plan_id, product_id))
+
 # Modificación para la función create_plan en payments.py
 
 def create_plan(plan_id: str, product_id: str) -> Optional[str]:
@@ -547,7 +642,7 @@ def create_plan(plan_id: str, product_id: str) -> Optional[str]:
         }
         
         logger.info(f"Creando plan en PayPal: {plan_details['name']}")
-        response = requests.post(f"{BASE_URL}/v1/billing/plans", headers=headers, json=data)
+        response = paypal_request('POST', f"{BASE_URL}/v1/billing/plans", headers=headers, json=data)
         
         # Registrar respuesta para depuración
         if response.status_code not in [200, 201]:
@@ -567,7 +662,7 @@ def create_plan(plan_id: str, product_id: str) -> Optional[str]:
         logger.error(f"Error al crear plan en PayPal: {str(e)}")
         return None
 
-def create_subscription_link(plan_id: str, user_id: int) -> Optional[str]:
+def create_subscription_link(plan_id: str, user_id: int, correlation_id: Optional[str] = None) -> Optional[str]:
     """Crea un enlace de suscripción recurrente a través de PayPal"""
     try:
         # 1. First verify that the credentials are valid by getting a token
@@ -582,8 +677,8 @@ def create_subscription_link(plan_id: str, user_id: int) -> Optional[str]:
             logger.error("No se pudo obtener/crear el producto para la suscripción")
             return None
         
-        # 3. Create the plan based on the product
-        paypal_plan_id = create_plan(plan_id, product_id)
+        # 3. Create the plan based on the product (reused after the first time)
+        paypal_plan_id = get_or_create_plan(plan_id, product_id)
         if not paypal_plan_id:
             logger.error(f"No se pudo crear el plan de suscripción para {plan_id}")
             return None
@@ -595,8 +690,8 @@ def create_subscription_link(plan_id: str, user_id: int) -> Optional[str]:
         }
         
         # Configure return URLs with user_id, plan_id and payment type
-        return_url = f"{WEBHOOK_URL}/paypal/return?user_id={user_id}&plan_id={plan_id}&payment_type=subscription"
-        cancel_url = f"{WEBHOOK_URL}/paypal/cancel?user_id={user_id}&plan_id={plan_id}&payment_type=subscription"
+        return_url = f"{WEBHOOK_URL}/paypal/return?user_id={user_id}&plan_id={plan_id}&payment_type=subscription{_correlation_query(correlation_id)}"
+        cancel_url = f"{WEBHOOK_URL}/paypal/cancel?user_id={user_id}&plan_id={plan_id}&payment_type=subscription{_correlation_query(correlation_id)}"
         
         data = {
             "plan_id": paypal_plan_id,
@@ -615,7 +710,7 @@ def create_subscription_link(plan_id: str, user_id: int) -> Optional[str]:
         }
         
         logger.info(f"Creando enlace de suscripción para usuario {user_id}, plan {plan_id}")
-        response = requests.post(f"{BASE_URL}/v1/billing/subscriptions", headers=headers, json=data)
+        response = paypal_request('POST', f"{BASE_URL}/v1/billing/subscriptions", headers=headers, json=data)
         
         # Log response for debugging
         if response.status_code not in [200, 201, 202]:
@@ -654,7 +749,7 @@ def verify_subscription(subscription_id: str) -> Optional[Dict]:
         }
         
         logger.info(f"Verificando suscripción con ID: {subscription_id}")
-        response = requests.get(f"{BASE_URL}/v1/billing/subscriptions/{subscription_id}", headers=headers)
+        response = paypal_request('GET', f"{BASE_URL}/v1/billing/subscriptions/{subscription_id}", headers=headers)
         
         if response.status_code != 200:
             logger.error(f"Error al verificar suscripción: Status code {response.status_code}")
@@ -693,7 +788,7 @@ def cancel_subscription(subscription_id: str, reason: str = "Cancelado por el bo
         }
         
         logger.info(f"Cancelando suscripción con ID: {subscription_id}")
-        response = requests.post(f"{BASE_URL}/v1/billing/subscriptions/{subscription_id}/cancel", 
+        response = paypal_request('POST', f"{BASE_URL}/v1/billing/subscriptions/{subscription_id}/cancel", 
                                  headers=headers, json=data)
         
         if response.status_code not in [200, 201, 204]:
@@ -714,9 +809,8 @@ def process_webhook_event(event_data: Dict) -> Tuple[bool, str]:
     try:
         event_type = event_data.get("event_type")
         
-        # Log the event for debugging
-        logger.info(f"PayPal webhook recibido: {event_type}")
-        logger.info(f"Contenido del webhook: {json.dumps(event_data, indent=2)}")
+        # El contenido completo ya se registra en la ruta /webhook/paypal
+        logger.info(f"Procesando evento de PayPal: {event_type}")
         
         # Extract the resource (can be subscription or order)
         resource = event_data.get("resource", {})
@@ -0,0 +1,182 @@
+"""
+Perfilado bajo demanda del proceso en ejecución.
+
+- sample_stacks: muestrea las pilas de todos los hilos durante N segundos y
+  devuelve "pilas colapsadas" (una línea 'marco;marco;marco conteo'), el
+  formato que aceptan flamegraph.pl, speedscope o inferno.
+- profile_job: ejecuta una tarea del planificador bajo cProfile y guarda el
+  resultado (texto de pstats o volcado binario para snakeviz/flameprof).
+- dump_threads: pila actual de cada hilo vivo, para diagnosticar bloqueos.
+
+Solo se permite un perfilado a la vez por proceso.
+"""
+import cProfile
+import io
+import logging
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+from config import PROFILER_MAX_SECONDS, PROFILER_DEFAULT_INTERVAL_MS
+
+logger = logging.getLogger(__name__)
+
+_busy = threading.Lock()
+# Último perfil de cada tarea: nombre -> {'finished_at', 'duration', 'error', 'stats'}
+_job_profiles = {}
+
+
+class ProfilerBusy(Exception):
+    """Ya hay un perfilado en curso en este proceso"""
+
+
+class _StatsSnapshot:
+    """Adaptador para pstats.Stats: pstats vacía el objeto que recibe, así que se crea uno por consulta"""
+
+    def __init__(self, stats):
+        self.stats = dict(stats)
+
+    def create_stats(self):
+        pass
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    module = frame.f_globals.get('__name__', os.path.basename(code.co_filename))
+    return f"{module}.{code.co_name}"
+
+
+def _collapse(frame):
+    """Pila de un hilo desde la raíz: 'modulo.funcion;modulo.funcion;...'"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+def sample_stacks(seconds, interval_ms=PROFILER_DEFAULT_INTERVAL_MS, thread_prefix=None):
+    """
+    Muestrea las pilas de todos los hilos.
+
+    Args:
+        seconds (float): Duración del muestreo (limitada a PROFILER_MAX_SECONDS)
+        interval_ms (float): Tiempo entre muestras
+        thread_prefix (str): Solo hilos cuyo nombre empiece así (por ejemplo 'job-security_check')
+
+    Returns:
+        dict: {'samples', 'seconds', 'collapsed': texto en formato de pilas colapsadas}
+    """
+    seconds = min(max(float(seconds), 0.1), PROFILER_MAX_SECONDS)
+    interval = max(float(interval_ms), 1) / 1000
+    if not _busy.acquire(blocking=False):
+        raise ProfilerBusy("Ya hay un perfilado en curso")
+
+    try:
+        own_ident = threading.get_ident()
+        counts = Counter()
+        samples = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                name = names.get(ident, f"thread-{ident}")
+                if thread_prefix and not name.startswith(thread_prefix):
+                    continue
+                # El nombre del hilo (sin números de worker) es la raíz de la pila
+                root = name.rstrip('0123456789').rstrip('-_') or name
+                counts[f"{root};{_collapse(frame)}"] += 1
+            samples += 1
+            time.sleep(interval)
+    finally:
+        _busy.release()
+
+    collapsed = "\n".join(f"{stack} {count}" for stack, count in counts.most_common())
+    logger.info(f"🔬 Muestreo de pilas completado: {samples} muestras en {seconds} s")
+    return {'samples': samples, 'seconds': seconds, 'collapsed': collapsed + "\n" if collapsed else ""}
+
+
+def profile_job(job_scheduler, job_name, seconds):
+    """
+    Ejecuta una tarea del planificador bajo cProfile y espera hasta N segundos a que termine.
+    Si no termina a tiempo, el perfil queda disponible con get_job_profile cuando acabe.
+
+    Returns:
+        dict: {'started', 'finished', 'result'}. started es False si la tarea no existe, ya está en curso
+              o este proceso no es el líder del planificador
+    """
+    seconds = min(max(float(seconds), 1), PROFILER_MAX_SECONDS)
+    if not _busy.acquire(blocking=False):
+        raise ProfilerBusy("Ya hay un perfilado en curso")
+
+    done = threading.Event()
+
+    def wrapper(func):
+        def profiled():
+            profile = cProfile.Profile()
+            started = time.monotonic()
+            error = None
+            try:
+                profile.runcall(func)
+            except Exception as e:
+                error = str(e)
+                raise
+            finally:
+                profile.create_stats()
+                _job_profiles[job_name] = {
+                    'finished_at': time.time(),
+                    'duration': time.monotonic() - started,
+                    'error': error,
+                    'stats': profile.stats,
+                }
+                _busy.release()
+                done.set()
+        return profiled
+
+    if not job_scheduler.run_now(job_name, wrapper=wrapper):
+        _busy.release()
+        return {'started': False, 'finished': False, 'result': None}
+
+    finished = done.wait(seconds)
+    return {'started': True, 'finished': finished, 'result': _job_profiles.get(job_name) if finished else None}
+
+
+def get_job_profile(job_name):
+    return _job_profiles.get(job_name)
+
+
+def format_profile_text(result, sort='cumulative', limit=60):
+    """Salida de pstats como texto (las funciones más costosas primero)"""
+    stream = io.StringIO()
+    stats = pstats.Stats(_StatsSnapshot(result['stats']), stream=stream)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    header = f"Duración: {result['duration']:.3f} s" + (f" | Error: {result['error']}" if result['error'] else "")
+    return header + "\n" + stream.getvalue()
+
+
+def format_profile_binary(result):
+    """Volcado en el formato de pstats.dump_stats (se abre con snakeviz, flameprof o pstats)"""
+    return marshal.dumps(result['stats'])
+
+
+def dump_threads():
+    """Pila actual de cada hilo vivo"""
+    frames = sys._current_frames()
+    threads = []
+    for thread in sorted(threading.enumerate(), key=lambda t: t.name):
+        frame = frames.get(thread.ident)
+        threads.append({
+            'name': thread.name,
+            'ident': thread.ident,
+            'daemon': thread.daemon,
+            'alive': thread.is_alive(),
+            'stack': [line.rstrip() for line in traceback.format_stack(frame)] if frame is not None else [],
+        })
+    return threads
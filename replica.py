@@ -0,0 +1,119 @@
+"""
+Réplica de solo lectura para las consultas de informes.
+
+Las lecturas largas (/stats, estadísticas de renovaciones, consola SQL) mantienen
+un bloqueo compartido sobre el archivo mientras duran; en modo rollback journal
+un escritor no puede confirmar hasta que termina, y los webhooks de pago acaban
+en 'database is locked'. Esas lecturas van a una copia del archivo:
+
+- La tarea 'replica_refresh' (solo en el proceso líder) copia la base de datos
+  cada REPLICA_REFRESH_SECONDS con la API de backup (backups.copy_database, por
+  pasos y sin bloquear a los escritores) a un archivo temporal y lo cambia por
+  la réplica con os.replace: las conexiones abiertas siguen leyendo la copia
+  anterior hasta cerrarse y las nuevas ven la nueva
+- La fecha de modificación de la réplica es el momento de la instantánea: todos
+  los workers calculan su antigüedad sin compartir memoria
+- select_read_path() devuelve la réplica si existe y tiene menos de
+  REPLICA_MAX_STALENESS_SECONDS; si no, la base de datos principal (sin la
+  tarea, p. ej. con el planificador desactivado, todo sigue como antes)
+
+Las respuestas que leen de aquí incluyen su origen y antigüedad (source_info).
+Las escrituras y las decisiones de pago o acceso usan siempre la principal.
+"""
+import datetime
+import logging
+import os
+import threading
+import time
+
+import backups
+from config import DB_PATH, REPLICA_ENABLED, REPLICA_DB_PATH, REPLICA_MAX_STALENESS_SECONDS
+
+logger = logging.getLogger(__name__)
+
+_refresh_lock = threading.Lock()
+_last_refresh = None
+
+
+def _snapshot_time():
+    """Momento de la instantánea de la réplica (None si no existe)"""
+    try:
+        return os.path.getmtime(REPLICA_DB_PATH)
+    except OSError:
+        return None
+
+
+def select_read_path(max_staleness=REPLICA_MAX_STALENESS_SECONDS):
+    """
+    Archivo para una lectura de informes.
+
+    Returns:
+        Tuple[str, dict]: (ruta, origen de los datos para la respuesta, ver source_info)
+    """
+    snapshot_time = _snapshot_time() if REPLICA_ENABLED else None
+    if snapshot_time is not None and time.time() - snapshot_time <= max_staleness:
+        return REPLICA_DB_PATH, source_info(snapshot_time)
+    return DB_PATH, source_info(None)
+
+
+def source_info(snapshot_time):
+    """Origen de los datos de una respuesta: 'replica' con su antigüedad o 'primary'"""
+    if snapshot_time is None:
+        return {'source': 'primary', 'refreshed_at': None, 'age_seconds': 0}
+    return {
+        'source': 'replica',
+        'refreshed_at': datetime.datetime.fromtimestamp(snapshot_time, datetime.timezone.utc).isoformat(),
+        'age_seconds': round(max(time.time() - snapshot_time, 0.0), 1),
+    }
+
+
+def refresh():
+    """
+    Copia la base de datos principal sobre la réplica.
+
+    Returns:
+        dict: páginas copiadas y duración (None si ya había un refresco en curso)
+    """
+    global _last_refresh
+    if not _refresh_lock.acquire(blocking=False):
+        logger.warning("⚠️ Ya hay un refresco de la réplica en curso")
+        return None
+    try:
+        started = time.perf_counter()
+        # La copia incluye todo lo confirmado hasta su último paso: fecharla al inicio
+        # nunca la hace parecer más reciente de lo que es
+        snapshot_time = time.time()
+        os.makedirs(os.path.dirname(REPLICA_DB_PATH) or '.', exist_ok=True)
+        tmp_path = REPLICA_DB_PATH + '.tmp'
+        try:
+            pages = backups.copy_database(tmp_path)
+            os.utime(tmp_path, (snapshot_time, snapshot_time))
+            os.replace(tmp_path, REPLICA_DB_PATH)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        _last_refresh = {
+            'finished_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'pages': pages,
+            'seconds': round(time.perf_counter() - started, 3),
+        }
+        logger.debug(f"Réplica de lectura actualizada: {pages} páginas en {_last_refresh['seconds']}s")
+        return _last_refresh
+    finally:
+        _refresh_lock.release()
+
+
+def get_status():
+    """Estado de la réplica para /admin/replica"""
+    snapshot_time = _snapshot_time()
+    available = snapshot_time is not None
+    return {
+        'enabled': REPLICA_ENABLED,
+        'available': available,
+        'in_use': select_read_path()[0] == REPLICA_DB_PATH,
+        'max_staleness_seconds': REPLICA_MAX_STALENESS_SECONDS,
+        'size_bytes': os.path.getsize(REPLICA_DB_PATH) if available else None,
+        **(source_info(snapshot_time) if available else {'refreshed_at': None, 'age_seconds': None}),
+        'last_refresh': _last_refresh,
+    }
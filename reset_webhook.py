@@ -8,15 +8,15 @@ import requests
 import logging
 import time
 from config import BOT_TOKEN, WEBHOOK_URL
+from telegram_api import method_url
 
-# Configurar logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Logger del módulo (el pipeline de logging se configura en config.py)
 logger = logging.getLogger(__name__)
 
 def verify_bot():
     """Verifica que el bot esté activo y responda correctamente"""
     try:
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/getMe"
+        url = method_url("getMe")
         response = requests.get(url)
         
         if response.status_code != 200:
@@ -41,7 +41,7 @@ def verify_bot():
 def get_webhook_info():
     """Obtiene la información actual del webhook"""
     try:
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/getWebhookInfo"
+        url = method_url("getWebhookInfo")
         response = requests.get(url)
         
         if response.status_code != 200:
@@ -62,7 +62,7 @@ def get_webhook_info():
 def delete_webhook():
     """Elimina el webhook actual"""
     try:
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/deleteWebhook"
+        url = method_url("deleteWebhook")
         response = requests.get(url)
         
         if response.status_code != 200:
@@ -87,7 +87,7 @@ def set_new_webhook():
         # Crear la URL completa del webhook
         webhook_url = f"{WEBHOOK_URL}/webhook/{BOT_TOKEN}"
         
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/setWebhook"
+        url = method_url("setWebhook")
         data = {
             "url": webhook_url,
             "allowed_updates": ["message", "callback_query", "chat_member"]
@@ -0,0 +1,255 @@
+"""
+Retención y archivado de las tablas que solo crecen.
+
+Cada política elige las filas antiguas de una tabla y las saca de ella por
+lotes de RETENTION_BATCH_SIZE (una transacción corta por lote, con una pausa
+entre lotes para no bloquear a los escritores):
+
+- 'table': las mueve a <tabla>_archive en la misma base de datos (siguen
+  consultables, pero las consultas de la tabla viva ya no las recorren)
+- 'file': las escribe en un NDJSON comprimido en RETENTION_ARCHIVE_DIR
+  (un archivo por tabla y ejecución) y las borra. El lote se escribe y se
+  sincroniza a disco antes de borrarlo: si el proceso muere entre medias, la
+  siguiente ejecución lo vuelve a archivar (puede haber duplicados, no pérdidas)
+
+Los contadores de stats_counters bajan con cada DELETE (triggers de
+database._stats_triggers); la retención los compensa en la misma transacción,
+así que los totales del panel siguen contando las filas archivadas.
+
+Al final se devuelve al sistema el espacio libre con PRAGMA incremental_vacuum.
+Requiere auto_vacuum = INCREMENTAL: las bases de datos nuevas se crean así (ver
+database.init_db) y las existentes se convierten una vez con VACUUM en la
+primera ejecución.
+"""
+import datetime
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+
+import database as db
+from config import RETENTION_BATCH_SIZE, RETENTION_BATCH_PAUSE_SECONDS, RETENTION_ARCHIVE_DIR
+from config import (RETENTION_PROCESSED_PAYMENTS_DAYS, RETENTION_RENEWAL_NOTIFICATIONS_DAYS,
+                    RETENTION_FAILED_EXPULSIONS_DAYS, RETENTION_EXPULSIONS_DAYS,
+                    RETENTION_INVITE_LINKS_DAYS, RETENTION_EXPIRED_SUBSCRIPTIONS_DAYS)
+
+logger = logging.getLogger(__name__)
+
+INCREMENTAL_VACUUM_PAGES = 1000  # Páginas liberadas por paso de incremental_vacuum
+
+# Índices de las tablas de archivo que se siguen consultando (los rollups leen
+# subscriptions_archive con los mismos filtros por fecha que subscriptions)
+ARCHIVE_INDEXES = {
+    'subscriptions': ('start_date', 'end_date', 'status_changed_at'),
+}
+
+# (tabla, condición de las filas que salen, modo, días)
+POLICIES = [
+    ('processed_payments', "datetime(processed_at) < datetime('now', '-{days} day')",
+     'file', RETENTION_PROCESSED_PAYMENTS_DAYS),
+    ('renewal_notifications', "datetime(sent_date) < datetime('now', '-{days} day')",
+     'file', RETENTION_RENEWAL_NOTIFICATIONS_DAYS),
+    ('failed_expulsions', "processed = 1 AND datetime(timestamp) < datetime('now', '-{days} day')",
+     'file', RETENTION_FAILED_EXPULSIONS_DAYS),
+    ('expulsions', "datetime(date) < datetime('now', '-{days} day')",
+     'table', RETENTION_EXPULSIONS_DAYS),
+    ('invite_links', "datetime(expires_at) < datetime('now', '-{days} day')",
+     'table', RETENTION_INVITE_LINKS_DAYS),
+    ('subscriptions', "status = 'EXPIRED' AND datetime(end_date) < datetime('now', '-{days} day')",
+     'table', RETENTION_EXPIRED_SUBSCRIPTIONS_DAYS),
+]
+
+_run_lock = threading.Lock()
+_last_report = None
+
+
+def _table_exists(conn, table):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _ensure_archive_table(conn, table):
+    """Crea <tabla>_archive (o le añade las columnas nuevas de la tabla). Devuelve las columnas"""
+    archive = f"{table}_archive"
+    columns = _columns(conn, table)
+    if not _table_exists(conn, archive):
+        conn.execute(f"CREATE TABLE {archive} AS SELECT * FROM {table} WHERE 0")
+        conn.execute(f"ALTER TABLE {archive} ADD COLUMN archived_at TIMESTAMP")
+    else:
+        archived_columns = set(_columns(conn, archive))
+        for column in columns:
+            if column not in archived_columns:
+                conn.execute(f"ALTER TABLE {archive} ADD COLUMN {column}")
+    for column in ARCHIVE_INDEXES.get(table, ()):
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{archive}_{column} ON {archive} ({column})")
+    conn.commit()
+    return columns
+
+
+def _compensate_counters(conn, table, rowids):
+    """Devuelve a stats_counters lo que restan los triggers al borrar las filas archivadas"""
+    if table not in db.STATS_COUNTED_TABLES:
+        return
+    conn.execute("UPDATE stats_counters SET value = value + ? WHERE name = ?", (len(rowids), table))
+    if table == 'subscriptions':
+        placeholders = ','.join('?' * len(rowids))
+        plans = conn.execute(f"""
+        SELECT 'subscriptions_plan:' || COALESCE(plan, ''), COUNT(*) FROM subscriptions
+        WHERE rowid IN ({placeholders}) GROUP BY plan
+        """, rowids).fetchall()
+        for name, count in plans:
+            conn.execute("UPDATE stats_counters SET value = value + ? WHERE name = ?", (count, name))
+
+
+def _apply_policy(conn, table, condition, mode, dry_run=False):
+    """Aplica una política por lotes. Devuelve el resumen de la tabla"""
+    result = {'table': table, 'mode': mode, 'rows': 0, 'target': None}
+    if not _table_exists(conn, table):
+        result['skipped'] = 'la tabla no existe'
+        return result
+
+    if dry_run:
+        result['rows'] = conn.execute(f"SELECT COUNT(*) FROM {table} WHERE {condition}").fetchone()[0]
+        return result
+
+    columns = _ensure_archive_table(conn, table) if mode == 'table' else _columns(conn, table)
+    column_list = ', '.join(columns)
+    archive_file = None
+    try:
+        while True:
+            rowids = [row[0] for row in conn.execute(
+                f"SELECT rowid FROM {table} WHERE {condition} ORDER BY rowid LIMIT ?", (RETENTION_BATCH_SIZE,))]
+            if not rowids:
+                break
+            placeholders = ','.join('?' * len(rowids))
+
+            if mode == 'file':
+                if archive_file is None:
+                    os.makedirs(RETENTION_ARCHIVE_DIR, exist_ok=True)
+                    stamp = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%d_%H%M%S')
+                    result['target'] = os.path.join(RETENTION_ARCHIVE_DIR, f"{table}_{stamp}.ndjson.gz")
+                    raw_file = open(result['target'], 'wb')
+                    archive_file = gzip.GzipFile(mode='wb', fileobj=raw_file)
+                rows = conn.execute(f"SELECT {column_list} FROM {table} WHERE rowid IN ({placeholders})", rowids)
+                archive_file.write(''.join(json.dumps(dict(zip(columns, row)), default=str) + '\n'
+                                           for row in rows).encode('utf-8'))
+                # Lote completo en disco antes de borrarlo de la tabla
+                archive_file.flush()
+                os.fsync(raw_file.fileno())
+
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if mode == 'table':
+                    result['target'] = f"{table}_archive"
+                    conn.execute(f"""
+                    INSERT INTO {table}_archive ({column_list}, archived_at)
+                    SELECT {column_list}, CURRENT_TIMESTAMP FROM {table} WHERE rowid IN ({placeholders})
+                    """, rowids)
+                _compensate_counters(conn, table, rowids)
+                conn.execute(f"DELETE FROM {table} WHERE rowid IN ({placeholders})", rowids)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+            result['rows'] += len(rowids)
+            time.sleep(RETENTION_BATCH_PAUSE_SECONDS)
+    finally:
+        if archive_file is not None:
+            archive_file.close()
+            raw_file.close()
+    return result
+
+
+def _pragma(conn, name):
+    return conn.execute(f"PRAGMA {name}").fetchone()[0]
+
+
+def _reclaim_space(conn):
+    """Devuelve las páginas libres al sistema. Devuelve (páginas liberadas, conversión a incremental)"""
+    converted = False
+    if _pragma(conn, 'auto_vacuum') != 2:
+        # Solo la primera vez: cambiar auto_vacuum exige reescribir el archivo con VACUUM
+        logger.info("🧹 Activando auto_vacuum = INCREMENTAL (VACUUM único)")
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+        converted = True
+
+    freed = 0
+    while True:
+        free_before = _pragma(conn, 'freelist_count')
+        if not free_before:
+            break
+        # Cada paso de la sentencia libera una página: executescript la ejecuta hasta el final
+        # (execute solo da el primer paso, porque el PRAGMA no devuelve filas)
+        conn.executescript(f'PRAGMA incremental_vacuum({INCREMENTAL_VACUUM_PAGES})')
+        free_after = _pragma(conn, 'freelist_count')
+        freed += free_before - free_after
+        if free_after >= free_before:
+            break
+        time.sleep(RETENTION_BATCH_PAUSE_SECONDS)
+    return freed, converted
+
+
+def run(dry_run=False):
+    """
+    Aplica todas las políticas y recupera el espacio liberado.
+
+    Args:
+        dry_run: solo cuenta las filas que saldrían de cada tabla
+
+    Returns:
+        dict: filas por tabla, espacio recuperado y duración (None si ya había una ejecución en curso)
+    """
+    global _last_report
+    if not _run_lock.acquire(blocking=False):
+        logger.warning("⚠️ Ya hay una ejecución de retención en curso")
+        return None
+    try:
+        started = time.perf_counter()
+        conn = db.get_db_connection()
+        # Transacciones explícitas (BEGIN IMMEDIATE por lote) y VACUUM fuera de transacción
+        conn.isolation_level = None
+        try:
+            page_size = _pragma(conn, 'page_size')
+            size_before = _pragma(conn, 'page_count') * page_size
+            tables = [_apply_policy(conn, table, condition.format(days=days), mode, dry_run)
+                      for table, condition, mode, days in POLICIES]
+            freed_pages, converted = (0, False) if dry_run else _reclaim_space(conn)
+            size_after = _pragma(conn, 'page_count') * page_size
+        finally:
+            conn.close()
+
+        report = {
+            'dry_run': dry_run,
+            'finished_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'tables': tables,
+            'rows': sum(table['rows'] for table in tables),
+            'freed_pages': freed_pages,
+            'converted_to_incremental': converted,
+            'size_before_bytes': size_before,
+            'size_after_bytes': size_after,
+            'reclaimed_bytes': size_before - size_after,
+            'seconds': round(time.perf_counter() - started, 3),
+        }
+        if not dry_run:
+            _last_report = report
+            logger.info(f"🧹 Retención: {report['rows']} filas archivadas, "
+                        f"{report['reclaimed_bytes'] / 1024:.0f} KB recuperados en {report['seconds']}s")
+        return report
+    finally:
+        _run_lock.release()
+
+
+def get_policies():
+    return [{'table': table, 'condition': condition.format(days=days), 'mode': mode, 'days': days}
+            for table, condition, mode, days in POLICIES]
+
+
+def get_last_report():
+    return _last_report
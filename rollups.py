@@ -0,0 +1,139 @@
+"""
+Rollups diarios de ingresos y bajas por plan.
+
+La tabla daily_rollups (ver database.init_db) guarda por día UTC y plan: altas,
+renovaciones, ingresos, cancelaciones, expiraciones y suscripciones activas al
+cierre del día. Las tendencias, el MRR y el churn de /admin/revenue-trend y el
+desglose por plan de /admin/renewal-stats se calculan sobre ella en lugar de
+recorrer subscriptions y subscription_renewals en cada petición.
+
+Refresco incremental: la marca de agua (tabla rollup_watermarks) guarda el
+último día calculado. Cada refresco recalcula desde la marca menos
+LOOKBACK_DAYS hasta hoy: el día actual está incompleto y las expiraciones se
+marcan cuando termina el periodo de gracia, después del día de fin. Las activas
+al abrir la ventana salen de los rollups guardados del día anterior, así que el
+refresco solo lee las suscripciones que cambian dentro de la ventana. Sin marca
+(primer arranque) o con full=True se calcula el historial completo.
+"""
+import datetime
+import logging
+import math
+import threading
+import time
+
+import database as db
+from config import PLANS, ROLLUP_LOOKBACK_DAYS, SUBSCRIPTION_GRACE_PERIOD_HOURS
+
+logger = logging.getLogger(__name__)
+
+# La ventana recalculada siempre cubre el periodo de gracia
+LOOKBACK_DAYS = max(ROLLUP_LOOKBACK_DAYS, math.ceil(SUBSCRIPTION_GRACE_PERIOD_HOURS / 24) + 1)
+
+SUMMED_METRICS = ('new_subscriptions', 'renewals', 'revenue_usd', 'cancellations', 'expirations')
+
+_refresh_lock = threading.Lock()
+
+
+def _today():
+    return datetime.datetime.now(datetime.timezone.utc).date()
+
+
+def refresh(full=False):
+    """
+    Recalcula los rollups desde la marca de agua (o todo el historial si no hay
+    marca o full=True) hasta hoy.
+
+    Returns:
+        dict: ventana recalculada, filas escritas y segundos empleados
+    """
+    with _refresh_lock:
+        started = time.perf_counter()
+        today = _today()
+        watermark = None if full else db.get_rollup_watermark()
+
+        if watermark and watermark.get('day'):
+            first = datetime.date.fromisoformat(watermark['day']) - datetime.timedelta(days=LOOKBACK_DAYS)
+            backfill = False
+        else:
+            first_activity = db.get_first_activity_day()
+            first = datetime.date.fromisoformat(first_activity) if first_activity else today
+            backfill = True
+        first = min(first, today)
+
+        rollups = db.compute_daily_rollups(first.isoformat(), today.isoformat(), incremental=not backfill)
+        rows = db.replace_daily_rollups(first.isoformat(), today.isoformat(), rollups)
+
+        result = {
+            'from': first.isoformat(),
+            'to': today.isoformat(),
+            'rows': rows,
+            'backfill': backfill,
+            'seconds': round(time.perf_counter() - started, 3),
+        }
+        if backfill:
+            logger.info(f"📈 Rollups diarios calculados desde {result['from']} ({rows} filas en {result['seconds']}s)")
+        else:
+            logger.debug(f"Rollups diarios recalculados desde {result['from']} ({rows} filas)")
+        return result
+
+
+def monthly_factor(plan):
+    """Multiplicador que convierte el precio de un ciclo del plan en ingreso mensual"""
+    duration_days = PLANS.get(plan, {}).get('duration_days') or 30
+    return 30 / duration_days
+
+
+def trend(days=30, plan=None):
+    """
+    Serie diaria de los últimos `days` días (hoy incluido) con totales, MRR y churn.
+
+    El MRR de cada día es la suma, por plan, de los precios de las suscripciones
+    activas al cierre llevados a 30 días. El churn del periodo es
+    (cancelaciones + expiraciones) / activas al cierre del día anterior al periodo.
+    """
+    today = _today()
+    first = today - datetime.timedelta(days=max(int(days), 1) - 1)
+    opening_day = (first - datetime.timedelta(days=1)).isoformat()
+
+    series = {}
+    opening_active = 0
+    opening_mrr = 0.0
+    for row in db.get_daily_rollups(opening_day, today.isoformat(), plan):
+        mrr = row['active_value_usd'] * monthly_factor(row['plan'])
+        if row['day'] == opening_day:
+            opening_active += row['active_end_of_day']
+            opening_mrr += mrr
+            continue
+        point = series.setdefault(row['day'], dict.fromkeys(SUMMED_METRICS + ('active_end_of_day', 'mrr_usd'), 0))
+        for metric in SUMMED_METRICS + ('active_end_of_day',):
+            point[metric] += row[metric]
+        point['mrr_usd'] += mrr
+
+    points = []
+    day = first
+    while day <= today:
+        point = series.get(day.isoformat(), dict.fromkeys(SUMMED_METRICS + ('active_end_of_day', 'mrr_usd'), 0))
+        point['day'] = day.isoformat()
+        point['revenue_usd'] = round(point['revenue_usd'], 2)
+        point['mrr_usd'] = round(point['mrr_usd'], 2)
+        points.append(point)
+        day += datetime.timedelta(days=1)
+
+    totals = {metric: sum(point[metric] for point in points) for metric in SUMMED_METRICS}
+    totals['revenue_usd'] = round(totals['revenue_usd'], 2)
+    churned = totals['cancellations'] + totals['expirations']
+
+    return {
+        'from': first.isoformat(),
+        'to': today.isoformat(),
+        'plan': plan,
+        'days': points,
+        'totals': totals,
+        'active_start': opening_active,
+        'active_end': points[-1]['active_end_of_day'],
+        'mrr_start_usd': round(opening_mrr, 2),
+        'mrr_usd': points[-1]['mrr_usd'],
+        'churned': churned,
+        'churn_rate': round(churned / opening_active, 4) if opening_active else None,
+        'watermark': db.get_rollup_watermark(),
+    }
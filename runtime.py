@@ -0,0 +1,90 @@
+"""
+Contexto de ejecución compartido.
+
+Guarda en memoria los valores costosos de obtener (identidad del bot, token de
+PayPal, IDs de producto y planes, permisos en el grupo) para no pedirlos de
+nuevo en cada llamada. El warm-up de arranque los precarga en segundo plano.
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RuntimeContext:
+    """Almacén clave/valor con expiración opcional y carga única por clave"""
+
+    def __init__(self):
+        self._values = {}  # clave -> (valor, guardado_en, expira_en)
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._values.get(key)
+        if item is None:
+            return default
+        value, _, expires_at = item
+        if expires_at is not None and time.monotonic() >= expires_at:
+            return default
+        return value
+
+    def set(self, key, value, ttl=None):
+        now = time.monotonic()
+        with self._lock:
+            self._values[key] = (value, now, now + ttl if ttl else None)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._values.pop(key, None)
+
+    def get_or_load(self, key, loader, ttl=None):
+        """
+        Devuelve el valor guardado o lo carga con loader().
+        Si varios hilos piden la misma clave a la vez, solo uno ejecuta loader.
+        Los valores None no se guardan.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            # Otro hilo pudo haberlo cargado mientras esperábamos
+            value = self.get(key)
+            if value is not None:
+                return value
+            value = loader()
+            if value is not None:
+                self.set(key, value, ttl)
+            return value
+
+    def describe(self):
+        """Resumen de las claves guardadas (sin exponer los valores)"""
+        now = time.monotonic()
+        with self._lock:
+            items = list(self._values.items())
+        return {
+            key: {
+                'age_seconds': round(now - stored_at, 1),
+                'expires_in_seconds': round(expires_at - now, 1) if expires_at is not None else None,
+            }
+            for key, (_, stored_at, expires_at) in items
+        }
+
+
+# Instancia compartida por toda la aplicación
+runtime = RuntimeContext()
+
+
+def get_bot_info(bot):
+    """Identidad del bot (resultado de getMe), cacheada durante toda la vida del proceso"""
+    return runtime.get_or_load('bot_info', bot.get_me)
+
+
+def get_bot_id(bot):
+    """ID del bot sin llamar a getMe en cada uso"""
+    return get_bot_info(bot).id
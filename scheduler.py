@@ -0,0 +1,447 @@
+"""
+Planificador unificado de tareas en segundo plano.
+
+Reemplaza los bucles independientes (seguridad, renovaciones, monitor) por
+tareas con nombre que se ejecutan con intervalo fijo o expresión tipo cron.
+Cuando hay varios procesos (por ejemplo, varios workers de gunicorn), un lease
+en SQLite decide qué proceso es el líder: solo ese ejecuta las tareas.
+
+Cada tarea informa de sus ciclos al registro de salud (health.py); el watchdog
+marca como atascada una ejecución que dura demasiado (sin relanzarla mientras su
+hilo siga vivo) o reinicia el bucle del planificador.
+"""
+import datetime
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+
+import database as db
+from config import SCHEDULER_ENABLED, SCHEDULER_LEASE_NAME, SCHEDULER_LEASE_TTL_SECONDS, HEALTH_JOB_STALL_SECONDS
+from health import health
+
+logger = logging.getLogger(__name__)
+
+
+class CronSchedule:
+    """
+    Expresión cron de 5 campos: minuto hora día-del-mes mes día-de-la-semana.
+    Admite '*', '*/n', 'a-b', 'a-b/n', 'a/n' (de a al máximo, como cron) y listas
+    separadas por comas.
+    El día de la semana usa 0 = domingo (como cron). Las horas son UTC.
+    """
+
+    FIELDS = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 6)]
+
+    def __init__(self, expression):
+        self.expression = expression
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError(f"Expresión cron inválida: {expression}")
+        self.minutes, self.hours, self.days, self.months, self.weekdays = [
+            self._parse_field(part, low, high) for part, (low, high) in zip(parts, self.FIELDS)
+        ]
+        self._any_day = parts[2] == '*'
+        self._any_weekday = parts[4] == '*'
+
+    @staticmethod
+    def _parse_field(field, low, high):
+        values = set()
+        for item in field.split(','):
+            step = 1
+            stepped = '/' in item
+            if stepped:
+                item, step_text = item.split('/')
+                step = int(step_text)
+            if item == '*':
+                start, end = low, high
+            elif '-' in item:
+                start, end = (int(v) for v in item.split('-'))
+            elif stepped:
+                # 'a/n' equivale a 'a-máximo/n'
+                start, end = int(item), high
+            else:
+                start = end = int(item)
+            if start < low or end > high or step < 1:
+                raise ValueError(f"Valor fuera de rango en campo cron: {field}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, moment):
+        weekday = (moment.weekday() + 1) % 7  # Python: lunes = 0; cron: domingo = 0
+        day_ok = moment.day in self.days
+        weekday_ok = weekday in self.weekdays
+        # Igual que cron: si ambos campos están restringidos, basta con que coincida uno
+        if not self._any_day and not self._any_weekday:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+    def next_after(self, moment):
+        """Devuelve el siguiente instante (datetime UTC) posterior a moment que cumple la expresión"""
+        candidate = moment.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = candidate + datetime.timedelta(days=366 * 5)
+        while candidate < limit:
+            if candidate.month not in self.months:
+                year = candidate.year + (candidate.month == 12)
+                month = candidate.month % 12 + 1
+                candidate = candidate.replace(year=year, month=month, day=1, hour=0, minute=0)
+                continue
+            if not self._day_matches(candidate):
+                candidate = (candidate + datetime.timedelta(days=1)).replace(hour=0, minute=0)
+                continue
+            if candidate.hour not in self.hours:
+                candidate = (candidate + datetime.timedelta(hours=1)).replace(minute=0)
+                continue
+            if candidate.minute not in self.minutes:
+                candidate += datetime.timedelta(minutes=1)
+                continue
+            return candidate
+        raise ValueError(f"La expresión cron nunca se cumple: {self.expression}")
+
+
+class Job:
+    """Tarea con nombre y sus estadísticas de ejecución"""
+
+    def __init__(self, name, func, interval=None, cron=None, jitter=0, run_on_start=False, description="",
+                 stall_after=HEALTH_JOB_STALL_SECONDS):
+        if (interval is None) == (cron is None):
+            raise ValueError("Cada tarea necesita un intervalo o una expresión cron (solo uno)")
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.cron = CronSchedule(cron) if cron else None
+        self.jitter = jitter
+        self.run_on_start = run_on_start
+        self.description = description
+        self.stall_after = stall_after
+
+        self.next_run = None  # time.time() de la próxima ejecución
+        self.running = False
+        self.run_count = 0
+        self.error_count = 0
+        self.skipped_overlaps = 0
+        self.stalled_runs = 0
+        self.stalled_since = None  # time.time() en que el watchdog marcó la ejecución en curso como atascada
+        self.missed_while_stalled = False  # Se omitió una ejecución programada mientras estaba atascada
+        self.last_started = None
+        self.last_finished = None
+        self.last_success = None
+        self.last_duration = None
+        self.last_status = None
+        self.last_error = None
+
+    def compute_next_run(self, now):
+        if self.interval is not None:
+            base = now + self.interval
+        else:
+            current = datetime.datetime.fromtimestamp(now, datetime.timezone.utc).replace(tzinfo=None)
+            upcoming = self.cron.next_after(current).replace(tzinfo=datetime.timezone.utc)
+            base = upcoming.timestamp()
+        # Jitter para que los procesos/tareas no se disparen todos a la vez
+        if self.jitter:
+            base += random.uniform(0, self.jitter)
+        return base
+
+    def to_dict(self):
+        def fmt(ts):
+            return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).isoformat() if ts else None
+
+        return {
+            'name': self.name,
+            'description': self.description,
+            'schedule': f"every {self.interval}s" if self.interval is not None else f"cron '{self.cron.expression}'",
+            'interval_seconds': self.interval,
+            'jitter_seconds': self.jitter,
+            'running': self.running,
+            'next_run': fmt(self.next_run),
+            'last_started': fmt(self.last_started),
+            'last_finished': fmt(self.last_finished),
+            'last_success': fmt(self.last_success),
+            'last_duration_seconds': round(self.last_duration, 3) if self.last_duration is not None else None,
+            'last_status': self.last_status,
+            'last_error': self.last_error,
+            'run_count': self.run_count,
+            'error_count': self.error_count,
+            'skipped_overlaps': self.skipped_overlaps,
+            'stalled': self.stalled_since is not None,
+            'stalled_runs': self.stalled_runs,
+        }
+
+
+class JobScheduler:
+    """Ejecuta tareas con nombre solo en el proceso que posee el lease de líder"""
+
+    def __init__(self, lease_name=SCHEDULER_LEASE_NAME, lease_ttl=SCHEDULER_LEASE_TTL_SECONDS):
+        self.lease_name = lease_name
+        self.lease_ttl = lease_ttl
+        self.owner_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._loop_generation = 0
+        self._stopping = False
+        self.is_leader = False
+        self._last_lease_check = 0
+
+    def add_job(self, name, func, interval=None, cron=None, jitter=0, run_on_start=False, description="",
+                stall_after=HEALTH_JOB_STALL_SECONDS):
+        """Registra una tarea. Si ya existe una con el mismo nombre, se conserva la existente"""
+        with self._lock:
+            if name in self._jobs:
+                logger.info(f"Tarea '{name}' ya registrada en el planificador")
+                return self._jobs[name]
+            job = Job(name, func, interval=interval, cron=cron, jitter=jitter,
+                      run_on_start=run_on_start, description=description, stall_after=stall_after)
+            now = time.time()
+            job.next_run = now if run_on_start else job.compute_next_run(now)
+            self._jobs[name] = job
+        health.register(f"job:{name}", kind='job', stall_after=stall_after,
+                        restart=lambda: self.mark_stalled(name), description=description)
+        logger.info(f"📅 Tarea '{name}' registrada ({job.to_dict()['schedule']})")
+        self._wakeup.set()
+        return job
+
+    def has_job(self, name):
+        with self._lock:
+            return name in self._jobs
+
+    def start(self):
+        """Inicia el bucle del planificador (idempotente)"""
+        if not SCHEDULER_ENABLED:
+            logger.warning("⚠️ Planificador de tareas desactivado (SCHEDULER_ENABLED=false)")
+            return None
+        with self._lock:
+            if self.is_running():
+                return None
+            self._stopping = False
+            self._start_loop()
+        # El bucle despierta al menos cada lease_ttl/3; sin latidos durante un TTL completo está atascado
+        health.register('scheduler', kind='loop', stall_after=self.lease_ttl, probe=self.is_running,
+                        restart=self.restart_loop, description="Bucle del planificador de tareas")
+        logger.info(f"✅ Planificador de tareas iniciado (proceso {self.owner_id})")
+        return self._thread
+
+    def _start_loop(self):
+        self._loop_generation += 1
+        self._thread = threading.Thread(target=self._run, args=(self._loop_generation,),
+                                        name="job-scheduler", daemon=True)
+        self._thread.start()
+
+    def restart_loop(self):
+        """Arranca un bucle nuevo; el anterior (si sigue vivo pero atascado) termina en su próxima iteración"""
+        with self._lock:
+            self._stopping = False
+            self._start_loop()
+        logger.warning(f"🔄 Bucle del planificador reiniciado (generación {self._loop_generation})")
+
+    def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+        if self.is_leader:
+            db.release_lease(self.lease_name, self.owner_id)
+            self.is_leader = False
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def can_run_here(self):
+        """
+        True si este proceso puede lanzar tareas a mano: es el líder, o el
+        planificador está desactivado y nadie ejecuta el calendario. En un
+        seguidor, la ejecución podría solaparse con la programada del líder
+        """
+        return self.is_leader or not SCHEDULER_ENABLED
+
+    def run_now(self, name, wrapper=None):
+        """
+        Ejecuta una tarea inmediatamente en este proceso (respetando que no se solape).
+        Solo en el líder (ver can_run_here).
+
+        Args:
+            name (str): Nombre de la tarea
+            wrapper (callable): Opcional, recibe la función de la tarea y devuelve la que se ejecuta
+                (lo usa el perfilador para envolver la ejecución con cProfile)
+
+        Returns:
+            bool: True si se lanzó, False si no existe, ya estaba en ejecución o este proceso no es el líder
+        """
+        with self._lock:
+            job = self._jobs.get(name)
+            if job is None or job.running or not self.can_run_here():
+                return False
+            job.running = True
+        func = wrapper(job.func) if wrapper else None
+        threading.Thread(target=self._execute, args=(job, func), name=f"job-{name}", daemon=True).start()
+        return True
+
+    def mark_stalled(self, name):
+        """
+        Marca como atascada la ejecución en curso (hook de reinicio del watchdog).
+        El hilo no se puede detener, y lanzar otro mientras siga vivo ejecutaría la
+        tarea dos veces a la vez (la mayoría no tienen cerrojo propio): la tarea sigue
+        en curso y, si se omitió alguna ejecución programada, se relanza cuando termine.
+
+        Returns:
+            bool: siempre False (no se reinicia nada; el watchdog solo alerta)
+        """
+        with self._lock:
+            job = self._jobs.get(name)
+            if job is None or not job.running or job.stalled_since is not None:
+                return False
+            job.stalled_since = time.time()
+            job.stalled_runs += 1
+        logger.warning(f"⚠️ Ejecución de '{name}' atascada; no se relanzará hasta que termine")
+        return False
+
+    def _refresh_lease(self, now):
+        was_leader = self.is_leader
+        try:
+            self.is_leader = db.acquire_lease(self.lease_name, self.owner_id, self.lease_ttl)
+        except Exception as e:
+            logger.error(f"Error al renovar el lease del planificador: {e}")
+            self.is_leader = False
+        self._last_lease_check = now
+
+        if self.is_leader and not was_leader:
+            logger.info(f"👑 Proceso {self.owner_id} es ahora el líder de tareas en segundo plano")
+        elif was_leader and not self.is_leader:
+            logger.warning(f"⚠️ Proceso {self.owner_id} perdió el liderazgo de tareas en segundo plano")
+
+    def _run(self, generation):
+        while not self._stopping and generation == self._loop_generation:
+            try:
+                health.beat('scheduler')
+                self._wakeup.clear()
+                now = time.time()
+                # Renovar el lease con margen suficiente antes de que expire
+                if now - self._last_lease_check >= self.lease_ttl / 3:
+                    self._refresh_lease(now)
+
+                next_wakeup = self._last_lease_check + self.lease_ttl / 3
+
+                with self._lock:
+                    jobs = list(self._jobs.values())
+
+                for job in jobs:
+                    if job.next_run is None:
+                        continue
+                    if job.next_run <= now:
+                        if self.is_leader:
+                            self._launch(job, now)
+                        else:
+                            # Los seguidores no ejecutan nada, pero siguen el calendario
+                            job.next_run = job.compute_next_run(now)
+                    next_wakeup = min(next_wakeup, job.next_run)
+
+                self._wakeup.wait(max(0.0, next_wakeup - time.time()))
+            except Exception as e:
+                logger.error(f"🔥 Error en el bucle del planificador: {e}")
+                time.sleep(5)
+
+    def _launch(self, job, now):
+        with self._lock:
+            job.next_run = job.compute_next_run(now)
+            if job.running:
+                # La ejecución anterior no terminó: no se solapan
+                job.skipped_overlaps += 1
+                if job.stalled_since is not None:
+                    job.missed_while_stalled = True
+                logger.warning(f"⏭️ Tarea '{job.name}' omitida: la ejecución anterior sigue en curso")
+                return
+            job.running = True
+        threading.Thread(target=self._execute, args=(job,), name=f"job-{job.name}", daemon=True).start()
+
+    def _execute(self, job, func=None):
+        component = f"job:{job.name}"
+        started = time.time()
+        job.last_started = started
+        health.cycle_started(component)
+        error = None
+        try:
+            (func or job.func)()
+        except Exception as e:
+            error = e
+
+        relaunch = False
+        with self._lock:
+            if job.stalled_since is not None:
+                logger.warning(f"Ejecución atascada de '{job.name}' terminó tras {time.time() - started:.1f} s")
+                # Recuperar la ejecución programada que se omitió mientras seguía en curso
+                relaunch = job.missed_while_stalled
+                job.stalled_since = None
+                job.missed_while_stalled = False
+                if relaunch:
+                    job.next_run = time.time()
+            job.last_finished = time.time()
+            job.last_duration = job.last_finished - started
+            job.run_count += 1
+            if error is None:
+                job.last_status = 'ok'
+                job.last_error = None
+                job.last_success = job.last_finished
+            else:
+                job.error_count += 1
+                job.last_status = 'error'
+                job.last_error = str(error)
+            job.running = False
+
+        if error is None:
+            health.cycle_succeeded(component)
+        else:
+            health.cycle_failed(component, error)
+            logger.error(f"❌ Error en tarea '{job.name}': {error}")
+        if relaunch:
+            self._wakeup.set()
+
+    def get_job_stats(self, name):
+        """Estadísticas de una tarea (sin consultar la base de datos)"""
+        with self._lock:
+            job = self._jobs.get(name)
+            return job.to_dict() if job else None
+
+    def get_jobs_snapshot(self):
+        """Valores numéricos de cada tarea (timestamps sin formatear), para métricas"""
+        with self._lock:
+            return [{
+                'name': job.name,
+                'running': job.running,
+                'last_success': job.last_success,
+                'last_duration': job.last_duration,
+                'run_count': job.run_count,
+                'error_count': job.error_count,
+                'skipped_overlaps': job.skipped_overlaps,
+            } for job in self._jobs.values()]
+
+    def get_leader(self):
+        """Propietario del lease de líder (None si no hay o no se pudo consultar)"""
+        try:
+            lease = db.get_lease(self.lease_name)
+        except Exception as e:
+            logger.error(f"Error al consultar el lease del planificador: {e}")
+            return None
+        return lease.get('owner') if lease else None
+
+    def get_stats(self):
+        with self._lock:
+            jobs = [job.to_dict() for job in self._jobs.values()]
+        lease = None
+        try:
+            lease = db.get_lease(self.lease_name)
+        except Exception as e:
+            logger.error(f"Error al consultar el lease del planificador: {e}")
+        return {
+            'owner_id': self.owner_id,
+            'is_leader': self.is_leader,
+            'thread_alive': self.is_running(),
+            'lease': lease,
+            'jobs': jobs,
+        }
+
+
+# Instancia compartida por toda la aplicación
+job_scheduler = JobScheduler()
@@ -0,0 +1,180 @@
+"""
+Consola SQL de solo lectura del panel (/admin/sql).
+
+Cada consulta abre su propia conexión con mode=ro y PRAGMA query_only, así que
+no puede escribir en la base de datos aunque el SQL lo intente. Un autorizador
+rechaza además ATTACH/DETACH y los PRAGMA que asignan valores (como
+query_only = OFF). set_progress_handler interrumpe la consulta cuando supera su
+presupuesto de tiempo y el número de filas está limitado.
+
+Las consultas se ejecutan sobre la réplica de lectura si está al día (ver
+replica.py), para que un análisis largo no bloquee las escrituras de los pagos;
+el resultado indica su origen (data_source). use_replica=False lee de la principal.
+
+Las filas se leen por lotes con fetchmany: la respuesta JSON se corta en
+SQL_CONSOLE_MAX_ROWS y las exportaciones CSV/NDJSON se envían por trozos desde
+un generador, con memoria constante aunque devuelvan cientos de miles de filas.
+"""
+import csv
+import io
+import json
+import logging
+import sqlite3
+import time
+
+import replica
+from config import DB_PATH, SQL_CONSOLE_TIMEOUT_SECONDS, SQL_CONSOLE_MAX_ROWS
+
+logger = logging.getLogger(__name__)
+
+FETCH_BATCH_SIZE = 500  # Filas leídas (y enviadas) de cada vez
+PROGRESS_HANDLER_STEPS = 1000  # Instrucciones de SQLite entre comprobaciones del reloj
+
+# PRAGMA de consulta: los primeros reciben una tabla o índice como argumento; los
+# segundos solo se permiten sin valor (con valor lo asignarían)
+INSPECT_PRAGMAS = {
+    'table_info', 'table_xinfo', 'table_list', 'index_list', 'index_info', 'index_xinfo',
+    'foreign_key_list', 'integrity_check', 'quick_check',
+}
+READ_PRAGMAS = {
+    'database_list', 'compile_options', 'page_count', 'page_size', 'freelist_count',
+    'user_version', 'schema_version', 'journal_mode',
+}
+
+
+def _authorizer(action, arg1, arg2, db_name, trigger):
+    if action in (sqlite3.SQLITE_ATTACH, sqlite3.SQLITE_DETACH):
+        return sqlite3.SQLITE_DENY
+    if action == sqlite3.SQLITE_PRAGMA:
+        pragma = (arg1 or '').lower()
+        if pragma in INSPECT_PRAGMAS or (pragma in READ_PRAGMAS and arg2 is None):
+            return sqlite3.SQLITE_OK
+        return sqlite3.SQLITE_DENY
+    return sqlite3.SQLITE_OK
+
+
+def open_readonly_connection(path=DB_PATH):
+    """Conexión de solo lectura a la base de datos (falla si el archivo no existe)"""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    conn.execute("PRAGMA query_only = ON")
+    conn.set_authorizer(_authorizer)
+    return conn
+
+
+def _row_dict(columns, row):
+    """Fila como diccionario para JSON (los BLOB en hexadecimal)"""
+    return {column: value.hex() if isinstance(value, bytes) else value for column, value in zip(columns, row)}
+
+
+class ReadOnlyQuery:
+    """
+    Consulta en ejecución sobre una conexión de solo lectura. Lanza ValueError
+    con un mensaje para el administrador si el SQL falla, intenta escribir o
+    supera el tiempo
+    """
+
+    def __init__(self, sql, timeout=SQL_CONSOLE_TIMEOUT_SECONDS, max_rows=SQL_CONSOLE_MAX_ROWS, use_replica=True):
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self.truncated = False
+        self.row_count = 0
+        self._started = time.monotonic()
+        self._deadline = self._started + timeout
+        path, self.data_source = replica.select_read_path() if use_replica else (DB_PATH, replica.source_info(None))
+        self._conn = open_readonly_connection(path)
+        # Devolver un valor distinto de cero interrumpe la consulta (sqlite3.OperationalError)
+        self._conn.set_progress_handler(lambda: time.monotonic() > self._deadline, PROGRESS_HANDLER_STEPS)
+        try:
+            self._cursor = self._conn.execute(sql)
+        except sqlite3.Error as e:
+            self.close()
+            raise self._error(e) from None
+        self.columns = [description[0] for description in self._cursor.description or ()]
+
+    def _error(self, e):
+        if time.monotonic() > self._deadline:
+            return ValueError(f"La consulta superó el límite de {self.timeout:g} s")
+        if isinstance(e, sqlite3.DatabaseError) and 'not authorized' in str(e):
+            return ValueError("Operación no permitida en la consola de solo lectura")
+        return ValueError(str(e))
+
+    @property
+    def elapsed_ms(self):
+        return round((time.monotonic() - self._started) * 1000, 1)
+
+    def batches(self):
+        """Lotes de filas hasta max_rows; truncated indica si quedaban más"""
+        try:
+            while self.row_count < self.max_rows:
+                rows = self._cursor.fetchmany(min(FETCH_BATCH_SIZE, self.max_rows - self.row_count))
+                if not rows:
+                    return
+                self.row_count += len(rows)
+                yield rows
+            self.truncated = self._cursor.fetchone() is not None
+        except sqlite3.Error as e:
+            raise self._error(e) from None
+
+    def close(self):
+        try:
+            self._conn.close()
+        except Exception:
+            pass
+
+
+def run_query(sql, max_rows=SQL_CONSOLE_MAX_ROWS, use_replica=True):
+    """Ejecuta una consulta y devuelve hasta max_rows filas como diccionarios"""
+    query = ReadOnlyQuery(sql, max_rows=max_rows, use_replica=use_replica)
+    try:
+        results = [_row_dict(query.columns, row) for rows in query.batches() for row in rows]
+        return {
+            'columns': query.columns,
+            'results': results,
+            'count': len(results),
+            'truncated': query.truncated,
+            'row_limit': query.max_rows,
+            'elapsed_ms': query.elapsed_ms,
+            'data_source': query.data_source,
+        }
+    finally:
+        query.close()
+
+
+def stream_csv(query):
+    """Generador de la exportación CSV (cabecera y filas) de una ReadOnlyQuery"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    try:
+        writer.writerow(query.columns)
+        for rows in query.batches():
+            writer.writerows(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+        if buffer.tell():
+            yield buffer.getvalue()
+        if query.truncated:
+            logger.warning(f"Exportación CSV cortada en {query.max_rows} filas")
+    except ValueError as e:
+        # La respuesta ya empezó: el CSV queda incompleto y solo se puede registrar
+        logger.error(f"Exportación CSV interrumpida tras {query.row_count} filas: {e}")
+    finally:
+        query.close()
+
+
+def stream_ndjson(query):
+    """
+    Generador de la exportación NDJSON (un objeto JSON por fila). Si se corta por
+    el límite de filas o por un error, la última línea es {"_truncated": ...} o
+    {"_error": ...}
+    """
+    try:
+        for rows in query.batches():
+            yield ''.join(json.dumps(_row_dict(query.columns, row)) + '\n' for row in rows)
+        if query.truncated:
+            yield json.dumps({'_truncated': True, 'row_limit': query.max_rows}) + '\n'
+    except ValueError as e:
+        logger.error(f"Exportación NDJSON interrumpida tras {query.row_count} filas: {e}")
+        yield json.dumps({'_error': str(e)}) + '\n'
+    finally:
+        query.close()
@@ -0,0 +1,154 @@
+"""
+Arranque en fases.
+
+- boot: lo mínimo para atender webhooks (handlers y workers). Se ejecuta de
+  forma síncrona al importar la aplicación y debe tardar menos de un segundo.
+- warmup: todo lo que depende de Telegram, PayPal o recorridos de la base de
+  datos. Se ejecuta en segundo plano para no retrasar el arranque.
+
+El estado de cada fase (y de cada paso dentro de ella) se publica en /ready.
+"""
+import datetime
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+def _now_iso():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+class StartupPhase:
+    """Estado de una fase de arranque y de sus pasos"""
+
+    def __init__(self, name):
+        self.name = name
+        self.status = 'pending'  # pending, running, ready, failed
+        self.started_at = None
+        self.finished_at = None
+        self.duration = None
+        self.steps = {}
+        self._lock = threading.Lock()
+
+    def run_step(self, step_name, func):
+        """Ejecuta un paso registrando tiempo y resultado. Devuelve el resultado o None si falla"""
+        step = {'status': 'running', 'started_at': _now_iso(), 'duration_ms': None, 'error': None}
+        with self._lock:
+            self.steps[step_name] = step
+
+        started = time.monotonic()
+        try:
+            result = func()
+            step['status'] = 'ok'
+            return result
+        except Exception as e:
+            step['status'] = 'failed'
+            step['error'] = str(e)[:200]
+            logger.error(f"❌ Paso de arranque '{self.name}.{step_name}' falló: {e}")
+            return None
+        finally:
+            step['duration_ms'] = round((time.monotonic() - started) * 1000, 1)
+            if step['status'] == 'ok':
+                logger.info(f"✅ Paso de arranque '{self.name}.{step_name}' completado en {step['duration_ms']} ms")
+
+    def to_dict(self):
+        with self._lock:
+            steps = {name: dict(step) for name, step in self.steps.items()}
+        return {
+            'status': self.status,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'duration_ms': round(self.duration * 1000, 1) if self.duration is not None else None,
+            'steps': steps,
+        }
+
+
+class StartupManager:
+    """Coordina las fases de arranque de la aplicación"""
+
+    def __init__(self):
+        self.process_started = time.monotonic()
+        self.phases = {}
+        self._lock = threading.Lock()
+
+    def get_phase(self, name):
+        with self._lock:
+            if name not in self.phases:
+                self.phases[name] = StartupPhase(name)
+            return self.phases[name]
+
+    def run_phase(self, name, steps, concurrent=False):
+        """
+        Ejecuta una fase de forma síncrona.
+
+        Args:
+            name (str): Nombre de la fase
+            steps (list): Lista de tuplas (nombre del paso, función)
+            concurrent (bool): Ejecutar los pasos en paralelo
+
+        Returns:
+            bool: True si todos los pasos terminaron bien
+        """
+        phase = self.get_phase(name)
+        phase.status = 'running'
+        phase.started_at = _now_iso()
+        started = time.monotonic()
+        logger.info(f"🚀 Fase de arranque '{name}' iniciada ({len(steps)} pasos)")
+
+        if concurrent and len(steps) > 1:
+            with ThreadPoolExecutor(max_workers=len(steps), thread_name_prefix=f"startup-{name}") as executor:
+                futures = [executor.submit(phase.run_step, step_name, func) for step_name, func in steps]
+                for future in futures:
+                    future.result()
+        else:
+            for step_name, func in steps:
+                phase.run_step(step_name, func)
+
+        phase.duration = time.monotonic() - started
+        phase.finished_at = _now_iso()
+        failed = [step_name for step_name, step in phase.steps.items() if step['status'] == 'failed']
+        phase.status = 'failed' if failed else 'ready'
+
+        if failed:
+            logger.error(f"⚠️ Fase de arranque '{name}' terminó con errores en: {', '.join(failed)}")
+        else:
+            logger.info(f"✅ Fase de arranque '{name}' lista en {round(phase.duration * 1000, 1)} ms")
+        return not failed
+
+    def run_phase_in_background(self, name, steps, concurrent=False):
+        """Ejecuta una fase en un hilo en segundo plano"""
+        self.get_phase(name)
+        thread = threading.Thread(
+            target=self.run_phase,
+            args=(name, steps),
+            kwargs={'concurrent': concurrent},
+            name=f"startup-{name}",
+            daemon=True
+        )
+        thread.start()
+        return thread
+
+    def is_phase_ready(self, name):
+        with self._lock:
+            phase = self.phases.get(name)
+        return phase is not None and phase.status == 'ready'
+
+    def is_phase_done(self, name):
+        with self._lock:
+            phase = self.phases.get(name)
+        return phase is not None and phase.status in ('ready', 'failed')
+
+    def get_status(self):
+        with self._lock:
+            phases = {name: phase.to_dict() for name, phase in self.phases.items()}
+        return {
+            'uptime_seconds': round(time.monotonic() - self.process_started, 1),
+            'phases': phases,
+        }
+
+
+# Instancia compartida por toda la aplicación
+startup = StartupManager()
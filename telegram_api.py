@@ -0,0 +1,72 @@
+"""
+Capa fina sobre las peticiones HTTP a la API de Telegram.
+
+Se instala como CUSTOM_REQUEST_SENDER de pyTelegramBotAPI, de modo que todas
+las llamadas del bot pasan por aquí: reutiliza una sesión HTTP por hilo y
+registra conteos, latencia y respuestas 429 por método de la API. Las llamadas
+directas con requests (verify_bot_permissions, get-telegram-user) también la usan.
+"""
+import logging
+import threading
+import time
+
+import requests
+from telebot import apihelper
+
+import metrics
+from config import BOT_TOKEN, TELEGRAM_API_URL
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def _get_session():
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        _local.session = session
+    return session
+
+
+def _method_from_url(url):
+    return url.split('?', 1)[0].rstrip('/').rsplit('/', 1)[-1] or 'unknown'
+
+
+def telegram_request(method, url, **kwargs):
+    """Realiza una petición a la API de Telegram registrando métricas"""
+    api_method = _method_from_url(url)
+    started = time.perf_counter()
+    try:
+        response = _get_session().request(method, url, **kwargs)
+    except Exception:
+        metrics.TELEGRAM_REQUESTS.inc(method=api_method, status='exception')
+        raise
+    finally:
+        metrics.TELEGRAM_REQUEST_DURATION.observe(time.perf_counter() - started, method=api_method)
+
+    metrics.TELEGRAM_REQUESTS.inc(method=api_method, status=str(response.status_code))
+    if response.status_code == 429:
+        metrics.TELEGRAM_RATE_LIMITED.inc(method=api_method)
+        logger.warning(f"Telegram devolvió 429 para {api_method}")
+    return response
+
+
+def method_url(api_method):
+    """URL de un método de la API (respeta TELEGRAM_API_URL)"""
+    return f"{TELEGRAM_API_URL}/bot{BOT_TOKEN}/{api_method}"
+
+
+def file_url(file_path):
+    """URL de descarga de un archivo de Telegram"""
+    return f"{TELEGRAM_API_URL}/file/bot{BOT_TOKEN}/{file_path}"
+
+
+def install():
+    """
+    Hace que pyTelegramBotAPI envíe todas sus peticiones a través de
+    telegram_request, contra TELEGRAM_API_URL
+    """
+    apihelper.API_URL = TELEGRAM_API_URL + "/bot{0}/{1}"
+    apihelper.FILE_URL = TELEGRAM_API_URL + "/file/bot{0}/{1}"
+    apihelper.CUSTOM_REQUEST_SENDER = telegram_request
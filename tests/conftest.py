@@ -0,0 +1,17 @@
+"""
+Configuración de las pruebas: config.py lee el entorno al importarse y
+database.py crea la base de datos, así que ambos apuntan a un directorio temporal
+antes de importar ningún módulo del bot.
+"""
+import os
+import sys
+import tempfile
+
+_data_dir = tempfile.mkdtemp(prefix='subsbot-tests-')
+os.environ.setdefault('DB_PATH', os.path.join(_data_dir, 'vip_bot.db'))
+os.environ.setdefault('GROUP_CHAT_ID', '-100')
+os.environ.setdefault('ADMIN_IDS', '1')
+os.environ.setdefault('SCHEDULER_ENABLED', 'false')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
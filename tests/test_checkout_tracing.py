@@ -0,0 +1,70 @@
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+from telebot import types
+
+import app
+import database as db
+import payments
+from config import PLANS
+
+
+class FakeResponse:
+    status_code = 201
+
+    def __init__(self, approve_url):
+        self.approve_url = approve_url
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {'links': [{'rel': 'approve', 'href': self.approve_url}]}
+
+
+def callback_update(user_id, data):
+    return types.Update.de_json({
+        'update_id': 1,
+        'callback_query': {
+            'id': '1',
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Test'},
+            'chat_instance': '1',
+            'data': data,
+            'message': {'message_id': 10, 'date': 0, 'chat': {'id': user_id, 'type': 'private'}, 'text': 'Planes'},
+        },
+    })
+
+
+def test_webhook_checkout_carries_correlation_id_to_subscription(monkeypatch):
+    user_id = 777001
+    plan_id = next(iter(PLANS))
+    sent = {}
+
+    def fake_paypal_request(method, url, **kwargs):
+        sent['return_url'] = kwargs['json']['application_context']['return_url']
+        return FakeResponse('https://paypal.test/approve')
+
+    fake_bot = mock.MagicMock()
+    monkeypatch.setattr(app, 'bot', fake_bot)
+    monkeypatch.setattr(app.animation_scheduler, 'start', mock.MagicMock())
+    monkeypatch.setattr(app.animation_scheduler, 'stop', mock.MagicMock())
+    monkeypatch.setattr(payments, 'get_access_token', lambda: 'token')
+    monkeypatch.setattr(payments, 'create_product_if_not_exists', lambda: 'PROD-1')
+    monkeypatch.setattr(payments, 'get_or_create_plan', lambda plan, product: 'P-1')
+    monkeypatch.setattr(payments, 'paypal_request', fake_paypal_request)
+
+    app.process_update(callback_update(user_id, f"payment_paypal_{plan_id}"))
+
+    query = parse_qs(urlsplit(sent['return_url']).query)
+    correlation_id = query['cid'][0]
+    assert db.get_trace_span(correlation_id, 'create_payment_link')['status'] == 'ok'
+    assert db.get_trace_span(correlation_id, 'payment_method')['status'] == 'ok'
+
+    # PayPal devuelve al usuario a la URL de retorno con el ID de la suscripción
+    monkeypatch.setattr(payments, 'verify_subscription', lambda subscription_id: {'id': subscription_id, 'status': 'ACTIVE'})
+    return_query = urlsplit(sent['return_url']).query
+    app.app.test_client().get(f"/paypal/return?{return_query}&subscription_id=I-TRACE1")
+
+    subscription = db.get_subscription_by_payment_id('I-TRACE1')
+    assert subscription['correlation_id'] == correlation_id
+    assert db.get_trace_span(correlation_id, 'paypal_return') is not None
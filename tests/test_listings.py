@@ -0,0 +1,72 @@
+import pytest
+
+import database as db
+
+
+@pytest.fixture
+def listing_rows():
+    conn = db.get_db_connection()
+    conn.execute("DELETE FROM subscription_renewals")
+    conn.execute("DELETE FROM expulsions")
+    # Fechas repetidas: el desempate por ID no debe perder ni repetir filas
+    for i in range(7):
+        conn.execute("""
+        INSERT INTO subscription_renewals (sub_id, user_id, plan, amount_usd, renewal_date, status)
+        VALUES (?, ?, 'weekly', 3.5, ?, 'COMPLETED')
+        """, (i, 500 + i % 2, f"2024-01-0{1 + i // 3} 10:00:00"))
+        conn.execute("INSERT INTO expulsions (user_id, reason, date) VALUES (?, 'test', ?)",
+                     (500 + i % 2, f"2024-02-0{1 + i // 3} 10:00:00"))
+    conn.commit()
+    conn.close()
+
+
+def walk(list_page, **filters):
+    """IDs de todas las páginas hacia delante y, desde la última, hacia atrás"""
+    forward, pages = [], []
+    page = list_page(limit=3, **filters)
+    while True:
+        pages.append(page)
+        forward.extend(page['items'])
+        if not page['next_cursor']:
+            break
+        page = list_page(after=page['next_cursor'], limit=3, **filters)
+    backward = list(pages[-1]['items'])
+    page = pages[-1]
+    while page['prev_cursor']:
+        page = list_page(before=page['prev_cursor'], limit=3, **filters)
+        backward = page['items'] + backward
+    return forward, backward
+
+
+def test_list_renewals_pages_by_date_and_id(listing_rows):
+    forward, backward = walk(db.list_renewals)
+    ids = [item['renewal_id'] for item in forward]
+    assert len(ids) == 7 and ids == sorted(ids, reverse=True)
+    assert backward == forward
+
+    forward, _ = walk(db.list_renewals, user_id=501)
+    assert {item['user_id'] for item in forward} == {501} and len(forward) == 3
+
+
+def test_list_expulsions_pages_by_date_and_id(listing_rows):
+    forward, backward = walk(db.list_expulsions, descending=False)
+    ids = [item['expel_id'] for item in forward]
+    assert len(ids) == 7 and ids == sorted(ids)
+    assert backward == forward
+
+
+def test_listing_endpoints(listing_rows):
+    import app
+
+    client = app.app.test_client()
+    response = client.get('/admin/api/renewals?admin_id=1&limit=5')
+    assert response.status_code == 200
+    assert len(response.json['renewals']) == 5 and response.json['next_cursor']
+
+    response = client.get('/admin/api/expulsions?admin_id=1&user_id=500&order=asc')
+    assert response.status_code == 200
+    assert [item['user_id'] for item in response.json['expulsions']] == [500] * 4
+
+    assert client.get('/admin/api/expulsions?admin_id=1&order=up').status_code == 400
+    assert client.get('/admin/api/renewals?admin_id=1&after=x&before=y').status_code == 400
+    assert client.get('/admin/api/renewals?admin_id=999').status_code == 401
@@ -0,0 +1,50 @@
+import logging
+
+import logging_setup
+from logging_setup import RateLimitFilter
+
+
+def make_record(message, lineno=10, level=logging.INFO, **extra):
+    record = logging.LogRecord('bot', level, '/app/bot.py', lineno, message, None, None)
+    for name, value in extra.items():
+        setattr(record, name, value)
+    return record
+
+
+def test_formatted_messages_share_the_call_site_limit():
+    rate_limit = RateLimitFilter(per_minute=2)
+    results = [rate_limit.filter(make_record(f"Usuario {user_id} procesado")) for user_id in range(5)]
+    assert results == [True, True, False, False, False]
+    # Otra línea del código tiene su propio límite
+    assert rate_limit.filter(make_record("Usuario 1 procesado", lineno=20))
+
+
+def test_log_type_is_used_as_key_when_present():
+    rate_limit = RateLimitFilter(per_minute=1)
+    assert rate_limit.filter(make_record("a", lineno=1, log_type='webhook'))
+    assert not rate_limit.filter(make_record("b", lineno=2, log_type='webhook'))
+
+
+def test_suppressed_count_is_reported_in_the_next_window(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(logging_setup.time, 'monotonic', lambda: now[0])
+    rate_limit = RateLimitFilter(per_minute=1)
+    for user_id in range(4):
+        rate_limit.filter(make_record(f"Usuario {user_id} procesado"))
+
+    now[0] += 61
+    record = make_record("Usuario 9 procesado")
+    assert rate_limit.filter(record)
+    assert record.suppressed == 3
+
+
+def test_distinct_errors_from_one_call_site_all_pass():
+    rate_limit = RateLimitFilter(per_minute=2)
+    records = [make_record(f"Error al expulsar al usuario {user_id}", level=logging.ERROR) for user_id in range(100)]
+    assert all(rate_limit.filter(record) for record in records)
+
+
+def test_identical_errors_are_still_limited():
+    rate_limit = RateLimitFilter(per_minute=2)
+    results = [rate_limit.filter(make_record("Base de datos bloqueada", level=logging.ERROR)) for _ in range(4)]
+    assert results == [True, True, False, False]
@@ -0,0 +1,49 @@
+import payments
+from runtime import runtime
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def fake_new_token():
+    runtime.set('paypal_access_token', 'new-token', ttl=3600)
+    return 'new-token'
+
+
+def test_rejected_token_is_replaced_and_retried_once(monkeypatch):
+    runtime.set('paypal_access_token', 'old-token', ttl=3600)
+    monkeypatch.setattr(payments, '_request_access_token', fake_new_token)
+    sent = []
+
+    def fake_request(method, url, **kwargs):
+        sent.append(kwargs['headers']['Authorization'])
+        return FakeResponse(401 if len(sent) == 1 else 200)
+
+    monkeypatch.setattr(payments.requests, 'request', fake_request)
+    response = payments.paypal_request('GET', f"{payments.BASE_URL}/v1/billing/subscriptions/I-1",
+                                       headers={'Authorization': 'Bearer old-token'})
+
+    assert response.status_code == 200
+    assert sent == ['Bearer old-token', 'Bearer new-token']
+    assert runtime.get('paypal_access_token') == 'new-token'
+    runtime.invalidate('paypal_access_token')
+
+
+def test_second_401_is_returned_without_more_retries(monkeypatch):
+    runtime.set('paypal_access_token', 'old-token', ttl=3600)
+    monkeypatch.setattr(payments, '_request_access_token', fake_new_token)
+    sent = []
+
+    def fake_request(method, url, **kwargs):
+        sent.append(kwargs['headers']['Authorization'])
+        return FakeResponse(401)
+
+    monkeypatch.setattr(payments.requests, 'request', fake_request)
+    response = payments.paypal_request('GET', f"{payments.BASE_URL}/v1/billing/subscriptions/I-1",
+                                       headers={'Authorization': 'Bearer old-token'})
+
+    assert response.status_code == 401
+    assert len(sent) == 2
+    runtime.invalidate('paypal_access_token')
@@ -0,0 +1,70 @@
+import datetime
+
+import database as db
+import rollups
+
+
+def day(offset):
+    return (datetime.date(2024, 3, 1) + datetime.timedelta(days=offset)).isoformat()
+
+
+def clear_subscriptions(conn):
+    conn.execute("DELETE FROM subscriptions")
+    conn.execute("DROP TABLE IF EXISTS subscriptions_archive")
+
+
+def add_subscription(conn, plan, start, end, status, status_changed=None):
+    conn.execute("""
+    INSERT INTO subscriptions (user_id, plan, price_usd, start_date, end_date, status)
+    VALUES (1, ?, 10, ?, ?, ?)
+    """, (plan, f"{start}T10:00:00", f"{end}T10:00:00", status))
+    if status_changed:
+        conn.execute("UPDATE subscriptions SET status_changed_at = ? WHERE sub_id = last_insert_rowid()",
+                     (f"{status_changed} 12:00:00",))
+
+
+def test_incremental_window_matches_full_recompute(monkeypatch):
+    conn = db.get_db_connection()
+    clear_subscriptions(conn)
+    add_subscription(conn, 'weekly', day(0), day(40), 'ACTIVE')
+    add_subscription(conn, 'weekly', day(2), day(9), 'EXPIRED')
+    add_subscription(conn, 'weekly', day(5), day(35), 'CANCELLED', status_changed=day(21))
+    add_subscription(conn, 'monthly', day(18), day(48), 'ACTIVE')
+    add_subscription(conn, 'monthly', day(1), day(22), 'EXPIRED')
+    # Baja anterior al alta: el alta y la baja de las activas caen el mismo día (dentro de la ventana)
+    add_subscription(conn, 'monthly', day(23), day(45), 'CANCELLED', status_changed=day(10))
+    conn.commit()
+    conn.close()
+
+    monkeypatch.setattr(rollups, '_today', lambda: datetime.date.fromisoformat(day(30)))
+    rollups.refresh(full=True)
+    stored = {(row['day'], row['plan']): {metric: row[metric] for metric in db.ROLLUP_METRICS}
+              for row in db.get_daily_rollups(day(20), day(30))}
+
+    incremental = db.compute_daily_rollups(day(20), day(30), incremental=True)
+    assert incremental == db.compute_daily_rollups(day(20), day(30))
+    assert incremental == stored
+    assert incremental[(day(21), 'weekly')]['cancellations'] == 1
+    assert incremental[(day(23), 'monthly')]['new_subscriptions'] == 1
+
+
+def test_full_recompute_keeps_archived_subscriptions(monkeypatch):
+    import retention
+
+    conn = db.get_db_connection()
+    clear_subscriptions(conn)
+    add_subscription(conn, 'weekly', day(0), day(7), 'EXPIRED')
+    add_subscription(conn, 'weekly', day(3), day(40), 'ACTIVE')
+    conn.commit()
+
+    monkeypatch.setattr(rollups, '_today', lambda: datetime.date.fromisoformat(day(30)))
+    rollups.refresh(full=True)
+    before = [dict(row) for row in db.get_daily_rollups(day(0), day(30))]
+
+    monkeypatch.setattr(retention, 'RETENTION_BATCH_PAUSE_SECONDS', 0)
+    result = retention._apply_policy(conn, 'subscriptions', "status = 'EXPIRED'", 'table')
+    conn.close()
+    assert result['rows'] == 1
+
+    rollups.refresh(full=True)
+    assert [dict(row) for row in db.get_daily_rollups(day(0), day(30))] == before
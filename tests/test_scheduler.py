@@ -0,0 +1,102 @@
+import datetime
+import threading
+import time
+
+import pytest
+
+import scheduler
+from scheduler import CronSchedule, JobScheduler
+
+
+def at(*args):
+    return datetime.datetime(*args)
+
+
+@pytest.mark.parametrize('field, low, high, expected', [
+    ('*', 0, 5, {0, 1, 2, 3, 4, 5}),
+    ('*/15', 0, 59, {0, 15, 30, 45}),
+    ('5/15', 0, 59, {5, 20, 35, 50}),
+    ('1-10/3', 0, 59, {1, 4, 7, 10}),
+    ('1,2,5', 0, 59, {1, 2, 5}),
+    ('7', 0, 59, {7}),
+    ('2/1', 0, 5, {2, 3, 4, 5}),
+])
+def test_parse_field(field, low, high, expected):
+    assert CronSchedule._parse_field(field, low, high) == expected
+
+
+@pytest.mark.parametrize('expression', ['* * * *', '60 * * * *', '* 24 * * *', '*/0 * * * *', '0 0 0 * *'])
+def test_invalid_expressions(expression):
+    with pytest.raises(ValueError):
+        CronSchedule(expression)
+
+
+@pytest.mark.parametrize('expression, moment, expected', [
+    # Cada 6 horas al minuto 15 (BACKUP_CRON)
+    ('15 */6 * * *', at(2024, 1, 1, 0, 20), at(2024, 1, 1, 6, 15)),
+    # El instante exacto no cuenta: la siguiente es al día siguiente
+    ('45 3 * * *', at(2024, 1, 1, 3, 45), at(2024, 1, 2, 3, 45)),
+    # Paso con inicio: 5, 20, 35, 50
+    ('5/15 * * * *', at(2024, 1, 1, 10, 21), at(2024, 1, 1, 10, 35)),
+    ('5/15 * * * *', at(2024, 1, 1, 10, 50), at(2024, 1, 1, 11, 5)),
+    # Lunes (domingo = 0) desde un domingo
+    ('0 9 * * 1', at(2024, 1, 7, 12, 0), at(2024, 1, 8, 9, 0)),
+    # Cambio de mes y de año
+    ('0 0 1 1 *', at(2024, 6, 1, 0, 0), at(2025, 1, 1, 0, 0)),
+    ('30 23 31 * *', at(2024, 4, 1, 0, 0), at(2024, 5, 31, 23, 30)),
+    # Día del mes y día de la semana restringidos: basta con uno (viernes 2 de febrero de 2024)
+    ('0 0 13 * 5', at(2024, 1, 28, 0, 0), at(2024, 2, 2, 0, 0)),
+    # 29 de febrero
+    ('0 12 29 2 *', at(2023, 3, 1, 0, 0), at(2024, 2, 29, 12, 0)),
+])
+def test_next_after(expression, moment, expected):
+    assert CronSchedule(expression).next_after(moment) == expected
+
+
+def test_run_now_only_on_leader(monkeypatch):
+    monkeypatch.setattr(scheduler, 'SCHEDULER_ENABLED', True)
+    job_scheduler = JobScheduler(lease_name='test_run_now')
+    ran = threading.Event()
+    job_scheduler.add_job('test_job', ran.set, interval=3600)
+
+    assert not job_scheduler.can_run_here()
+    assert job_scheduler.run_now('test_job') is False
+    assert not ran.wait(0.2)
+
+    job_scheduler.is_leader = True
+    assert job_scheduler.run_now('test_job') is True
+    assert ran.wait(5)
+
+
+def test_stalled_run_is_not_relaunched_while_alive(monkeypatch):
+    monkeypatch.setattr(scheduler, 'SCHEDULER_ENABLED', True)
+    job_scheduler = JobScheduler(lease_name='test_stalled')
+    job_scheduler.is_leader = True
+    release = threading.Event()
+    calls = []
+
+    def slow_job():
+        calls.append(time.time())
+        release.wait(5)
+
+    job = job_scheduler.add_job('slow_job', slow_job, interval=3600)
+    assert job_scheduler.run_now('slow_job')
+    while not calls:
+        time.sleep(0.01)
+
+    assert job_scheduler.mark_stalled('slow_job') is False
+    stats = job_scheduler.get_job_stats('slow_job')
+    assert stats['running'] and stats['stalled'] and stats['stalled_runs'] == 1
+    # El calendario vence mientras sigue atascada: se omite, no se solapa
+    job_scheduler._launch(job, time.time())
+    assert job_scheduler.run_now('slow_job') is False
+    assert len(calls) == 1 and job.missed_while_stalled
+
+    release.set()
+    deadline = time.time() + 5
+    while job_scheduler.get_job_stats('slow_job')['running'] and time.time() < deadline:
+        time.sleep(0.01)
+    stats = job_scheduler.get_job_stats('slow_job')
+    assert not stats['stalled'] and stats['last_status'] == 'ok'
+    # La ejecución omitida se relanza al terminar la atascada
+    assert job.next_run <= time.time()
@@ -0,0 +1,57 @@
+import time
+from unittest import mock
+
+import pytest
+
+import bot_handlers
+import events
+from health import health
+from scheduler import JobScheduler
+
+
+@pytest.fixture
+def sweep(monkeypatch):
+    monkeypatch.setattr(bot_handlers, 'verify_bot_permissions', lambda bot: True)
+    monkeypatch.setattr(bot_handlers.db, 'check_and_update_subscriptions', lambda force: [{'user_id': 1}])
+    published = []
+    monkeypatch.setattr(events, 'publish', lambda name, data: published.append((name, data)))
+    return published
+
+
+def run_job(name, func):
+    job_scheduler = JobScheduler(lease_name=f"test_{name}")
+    job_scheduler.add_job(name, func, interval=3600)
+    assert job_scheduler.run_now(name)
+    deadline = time.time() + 5
+    while job_scheduler.get_job_stats(name)['running'] and time.time() < deadline:
+        time.sleep(0.01)
+    return job_scheduler.get_job_stats(name)
+
+
+def test_failed_expulsions_fail_the_job(sweep, monkeypatch):
+    monkeypatch.setattr(bot_handlers, 'perform_group_security_check', lambda bot, chat_id, expired: False)
+
+    stats = run_job('security_check_failing', lambda: bot_handlers.run_security_check(mock.MagicMock()))
+
+    assert stats['last_status'] == 'error'
+    assert health.get_component_status('job:security_check_failing')['status'] == 'failing'
+    assert sweep == [('sweep_completed', mock.ANY)] and sweep[0][1]['ok'] is False
+
+
+def test_database_error_fails_the_job(sweep, monkeypatch):
+    def broken(force):
+        raise RuntimeError("database is locked")
+    monkeypatch.setattr(bot_handlers.db, 'check_and_update_subscriptions', broken)
+
+    with pytest.raises(RuntimeError, match="database is locked"):
+        bot_handlers.run_security_check(mock.MagicMock())
+    assert sweep[0][1]['error'] == "database is locked"
+
+
+def test_successful_sweep_is_ok(sweep, monkeypatch):
+    monkeypatch.setattr(bot_handlers, 'perform_group_security_check', lambda bot, chat_id, expired: True)
+
+    stats = run_job('security_check_ok', lambda: bot_handlers.run_security_check(mock.MagicMock()))
+
+    assert stats['last_status'] == 'ok'
+    assert sweep[0][1]['ok'] is True
@@ -0,0 +1,169 @@
+"""
+Trazas de latencia del checkout, de punta a punta.
+
+Cada checkout recibe un ID de correlación (cid) al elegir método de pago. El
+cid viaja en la URL de retorno de PayPal, se guarda con la suscripción y cada
+etapa registra un span (inicio y fin) en la tabla trace_spans:
+
+Etapas principales (consecutivas, su suma es el tiempo hasta el acceso):
+- payment_method: callback del botón de pago hasta enviar el enlace.
+- paypal_checkout: desde que se envió el enlace hasta que PayPal redirige.
+- paypal_return: /paypal/return completo (verificar, registrar, invitar).
+- join_wait: desde el fin de paypal_return hasta que el usuario entra al grupo.
+
+Etapas anidadas (detalle de las anteriores): create_payment_link,
+verify_payment, process_subscription, create_invite_link.
+
+Registrar un span nunca lanza excepciones: una traza incompleta no debe
+romper un pago. El informe se consulta en /admin/checkout-latency.
+"""
+import logging
+import math
+import time
+import uuid
+from contextlib import contextmanager
+
+import database as db
+import metrics
+
+logger = logging.getLogger(__name__)
+
+TOP_LEVEL_STAGES = ('payment_method', 'paypal_checkout', 'paypal_return', 'join_wait')
+NESTED_STAGES = ('create_payment_link', 'verify_payment', 'process_subscription', 'create_invite_link')
+
+CHECKOUT_STAGE_DURATION = metrics.registry.histogram(
+    'checkout_stage_duration_seconds', 'Duración de cada etapa del checkout', ('stage',),
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600, 86400))
+
+
+def new_correlation_id():
+    """ID corto para unir las etapas de un checkout"""
+    return uuid.uuid4().hex[:16]
+
+
+def record_span(correlation_id, stage, started_at, ended_at=None, user_id=None, status='ok', detail=None):
+    """Guarda un span (tiempos en epoch). Sin cid no hace nada"""
+    if not correlation_id:
+        return False
+    ended_at = ended_at if ended_at is not None else time.time()
+    try:
+        CHECKOUT_STAGE_DURATION.observe(max(0.0, ended_at - started_at), stage=stage)
+        return db.record_trace_span(correlation_id, stage, started_at, ended_at, user_id, status,
+                                    str(detail)[:300] if detail else None)
+    except Exception as e:
+        logger.error(f"Error al registrar span {stage} de la traza {correlation_id}: {e}")
+        return False
+
+
+@contextmanager
+def span(correlation_id, stage, user_id=None):
+    """
+    Mide el bloque como un span. Una excepción se registra con status='error'
+    y se vuelve a lanzar; el bloque puede marcar el resultado con
+    s['status'] = 'error' y s['detail'] = '...'.
+    """
+    state = {'status': 'ok', 'detail': None}
+    started_at = time.time()
+    try:
+        yield state
+    except Exception as e:
+        state['status'], state['detail'] = 'error', str(e)
+        raise
+    finally:
+        record_span(correlation_id, stage, started_at, user_id=user_id,
+                    status=state['status'], detail=state['detail'])
+
+
+def record_checkout_return(correlation_id, user_id, returned_at):
+    """Span paypal_checkout: desde el envío del enlace de pago hasta la vuelta de PayPal"""
+    if not correlation_id:
+        return
+    try:
+        previous = db.get_trace_span(correlation_id, 'payment_method')
+        if previous and previous['ended_at']:
+            record_span(correlation_id, 'paypal_checkout', previous['ended_at'], returned_at, user_id)
+    except Exception as e:
+        logger.error(f"Error al registrar la vuelta de PayPal de la traza {correlation_id}: {e}")
+
+
+def record_join(user_id):
+    """Span join_wait cuando el usuario entra al grupo (una vez por traza)"""
+    try:
+        correlation_id = db.get_latest_correlation_id(user_id)
+        if not correlation_id or db.get_trace_span(correlation_id, 'join_wait'):
+            return
+        previous = db.get_trace_span(correlation_id, 'paypal_return')
+        if previous and previous['ended_at']:
+            record_span(correlation_id, 'join_wait', previous['ended_at'], user_id=user_id)
+    except Exception as e:
+        logger.error(f"Error al registrar la entrada al grupo del usuario {user_id}: {e}")
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def _seconds(value):
+    return round(value, 2) if value is not None else None
+
+
+def get_report(days=30):
+    """
+    Informe de latencia de los checkouts iniciados en los últimos N días:
+    embudo, percentiles del tiempo hasta el acceso, percentiles por etapa y
+    cuántas veces cada etapa principal fue la más lenta de su traza.
+    """
+    since = time.time() - days * 86400
+    traces = {}
+    for row in db.get_trace_spans_since(since):
+        # Si una etapa se repite (reintentos), cuenta la última
+        traces.setdefault(row['correlation_id'], {})[row['stage']] = row
+
+    funnel = {'started': 0, 'returned': 0, 'invite_sent': 0, 'joined': 0}
+    stage_durations = {}
+    dominant = dict.fromkeys(TOP_LEVEL_STAGES, 0)
+    time_to_access = []
+    time_to_invite = []
+
+    for stages in traces.values():
+        funnel['started'] += 'payment_method' in stages
+        funnel['returned'] += 'paypal_return' in stages
+        funnel['invite_sent'] += stages.get('create_invite_link', {}).get('status') == 'ok'
+        funnel['joined'] += 'join_wait' in stages
+
+        for stage, row in stages.items():
+            stage_durations.setdefault(stage, []).append(row['duration_ms'] / 1000)
+
+        if 'payment_method' in stages and 'paypal_return' in stages:
+            time_to_invite.append(stages['paypal_return']['ended_at'] - stages['payment_method']['started_at'])
+        if all(stage in stages for stage in TOP_LEVEL_STAGES):
+            time_to_access.append(stages['join_wait']['ended_at'] - stages['payment_method']['started_at'])
+            slowest = max(TOP_LEVEL_STAGES, key=lambda stage: stages[stage]['duration_ms'])
+            dominant[slowest] += 1
+
+    def summary(values):
+        return {
+            'count': len(values),
+            'p50': _seconds(_percentile(values, 0.5)),
+            'p90': _seconds(_percentile(values, 0.9)),
+            'p95': _seconds(_percentile(values, 0.95)),
+            'max': _seconds(max(values) if values else None),
+        }
+
+    stage_order = TOP_LEVEL_STAGES + NESTED_STAGES
+    return {
+        'days': days,
+        'traces': len(traces),
+        'funnel': funnel,
+        'time_to_access_seconds': summary(time_to_access),
+        'time_to_invite_seconds': summary(time_to_invite),
+        # Lista (no diccionario) para conservar el orden de las etapas en el JSON
+        'stages_seconds': [
+            dict(summary(stage_durations[stage]), stage=stage)
+            for stage in sorted(stage_durations, key=lambda s: stage_order.index(s) if s in stage_order else len(stage_order))
+        ],
+        'dominant_stage': dominant,
+    }
@@ -0,0 +1,279 @@
+"""
+Cola de actualizaciones de Telegram.
+
+El webhook confirma cada actualización de inmediato y la deja en esta cola.
+Un pool acotado de workers la procesa en segundo plano, respetando el orden
+de llegada dentro de cada chat. Las actualizaciones repetidas (mismo update_id)
+se descartan usando un anillo de tamaño fijo.
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateDeduplicator:
+    """Anillo acotado de update_id ya vistos"""
+
+    def __init__(self, size):
+        self.size = size
+        self._ring = deque()
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def add(self, update_id):
+        """
+        Registra un update_id.
+
+        Returns:
+            bool: True si es nuevo, False si ya se había visto
+        """
+        with self._lock:
+            if update_id in self._seen:
+                return False
+            self._ring.append(update_id)
+            self._seen.add(update_id)
+            # Olvidar los más antiguos al superar el tamaño del anillo
+            while len(self._ring) > self.size:
+                self._seen.discard(self._ring.popleft())
+            return True
+
+    def discard(self, update_id):
+        """Olvida un update_id (por ejemplo, si no se pudo encolar)"""
+        with self._lock:
+            if update_id in self._seen:
+                self._seen.discard(update_id)
+                try:
+                    self._ring.remove(update_id)
+                except ValueError:
+                    pass
+
+    def __len__(self):
+        with self._lock:
+            return len(self._ring)
+
+
+def get_update_chat_key(update):
+    """Obtiene la clave de orden (chat) de una actualización"""
+    try:
+        if update.message:
+            return update.message.chat.id
+        if update.callback_query:
+            if update.callback_query.message:
+                return update.callback_query.message.chat.id
+            return update.callback_query.from_user.id
+        if getattr(update, 'chat_member', None):
+            return update.chat_member.chat.id
+        if getattr(update, 'my_chat_member', None):
+            return update.my_chat_member.chat.id
+        if getattr(update, 'edited_message', None):
+            return update.edited_message.chat.id
+    except Exception:
+        pass
+    # Sin chat identificable: cada actualización va por su cuenta
+    return f"update:{update.update_id}"
+
+
+class UpdateDispatcher:
+    """
+    Pool de workers con orden por chat.
+
+    Cada chat tiene su propia cola. Un chat solo puede estar en manos de un
+    worker a la vez, así que sus actualizaciones se procesan en orden, mientras
+    que chats distintos avanzan en paralelo sin bloquearse entre sí.
+    """
+
+    def __init__(self, handler, workers=4, max_pending=1000, dedup_size=5000, name="webhook"):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.name = name
+        self.dedup = UpdateDeduplicator(dedup_size)
+
+        self._lock = threading.Condition()
+        self._chat_queues = {}      # chat -> deque[(update, enqueued_at)]
+        self._ready = deque()       # chats con trabajo pendiente y sin worker asignado
+        self._busy_chats = set()    # chats que un worker está procesando
+        self._pending = 0
+        self._threads = []
+        self._started = False
+
+        # Estadísticas
+        self._active = 0
+        self._counters = {
+            'received': 0,
+            'queued': 0,
+            'duplicates': 0,
+            'rejected': 0,
+            'processed': 0,
+            'errors': 0,
+        }
+        self._lags = deque(maxlen=500)
+        self._durations = deque(maxlen=500)
+        self._max_pending_seen = 0
+
+    def start(self):
+        """Inicia los workers (idempotente)"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._worker_loop,
+                    name=f"{self.name}-worker-{i}",
+                    daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+        logger.info(f"Pool de actualizaciones iniciado con {self.workers} workers (máx. {self.max_pending} pendientes)")
+
+    def is_healthy(self):
+        """True si todos los workers siguen vivos (o el pool aún no se inició)"""
+        return not self._started or all(thread.is_alive() for thread in self._threads)
+
+    def ensure_workers(self):
+        """Sustituye los workers que hayan terminado (por ejemplo, tras un error inesperado)"""
+        replaced = 0
+        with self._lock:
+            for i, thread in enumerate(self._threads):
+                if thread.is_alive():
+                    continue
+                thread = threading.Thread(target=self._worker_loop, name=f"{self.name}-worker-{i}", daemon=True)
+                thread.start()
+                self._threads[i] = thread
+                replaced += 1
+        if replaced:
+            logger.warning(f"🔄 {replaced} workers de actualizaciones reemplazados")
+        return replaced
+
+    def submit(self, update):
+        """
+        Encola una actualización para procesarla en segundo plano.
+
+        Returns:
+            str: 'queued', 'duplicate' o 'rejected' (cola llena)
+        """
+        if not self._started:
+            self.start()
+
+        with self._lock:
+            self._counters['received'] += 1
+
+        update_id = getattr(update, 'update_id', None)
+        if update_id is not None and not self.dedup.add(update_id):
+            with self._lock:
+                self._counters['duplicates'] += 1
+            logger.info(f"Actualización duplicada ignorada: {update_id}")
+            return 'duplicate'
+
+        chat_key = get_update_chat_key(update)
+
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._counters['rejected'] += 1
+                rejected = True
+            else:
+                rejected = False
+                chat_queue = self._chat_queues.get(chat_key)
+                if chat_queue is None:
+                    chat_queue = deque()
+                    self._chat_queues[chat_key] = chat_queue
+                chat_queue.append((update, time.monotonic()))
+                self._pending += 1
+                self._max_pending_seen = max(self._max_pending_seen, self._pending)
+                self._counters['queued'] += 1
+
+                # Si el chat no está en proceso ni esperando, marcarlo como listo
+                if chat_key not in self._busy_chats and len(chat_queue) == 1:
+                    self._ready.append(chat_key)
+                    self._lock.notify()
+
+        if rejected:
+            # Permitir que Telegram la reenvíe más tarde
+            if update_id is not None:
+                self.dedup.discard(update_id)
+            logger.warning(f"Cola de actualizaciones llena ({self.max_pending}), rechazando {update_id}")
+            return 'rejected'
+
+        return 'queued'
+
+    def _worker_loop(self):
+        while True:
+            with self._lock:
+                while not self._ready:
+                    self._lock.wait()
+                chat_key = self._ready.popleft()
+                chat_queue = self._chat_queues[chat_key]
+                update, enqueued_at = chat_queue.popleft()
+                self._busy_chats.add(chat_key)
+                self._pending -= 1
+                self._active += 1
+
+            started = time.monotonic()
+            lag = started - enqueued_at
+            try:
+                self.handler(update)
+                error = False
+            except Exception as e:
+                error = True
+                logger.error(f"Error procesando actualización {getattr(update, 'update_id', '?')}: {str(e)}")
+            duration = time.monotonic() - started
+
+            with self._lock:
+                self._active -= 1
+                self._busy_chats.discard(chat_key)
+                self._lags.append(lag)
+                self._durations.append(duration)
+                self._counters['processed'] += 1
+                if error:
+                    self._counters['errors'] += 1
+
+                # Devolver el chat a la cola de listos si aún tiene trabajo
+                if chat_queue:
+                    self._ready.append(chat_key)
+                    self._lock.notify()
+                else:
+                    del self._chat_queues[chat_key]
+
+    @staticmethod
+    def _summarize(samples):
+        if not samples:
+            return {'count': 0, 'avg_ms': 0, 'p50_ms': 0, 'p95_ms': 0, 'max_ms': 0}
+        ordered = sorted(samples)
+        count = len(ordered)
+        return {
+            'count': count,
+            'avg_ms': round(sum(ordered) / count * 1000, 2),
+            'p50_ms': round(ordered[int(count * 0.50)] * 1000, 2),
+            'p95_ms': round(ordered[min(count - 1, int(count * 0.95))] * 1000, 2),
+            'max_ms': round(ordered[-1] * 1000, 2),
+        }
+
+    def get_stats(self):
+        """Devuelve profundidad de cola, retraso de procesamiento y contadores"""
+        with self._lock:
+            now = time.monotonic()
+            oldest = None
+            for chat_queue in self._chat_queues.values():
+                if chat_queue:
+                    enqueued_at = chat_queue[0][1]
+                    if oldest is None or enqueued_at < oldest:
+                        oldest = enqueued_at
+
+            return {
+                'workers': self.workers,
+                'workers_alive': sum(1 for t in self._threads if t.is_alive()),
+                'active_workers': self._active,
+                'queue_depth': self._pending,
+                'max_queue_depth': self.max_pending,
+                'peak_queue_depth': self._max_pending_seen,
+                'chats_pending': len(self._chat_queues),
+                'oldest_pending_ms': round((now - oldest) * 1000, 2) if oldest is not None else 0,
+                'dedup_window': len(self.dedup),
+                'counters': dict(self._counters),
+                'lag': self._summarize(list(self._lags)),
+                'processing': self._summarize(list(self._durations)),
+            }